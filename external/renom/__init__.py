@@ -46,6 +46,13 @@ from renom import cuda
 from renom import core
 from renom.core import Pos
 from renom.core import Variable
+from renom.core import IndexedSlices
+from renom.core import no_grad, set_grad_enabled, is_grad_enabled
+from renom.core import Fused
+from renom.core.pool import BufferPool, get_buffer_pool, use_buffer_pool, \
+    set_buffer_pool_active, is_buffer_pool_active, release_buffer_pool
+from renom.core.rng import RandomStream, sample_offset, set_rng_seed
+from renom.core.layout import set_data_format, get_data_format, use_data_format
 from renom import operation
 from renom.operation import *
 from renom.utility import *
@@ -62,6 +69,7 @@ def set_renom_seed(seed=30):
     if is_cuda_active():
         curand_set_seed(seed)
     np.random.seed(seed)
+    set_rng_seed(seed)
 
 
 __version__ = "2.7.3"
@@ -3,6 +3,7 @@
 from __future__ import division
 import numpy as np
 from renom.core import Node, to_value
+from renom.utility.distributor.utilities import build_yolo_labels
 import renom.cuda as cu
 if cu.has_cuda():
     from renom.cuda.gpuvalue import GPUValue, get_gpu
@@ -28,24 +29,7 @@ def build_truth(y, total_w, total_h, cells, classes):
     | truth[0,0,1] = 0 0 0 0 0 0 0 0 0
     | (cell 0,1 has no object)
     """
-    truth = np.zeros((y.shape[0], cells, cells, 5 + classes))
-    for im in range(y.shape[0]):
-        for obj in range(0, y.shape[1], 4 + classes):
-            truth_classes = y[im, obj + 4:obj + 4 + classes]
-            if np.all(truth_classes == 0):
-                continue
-            truth_x = y[im, obj]
-            truth_y = y[im, obj + 1]
-            truth_w = y[im, obj + 2]
-            truth_h = y[im, obj + 3]
-            norm_x = truth_x * .99 * cells / total_w
-            norm_y = truth_y * .99 * cells / total_h
-            norm_w = truth_w / total_w
-            norm_h = truth_h / total_h
-            truth[im, int(norm_y), int(norm_x)] = np.concatenate(
-                ([1, norm_x % 1, norm_y % 1, norm_w, norm_h], truth_classes))
-    truth = truth.reshape(y.shape[0], -1)
-    return truth
+    return build_yolo_labels(y, total_w, total_h, cells, classes)
 
 
 def box_iou(box1, box2):
@@ -72,85 +56,137 @@ def box_iou(box1, box2):
 
 
 def make_box(box):
-    x1 = box[:, :, :, 0] - box[:, :, :, 2] / 2
-    y1 = box[:, :, :, 1] - box[:, :, :, 3] / 2
-    x2 = box[:, :, :, 0] + box[:, :, :, 2] / 2
-    y2 = box[:, :, :, 1] + box[:, :, :, 3] / 2
+    x1 = box[..., 0] - box[..., 2] / 2
+    y1 = box[..., 1] - box[..., 3] / 2
+    x2 = box[..., 0] + box[..., 2] / 2
+    y2 = box[..., 1] + box[..., 3] / 2
     return [x1, y1, x2, y2]
 
 
-def apply_nms(x, cells, bbox, classes, image_size, thresh=0.2, iou_thresh=0.3):
+def box_iou_matrix(box1, box2):
+    """IoU of every pair of boxes.
+
+    Args:
+        box1 (ndarray): Boxes of the shape (..., N, 4) given as x1 y1 x2 y2.
+        box2 (ndarray): Boxes of the shape (..., M, 4) given as x1 y1 x2 y2.
+
+    Returns:
+        (ndarray): IoU of the shape (..., N, M), as computed by box_iou.
+    """
+    box1 = np.moveaxis(box1[..., :, None, :], -1, 0)
+    box2 = np.moveaxis(box2[..., None, :, :], -1, 0)
+    return box_iou(box1, box2)
+
+
+def nms(boxes, scores, iou_thresh=0.3, thresh=0., method="hard", sigma=0.5):
+    u"""Non maximum suppression of every class of a batch of images at once.
+
+    Boxes are taken in the order of their scores for every class. ``hard``
+    zeroes the scores of the boxes overlapping a taken box with an IoU over
+    iou_thresh. ``linear`` and ``gaussian`` are Soft-NMS [softnms]_, which
+    decay those scores by ``1 - IoU`` and ``exp(-IoU^2 / sigma)`` instead.
+
+    Args:
+        boxes (ndarray): Boxes of the shape (..., B, 4) given as x1 y1 x2 y2.
+        scores (ndarray): Scores of the shape (..., B, classes).
+        iou_thresh (float): A threshold for bounding box suppression.
+        thresh (float): Scores less than this are zeroed, before the
+            suppression and after every decay of Soft-NMS.
+        method (str): ``hard``, ``linear`` or ``gaussian``.
+        sigma (float): Width of the gaussian decay.
+
+    Returns:
+        (ndarray): Scores of the shape of scores, zero for suppressed boxes.
+
+    .. [softnms] Navaneeth Bodla, Bharat Singh, Rama Chellappa, Larry S. Davis.
+        Soft-NMS -- Improving Object Detection With One Line of Code. ICCV 2017.
+    """
+    assert method in ("hard", "linear", "gaussian"), method
+    shape = scores.shape
+    boxes = boxes.reshape((-1, ) + boxes.shape[-2:])
+    scores = np.where(scores < thresh, 0., scores).reshape((-1, ) + shape[-2:])
+    n, classes = len(scores), shape[-1]
+
+    # Only the boxes scored for some class take part, the images are padded
+    # to the largest number of them.
+    order = np.argsort(-scores.max(axis=2), axis=1, kind="stable")
+    count = int(np.max(np.sum(scores.max(axis=2) > 0, axis=1), initial=0))
+    order = order[:, :count]
+    image = np.arange(n)[:, None]
+    iou = box_iou_matrix(boxes[image, order], boxes[image, order])
+    cand = scores[image, order]
+
+    image, label = np.arange(n)[:, None], np.arange(classes)
+    taken = np.zeros(cand.shape, dtype=bool)
+    for _ in range(count):
+        # The best remaining box of every image and class.
+        best = np.argmax(np.where(taken, 0., cand), axis=1)
+        active = cand[image, best, label] > 0
+        if not active.any():
+            break
+        taken[image, best, label] |= active
+        overlap = iou[image, best].swapaxes(1, 2)
+        target = ~taken & active[:, None]
+        if method == "hard":
+            cand[target & (overlap > iou_thresh)] = 0
+        else:
+            if method == "linear":
+                decay = np.where(overlap > iou_thresh, 1. - overlap, 1.)
+            else:
+                decay = np.exp(-overlap ** 2 / sigma)
+            cand = np.where(target, cand * decay, cand)
+            cand[cand < thresh] = 0
+
+    ret = np.zeros(scores.shape, dtype=cand.dtype)
+    ret[np.arange(n)[:, None], order] = cand
+    return ret.reshape(shape)
+
+
+def apply_nms(x, cells, bbox, classes, image_size, thresh=0.2, iou_thresh=0.3,
+              method="hard", sigma=0.5):
     u"""Apply to X predicted out of yolo_detector layer to get list of detected objects.
     Default threshold for detection is prob < 0.2.
     Default threshold for suppression is IOU > 0.4
 
     Args:
+        x (ndarray): Prediction of one image, or of a batch of images.
         cells (int): Cell size.
         bbox (int): Number of bbox.
         classes (int): Number of class.
         image_size (tuple): Image size.
         thresh (float): A threshold for effective bounding box.
         iou_thresh (float): A threshold for bounding box suppression.
+        method (str): Suppression of :func:`nms`, ``hard``, ``linear`` or ``gaussian``.
+        sigma (float): Width of the gaussian Soft-NMS.
 
     Returns:
         List of dict object is returned. The dict includes keys ``class``,
-            ``box``, ``score``.
+            ``box``, ``score``. For a batch, a list of them per image is returned.
     """
-    probs = np.zeros((cells, cells, bbox, classes))
-    boxes = np.zeros((cells, cells, bbox, 4))  # 4 is x y w h
-    for b in range(bbox):
-        # bbox prob is "confidence of a bbox * probability of a class"
-        prob = x[:, :, b * 5] * x[:, :, bbox * 5:].transpose(2, 0, 1)
-        probs[:, :, b, :] = prob.transpose(1, 2, 0)
-        boxes[:, :, b, :] = x[:, :, b * 5 + 1:b * 5 + 5]
-        boxes[:, :, b, 2] = boxes[:, :, b, 2]
-        boxes[:, :, b, 3] = boxes[:, :, b, 3]
-    offset = np.array([np.arange(cells)] * (cells * bbox)
-                      ).reshape(bbox, cells, cells).transpose(1, 2, 0)
+    x = x.reshape(x.shape[:-3] + (cells, cells, -1))
+    pred = x[..., :bbox * 5].reshape(x.shape[:-1] + (bbox, 5))
+    # bbox prob is "confidence of a bbox * probability of a class"
+    probs = (pred[..., :1] * x[..., None, bbox * 5:]).astype(np.float64)
+    boxes = pred[..., 1:].astype(np.float64)  # 4 is x y w h
     # offset x and y values to be 0<xy<1 for the whole image, not a cell
-    boxes[:, :, :, 0] += offset
-    boxes[:, :, :, 1] += offset.transpose(1, 0, 2)
-    boxes[:, :, :, 0:2] = boxes[:, :, :, 0:2] / float(cells)
-    # get a single list of all bbox and pred for this image
-    probs = probs.reshape(-1, classes)
-    boxes = boxes.reshape(-1, 4)  # 4 is x y w h
-    # filter bbox with prob less than thresh (default 0.2)
-    probs[probs < thresh] = 0
-    # reorder results by highest prob
-    argsort = np.argsort(probs, axis=0)[::-1]
+    boxes[..., 0] += np.arange(cells)[:, None]
+    boxes[..., 1] += np.arange(cells)[:, None, None]
+    boxes[..., 0:2] /= float(cells)
+    # get a single list of all bbox and pred for every image
+    batch_shape = x.shape[:-3]
+    probs = probs.reshape(batch_shape + (-1, classes))
+    boxes = boxes.reshape(batch_shape + (-1, 4))
     # perform nms for boxes of same class
+    probs = nms(np.stack(make_box(boxes), axis=-1), probs, iou_thresh, thresh,
+                method, sigma)
 
-    def get_xy12(box):
-        x1 = box[0] - box[2] / 2
-        y1 = box[1] - box[3] / 2
-        x2 = box[0] + box[2] / 2
-        y2 = box[1] + box[3] / 2
-        return [x1, y1, x2, y2]
-    for cl in range(classes):
-        for b in range(boxes.shape[0]):
-            if probs[argsort[b, cl], cl] == 0:
-                continue
-            b1 = boxes[argsort[b, cl], :]
-            b1 = get_xy12(b1)
-            for compar in range(b + 1, boxes.shape[0]):
-                b2 = boxes[argsort[compar, cl], :]
-                b2 = get_xy12(b2)
-                if box_iou(b1, b2) > iou_thresh:
-                    probs[argsort[compar, cl], cl] = 0
-    classes = np.argmax(probs, axis=1)
-    # filter only remaining boxes
-    filter_iou = probs > 0
-    indexes = np.nonzero(filter_iou)
-    # save results
-    results = []
-    for b in range(len(indexes[0])):
-        result = {
-            "class": indexes[1][b],
-            "box": boxes[indexes[0][b]],
-            "score": probs[indexes[0][b], indexes[1][b]]
-        }
-        results.append(result)
-    return results
+    def results(boxes, probs):
+        indexes = np.nonzero(probs > 0)
+        return [{"class": c, "box": boxes[b], "score": probs[b, c]} for b, c in zip(*indexes)]
+
+    if batch_shape:
+        return [results(b, p) for b, p in zip(boxes, probs)]
+    return results(boxes, probs)
 
 
 class yolo(Node):
@@ -169,40 +205,32 @@ class yolo(Node):
         x = x.reshape(-1, cells, cells, (5 * bbox) + classes)
         y = y.reshape(-1, cells, cells, 5 + classes)
         deltas = np.zeros_like(x)
-        loss = 0
         # Case: there's no object in the cell
         bg_ind = (y[:, :, :, 0] == 0)
         # Case: there's an object
         obj_ind = (y[:, :, :, 0] == 1)
         # add 5th part of the equation
         deltas[obj_ind, bbox * 5:] = x[obj_ind, bbox * 5:] - y[obj_ind, 5:]
-        loss += np.sum(np.square(x[obj_ind, bbox * 5:] - y[obj_ind, 5:]))
-        # search for the best predicted bounding box
-        truth_box = make_box(y[:, :, :, 1:5])
-        ious = np.zeros((y.shape[0], y.shape[1], y.shape[2], bbox))
-
-        for b in range(bbox):
-            # add 4th part of the equation
-            deltas[bg_ind, b * 5] = noobj_scale * x[bg_ind, b * 5]
-            loss += noobj_scale * np.sum(np.square(x[bg_ind, b * 5]))
-            # get ious for current box
-            box = x[:, :, :, 5 * b + 1:5 * b + 5]
-            predict_box = make_box(box)
-            ious[:, :, :, b] = box_iou(truth_box, predict_box)
+        loss = np.sum(np.square(deltas[obj_ind, bbox * 5:]))
+        pred = x[..., :bbox * 5].reshape(x.shape[:3] + (bbox, 5))
+        pred_deltas = deltas[..., :bbox * 5].reshape(pred.shape)
+        # add 4th part of the equation
+        pred_deltas[bg_ind, :, 0] = noobj_scale * pred[bg_ind, :, 0]
+        loss += noobj_scale * np.sum(np.square(pred[bg_ind, :, 0]))
+        # search for the best predicted bounding box of every cell
+        truth_box = make_box(y[:, :, :, None, 1:5])
+        ious = box_iou(truth_box, make_box(pred[..., 1:5]))
         best_ind = np.argmax(ious, axis=3)
-
-        for b in range(bbox):
-            update_ind = (b == best_ind) & obj_ind
-            # add 3rd part of the equation
-            loss += np.sum(np.square(x[update_ind, 5 * b] - 1))
-            deltas[update_ind, 5 * b] = (x[update_ind, 5 * b] - 1)
-
-            # add 1st-2nd part of the equation
-            loss += obj_scale * \
-                np.sum(np.square(x[update_ind, 5 * b + 1:5 * b + 5] - y[update_ind, 1:5]))
-
-            deltas[update_ind, 5 * b + 1:5 * b + 5] = obj_scale * \
-                (x[update_ind, 5 * b + 1:5 * b + 5] - y[update_ind, 1:5])
+        update_ind = (np.arange(bbox) == best_ind[..., None]) & obj_ind[..., None]
+
+        # add 3rd part of the equation
+        pred_deltas[update_ind, 0] = pred[update_ind, 0] - 1
+        loss += np.sum(np.square(pred_deltas[update_ind, 0]))
+        # add 1st-2nd part of the equation
+        truth = np.broadcast_to(y[..., None, 1:5], pred[..., 1:].shape)
+        diff = pred[update_ind, 1:] - truth[update_ind]
+        pred_deltas[update_ind, 1:] = obj_scale * diff
+        loss += obj_scale * np.sum(np.square(diff))
 
         loss = loss / 2 / N
         deltas = deltas.reshape(-1, cells * cells * (5 * bbox + classes)) / N
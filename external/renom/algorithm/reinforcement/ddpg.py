@@ -30,7 +30,8 @@ class DDPG(object):
         self._actor.set_models(inference=True)
         shape = [-1, ] + self._state_size
         s = state.reshape(shape)
-        return np.argmax(self._actor(s).as_ndarray(), axis=1)
+        with rm.no_grad():
+            return np.argmax(self._actor(s).as_ndarray(), axis=1)
 
     def update(self):
         # Check GPU data
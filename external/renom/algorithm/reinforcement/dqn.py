@@ -41,7 +41,8 @@ class DQN(object):
         self._network.set_models(inference=True)
         shape = [-1, ] + list(self._state_size)
         s = state.reshape(shape)
-        return np.argmax(self._network(s).as_ndarray(), axis=1)
+        with rm.no_grad():
+            return np.argmax(self._network(s).as_ndarray(), axis=1)
 
     def update(self):
         """This function updates target network."""
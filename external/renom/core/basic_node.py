@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function, division
 import collections
+import contextlib
 import weakref
 import numpy as np
 from numbers import Number
@@ -13,10 +14,17 @@ if renom.cuda.has_cuda():
 
 
 class GraphAttrs(object):
+    __slots__ = ('v__attrs',)
 
     def __init__(self):
         object.__setattr__(self, 'v__attrs', {})
 
+    def __getstate__(self):
+        return self.v__attrs
+
+    def __setstate__(self, state):
+        object.__setattr__(self, 'v__attrs', state)
+
     def clear(self):
         self.v__attrs.clear()
 
@@ -39,6 +47,85 @@ class GraphAttrs(object):
         return self.v__attrs.get(key, default)
 
 
+class _NoGraphAttrs(GraphAttrs):
+    '''Graph attributes of nodes created while gradient calculation is
+    disabled. Assigned attributes are discarded.'''
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        pass
+
+
+_NO_GRAPH_ATTRS = _NoGraphAttrs()
+
+_grad_is_enabled = True
+
+
+def set_grad_enabled(enabled=True):
+    '''If False is given, operations do not build computational graph.
+
+    Args:
+        enabled (bool): Flag of gradient calculation.
+    '''
+    global _grad_is_enabled
+    _grad_is_enabled = enabled
+
+
+def is_grad_enabled():
+    """Checks whether computational graph is built by operations.
+
+    Returns:
+        (bool): True if gradient calculation is enabled.
+    """
+    return _grad_is_enabled
+
+
+@contextlib.contextmanager
+def no_grad():
+    '''Context manager that disables building of computational graph.
+
+    Nodes created in this context keep neither their inputs nor
+    intermediate results, so gradients can not be calculated from them.
+    This reduces the overhead of inference.
+
+    Example:
+        >>> import numpy as np
+        >>> import renom as rm
+        >>> model = rm.Dense(2)
+        >>> with rm.no_grad():
+        ...     z = model(np.random.rand(3, 2))
+        >>> list(z.attrs.get_attrs())
+        []
+    '''
+    cur = _grad_is_enabled
+    set_grad_enabled(False)
+    try:
+        yield None
+    finally:
+        set_grad_enabled(cur)
+
+
+# Nodes created while a model is traced are appended as (node, args, kwargs).
+_recorded_nodes = None
+
+
+@contextlib.contextmanager
+def record_nodes():
+    '''Context manager which records every node created in the context
+    together with the arguments it was created from.
+
+    Yields:
+        (list): List of ``(node, args, kwargs)`` in order of creation.
+    '''
+    global _recorded_nodes
+    cur = _recorded_nodes
+    _recorded_nodes = []
+    try:
+        yield _recorded_nodes
+    finally:
+        _recorded_nodes = cur
+
+
 class Node(np.ndarray):
     '''This is the base class of all operation function.
     Node class inherits numpy ndarray class.
@@ -79,7 +166,10 @@ class Node(np.ndarray):
     @classmethod
     def _create_node(cls, value):
         if isinstance(value, np.ndarray):
-            ret = value.astype(precision).view(cls)
+            # Results of operations are fresh arrays and need not be copied.
+            if value.dtype != precision or not value.flags.owndata or isinstance(value, Node):
+                value = value.astype(precision)
+            ret = value.view(cls)
         elif renom.cuda.has_cuda() and isinstance(value, GPUValue):
             ret = super(Node, cls).__new__(
                 cls, shape=value.shape, dtype=value.dtype)
@@ -94,11 +184,12 @@ class Node(np.ndarray):
             "Type miss matched. Required is {}, actual is {}".format(
                 precision().dtype, ret.dtype))
 
-        ret.attrs = GraphAttrs()
-        if renom.debug_graph.GET_ACTIVE_NODE() is not None:
+        ret.attrs = GraphAttrs() if _grad_is_enabled else _NO_GRAPH_ATTRS
+        if renom.debug_graph.ACTIVE_NODE is not None:
             renom.debug_graph.SET_NODE_DICT(id(ret), ret)
 
-        ret = cls._run_node_hook(ret)
+        if cls._node_hook:
+            ret = cls._run_node_hook(ret)
 
         return ret
 
@@ -112,8 +203,19 @@ class Node(np.ndarray):
 
     def __init__(self, *args, **kwargs):
         self.setflags(write=False)
+        if _recorded_nodes is not None:
+            _recorded_nodes.append((self, args, kwargs))
+        if not _grad_is_enabled:
+            self._no_backward = True
+            return
+
         self._args = []
-        q = collections.deque([args])
+        q = collections.deque()
+        for a in args:
+            if isinstance(a, Node):
+                self._args.append(a)
+            elif isinstance(a, (list, tuple, dict)):
+                q.append(a)
         while q:
             a = q.pop()
             if isinstance(a, Node):
@@ -122,7 +224,8 @@ class Node(np.ndarray):
                 q.extend(a)
             elif isinstance(a, dict):
                 q.extend(a.values())
-        self._args.extend(a for a in kwargs.values() if isinstance(a, Node))
+        if kwargs:
+            self._args.extend(a for a in kwargs.values() if isinstance(a, Node))
 
         self._reduce_graph()
         return
@@ -247,8 +350,7 @@ class Node(np.ndarray):
     def _update_diff(self, context, dy, **kwargs):
         ready = context.add(self, dy)
         if ready:
-            diff = context.get(self)
-            self.backward(context, diff, **kwargs)
+            context.schedule(self, **kwargs)
 
     def _get_graph(self):
         if self.attrs:
@@ -277,13 +379,14 @@ class Node(np.ndarray):
     def detach_graph(self):
         '''This method destroys computational graph.'''
 
-        for v in self._get_graph():
-            if isinstance(v, Node):
-                v.detach_graph()
-        if self.attrs:
-            self.attrs.clear()
+        q = [self]
+        while q:
+            t = q.pop()
+            q.extend(v for v in t._get_graph() if isinstance(v, Node))
+            if t.attrs:
+                t.attrs.clear()
 
-        self._args = []
+            t._args = []
 
     def backward(self, context, dy, **kwargs):
         if self._no_backward:
@@ -524,8 +627,9 @@ class Node(np.ndarray):
         new_inputs = []
         for item in inputs:
             if isinstance(item, Node):
-                item.to_cpu()
-                item.release_gpu()
+                if item._gpu:
+                    item.to_cpu()
+                    item.release_gpu()
                 new_inputs.append(item.view(np.ndarray))
             else:
                 new_inputs.append(item)
@@ -607,6 +711,9 @@ class Variable(Node):
     weight_decay = None
 
     def __new__(cls, value, auto_update=True, weight_decay=None):
+        if isinstance(value, np.ndarray):
+            # Variables are updated in place, never share the given array.
+            value = value.astype(precision)
         ret = super(Variable, cls).__new__(cls, value)
         ret._auto_update = auto_update
         ret.weight_decay = weight_decay
@@ -1,6 +1,7 @@
 from __future__ import division
 from renom.core import Node
 import weakref
+from numbers import Number
 import numpy as np
 import renom.cuda
 if renom.cuda.has_cuda():
@@ -1011,3 +1012,294 @@ class EnterModel(ModelMark):
 
 class LeaveModel(ModelMark):
     pass
+
+
+class _Expr(object):
+    '''Symbolic value recorded while a function given to Fused is traced.
+
+    Leaves are the arguments of the function (``args`` is their position) and
+    every other expression is the application of ``op`` to ``args``, which are
+    expressions or constants.
+    '''
+    __slots__ = ('op', 'args')
+
+    def __init__(self, op, args):
+        self.op = op
+        self.args = args
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        if method != '__call__' or kwargs or ufunc not in _FUSED_GRADS:
+            return NotImplemented
+        return _Expr(ufunc, inputs)
+
+    def __add__(self, other):
+        return _Expr(np.add, (self, other))
+
+    def __radd__(self, other):
+        return _Expr(np.add, (other, self))
+
+    def __sub__(self, other):
+        return _Expr(np.subtract, (self, other))
+
+    def __rsub__(self, other):
+        return _Expr(np.subtract, (other, self))
+
+    def __mul__(self, other):
+        return _Expr(np.multiply, (self, other))
+
+    def __rmul__(self, other):
+        return _Expr(np.multiply, (other, self))
+
+    def __truediv__(self, other):
+        return _Expr(np.true_divide, (self, other))
+
+    def __rtruediv__(self, other):
+        return _Expr(np.true_divide, (other, self))
+
+    __div__ = __truediv__
+    __rdiv__ = __rtruediv__
+
+    def __neg__(self):
+        return _Expr(np.negative, (self, ))
+
+    def __abs__(self):
+        return _Expr(np.absolute, (self, ))
+
+    def __pow__(self, other):
+        if isinstance(other, Number) and other == 2:
+            return _Expr(np.square, (self, ))
+        return _Expr(np.power, (self, other))
+
+    def __rpow__(self, other):
+        return _Expr(np.power, (other, self))
+
+
+# Gradients of the fusable ufuncs with respect to each operand, given the
+# gradient ``g`` of the output ``y`` and the operand values ``x``.
+_FUSED_GRADS = {
+    np.add: (lambda g, x, y: g,
+             lambda g, x, y: g),
+    np.subtract: (lambda g, x, y: g,
+                  lambda g, x, y: -g),
+    np.multiply: (lambda g, x, y: g * x[1],
+                  lambda g, x, y: g * x[0]),
+    np.true_divide: (lambda g, x, y: g / x[1],
+                     lambda g, x, y: -g * y / x[1]),
+    np.power: (lambda g, x, y: g * x[1] * x[0] ** (x[1] - 1),
+               lambda g, x, y: g * y * np.log(x[0])),
+    np.negative: (lambda g, x, y: -g, ),
+    np.absolute: (lambda g, x, y: g * np.sign(x[0]), ),
+    np.square: (lambda g, x, y: 2 * g * x[0], ),
+    np.sqrt: (lambda g, x, y: 0.5 * g / y, ),
+    np.exp: (lambda g, x, y: g * y, ),
+    np.log: (lambda g, x, y: g / x[0], ),
+    np.tanh: (lambda g, x, y: g * (1 - y * y), ),
+}
+
+
+class _FusedProgram(object):
+    '''Linear program of ufunc calls obtained by tracing ``func``.
+
+    Every value of the program lives in a slot. The first ``nargs`` slots
+    hold the arguments, followed by the constants and the results of the
+    steps. A step is a tuple of ``(ufunc, operand slots, result slot)``.
+    '''
+
+    def __init__(self, func, nargs):
+        self.nargs = nargs
+        root = func(*[_Expr(None, i) for i in range(nargs)])
+
+        # Post order traversal of the traced expression.
+        order = []
+        seen = set()
+        stack = [(root, False)]
+        while stack:
+            expr, visited = stack.pop()
+            if visited:
+                order.append(expr)
+            elif id(expr) not in seen:
+                seen.add(id(expr))
+                stack.append((expr, True))
+                if isinstance(expr, _Expr) and expr.op is not None:
+                    stack.extend((a, False) for a in reversed(expr.args))
+
+        slots = {}
+        self.consts = []
+        for expr in order:
+            if not isinstance(expr, _Expr):
+                slots[id(expr)] = nargs + len(self.consts)
+                self.consts.append(expr)
+            elif expr.op is None:
+                slots[id(expr)] = expr.args
+
+        self.steps = []
+        for expr in order:
+            if isinstance(expr, _Expr) and expr.op is not None:
+                slots[id(expr)] = nargs + len(self.consts) + len(self.steps)
+                operands = tuple(slots[id(a)] for a in expr.args)
+                self.steps.append((expr.op, operands, slots[id(expr)]))
+        self.root = slots[id(root)]
+
+        # Last step which reads each slot, so that dead temporaries can be reused.
+        self.last_use = {}
+        for i, (_, operands, _) in enumerate(self.steps):
+            for o in operands:
+                self.last_use[o] = i
+
+    def _load(self, args):
+        assert len(args) == self.nargs
+        return list(args) + self.consts + [None] * len(self.steps)
+
+    def run(self, args, out=None):
+        '''Evaluates the program on ``args`` in one pass.
+
+        The result of a step is written into the buffer of a temporary
+        operand which is not read afterwards, so that a chain of operations
+        allocates as few arrays as possible. The last step writes into ``out``
+        if it is given.
+        '''
+        slots = self._load(args)
+        temps = set()
+        last = len(self.steps) - 1
+        for i, (op, operands, result) in enumerate(self.steps):
+            values = [slots[o] for o in operands]
+            buf = out if i == last else None
+            if buf is None:
+                for o in operands:
+                    if o in temps and self.last_use[o] == i:
+                        t = slots[o]
+                        if t.dtype.kind in 'fc' and t.shape == np.broadcast(*values).shape and \
+                                np.result_type(*values) == t.dtype:
+                            buf = t
+                            break
+            if buf is None:
+                slots[result] = op(*values)
+            else:
+                slots[result] = op(*values, out=buf)
+            if isinstance(slots[result], np.ndarray):
+                temps.add(result)
+            for o in operands:
+                if o >= self.nargs and self.last_use[o] == i:
+                    temps.discard(o)
+                    slots[o] = None
+
+        if not self.steps:
+            value = slots[self.root]
+            if out is None:
+                return np.array(value, copy=True)
+            out[...] = value
+            return out
+        return slots[self.root]
+
+    def backward(self, args, dy, needs):
+        '''Returns gradients of the program for the arguments flagged in
+        ``needs``. Intermediate values are recomputed from ``args``.'''
+        slots = self._load(args)
+        for op, operands, result in self.steps:
+            slots[result] = op(*[slots[o] for o in operands])
+
+        requires = [False] * len(slots)
+        requires[:self.nargs] = needs
+        for op, operands, result in self.steps:
+            requires[result] = any(requires[o] for o in operands)
+
+        grads = [None] * len(slots)
+        grads[self.root] = dy
+        for op, operands, result in reversed(self.steps):
+            g = grads[result]
+            if g is None:
+                continue
+            grads[result] = None
+            x = [slots[o] for o in operands]
+            for o, grad in zip(operands, _FUSED_GRADS[op]):
+                if requires[o]:
+                    dx = broad_cast(slots[o], grad(g, x, slots[result]))
+                    grads[o] = dx if grads[o] is None else grads[o] + dx
+        return grads[:self.nargs]
+
+
+def evaluate_fused(func, *args, **kwargs):
+    '''Evaluates a chain of elementwise operations in one pass without
+    building a computational graph.
+
+    ``func`` is traced with symbolic arguments, so it may only combine them
+    with arithmetic operators, scalars, arrays and the numpy ufuncs
+    ``sqrt``, ``square``, ``exp``, ``log``, ``tanh``, ``absolute``,
+    ``negative`` and ``power``. Intermediate results are computed in place.
+
+    Args:
+        func (callable): Function of the elementwise expression.
+        *args (Node, ndarray): Arguments of ``func``.
+        out (ndarray): Array to write the result to.
+
+    Returns:
+        (ndarray): Value of ``func(*args)``.
+
+    Example:
+        >>> import numpy as np
+        >>> from renom.core import evaluate_fused
+        >>> u, r = np.ones(3), np.full(3, 4.)
+        >>> evaluate_fused(lambda u, r: 0.1 * u / (np.sqrt(r) + 1e-8), u, r)
+        array([ 0.05,  0.05,  0.05])
+    '''
+    out = kwargs.pop('out', None)
+    return _FusedProgram(func, len(args)).run([to_value(a) for a in args], out=out)
+
+
+class Fused(Node):
+    '''Chain of elementwise operations evaluated as a single node.
+
+    The forward pass is computed like :func:`evaluate_fused` and the
+    backward pass propagates the gradient through the whole chain at once,
+    instead of creating a node and a temporary array for every operation.
+    With cuda, ``func(*args)`` is returned.
+
+    Args:
+        func (callable): Function of the elementwise expression.
+        *args (Node, ndarray): Arguments of ``func``.
+
+    Example:
+        >>> import numpy as np
+        >>> import renom as rm
+        >>> x = rm.Variable(np.arange(3.))
+        >>> z = rm.Fused(lambda x: np.exp(-x * x) + 1, x)
+        >>> rm.sum(z).grad().get(x)
+        array([-0.        , -0.73575888, -0.07326256])
+    '''
+
+    def __new__(cls, func, *args):
+        if renom.cuda.is_cuda_active():
+            return func(*args)
+
+        program = _FusedProgram(func, len(args))
+        ret = cls._create_node(program.run([to_value(a) for a in args]))
+        ret.attrs._program = program
+        ret.attrs._args = args
+        nodes = {}
+        for a in args:
+            if isinstance(a, Node):
+                nodes[id(a)] = a
+        ret.attrs._nodes = list(nodes.values())
+        return ret
+
+    def __init__(self, func, *args):
+        super(Fused, self).__init__(self._get_graph())
+
+    def _get_graph(self):
+        if self.attrs and self.attrs.get('_nodes') is not None:
+            return self.attrs._nodes
+        return []
+
+    def _backward_cpu(self, context, dy, **kwargs):
+        args = self.attrs._args
+        grads = self.attrs._program.backward([to_value(a) for a in args], to_value(dy),
+                                             [isinstance(a, Node) for a in args])
+        diffs = {}
+        for a, g in zip(args, grads):
+            if g is not None:
+                diffs[id(a)] = g if id(a) not in diffs else diffs[id(a)] + g
+        for node in self.attrs._nodes:
+            diff = diffs.get(id(node))
+            if diff is None:
+                diff = np.zeros_like(to_value(node))
+            node._update_diff(context, diff, **kwargs)
@@ -8,6 +8,101 @@ if has_cuda():
 import numpy as np
 
 
+class IndexedSlices(object):
+    '''Sparse gradient of a table of which only some rows are used, like
+    the weight of an Embedding. Row ``indices[i]`` of the gradient is
+    ``values[i]``, the same row may appear more than once and the
+    gradients of repeated rows are summed.
+
+    ``Grads`` accumulates IndexedSlices without building the dense
+    gradient, and optimizers update only the rows which appear in it.
+
+    Args:
+        indices (ndarray): Row indices of shape (N, ).
+        values (ndarray): Gradients of the rows of shape (N, ...).
+        dense_shape (tuple): Shape of the table.
+
+    Example:
+        >>> import numpy as np
+        >>> import renom as rm
+        >>> layer = rm.Embedding(output_size=2, input_size=10, sparse=True)
+        >>> x = np.array([[1], [3], [1]])
+        >>> with layer.train():
+        ...     loss = rm.sum(layer(x))
+        >>> grad = loss.grad().get(layer.params.w)
+        >>> grad.coalesce().indices
+        array([1, 3])
+    '''
+
+    # Makes numpy defer binary operators with ndarrays to this class.
+    __array_ufunc__ = None
+
+    def __init__(self, indices, values, dense_shape):
+        self.indices = np.asarray(indices)
+        self.values = values
+        self.dense_shape = tuple(dense_shape)
+
+    @property
+    def shape(self):
+        return self.dense_shape
+
+    @property
+    def dtype(self):
+        return self.values.dtype
+
+    def coalesce(self):
+        '''Returns the IndexedSlices with unique, sorted indices.'''
+        order = np.argsort(self.indices, kind="mergesort")
+        indices = self.indices[order]
+        starts = np.flatnonzero(np.concatenate([[True], indices[1:] != indices[:-1]]))
+        if len(starts) == len(indices):
+            values = self.values[order]
+        else:
+            values = np.add.reduceat(self.values[order], starts, axis=0)
+        return IndexedSlices(indices[starts], values, self.dense_shape)
+
+    def add_to(self, dense):
+        '''Adds the gradient to the rows of a dense array in place.'''
+        grad = self.coalesce()
+        dense.view(np.ndarray)[grad.indices] += grad.values
+        return dense
+
+    def to_dense(self):
+        return self.add_to(np.zeros(self.dense_shape, dtype=self.dtype))
+
+    def __add__(self, other):
+        if isinstance(other, IndexedSlices):
+            return IndexedSlices(np.concatenate([self.indices, other.indices]),
+                                 np.concatenate([self.values, other.values]), self.dense_shape)
+        return self.add_to(np.array(other, dtype=np.result_type(other, self.dtype)))
+
+    __radd__ = __add__
+
+    def __mul__(self, scalar):
+        return IndexedSlices(self.indices, self.values * scalar, self.dense_shape)
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, scalar):
+        return IndexedSlices(self.indices, self.values / scalar, self.dense_shape)
+
+    __div__ = __truediv__
+
+    def __neg__(self):
+        return IndexedSlices(self.indices, -self.values, self.dense_shape)
+
+    def __pow__(self, exponent):
+        grad = self.coalesce()
+        return IndexedSlices(grad.indices, grad.values ** exponent, grad.dense_shape)
+
+    def sum(self):
+        return self.values.sum()
+
+    def __repr__(self):
+        return "IndexedSlices(indices={!r}, values={!r}, dense_shape={!r})".format(
+            self.indices, self.values, self.dense_shape)
+
+
 class Grads:
     '''Grads class. This class contains gradients of each Node object.
 
@@ -32,11 +127,15 @@ class Grads:
               [ 2.,  2.,  2.]], dtype=float32)
     '''
 
-    def __init__(self, root=None, weight_decay=None):
+    def __init__(self, root=None, weight_decay=None, release_graph=False):
         self.stroage = {}
         self.variables = {}
         self._auto_updates = []
         self._weight_decay = weight_decay
+        self._ready = []
+        self._pending = []
+        self._running = False
+        self._release_graph = release_graph
 
         if root is not None:
             self._build_refcounts(root)
@@ -60,6 +159,47 @@ class Grads:
                     for c in t._args:
                         q.append(c)
 
+    def schedule(self, node, **kwargs):
+        '''Queues a node whose gradient has been fully accumulated.
+
+        Nodes are visited in reverse topological order by an explicit stack
+        instead of recursing through ``_update_diff``, so the depth of the
+        graph is not limited by the Python call stack. Nodes which become
+        ready during one ``backward`` call are visited in the order they became
+        ready, which matches the order of the former recursive traversal.
+        '''
+        self._pending.append((node, kwargs))
+        if not self._running:
+            self._run_backward()
+
+    def _run_backward(self):
+        self._running = True
+        try:
+            ready = self._ready
+            while self._pending or ready:
+                ready.extend(reversed(self._pending))
+                del self._pending[:]
+                node, kwargs = ready.pop()
+                node.backward(self, self.get(node), **kwargs)
+                if self._release_graph:
+                    self._release_node(node)
+        finally:
+            self._running = False
+
+    def _release_node(self, node):
+        '''Releases the graph attributes of a node whose backward has finished.
+
+        All consumers of the node have been processed at this point, so its
+        inputs and scratch arrays are no longer needed. The gradient of an
+        intermediate node is dropped as well, gradients of Variables and of
+        graph inputs are kept.
+        '''
+        if node._args and not isinstance(node, Variable):
+            self.variables.pop(id(node), None)
+        if node.attrs:
+            node.attrs.clear()
+        node._args = []
+
     def check_weight_decay(self, node):
         if node.weight_decay is not None:
             wd = node.weight_decay or self._weight_decay
@@ -87,12 +227,17 @@ class Grads:
         selfid = id(node)
         if selfid in self.variables:
             v = self.variables[selfid]
-            with self.unlock_node(v):
-                if has_cuda() and isinstance(dy, GPUValue):
-                    diff = v.get_gpu() + dy
-                    v.set_gpu(diff)
-                else:
-                    v[...] += dy
+            if isinstance(v, IndexedSlices):
+                self.variables[selfid] = v + dy
+            else:
+                with self.unlock_node(v):
+                    if isinstance(dy, IndexedSlices):
+                        dy.add_to(v)
+                    elif has_cuda() and isinstance(dy, GPUValue):
+                        diff = v.get_gpu() + dy
+                        v.set_gpu(diff)
+                    else:
+                        v[...] += dy
         else:
             if has_cuda() and isinstance(dy, GPUValue):
                 dy = Variable(dy)
@@ -111,6 +256,10 @@ class Grads:
         In the case of that there isn't the gradient of given node, this function
         returns 'None'.
 
+        Gradients of intermediate nodes are dropped during the backward pass
+        unless ``grad`` was called with ``detach_graph=False``. Their lookup
+        raises an exception or returns ``default`` like that of any unknown node.
+
         Args:
             node (Node): Returns a gradient with respect to this argument.
             default (object): If gradient of given node is not found, object given to this
@@ -137,7 +286,11 @@ class Grads:
             return
 
         with self.unlock_node(node):
-            dy = self.get(node) if opt is None else opt(self.get(node), node)
+            dy = self.get(node)
+            if isinstance(dy, IndexedSlices):
+                dy = dy.coalesce()
+            if opt is not None:
+                dy = opt(dy, node)
             if node._auto_update:
                 if callable(node.auto_update):
                     node.auto_update(dy)
@@ -145,6 +298,8 @@ class Grads:
                     if is_cuda_active():
                         ngpu = get_gpu(node)
                         ngpu -= get_gpu(dy)
+                    elif isinstance(dy, IndexedSlices):
+                        node.view(np.ndarray)[dy.indices] -= dy.values
                     else:
                         node[...] -= dy
             node.detach_graph()
@@ -202,6 +357,10 @@ def _grad(self, initial=None, detach_graph=True, weight_decay=None, **kwargs):
     Args:
         initial (ndarray): Initial value of following the graph.
         detach_graph (bool): If it's True, the computational graph will be destroyed.
+            The graph attributes of each node are released as soon as its backward
+            has finished, and only gradients of Variables and graph inputs are kept.
+            ``Grads.get`` raises for an intermediate node then, so pass False to
+            read the gradients of intermediate nodes.
         weight_decay (float): Sets the default weight decay of the model.
                             See the Variable class for more info.
     '''
@@ -217,7 +376,7 @@ def _grad(self, initial=None, detach_graph=True, weight_decay=None, **kwargs):
         else:
             initial = np.ones_like(self).astype(precision)
 
-    context = Grads(self, weight_decay=weight_decay)
+    context = Grads(self, weight_decay=weight_decay, release_graph=detach_graph)
     self._update_diff(context, initial, **kwargs)
 
     if detach_graph:
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import contextlib
+
+NCHW = "NCHW"
+NHWC = "NHWC"
+DATA_FORMATS = (NCHW, NHWC)
+
+# Axes which turn an NHWC array into NCHW and back.
+NHWC_TO_NCHW = (0, 3, 1, 2)
+NCHW_TO_NHWC = (0, 2, 3, 1)
+
+_data_format = NCHW
+
+
+def set_data_format(data_format):
+    '''Sets the memory layout of images taken by the layers which are created
+    afterwards, i.e. Conv2d, Deconv2d, MaxPool2d, AveragePool2d, BatchNormalize
+    in 'feature' mode and the image distributors.
+
+    With "NHWC" the channels are the last axis, so the CPU kernels read the
+    channels of a pixel contiguously and the output of a convolution GEMM is
+    used as it is. Weights keep the same shapes in both layouts.
+
+    Args:
+        data_format (str): "NCHW" or "NHWC".
+    '''
+    global _data_format
+    _data_format = check_data_format(data_format)
+
+
+def get_data_format():
+    '''Returns the default memory layout of images, "NCHW" or "NHWC".'''
+    return _data_format
+
+
+def check_data_format(data_format=None):
+    '''Returns the given data format, or the default one if None is given.'''
+    if data_format is None:
+        return _data_format
+    data_format = data_format.upper()
+    assert data_format in DATA_FORMATS, \
+        "The data format must be one of {}. Actual is {}.".format(DATA_FORMATS, data_format)
+    return data_format
+
+
+@contextlib.contextmanager
+def use_data_format(data_format):
+    '''Sets the default memory layout of images within the context.
+
+    Example:
+        >>> import renom as rm
+        >>> with rm.use_data_format("NHWC"):
+        ...     model = rm.Sequential([rm.Conv2d(16), rm.Relu(), rm.MaxPool2d(2, stride=2)])
+    '''
+    data_format_ = _data_format
+    set_data_format(data_format)
+    try:
+        yield
+    finally:
+        set_data_format(data_format_)
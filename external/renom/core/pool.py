@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import division
+import sys
+import contextlib
+import threading
+import collections
+import numpy as np
+from renom.config import precision
+
+
+def _refcount(buffers, i):
+    return sys.getrefcount(buffers[i])
+
+
+# Reference count of a buffer which is referenced by the pool only.
+_FREE_REFCOUNT = _refcount([np.empty(1)], 0)
+
+
+class BufferPool(object):
+    '''Shape keyed pool of numpy arrays for temporaries of the CPU
+    forward and backward computations.
+
+    A buffer is handed out again once every array referring to it has been
+    dropped, e.g. when a column tensor kept for the backward pass is released
+    by ``Grads``. So buffers are never returned explicitly and a steady
+    training loop reuses the same memory every iteration.
+
+    Args:
+        threshold (int): Arrays smaller than this number of bytes are not pooled.
+        max_buffers (int): Maximum number of buffers kept for each shape.
+    '''
+
+    def __init__(self, threshold=1 << 16, max_buffers=8):
+        self.threshold = threshold
+        self.max_buffers = max_buffers
+        self._buffers = collections.defaultdict(list)
+        self._lock = threading.Lock()
+        self.reset_counters()
+
+    def reset_counters(self):
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def nbytes(self):
+        '''Total size of the pooled buffers.'''
+        return sum(b.nbytes for buffers in list(self._buffers.values()) for b in buffers)
+
+    def empty(self, shape, dtype=precision):
+        '''Returns an uninitialized array of the given shape and dtype.'''
+        dtype = np.dtype(dtype)
+        shape = tuple(shape)
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        if nbytes < self.threshold:
+            return np.empty(shape, dtype=dtype)
+
+        with self._lock:
+            buffers = self._buffers[(shape, dtype.str)]
+            for i in range(len(buffers)):
+                if _refcount(buffers, i) <= _FREE_REFCOUNT:
+                    self.hits += 1
+                    return buffers[i]
+
+            self.misses += 1
+            ret = np.empty(shape, dtype=dtype)
+            if len(buffers) < self.max_buffers:
+                buffers.append(ret)
+            return ret
+
+    def zeros(self, shape, dtype=precision):
+        '''Returns an array of the given shape and dtype filled with zeros.'''
+        ret = self.empty(shape, dtype)
+        ret.fill(0)
+        return ret
+
+    def release(self):
+        '''Drops all the pooled buffers.'''
+        with self._lock:
+            self._buffers = collections.defaultdict(list)
+
+
+_buffer_pool = BufferPool()
+# Pool which the temporaries are drawn from, None if no pool is active.
+_active_pool = None
+
+
+def get_buffer_pool():
+    '''Returns the default BufferPool object, which is used while the buffer
+    pool is active unless another pool is given.
+
+    Example:
+        >>> import renom as rm
+        >>> pool = rm.get_buffer_pool()
+        >>> print(pool.hits, pool.misses)
+        0 0
+    '''
+    return _buffer_pool
+
+
+def set_buffer_pool_active(activate=True, pool=None):
+    '''If True is given, temporaries of the CPU computations are drawn from
+    the buffer pool.
+
+    Args:
+        activate (bool): True if the buffer pool is used.
+        pool (BufferPool): Pool to draw from. Defaults to the default pool.
+    '''
+    global _active_pool
+    if not activate:
+        _active_pool = None
+    else:
+        _active_pool = _buffer_pool if pool is None else pool
+
+
+def is_buffer_pool_active():
+    '''Checks whether the buffer pool is active or not.
+
+    Returns:
+        (bool): True if the buffer pool is active.
+    '''
+    return _active_pool is not None
+
+
+@contextlib.contextmanager
+def use_buffer_pool(activate=True, pool=None):
+    '''Activates the buffer pool within the context.
+
+    Args:
+        activate (bool): True if the buffer pool is used.
+        pool (BufferPool): Pool to draw from. Defaults to the default pool.
+
+    Example:
+        >>> import renom as rm
+        >>> with rm.use_buffer_pool():
+        ...     loss = model(x)
+        ...     loss.grad().update(opt)
+    '''
+    global _active_pool
+    active = _active_pool
+    set_buffer_pool_active(activate, pool)
+    try:
+        yield
+    finally:
+        _active_pool = active
+
+
+def release_buffer_pool():
+    '''Releases the buffers kept in the default buffer pool.'''
+    _buffer_pool.release()
+
+
+def empty_buffer(shape, dtype=precision):
+    '''``np.empty`` drawing from the buffer pool if it is active.'''
+    pool = _active_pool
+    if pool is not None:
+        return pool.empty(shape, dtype)
+    return np.empty(shape, dtype=dtype)
+
+
+def zeros_buffer(shape, dtype=precision):
+    '''``np.zeros`` drawing from the buffer pool if it is active.'''
+    pool = _active_pool
+    if pool is not None:
+        return pool.zeros(shape, dtype)
+    return np.zeros(shape, dtype=dtype)
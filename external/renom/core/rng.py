@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import division
+import zlib
+import itertools
+import threading
+import contextlib
+import numpy as np
+from renom.config import precision
+
+_seed = None
+_generation = 0
+_stream_ids = itertools.count()
+_local = threading.local()
+
+# Number of 32 bit words of one Philox counter block.
+_BLOCK_WORDS = 8
+
+
+def _key_int(key):
+    if isinstance(key, (int, np.integer)):
+        return int(key) & 0xFFFFFFFF
+    return zlib.crc32(str(key).encode("utf-8"))
+
+
+def set_rng_seed(seed):
+    '''Sets the seed of all the keyed random streams and rewinds them to
+    their first step.
+
+    Args:
+        seed (int): Seed.
+    '''
+    global _seed, _generation
+    _seed = int(seed)
+    _generation += 1
+
+
+def get_rng_seed():
+    '''Returns the seed of the keyed random streams. If no seed has been
+    set, one is drawn from ``np.random``.
+    '''
+    global _seed
+    if _seed is None:
+        _seed = int(np.random.randint(2**31 - 1))
+    return _seed
+
+
+def generator(*key):
+    '''Returns a ``np.random.Generator`` of the Philox stream identified by
+    the seed and the given key, e.g. ``generator("augmentation", worker, epoch)``.
+    The same key always gives the same stream, whatever process draws it.
+
+    Args:
+        key: Integers or strings identifying the stream.
+
+    Returns:
+        (np.random.Generator): Generator of the keyed stream.
+    '''
+    return np.random.Generator(_philox(tuple(_key_int(k) for k in key)))
+
+
+def _philox(key):
+    state = np.random.SeedSequence(get_rng_seed(), spawn_key=key).generate_state(2, np.uint64)
+    return np.random.Philox(key=state)
+
+
+def get_sample_offset():
+    '''Returns the index of the first sample of the current batch slice.'''
+    return getattr(_local, "offset", 0)
+
+
+@contextlib.contextmanager
+def sample_offset(offset):
+    '''Declares that the computations within the context work on the samples
+    of a batch starting at ``offset``, e.g. the share of one worker of a data
+    parallel step. Random streams then draw the numbers of exactly those
+    samples, so the result does not depend on how the batch is split.
+
+    Example:
+        >>> import renom as rm
+        >>> with rm.sample_offset(64):
+        ...     z = model(x[64:])
+    '''
+    offset_ = get_sample_offset()
+    _local.offset = int(offset)
+    try:
+        yield
+    finally:
+        _local.offset = offset_
+
+
+class RandomStream(object):
+    '''Counter based random stream of a layer.
+
+    Every call draws from a fresh Philox stream keyed by the seed, the key of
+    the stream and a step counter, so the numbers of a step can be computed
+    for any part of a batch without drawing the rest of it. Copies of the
+    stream, e.g. the model replicas of data parallel workers, advance their
+    counters in step and draw the same numbers.
+
+    Args:
+        key: Integers or strings identifying the stream. If not given, the
+            stream is keyed by the order of creation.
+    '''
+
+    def __init__(self, *key):
+        if not key:
+            key = (next(_stream_ids), )
+        self._key = tuple(_key_int(k) for k in key)
+        self._generation = _generation
+        self._step = 0
+
+    def spawn(self, *key):
+        '''Returns an independent stream keyed by this key followed by the
+        given one, e.g. one per worker.'''
+        return RandomStream(*(self._key + key))
+
+    @property
+    def step(self):
+        if self._generation != _generation:
+            self._generation = _generation
+            self._step = 0
+        return self._step
+
+    def get_state(self):
+        return self.step
+
+    def set_state(self, step):
+        self._generation = _generation
+        self._step = step
+
+    def next_step(self):
+        '''Returns the current step and advances the counter.'''
+        step = self.step
+        self._step += 1
+        return step
+
+    def random(self, shape, dtype=precision, out=None, offset=None):
+        '''Draws uniform numbers in [0, 1) for a slice of a batch.
+
+        The first axis of ``shape`` is the batch axis. The numbers of the
+        samples ``offset`` to ``offset + shape[0]`` of the step are drawn,
+        where ``offset`` defaults to the one set by ``sample_offset``.
+
+        Args:
+            shape (tuple): Shape of the slice.
+            dtype: float32 or float64.
+            out (ndarray): Array the numbers are written to.
+            offset (int): Index of the first sample of the slice.
+        '''
+        dtype = np.dtype(dtype)
+        if out is None:
+            out = np.empty(shape, dtype=dtype)
+        if offset is None:
+            offset = get_sample_offset()
+        start = offset * int(np.prod(shape[1:], dtype=np.int64))
+        per_block = _BLOCK_WORDS * 4 // dtype.itemsize
+        bit_generator = _philox(self._key + (self.next_step(), ))
+        bit_generator.advance(start // per_block)
+        gen = np.random.Generator(bit_generator)
+        if start % per_block:
+            gen.random(start % per_block, dtype=dtype)
+        gen.random(dtype=dtype, out=out)
+        return out
+
+    def bernoulli(self, shape, prob, dtype=precision, out=None, offset=None):
+        '''Draws a mask which is ``1 / prob`` with probability ``prob`` and
+        0 otherwise, written in place into ``out``.'''
+        out = self.random(shape, dtype, out, offset)
+        np.less(out, prob, out=out)
+        out *= 1. / prob
+        return out
+
+
+_default_stream = RandomStream("renom")
+
+
+def default_stream():
+    '''Returns the stream used by functions called without a stream.'''
+    return _default_stream
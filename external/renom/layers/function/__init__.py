@@ -1,8 +1,10 @@
 from .parameterized import Model, Parametrized, Sequential
 from .dense import Dense
 from .conv2d import Conv2d
+from .conv2d_algorithm import Conv2dAlgorithm, register_conv2d_algorithm, \
+    clear_conv2d_algorithm_cache
 from .convnd import ConvNd, Conv3d
-from .batch_normalize import BatchNormalize
+from .batch_normalize import BatchNormalize, fold_batch_normalize
 from .layer_normalize import LayerNormalize
 from .weight_normalize import WeightNormalize
 from .peephole_lstm import PeepholeLstm
@@ -17,6 +19,7 @@ from .unpool2d import MaxUnPool2d, max_unpool2d
 from .lstm import Lstm as Lstm, ChainedLSTM
 from .gru import Gru as Gru
 from .embedding import embedding, Embedding
-from .roi_pool2d import roi_pool2d, RoiPool2d
+from .roi_pool2d import roi_pool2d, RoiPool2d, roi_align2d, RoiAlign2d
 from .l2_norm import l2_norm, L2Norm
 from .group_conv2d import GroupConv2d
+from .traced_model import trace, TracedModel
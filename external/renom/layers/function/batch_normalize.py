@@ -4,9 +4,16 @@
 from __future__ import division, print_function
 import numpy as np
 from numbers import Number
+import copy
 from renom.core import Node, Variable, to_value
+from renom.core.pool import empty_buffer
+from renom.core.basic_ops import Transpose
+from renom.core.layout import NCHW, NHWC, NHWC_TO_NCHW, NCHW_TO_NHWC, check_data_format
 from renom import precision
-from renom.layers.function.parameterized import Parametrized
+from renom.layers.function.parameterized import Parametrized, Sequential
+from renom.layers.function.dense import Dense
+from renom.layers.function.conv2d import Conv2d
+from renom.layers.function.utils import moments, reduce_sum
 from renom.utility.initializer import GlorotNormal
 import renom.cuda as cu
 if cu.has_cuda():
@@ -19,47 +26,75 @@ mode_dict = {
     "feature": BATCH_NORMALIZE_FEATUREMAP}
 
 
+def _channels_last(a):
+    # Parameters and statistics of the 'feature' mode are kept as (1, C, 1, 1)
+    # in both layouts and broadcast over NHWC arrays as (1, 1, 1, C).
+    return a.reshape(1, 1, 1, -1) if np.ndim(a) else a
+
+
 class batch_normalize(Node):
-    def __new__(cls, x, w, b, momentum, mov_m, mov_s, inference, mode, epsilon):
+    def __new__(cls, x, w, b, momentum, mov_m, mov_s, inference, mode, epsilon, data_format=None):
         assert inference is True or x.shape[0] > 1, "Batch Normalize expects more than" \
             + " one batch when not in inference mode."
-        return cls.calc_value(x, w, b, momentum, mov_m, mov_s, inference, mode, epsilon)
+        data_format = check_data_format(data_format)
+        if mode != BATCH_NORMALIZE_FEATUREMAP:
+            data_format = NCHW
+        assert data_format == NCHW or not cu.is_cuda_active(), \
+            "NHWC arrays must be transposed to NCHW for batch_normalize on GPU."
+        return cls.calc_value(x, w, b, momentum, mov_m, mov_s, inference, mode, epsilon,
+                              data_format)
 
     @classmethod
-    def _oper_cpu(cls, x, w, b, momentum, mov_m, mov_s, inference, mode, epsilon):
-        if mode == BATCH_NORMALIZE_FEATUREMAP:
+    def _oper_cpu(cls, x, w, b, momentum, mov_m, mov_s, inference, mode, epsilon, data_format):
+        w_ = to_value(w)
+        b_ = None if b is None else to_value(b)
+        if data_format == NHWC:
+            axs = (0, 1, 2)
+            w_, b_, mov_m, mov_s = map(_channels_last, (w_, b_, mov_m, mov_s))
+        elif mode == BATCH_NORMALIZE_FEATUREMAP:
             axs = (0, 2, 3)
         else:
             axs = (0, )
 
         if inference:
+            # Normalization, scale and shift folded into one multiply-add.
             mean = mov_m
-            var = mov_s
+            sq_var = 1.0 / np.sqrt(mov_s + epsilon)
+            scale = w_ * sq_var
+            shift = -mean * scale
+            if b_ is not None:
+                shift = shift + b_
+            z = to_value(x) * scale
+            z += shift
+            xh = None
         else:
-            mean = np.mean(to_value(x), axis=axs, keepdims=True)
-            var = np.var(to_value(x), axis=axs, keepdims=True)
-
-        sq_var = 1.0 / np.sqrt(var + epsilon)
-        xh = (to_value(x) - mean) * sq_var
-        z = to_value(w) * xh
-        if b is not None:
-            z += to_value(b)
+            xh = empty_buffer(x.shape)
+            mean, var = moments(to_value(x), axs, xh)
+            sq_var = 1.0 / np.sqrt(var + epsilon)
+            xh *= sq_var
+            z = xh * w_
+            if b_ is not None:
+                z += b_
 
         ret = cls._create_node(z)
         ret.attrs._axs = axs
+        ret.attrs._data_format = data_format
         ret.attrs._x = x
         ret.attrs._w = w
         ret.attrs._b = b
         ret.attrs._m = mean
         ret.attrs._v = sq_var
+        ret.attrs._xh = xh
         if not inference:
             N = np.prod([x.shape[s] for s in axs])
-            ret.attrs._mov_m = (1 - momentum) * mov_m + momentum * mean
-            ret.attrs._mov_v = (1 - momentum) * mov_s + momentum * var * N / max(N - 1., 1.)
+            mov_m = (1 - momentum) * mov_m + momentum * mean
+            mov_v = (1 - momentum) * mov_s + momentum * var * N / max(N - 1., 1.)
+            ret.attrs._mov_m = mov_m.reshape(w.shape)
+            ret.attrs._mov_v = mov_v.reshape(w.shape)
         return ret
 
     @classmethod
-    def _oper_gpu(cls, x, w, b, momentum, mov_m, mov_s, inference, mode, epsilon):
+    def _oper_gpu(cls, x, w, b, momentum, mov_m, mov_s, inference, mode, epsilon, data_format):
         if mode == BATCH_NORMALIZE_FEATUREMAP:
             axs = 1
         else:
@@ -100,22 +135,31 @@ class batch_normalize(Node):
 
     def _backward_cpu(self, context, dy, **kwargs):
         a = self.attrs._axs
+        w, b = self.attrs._w, self.attrs._b
         sq_var = self.attrs._v
-        meaned = self.attrs._x - self.attrs._m
-        N = np.prod([self.attrs._x.shape[s] for s in a])
+        xh = self.attrs._xh
+        if xh is None:
+            xh = (to_value(self.attrs._x) - self.attrs._m) * sq_var
+        N = np.prod([xh.shape[s] for s in a])
+        dy = to_value(dy)
+        db = reduce_sum(dy, a)
+        dw = reduce_sum(xh, a, dy)
 
         if isinstance(self.attrs._x, Node):
-            dxh = dy * to_value(self.attrs._w)
-            ds = np.sum(dxh * meaned * -np.power(sq_var, 3) / 2, axis=a, keepdims=True)
-            du = np.sum(-dxh * sq_var, axis=a, keepdims=True)
-            dx = dxh * sq_var + (ds * 2 * meaned + du) / N
+            # dx = w / sigma * (dy - mean(dy) - xh * mean(dy * xh))
+            dx = dy * N
+            dx -= db
+            dx -= np.multiply(xh, dw, out=empty_buffer(xh.shape))
+            w_ = to_value(w)
+            if self.attrs._data_format == NHWC:
+                w_ = _channels_last(w_)
+            dx *= w_ * sq_var / N
             self.attrs._x._update_diff(context, dx, **kwargs)
-        if isinstance(self.attrs._w, Node):
-            xh = meaned * sq_var
-            self.attrs._w._update_diff(context, np.sum(xh * dy, axis=a, keepdims=True), **kwargs)
+        if isinstance(w, Node):
+            w._update_diff(context, dw.reshape(w.shape), **kwargs)
 
-        if isinstance(self.attrs._b, Node):
-            self.attrs._b._update_diff(context, np.sum(dy, axis=a, keepdims=True), **kwargs)
+        if isinstance(b, Node):
+            b._update_diff(context, db.reshape(b.shape), **kwargs)
 
     def _backward_gpu(self, context, dy, **kwargs):
         gw, gx, gdy, gm, gv = map(get_gpu, (self.attrs._w, self.attrs._x,
@@ -149,7 +193,8 @@ class BatchNormalize(Parametrized):
     If the argument mode is set to 'activation', this layer normalizes prior-layer features per unit.
     Otherwise the argument mode is set to 'feature', this layer normalizes prior-layer features per channel.
 
-    The 'feature' mode is only effective for 4D tensor input.
+    The 'feature' mode is only effective for 4D tensor input, whose channel axis
+    is given by ``data_format``.
 
     If the argument `input_size` is passed, this layers' weight is initialized
     in the __init__ function.
@@ -162,6 +207,10 @@ class BatchNormalize(Parametrized):
         epsilon (float): Small number added to avoid division by zero.
         ignore_bias (bool): If `True` is given, bias will not be added.
         initializer (Initializer): Initializer object for weight initialization.
+        data_format (str): Memory layout of 4D inputs of the 'feature' mode, "NCHW"
+            or "NHWC". If None is given, the default set by ``rm.set_data_format``
+            when the layer is created is used. The parameters and the moving
+            statistics are of the shape (1, C, 1, 1) in both layouts.
 
     Example:
         >>> import numpy as np
@@ -180,6 +229,8 @@ class BatchNormalize(Parametrized):
 
     """
     SERIALIZED = ('_mov_mean', '_mov_std', '_epsilon', '_mode')
+    # Moving statistics are updated by forward.
+    _traceable = False
 
     def __init__(self,
                  input_size=None,
@@ -188,7 +239,8 @@ class BatchNormalize(Parametrized):
                  epsilon=1e-5,
                  ignore_bias=False,
                  initializer=GlorotNormal(),
-                 weight_decay=0):
+                 weight_decay=0,
+                 data_format=None):
 
         assert momentum > 0, "The value of momentum must be lager than 0."
         self._mov_mean = 0
@@ -200,12 +252,15 @@ class BatchNormalize(Parametrized):
         self._ignore_bias = ignore_bias
         self._initializer = initializer
         self._weight_decay = weight_decay
+        self._data_format = check_data_format(data_format)
         super(BatchNormalize, self).__init__(input_size)
 
     def weight_initiallize(self, input_size):
         size_i = [1, ]
         size_i.extend(input_size)
         if self._mode == BATCH_NORMALIZE_FEATUREMAP and len(size_i) > 2:
+            if self._data_format == NHWC:
+                size_i[1] = size_i[3]
             size_i[2] = 1
             size_i[3] = 1
         self.params = {"w": Variable(self._initializer(size_i).astype(
@@ -214,6 +269,12 @@ class BatchNormalize(Parametrized):
             self.params["b"] = Variable(np.zeros(size_i, dtype=precision), auto_update=True)
 
     def forward(self, x):
+        data_format = self._data_format
+        transposed = data_format == NHWC and self._mode == BATCH_NORMALIZE_FEATUREMAP \
+            and cu.is_cuda_active()
+        if transposed:
+            # cuDNN takes NCHW.
+            x, data_format = Transpose(x, NHWC_TO_NCHW), NCHW
         ret = batch_normalize(x,
                               self.params["w"],
                               self.params.get("b", None),
@@ -222,8 +283,77 @@ class BatchNormalize(Parametrized):
                               self._mov_std,
                               self.inference,
                               self._mode,
-                              self._epsilon)
+                              self._epsilon,
+                              data_format)
         self._mov_mean = ret.attrs.get("_mov_m", self._mov_mean)
         self._mov_std = ret.attrs.get("_mov_v", self._mov_std)
 
+        if transposed:
+            return Transpose(ret, NCHW_TO_NHWC)
         return ret
+
+
+def _fold(layer, bn):
+    if not bn.params or not layer.params:
+        return False
+    if isinstance(layer, Dense) and bn._mode == BATCH_NORMALIZE_ELEMENTWISE:
+        axis = 1
+    elif isinstance(layer, Conv2d) and bn._mode == BATCH_NORMALIZE_FEATUREMAP:
+        axis = 0
+    else:
+        return False
+
+    w = to_value(bn.params["w"])
+    scale = w / np.sqrt(to_value(bn._mov_std) + bn._epsilon)
+    shift = -to_value(bn._mov_mean) * scale
+    if "b" in bn.params:
+        shift = shift + to_value(bn.params["b"])
+    weight = to_value(layer.params["w"])
+    shape = [1] * weight.ndim
+    shape[axis] = -1
+    bias = np.broadcast_to(shift, w.shape)
+    if "b" in layer.params:
+        bias = to_value(layer.params["b"]) * scale + bias
+    layer.params["w"] = Variable(weight * scale.reshape(shape), auto_update=True,
+                                 weight_decay=layer.params["w"].weight_decay)
+    layer.params["b"] = Variable(bias.astype(precision), auto_update=True)
+    return True
+
+
+def fold_batch_normalize(model):
+    """Returns a copy of the model for inference in which every BatchNormalize
+    directly following a Dense or a Conv2d in a Sequential is merged into the
+    weight and bias of that layer, using the moving statistics.
+
+    Dense layers are merged with the 'activation' mode and Conv2d layers with
+    the 'feature' mode. Other BatchNormalize layers are kept. The copy is set
+    to inference mode.
+
+    Args:
+        model (Model): Trained model.
+
+    Returns:
+        (Model): Model without the merged BatchNormalize layers.
+
+    Example:
+        >>> import renom as rm
+        >>> model = rm.Sequential([rm.Conv2d(16), rm.BatchNormalize(mode="feature"), rm.Relu()])
+        >>> # ... training ...
+        >>> folded = rm.fold_batch_normalize(model)
+        >>> z = folded(x)
+    """
+    model = copy.deepcopy(model)
+    for m in list(model.iter_models()):
+        if not isinstance(m, Sequential):
+            continue
+        layers = []
+        for layer in m._layers:
+            if isinstance(layer, BatchNormalize) and layers and _fold(layers[-1], layer):
+                continue
+            layers.append(layer)
+        if len(layers) < len(m._layers):
+            for i in range(len(m._layers)):
+                delattr(m, "l%d" % i)
+            Sequential.__init__(m, layers)
+    model.set_models(inference=True)
+    return model
@@ -2,8 +2,11 @@
 # encoding: utf-8
 
 import numpy as np
-from renom.layers.function.utils import im2col, col2im, out_size, tuplize
+from renom.layers.function.utils import out_size, tuplize
+from renom.layers.function.conv2d_algorithm import get_conv2d_algorithm
 from renom.core import Node, Variable, to_value
+from renom.core.basic_ops import Transpose
+from renom.core.layout import NCHW, NHWC, NHWC_TO_NCHW, NCHW_TO_NHWC, check_data_format
 from renom import precision
 from .parameterized import Parametrized
 from renom.utility.initializer import GlorotNormal
@@ -14,26 +17,50 @@ if cu.has_cuda():
 
 class conv2d(Node):
 
-    def __new__(cls, x, w, b, filter=3, stride=1, padding=0, dilation=1):
+    def __new__(cls, x, w, b, filter=3, stride=1, padding=0, dilation=1, algorithm="gemm",
+                data_format=None):
         filter, stride, padding, dilation = (tuplize(x)
                                              for x in (filter, stride, padding, dilation))
+        data_format = check_data_format(data_format)
+        if data_format == NHWC and cu.is_cuda_active():
+            # cuDNN takes NCHW.
+            z = cls(Transpose(x, NHWC_TO_NCHW), w, b, filter, stride, padding, dilation,
+                    algorithm, NCHW)
+            return Transpose(z, NCHW_TO_NHWC)
 
         in_shape = x.shape[1:]
-        out_shape = [w.shape[0]]
-        out_shape.extend(out_size(x.shape[2:], filter, stride, padding, dilation))
-        return cls.calc_value(x, w, b, in_shape, out_shape, filter, stride, padding, dilation)
+        if data_format == NHWC:
+            out_shape = list(out_size(x.shape[1:3], filter, stride, padding, dilation))
+            out_shape.append(w.shape[0])
+        else:
+            out_shape = [w.shape[0]]
+            out_shape.extend(out_size(x.shape[2:], filter, stride, padding, dilation))
+        return cls.calc_value(x, w, b, in_shape, out_shape, filter, stride, padding, dilation,
+                              algorithm, data_format)
 
     @classmethod
-    def _oper_cpu(cls, x, w, b, in_shape, out_shape, kernel, stride, padding, dilation):
-        col = im2col(to_value(x),
-                     out_shape[1:], kernel,
-                     stride, padding, dilation)
-        value = np.rollaxis(np.tensordot(col, to_value(w),
-                                         ([1, 2, 3], [1, 2, 3])), 3, 1)
-        if b is not None:
-            value += b
+    def _oper_cpu(cls, x, w, b, in_shape, out_shape, kernel, stride, padding, dilation,
+                  algorithm, data_format):
+        x_, w_ = to_value(x), to_value(w)
+        if data_format == NHWC:
+            size = tuple(out_shape[:2])
+        else:
+            size = tuple(out_shape[1:])
+        algorithm = get_conv2d_algorithm(algorithm, x_, w_, size, kernel, stride, padding,
+                                         dilation, isinstance(x, Node) or isinstance(w, Node),
+                                         data_format)
+        if data_format == NHWC:
+            value, state = algorithm.forward_nhwc(x_, w_, size, kernel, stride, padding, dilation)
+            if b is not None:
+                value += to_value(b).reshape(1, 1, 1, -1)
+        else:
+            value, state = algorithm.forward(x_, w_, size, kernel, stride, padding, dilation)
+            if b is not None:
+                value += b
         ret = cls._create_node(value)
-        ret.attrs._col = col
+        ret.attrs._data_format = data_format
+        ret.attrs._algorithm = algorithm
+        ret.attrs._state = state
         ret.attrs._x = x
         ret.attrs._w = w
         ret.attrs._b = b
@@ -46,7 +73,8 @@ class conv2d(Node):
         return ret
 
     @classmethod
-    def _oper_gpu(cls, x, w, b, in_shape, out_shape, kernel, stride, padding, dilation):
+    def _oper_gpu(cls, x, w, b, in_shape, out_shape, kernel, stride, padding, dilation,
+                  algorithm, data_format):
         N = x.shape[0]
         conv_desc = cu.ConvolutionDescriptor(padding, stride, dilation, precision)
         filter_desc = cu.FilterDescriptor(w.shape, precision)
@@ -75,20 +103,24 @@ class conv2d(Node):
 
     def _backward_cpu(self, context, dy, **kwargs):
         dy = to_value(dy)
+        x, w = self.attrs._x, self.attrs._w
+        if self.attrs._data_format == NHWC:
+            backward, bias_axes = self.attrs._algorithm.backward_nhwc, (0, 1, 2)
+        else:
+            backward, bias_axes = self.attrs._algorithm.backward, (0, 2, 3)
+        dx, dw = backward(
+            self.attrs._state, to_value(x), to_value(w), dy, self.attrs._kernel, self.attrs._stride,
+            self.attrs._padding, self.attrs._dilation, isinstance(x, Node), isinstance(w, Node))
 
-        if isinstance(self.attrs._x, Node):
-            dx = np.tensordot(self.attrs._w, dy, (0, 1))
-            dx = np.rollaxis(dx, 3)
-            dx = col2im(dx, self.attrs._in_shape[1:],
-                        self.attrs._stride, self.attrs._padding, self.attrs._dilation)
-            self.attrs._x._update_diff(context, dx, **kwargs)
+        if isinstance(x, Node):
+            x._update_diff(context, dx, **kwargs)
 
-        if isinstance(self.attrs._w, Node):
-            self.attrs._w._update_diff(context, np.tensordot(
-                dy, self.attrs._col, ([0, 2, 3], [0, 4, 5])), **kwargs)
+        if isinstance(w, Node):
+            w._update_diff(context, dw, **kwargs)
 
         if isinstance(self.attrs._b, Node):
-            self.attrs._b._update_diff(context, np.sum(dy, (0, 2, 3), keepdims=True), **kwargs)
+            db = np.sum(dy, bias_axes).reshape(self.attrs._b.shape)
+            self.attrs._b._update_diff(context, db, **kwargs)
 
     def _backward_gpu(self, context, dy, **kwargs):
         dw, db, dx = (get_gpu(g).empty_like_me() if g is not None else None
@@ -129,9 +161,18 @@ class Conv2d(Parametrized):
         padding (tuple,int): Size of the zero-padding around the image.
         stride (tuple,int): Stride-size of the convolution.
         dilation(tupe, int): Dilation of the convolution.
-        input_size (tuple): Input unit size. This must be a tuple like (Channel, Height, Width).
+        input_size (tuple): Input unit size. This must be a tuple like (Channel, Height, Width),
+            or (Height, Width, Channel) in NHWC.
         ignore_bias (bool): If `True` is given, bias will not be added.
         initializer (Initializer): Initializer object for weight initialization.
+        algorithm (str): Algorithm of the convolution on CPU. "gemm" (im2col and
+            GEMM), "winograd" (3x3 kernels of unit stride) or "fft" (unit stride,
+            for large kernels). If "auto" is given, the fastest of them is timed
+            once for every input shape and then reused.
+        data_format (str): Memory layout of the input and the output, "NCHW"
+            or "NHWC". If None is given, the default set by ``rm.set_data_format``
+            when the layer is created is used. The weight is (O, C, k_h, k_w)
+            in both layouts.
 
     Example:
         >>> import numpy as np
@@ -146,7 +187,8 @@ class Conv2d(Parametrized):
         (10, 32, 30, 30)
 
     Note:
-        Tensor data format is **NCHW**.
+        Tensor data format is **NCHW** unless "NHWC" is given. On GPU NHWC
+        tensors are transposed to NCHW for cuDNN.
     """
 
     def __init__(self,
@@ -158,16 +200,22 @@ class Conv2d(Parametrized):
                  input_size=None,
                  ignore_bias=False,
                  initializer=GlorotNormal(),
-                 weight_decay=0):
+                 weight_decay=0,
+                 algorithm="gemm",
+                 data_format=None):
         self._padding, self._stride, self._kernel, self._dilation = (tuplize(x)
                                                                      for x in (padding, stride, filter, dilation))
         self._channel = channel
+        self._algorithm = algorithm
+        self._data_format = check_data_format(data_format)
         self._ignore_bias = ignore_bias
         self._initializer = initializer
         self._weight_decay = weight_decay
         super(Conv2d, self).__init__(input_size)
 
     def weight_initiallize(self, input_size):
+        if self._data_format == NHWC:
+            input_size = (input_size[-1], ) + tuple(input_size[:-1])
         size_f = (self._channel, input_size[0],
                   self._kernel[0], self._kernel[1])
         assert all([s > 0 for s in input_size[1:]]), \
@@ -181,8 +229,9 @@ class Conv2d(Parametrized):
 
     def forward(self, x):
         assert len(x.shape) == 4, "The dimension of input array must be 4. Actual dim is {}".format(x.ndim)
-        assert all([s > 0 for s in x.shape[2:]]), \
+        assert all([s > 0 for s in x.shape[1:]]), \
             "The shape of input array {} is small. Please give an array which size is lager than 0.".format(
                 x.shape)
         return conv2d(x, self.params.w, self.params.get("b", None), self._kernel,
-                      self._stride, self._padding, self._dilation)
+                      self._stride, self._padding, self._dilation, self._algorithm,
+                      self._data_format)
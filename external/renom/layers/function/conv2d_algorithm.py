@@ -0,0 +1,326 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""CPU algorithms of conv2d.
+
+Every algorithm computes the convolution of im2col and one GEMM, i.e.
+``y[n, o, i, j] = sum(w[o, c, a, b] * x[n, c, i * s_h + (k_h - 1 - a) * d_h, ...])``
+over the zero padded x, and its gradients with respect to x and w. In the
+NHWC layout x and the output are of the shapes (N, H, W, C) and
+(N, out_h, out_w, O), while w is (O, C, k_h, k_w) in both layouts.
+"""
+
+import time
+import collections
+import numpy as np
+from renom.layers.function.utils import im2row, col2im, pad_constant
+from renom.core.pool import empty_buffer
+from renom.core.layout import NCHW, NHWC, NHWC_TO_NCHW, NCHW_TO_NHWC
+
+
+class Conv2dAlgorithm(object):
+    '''Base class of the CPU algorithms of conv2d.
+
+    ``forward`` returns the output of the shape (N, O, out_h, out_w) and a
+    state kept for ``backward``. ``backward`` returns the gradients of x and
+    w, where a gradient which is not requested is None.
+    '''
+
+    def supports(self, kernel, stride, dilation):
+        return True
+
+    def forward(self, x, w, size, kernel, stride, padding, dilation):
+        raise NotImplementedError
+
+    def backward(self, state, x, w, dy, kernel, stride, padding, dilation, need_dx=True,
+                 need_dw=True):
+        raise NotImplementedError
+
+    def forward_nhwc(self, x, w, size, kernel, stride, padding, dilation):
+        '''``forward`` in the NHWC layout. By default x is transposed to NCHW
+        and the output back, which algorithms with native NHWC kernels override.'''
+        x = np.ascontiguousarray(x.transpose(NHWC_TO_NCHW))
+        value, state = self.forward(x, w, size, kernel, stride, padding, dilation)
+        return value.transpose(NCHW_TO_NHWC), state
+
+    def backward_nhwc(self, state, x, w, dy, kernel, stride, padding, dilation, need_dx=True,
+                      need_dw=True):
+        '''``backward`` in the NHWC layout.'''
+        x, dy = (np.ascontiguousarray(a.transpose(NHWC_TO_NCHW)) for a in (x, dy))
+        dx, dw = self.backward(state, x, w, dy, kernel, stride, padding, dilation, need_dx,
+                               need_dw)
+        if dx is not None:
+            dx = dx.transpose(NCHW_TO_NHWC)
+        return dx, dw
+
+
+class Im2colGemm(Conv2dAlgorithm):
+    '''im2col followed by one GEMM. It supports every convolution.'''
+
+    def forward(self, x, w, size, kernel, stride, padding, dilation):
+        col = im2row(x, size, kernel, stride, padding, dilation)
+        value = np.dot(col, w.reshape(len(w), -1).T)
+        value = value.reshape((len(x), ) + tuple(size) + (len(w), )).transpose(0, 3, 1, 2)
+        return value, col
+
+    def backward(self, state, x, w, dy, kernel, stride, padding, dilation, need_dx=True,
+                 need_dw=True):
+        dx = dw = None
+        if need_dx:
+            dx = np.rollaxis(np.tensordot(w, dy, (0, 1)), 3)
+            dx = col2im(dx, x.shape[2:], stride, padding, dilation)
+        if need_dw:
+            dw = np.dot(dy.transpose(1, 0, 2, 3).reshape(len(w), -1), state).reshape(w.shape)
+        return dx, dw
+
+    # In NHWC the rows of im2row are ordered as (k_h, k_w, C), the output of
+    # the GEMM is already of the shape (N, out_h, out_w, O) and the
+    # gradients are GEMMs of dy as it is.
+
+    @staticmethod
+    def _weight_rows(w):
+        return w.transpose(0, 2, 3, 1).reshape(len(w), -1)
+
+    def forward_nhwc(self, x, w, size, kernel, stride, padding, dilation):
+        row = im2row(x, size, kernel, stride, padding, dilation, data_format=NHWC)
+        value = np.dot(row, self._weight_rows(w).T)
+        return value.reshape((len(x), ) + tuple(size) + (len(w), )), row
+
+    def backward_nhwc(self, state, x, w, dy, kernel, stride, padding, dilation, need_dx=True,
+                      need_dw=True):
+        dx = dw = None
+        N, out_h, out_w, O = dy.shape
+        dy = dy.reshape(-1, O)
+        if need_dx:
+            k_h, k_w = kernel
+            col = np.dot(dy, self._weight_rows(w)).reshape(N, out_h, out_w, k_h, k_w, -1)
+            dx = col2im(col.transpose(0, 5, 3, 4, 1, 2), x.shape[1:3], stride, padding, dilation,
+                        data_format=NHWC)
+        if need_dw:
+            dw = np.dot(dy.T, state).reshape((O, ) + tuple(kernel) + (-1, ))
+            dw = np.ascontiguousarray(dw.transpose(0, 3, 1, 2))
+        return dx, dw
+
+
+def _pad(x, padding):
+    p_h, p_w = padding
+    if p_h or p_w:
+        return pad_constant(x, ((0, 0), (0, 0), (p_h, p_h), (p_w, p_w)))
+    return x
+
+
+class Winograd(Conv2dAlgorithm):
+    '''Winograd F(2x2, 3x3). A 4x4 tile of x gives a 2x2 tile of the output
+    with 16 instead of 36 multiplications per pair of channels, computed as
+    16 GEMMs in the transformed domain. It supports 3x3 kernels of unit
+    stride and dilation.'''
+
+    # Kernel transform of F(2, 3).
+    _G = np.array([[1., 0., 0.], [.5, .5, .5], [.5, -.5, .5], [0., 0., 1.]])
+
+    def supports(self, kernel, stride, dilation):
+        return tuple(kernel) == (3, 3) and tuple(stride) == (1, 1) and tuple(dilation) == (1, 1)
+
+    @staticmethod
+    def _input_transform(d, out):
+        # B^T d along the 4 rows d[0], ..., d[3] of the tiles.
+        np.subtract(d[0], d[2], out=out[0])
+        np.add(d[1], d[2], out=out[1])
+        np.subtract(d[2], d[1], out=out[2])
+        np.subtract(d[1], d[3], out=out[3])
+
+    def _correlate(self, x, w, size, padding):
+        # Correlation of x padded by ``padding`` with w, cropped to ``size``.
+        N, C = x.shape[:2]
+        O = len(w)
+        t_h, t_w = (size[0] + 1) // 2, (size[1] + 1) // 2
+        p_h, p_w = padding
+        x = pad_constant(x, ((0, 0), (0, 0), (p_h, 2 * t_h + 2 - x.shape[2] - p_h),
+                             (p_w, 2 * t_w + 2 - x.shape[3] - p_w)))
+
+        # Even and odd columns apart, so that the tiles are read contiguously.
+        cols = empty_buffer((N, C, 2 * t_h + 2, 2, t_w + 1), dtype=x.dtype)
+        np.copyto(cols, x.reshape(N, C, 2 * t_h + 2, t_w + 1, 2).transpose(0, 1, 2, 4, 3))
+
+        # Tiles of x transformed as B^T d B, of the shape (4, 4, N, C, t_h, t_w).
+        rows = empty_buffer((4, N, C, t_h, 2, t_w + 1), dtype=x.dtype)
+        self._input_transform([cols[:, :, a:a + 2 * t_h:2] for a in range(4)], rows)
+        v = empty_buffer((4, 4, N, C, t_h, t_w), dtype=x.dtype)
+        for a in range(4):
+            r = rows[a]
+            self._input_transform([r[..., 0, :t_w], r[..., 1, :t_w], r[..., 0, 1:], r[..., 1, 1:]],
+                                  v[a])
+
+        g = self._G.astype(x.dtype)
+        u = np.ascontiguousarray(np.matmul(np.matmul(g, w), g.T).transpose(2, 3, 0, 1))
+        m = np.matmul(u[:, :, None], v.reshape(4, 4, N, C, -1)).reshape(4, 4, N, O, t_h, t_w)
+
+        # A^T m A with A^T = [[1, 1, 1, 0], [0, 1, -1, -1]].
+        y = np.empty((N, O, t_h, 2, t_w, 2), dtype=x.dtype)
+        for r, row in enumerate((m[0] + m[1] + m[2], m[1] - m[2] - m[3])):
+            np.add(row[0] + row[1], row[2], out=y[:, :, :, r, :, 0])
+            np.subtract(row[1] - row[2], row[3], out=y[:, :, :, r, :, 1])
+        y = y.reshape(N, O, 2 * t_h, 2 * t_w)
+        return y[:, :, :size[0], :size[1]]
+
+    def forward(self, x, w, size, kernel, stride, padding, dilation):
+        return self._correlate(x, w[:, :, ::-1, ::-1], size, padding), None
+
+    def backward(self, state, x, w, dy, kernel, stride, padding, dilation, need_dx=True,
+                 need_dw=True):
+        dx = dw = None
+        if need_dx:
+            p_h, p_w = padding
+            if p_h <= 2 and p_w <= 2:
+                # Correlation of dy with the transposed w over the full extent.
+                dx = self._correlate(dy, w.transpose(1, 0, 2, 3), x.shape[2:], (2 - p_h, 2 - p_w))
+            else:
+                dx = _gemm.backward(None, x, w, dy, kernel, stride, padding, dilation,
+                                    need_dw=False)[0]
+        if need_dw:
+            # One GEMM over the batch and the pixels per kernel offset.
+            x = _pad(x, padding).transpose(1, 0, 2, 3)
+            N, O, out_h, out_w = dy.shape
+            dy = np.ascontiguousarray(dy.transpose(1, 0, 2, 3)).reshape(O, -1)
+            window = empty_buffer((len(x), N, out_h, out_w), dtype=x.dtype)
+            dw = np.empty(w.shape, dtype=dy.dtype)
+            for a, b in np.ndindex(3, 3):
+                np.copyto(window, x[:, :, 2 - a:2 - a + out_h, 2 - b:2 - b + out_w])
+                dw[:, :, a, b] = np.dot(dy, window.reshape(len(window), -1).T)
+        return dx, dw
+
+
+def _fft_size(n):
+    # Smallest 2^i * 3^j * 5^k which is not less than n.
+    while True:
+        m = n
+        for p in (2, 3, 5):
+            while m % p == 0:
+                m //= p
+        if m == 1:
+            return n
+        n += 1
+
+
+class FFT(Conv2dAlgorithm):
+    '''Convolution as a product in the frequency domain, whose cost does not
+    grow with the kernel size. It supports unit stride and dilation and pays
+    off for large kernels, e.g. the long 1d kernels of audio models.'''
+
+    def supports(self, kernel, stride, dilation):
+        return tuple(stride) == (1, 1) and tuple(dilation) == (1, 1)
+
+    @staticmethod
+    def _spectrum(x, shape):
+        # rfft2 of x (A, B, h, w) with the frequencies first, i.e. of the
+        # shape (F_h, F_w, A, B), in single precision for float32.
+        f = np.fft.rfft2(x, shape)
+        ret = np.empty(f.shape[2:] + f.shape[:2], dtype=np.result_type(x.dtype, np.complex64))
+        np.copyto(ret, f.transpose(2, 3, 0, 1))
+        return ret
+
+    @staticmethod
+    def _image(f, shape):
+        return np.fft.irfft2(f.transpose(2, 3, 0, 1), shape)
+
+    @staticmethod
+    def _shape(size, kernel):
+        # Transform size of the linear convolution of the padded image.
+        return tuple(_fft_size(i + k - 1) for i, k in zip(size, kernel))
+
+    def forward(self, x, w, size, kernel, stride, padding, dilation):
+        x = _pad(x, padding)
+        shape = self._shape(x.shape[2:], kernel)
+        fx = self._spectrum(x, shape)
+        fy = np.matmul(fx, self._spectrum(w.transpose(1, 0, 2, 3), shape))
+        k_h, k_w = kernel
+        y = self._image(fy, shape)[:, :, k_h - 1:k_h - 1 + size[0], k_w - 1:k_w - 1 + size[1]]
+        return y.astype(x.dtype), fx
+
+    def backward(self, state, x, w, dy, kernel, stride, padding, dilation, need_dx=True,
+                 need_dw=True):
+        dx = dw = None
+        (h, w_), (p_h, p_w), (k_h, k_w) = x.shape[2:], padding, kernel
+        shape = self._shape((h + 2 * p_h, w_ + 2 * p_w), kernel)
+        fdy = self._spectrum(dy, shape)
+        if need_dx:
+            # Full convolution of dy with the flipped and transposed w.
+            fdx = np.matmul(fdy, self._spectrum(w[:, :, ::-1, ::-1], shape))
+            dx = self._image(fdx, shape)[:, :, p_h:p_h + h, p_w:p_w + w_].astype(x.dtype)
+        if need_dw:
+            # Correlation of x with dy, whose first k_h x k_w lags are w flipped.
+            fdw = np.matmul(np.conj(fdy).swapaxes(2, 3), state)
+            dw = self._image(fdw, shape)[:, :, k_h - 1::-1, k_w - 1::-1].astype(w.dtype)
+        return dx, dw
+
+
+_gemm = Im2colGemm()
+
+CONV2D_ALGORITHMS = collections.OrderedDict([
+    ("gemm", _gemm),
+    ("winograd", Winograd()),
+    ("fft", FFT()),
+])
+
+_tuned = {}
+
+
+def register_conv2d_algorithm(name, algorithm):
+    '''Registers a CPU algorithm of conv2d under the given name, which can
+    then be passed to ``Conv2d`` and is a candidate of the auto tuner.
+
+    Args:
+        name (str): Name of the algorithm.
+        algorithm (Conv2dAlgorithm): Algorithm.
+    '''
+    CONV2D_ALGORITHMS[name] = algorithm
+    _tuned.clear()
+
+
+def clear_conv2d_algorithm_cache():
+    '''Forgets the algorithms chosen by the auto tuner.'''
+    _tuned.clear()
+
+
+def find_conv2d_algorithm(x, w, size, kernel, stride, padding, dilation, backward=True,
+                          data_format=NCHW):
+    '''Returns the name of the fastest CPU algorithm of conv2d for the shapes
+    of x and w and the geometry of the convolution. Each candidate is timed
+    once on x and w, including the backward pass if ``backward`` is True,
+    and the winner is cached for later calls of the same configuration.
+    '''
+    key = (x.shape, w.shape, x.dtype.str, tuple(kernel), tuple(stride), tuple(padding),
+           tuple(dilation), backward, data_format)
+    name = _tuned.get(key)
+    if name is None:
+        times = []
+        for candidate, algorithm in CONV2D_ALGORITHMS.items():
+            if not algorithm.supports(kernel, stride, dilation):
+                continue
+            if data_format == NHWC:
+                forward, backward_ = algorithm.forward_nhwc, algorithm.backward_nhwc
+            else:
+                forward, backward_ = algorithm.forward, algorithm.backward
+            start = time.perf_counter()
+            value, state = forward(x, w, size, kernel, stride, padding, dilation)
+            if backward:
+                backward_(state, x, w, value, kernel, stride, padding, dilation)
+            times.append((time.perf_counter() - start, candidate))
+        name = _tuned[key] = min(times)[1]
+    return name
+
+
+def get_conv2d_algorithm(name, x, w, size, kernel, stride, padding, dilation, backward=True,
+                         data_format=NCHW):
+    '''Returns the algorithm of the given name, tuning it if the name is "auto".'''
+    if name == "auto":
+        name = find_conv2d_algorithm(x, w, size, kernel, stride, padding, dilation, backward,
+                                     data_format)
+    assert name in CONV2D_ALGORITHMS, \
+        "Unknown conv2d algorithm {}. Choose one of {}.".format(
+            name, ", ".join(["auto"] + list(CONV2D_ALGORITHMS)))
+    algorithm = CONV2D_ALGORITHMS[name]
+    assert algorithm.supports(kernel, stride, dilation), \
+        "The conv2d algorithm {} does not support the kernel {}, stride {} and dilation {}.".format(
+            name, kernel, stride, dilation)
+    return algorithm
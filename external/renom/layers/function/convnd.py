@@ -2,7 +2,7 @@
 # encoding: utf - 8
 
 import numpy as np
-from renom.layers.function.utils import imncol, colnim, pad_dx, pad_image, colnw
+from renom.layers.function.utils import imncol, colnim, colnw
 from renom.core import Node, Variable, to_value
 from renom import precision
 from .parameterized import Parametrized
@@ -21,7 +21,7 @@ class convnd(Node):
 
     @classmethod
     def _oper_cpu(cls, x, w, b, in_shape, kernel, stride, padding):
-        col = imncol(to_value(x), w, stride, padding)
+        col = imncol(to_value(x), to_value(w), stride, padding)
         if b is not None:
             col += b
         ret = cls._create_node(col)
@@ -57,12 +57,15 @@ class convnd(Node):
         return ret
 
     def _backward_cpu(self, context, dy, **kwargs):
+        dy = to_value(dy)
         if isinstance(self.attrs._x, Node):
-            dx = colnim(dy, self.attrs._w, self.attrs._stride)
+            dx = colnim(dy, to_value(self.attrs._w), self.attrs._stride,
+                        self.attrs._padding, self.attrs._x.shape[2:])
             self.attrs._x._update_diff(context, dx)
 
         if isinstance(self.attrs._w, Node):
-            dw = colnw(self.attrs._x, dy, self.attrs._stride)
+            dw = colnw(to_value(self.attrs._x), dy, self.attrs._stride,
+                       self.attrs._padding, self.attrs._w.shape[2:])
             self.attrs._w._update_diff(context, dw)
 
         if isinstance(self.attrs._b, Node):
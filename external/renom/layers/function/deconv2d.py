@@ -3,8 +3,10 @@
 
 
 import numpy as np
-from renom.layers.function.utils import col2im, transpose_out_size, im2col, tuplize
+from renom.layers.function.utils import col2im, transpose_out_size, im2row, tuplize
 from renom.core import Node, Variable, to_value
+from renom.core.basic_ops import Transpose
+from renom.core.layout import NCHW, NHWC, NHWC_TO_NCHW, NCHW_TO_NHWC, check_data_format
 from renom import precision
 from .parameterized import Parametrized
 from renom.utility.initializer import GlorotNormal
@@ -15,23 +17,47 @@ if cu.has_cuda():
 
 class deconv2d(Node):
 
-    def __new__(cls, x, w, b, filter=3, stride=1, padding=0, dilation=1):
+    def __new__(cls, x, w, b, filter=3, stride=1, padding=0, dilation=1, data_format=None):
         filter, stride, padding, dilation = (tuplize(x)
                                              for x in (filter, stride, padding, dilation))
-
-        in_shape = x.shape[1:]
+        data_format = check_data_format(data_format)
+        if data_format == NHWC:
+            if cu.is_cuda_active():
+                # cuDNN takes NCHW.
+                z = cls(Transpose(x, NHWC_TO_NCHW), w, b, filter, stride, padding, dilation, NCHW)
+                return Transpose(z, NCHW_TO_NHWC)
+            # Shapes are kept channels first as with NCHW.
+            in_shape = (x.shape[3], ) + x.shape[1:3]
+        else:
+            in_shape = x.shape[1:]
         out_shape = [w.shape[1], ]
         out_shape.extend(transpose_out_size(in_shape[1:], filter, stride, padding, dilation))
-        return cls.calc_value(x, w, b, in_shape, out_shape, filter, stride, padding, dilation)
+        return cls.calc_value(x, w, b, in_shape, out_shape, filter, stride, padding, dilation,
+                              data_format)
+
+    @staticmethod
+    def _weight_rows(w):
+        # w (C_in, C_out, k_h, k_w) as the matrix (C_in, k_h * k_w * C_out).
+        return to_value(w).transpose(0, 2, 3, 1).reshape(len(w), -1)
 
     @classmethod
-    def _oper_cpu(cls, x, w, b, in_shape, out_shape, kernel, stride, padding, dilation):
-        z = np.tensordot(w, x, (0, 1))
-        z = np.rollaxis(z, 3)
-        z = col2im(z, out_shape[1:], stride, padding, dilation)
-        if b is not None:
-            z += b
+    def _oper_cpu(cls, x, w, b, in_shape, out_shape, kernel, stride, padding, dilation,
+                  data_format):
+        if data_format == NHWC:
+            N, h, w_ = x.shape[:3]
+            z = np.dot(to_value(x).reshape(-1, in_shape[0]), cls._weight_rows(w))
+            z = z.reshape((N, h, w_) + tuple(kernel) + (-1, )).transpose(0, 5, 3, 4, 1, 2)
+            z = col2im(z, out_shape[1:], stride, padding, dilation, data_format=NHWC)
+            if b is not None:
+                z += to_value(b).reshape(1, 1, 1, -1)
+        else:
+            z = np.tensordot(w, x, (0, 1))
+            z = np.rollaxis(z, 3)
+            z = col2im(z, out_shape[1:], stride, padding, dilation)
+            if b is not None:
+                z += b
         ret = cls._create_node(z)
+        ret.attrs._data_format = data_format
         ret.attrs._x = x
         ret.attrs._w = w
         ret.attrs._b = b
@@ -43,7 +69,8 @@ class deconv2d(Node):
         return ret
 
     @classmethod
-    def _oper_gpu(cls, x, w, b, in_shape, out_shape, kernel, stride, padding, dilation):
+    def _oper_gpu(cls, x, w, b, in_shape, out_shape, kernel, stride, padding, dilation,
+                  data_format):
         conv_desc = cu.ConvolutionDescriptor(padding, stride, dilation, precision)
         filter_desc = cu.FilterDescriptor(w.shape, precision)
         N = x.shape[0]
@@ -64,22 +91,43 @@ class deconv2d(Node):
         return ret
 
     def _backward_cpu(self, context, dy, **kwargs):
+        if self.attrs._data_format == NHWC:
+            return self._backward_cpu_nhwc(context, dy, **kwargs)
 
-        col = im2col(dy, self.attrs._in_shape[1:], self.attrs._kernel,
+        w = self.attrs._w
+        col = im2row(to_value(dy), self.attrs._in_shape[1:], self.attrs._kernel,
                      self.attrs._stride, self.attrs._padding, self.attrs._dilation)
 
         if isinstance(self.attrs._x, Node):
-            dx = np.tensordot(col, self.attrs._w, ([1, 2, 3], [1, 2, 3]))
-            dx = np.rollaxis(dx, 3, 1)
-            self.attrs._x._update_diff(context, dx, **kwargs)
+            dx = np.dot(col, to_value(w).reshape(len(w), -1).T)
+            dx = dx.reshape((len(dy), ) + tuple(self.attrs._in_shape[1:]) + (len(w), ))
+            self.attrs._x._update_diff(context, dx.transpose(0, 3, 1, 2), **kwargs)
 
-        if isinstance(self.attrs._w, Node):
-            self.attrs._w._update_diff(context, np.tensordot(
-                self.attrs._x, col, ([0, 2, 3], [0, 4, 5])), **kwargs)
+        if isinstance(w, Node):
+            x = to_value(self.attrs._x).transpose(1, 0, 2, 3).reshape(len(w), -1)
+            w._update_diff(context, np.dot(x, col).reshape(w.shape), **kwargs)
 
         if isinstance(self.attrs._b, Node):
             self.attrs._b._update_diff(context, np.sum(dy, (0, 2, 3), keepdims=True), **kwargs)
 
+    def _backward_cpu_nhwc(self, context, dy, **kwargs):
+        x, w, b = self.attrs._x, self.attrs._w, self.attrs._b
+        dy = to_value(dy)
+        col = im2row(dy, self.attrs._in_shape[1:], self.attrs._kernel, self.attrs._stride,
+                     self.attrs._padding, self.attrs._dilation, data_format=NHWC)
+
+        if isinstance(x, Node):
+            dx = np.dot(col, self._weight_rows(w).T)
+            x._update_diff(context, dx.reshape(x.shape), **kwargs)
+
+        if isinstance(w, Node):
+            dw = np.dot(to_value(x).reshape(-1, len(w)).T, col)
+            dw = dw.reshape((len(w), ) + tuple(self.attrs._kernel) + (-1, ))
+            w._update_diff(context, np.ascontiguousarray(dw.transpose(0, 3, 1, 2)), **kwargs)
+
+        if isinstance(b, Node):
+            b._update_diff(context, np.sum(dy, (0, 1, 2)).reshape(b.shape), **kwargs)
+
     def _backward_gpu(self, context, dy, **kwargs):
         dw, db, dx = (get_gpu(g).empty_like_me() if g is not None else None
                       for g in (self.attrs._w, self.attrs._b, self.attrs._x))
@@ -120,9 +168,14 @@ class Deconv2d(Parametrized):
         padding (tuple,int): Pad around image by 0 according to this size.
         stride (tuple,int): Specifying the strides of the convolution.
         dilation (tuple, int): Dilation of the convolution.
-        input_size (tuple): Input unit size. This must be a tuple like (Channel, Height, Width).
+        input_size (tuple): Input unit size. This must be a tuple like (Channel, Height, Width),
+            or (Height, Width, Channel) in NHWC.
         ignore_bias (bool): If True is given, bias will not be added.
         initializer (Initializer): Initializer object for weight initialization.
+        data_format (str): Memory layout of the input and the output, "NCHW"
+            or "NHWC". If None is given, the default set by ``rm.set_data_format``
+            when the layer is created is used. The weight is (C, O, k_h, k_w)
+            in both layouts.
 
     Example:
         >>> import numpy as np
@@ -147,7 +200,8 @@ class Deconv2d(Parametrized):
                  input_size=None,
                  ignore_bias=False,
                  initializer=GlorotNormal(),
-                 weight_decay=0):
+                 weight_decay=0,
+                 data_format=None):
 
         self._padding, self._stride, self._kernel, self._dilation = (tuplize(x)
                                                                      for x in (padding, stride, filter, dilation))
@@ -155,9 +209,12 @@ class Deconv2d(Parametrized):
         self._initializer = initializer
         self._ignore_bias = ignore_bias
         self._weight_decay = weight_decay
+        self._data_format = check_data_format(data_format)
         super(Deconv2d, self).__init__(input_size)
 
     def weight_initiallize(self, input_size):
+        if self._data_format == NHWC:
+            input_size = (input_size[-1], ) + tuple(input_size[:-1])
         size_f = (input_size[0], self._channel,
                   self._kernel[0], self._kernel[1])
         self.params = {"w": Variable(self._initializer(
@@ -168,4 +225,5 @@ class Deconv2d(Parametrized):
 
     def forward(self, x):
         return deconv2d(x, self.params["w"], self.params.get("b"),
-                        self._kernel, self._stride, self._padding, self._dilation)
+                        self._kernel, self._stride, self._padding, self._dilation,
+                        self._data_format)
@@ -2,7 +2,7 @@
 # encoding: utf - 8
 
 import numpy as np
-from renom.layers.function.utils import imncol, colnim, pad_dx, pad_image, colnw
+from renom.layers.function.utils import imncol, colnim, colnw
 from renom.core import Node, Variable, to_value
 from renom import precision
 from .parameterized import Parametrized
@@ -13,6 +13,11 @@ if cu.has_cuda():
 from renom.cuda import is_cuda_active
 
 
+def _flip_kernel(w):
+    # The CPU kernels scatter with the kernel reversed along every spatial axis.
+    return w[(slice(None), slice(None)) + (slice(None, None, -1), ) * (w.ndim - 2)]
+
+
 class deconvnd(Node):
 
     def __new__(cls, x, w, b, filter=3, stride=1, padding=0):
@@ -21,9 +26,7 @@ class deconvnd(Node):
 
     @classmethod
     def _oper_cpu(cls, x, w, b, in_shape, kernel, stride, padding):
-        w_rev = np.reshape(w, (w.shape[0], w.shape[1], -1))
-        w_rev = np.flip(w_rev, 2).reshape(w.shape)
-        col = colnim(x, w_rev, stride)
+        col = colnim(to_value(x), _flip_kernel(to_value(w)), stride, padding)
         if b is not None:
             col += b
         ret = cls._create_node(col)
@@ -59,22 +62,20 @@ class deconvnd(Node):
         return ret
 
     def _backward_cpu(self, context, dy, **kwargs):
+        dy = to_value(dy)
+        w_rev = _flip_kernel(to_value(self.attrs._w))
         if isinstance(self.attrs._x, Node):
-            dx = imncol(dy, self.attrs._w, self.attrs._stride, padding=[
-                        0 for _ in range(len(self.attrs._stride))])
+            dx = imncol(dy, w_rev, self.attrs._stride, self.attrs._padding)
             self.attrs._x._update_diff(context, dx, **kwargs)
 
         if isinstance(self.attrs._w, Node):
-            l = [x for x in range(len(self.shape))]  # noqa
-            del(l[1])
-            dw = np.ones_like(self.attrs._w) * \
-                np.swapaxes(np.sum(self.attrs._x, axis=tuple(l), keepdims=True), 0, 1)
-            self.attrs._w._update_diff(context, dw, **kwargs)
+            dw = colnw(dy, to_value(self.attrs._x), self.attrs._stride,
+                       self.attrs._padding, w_rev.shape[2:])
+            self.attrs._w._update_diff(context, _flip_kernel(dw), **kwargs)
 
         if isinstance(self.attrs._b, Node):
-            db = np.sum(np.ones_like(self), axis=tuple(
-                [x for x in range(2, len(self.shape), 1)]), keepdims=True)
-            self.attrs._b._update_diff(context, np.sum(db, axis=0, keepdims=True))
+            db = np.sum(dy, axis=tuple([0, ] + list(range(2, dy.ndim))), keepdims=True)
+            self.attrs._b._update_diff(context, db, **kwargs)
 
     def _backward_gpu(self, context, dy, **kwargs):
         dw, db, dx = (get_gpu(g).empty_like_me() if g is not None else None for g in (
@@ -4,6 +4,8 @@
 from __future__ import division
 import numpy as np
 from renom.core import Node
+from renom.core.pool import empty_buffer
+from renom.core.rng import RandomStream, default_stream
 from renom import precision
 from renom.layers.function.parameterized import Model
 import renom.cuda as cu
@@ -18,16 +20,16 @@ except ImportError:
 
 class dropout(Node):
 
-    def __new__(cls, x, dropout_ratio=0.5, inference=False):
+    def __new__(cls, x, dropout_ratio=0.5, inference=False, stream=None):
         if inference:
             return x
-        ret = cls.calc_value(x, 1. - dropout_ratio)
+        ret = cls.calc_value(x, 1. - dropout_ratio, stream or default_stream())
         ret._ratio = dropout_ratio
         return ret
 
     @classmethod
-    def _oper_cpu(cls, x, dropout_ratio):
-        mask = np.array(np.random.rand(*x.shape) < dropout_ratio, dtype=precision) / dropout_ratio
+    def _oper_cpu(cls, x, dropout_ratio, stream):
+        mask = stream.bernoulli(x.shape, dropout_ratio, out=empty_buffer(x.shape))
         value = x * mask
 
         ret = cls._create_node(value)
@@ -36,7 +38,7 @@ class dropout(Node):
         return ret
 
     @classmethod
-    def _oper_gpu(cls, x, dropout_ratio):
+    def _oper_gpu(cls, x, dropout_ratio, stream):
         mask = get_gpu(x).empty_like_me()
         curand_generator().rand_bernoulli(mask, 1 - dropout_ratio)
         mask = mask / dropout_ratio
@@ -59,17 +61,16 @@ class dropout(Node):
 
 class spatial_dropout(dropout):
 
-    def __new__(cls, x, dropout_ratio=0.5, inference=False):
+    def __new__(cls, x, dropout_ratio=0.5, inference=False, stream=None):
         assert len(x.shape) == 4, "Spatial_dropout only accepts 4d tensors."
         if inference:
             return x
         else:
-            return cls.calc_value(x, 1. - dropout_ratio)
+            return cls.calc_value(x, 1. - dropout_ratio, stream or default_stream())
 
     @classmethod
-    def _oper_cpu(cls, x, dropout_ratio):
-        mask = np.array(np.random.rand(*x.shape[:2]) < dropout_ratio,
-                        dtype=precision)[:, :, None, None] / dropout_ratio
+    def _oper_cpu(cls, x, dropout_ratio, stream):
+        mask = stream.bernoulli(x.shape[:2], dropout_ratio, precision)[:, :, None, None]
         value = x * mask
         ret = cls._create_node(value)
         ret.attrs._x = x
@@ -77,7 +78,7 @@ class spatial_dropout(dropout):
         return ret
 
     @classmethod
-    def _oper_gpu(cls, x, drop_out_ratio):
+    def _oper_gpu(cls, x, drop_out_ratio, stream):
         shape = (x.shape[0], x.shape[1], 1, 1)
         mask = GPUValue(shape=shape)
         curand_generator().rand_bernoulli(mask, 1 - drop_out_ratio)
@@ -97,8 +98,14 @@ class Dropout(Model):
     the data sets them to zero.
     Remaining data will be rescaled by ``1/(1 - dropout_ratio)``.
 
+    On CPU the mask is drawn from a counter based random stream of the
+    layer, see ``RandomStream``. It is reproduced by ``set_renom_seed`` and
+    does not depend on how a batch is split between workers.
+
     Args:
         dropout_ratio (float): Dropout ratio.
+        key: Integers or strings identifying the random stream of the layer.
+            If not given, the stream is keyed by the order of creation.
 
     Example:
         >>> import numpy as np
@@ -128,8 +135,9 @@ class Dropout(Model):
 
     """
 
-    def __init__(self, dropout_ratio=0.5):
+    def __init__(self, dropout_ratio=0.5, key=None):
         self._dropout_ratio = dropout_ratio
+        self._stream = RandomStream() if key is None else RandomStream(key)
         self.inference = False
 
     def __call__(self, x):
@@ -138,7 +146,7 @@ class Dropout(Model):
         return self.forward(x)
 
     def forward(self, x):
-        return dropout(x, self._dropout_ratio, self.inference)
+        return dropout(x, self._dropout_ratio, self.inference, self._stream)
 
 
 class SpatialDropout(Dropout):
@@ -182,4 +190,4 @@ class SpatialDropout(Dropout):
     """
 
     def forward(self, x):
-        return spatial_dropout(x, self._dropout_ratio, self.inference)
+        return spatial_dropout(x, self._dropout_ratio, self.inference, self._stream)
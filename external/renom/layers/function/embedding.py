@@ -3,7 +3,7 @@
 
 from __future__ import division
 import numpy as np
-from renom.core import Node, Variable
+from renom.core import Node, Variable, IndexedSlices, to_value
 from renom import precision
 from renom.layers.function.parameterized import Parametrized
 from renom.utility.initializer import GlorotNormal
@@ -14,25 +14,23 @@ if cu.has_cuda():
 
 class embedding(Node):
 
-    def __new__(cls, x, w):
+    def __new__(cls, x, w, sparse=False):
         assert x.shape[1] == 1
-        return cls.calc_value(x, w)
+        return cls.calc_value(x, w, sparse)
 
     @classmethod
-    def _oper_cpu(cls, x, w):
-        if isinstance(x, Node):
-            index = x.as_ndarray().astype(np.int)[:, 0]
-        else:
-            index = x.astype(np.int)[:, 0]
-        value = w[index]
+    def _oper_cpu(cls, x, w, sparse):
+        index = to_value(x).astype(int)[:, 0]
+        value = to_value(w)[index]
         ret = cls._create_node(value)
         ret.attrs._x = x
         ret.attrs._w = w
         ret.attrs._index = index
+        ret.attrs._sparse = sparse
         return ret
 
     @classmethod
-    def _oper_gpu(cls, x, w):
+    def _oper_gpu(cls, x, w, sparse):
         z = GPUValue(shape=(len(x), len(w[0])))
         cu.cuembedding_forward(get_gpu(x), get_gpu(w), z)
         ret = cls._create_node(z)
@@ -42,11 +40,10 @@ class embedding(Node):
 
     def _backward_cpu(self, context, dy, **kwargs):
         if isinstance(self.attrs._w, Node):
-            N = len(self.attrs._index)
-            dx = np.zeros(self.attrs._w.shape, dtype=self.attrs._w.dtype)
-            for i in range(N):
-                dx[self.attrs._index[i]] += dy[i]
-            self.attrs._w._update_diff(context, dx, **kwargs)
+            dw = IndexedSlices(self.attrs._index, to_value(dy), self.attrs._w.shape)
+            if not self.attrs._sparse:
+                dw = dw.to_dense()
+            self.attrs._w._update_diff(context, dw, **kwargs)
 
     def _backward_gpu(self, context, dy, **kwargs):
         if isinstance(self.attrs._w, Node):
@@ -68,10 +65,15 @@ class Embedding(Parametrized):
     | **[Embedding layer]**
     |  data -> embedding layer -> embedded data
 
+    If ``sparse`` is True, the gradient of the weight is an ``IndexedSlices``
+    holding the rows of the batch only, and ``Sgd``, ``Adagrad`` and ``Adam``
+    update only these rows. This saves the dense gradient of large tables.
+
     Args:
         output_size (int): Output unit size.
         input_size (int): Input unit size. This is same as number of embedding characters.
         initializer (Initializer): Initializer object for weight initialization.
+        sparse (bool): If True, the gradient of the weight is sparse.
 
     Example:
         >>> import numpy as np
@@ -86,8 +88,10 @@ class Embedding(Parametrized):
         2. Both ``output_size`` and ``input_size`` must be specified.
     """
 
-    def __init__(self, output_size, input_size, initializer=GlorotNormal(), weight_decay=None):
+    def __init__(self, output_size, input_size, initializer=GlorotNormal(), weight_decay=None,
+                 sparse=False):
         self._output_size = output_size
+        self._sparse = sparse
         self._initializer = initializer
         self._weight_decay = weight_decay
         super(Embedding, self).__init__(input_size)
@@ -99,4 +103,4 @@ class Embedding(Parametrized):
             "w": Variable(self._initializer((size_i, size_o)), auto_update=True, weight_decay=self._weight_decay)}
 
     def forward(self, x):
-        return embedding(x, self.params.w)
+        return embedding(x, self.params.w, self._sparse)
@@ -2,7 +2,7 @@
 # encoding: utf-8
 
 import numpy as np
-from renom.layers.function.utils import im2col, col2im, out_size, tuplize
+from renom.layers.function.utils import im2col_view, col2im, out_size, tuplize
 from renom.core import Node, Variable, to_value
 from renom import precision
 from .parameterized import Parametrized
@@ -32,9 +32,10 @@ class group_conv2d(Node):
         iCg = in_channels // groups
         oCg = out_channels // groups
 
-        col = im2col(to_value(x), out_shape[1:], kernel, stride, padding, dilation)
+        col = im2col_view(to_value(x), out_shape[1:], kernel, stride, padding, dilation)
         out_h, out_w = col.shape[-2:]
 
+        # The transposed view is copied only once by the reshape.
         col = col.transpose(1, 2, 3, 0, 4, 5)
         col = col.reshape(groups, iCg * k_h * k_w, N * out_h * out_w)
         w_new = w.reshape(groups, oCg, iCg * k_h * k_w)
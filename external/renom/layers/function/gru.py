@@ -5,11 +5,11 @@ from __future__ import division
 import numpy as np
 from renom.layers.activation.sigmoid import sigmoid
 from renom.layers.activation.tanh import tanh
-from renom.core import Node, Variable, GetItem
+from renom.core import Node, Variable, GetItem, to_value
 from renom import precision
 from renom.operation import dot, sum, concat
 from renom.utility.initializer import GlorotNormal
-from .parameterized import Parametrized
+from .parameterized import Parametrized, _detach_state
 import renom.cuda as cu
 if cu.has_cuda():
     from renom.cuda.gpuvalue import get_gpu
@@ -23,6 +23,15 @@ def tanh_diff(x):
     return (1.0 - tanh(x) ** 2)
 
 
+def _sigmoid(x):
+    # Logistic function computed in place.
+    np.negative(x, out=x)
+    np.exp(x, out=x)
+    x += 1.
+    np.reciprocal(x, out=x)
+    return x
+
+
 class gru(Node):
     '''
     @ parameters
@@ -150,12 +159,10 @@ class gru(Node):
 
         dpz = pz_z + pz_r + pz_h
 
-        self.attrs._x._update_diff(context, dx)
-        self.attrs._w._update_diff(context, dw)
-        self.attrs._b._update_diff(context, db)
-        self.attrs._u._update_diff(context, du)
-        if isinstance(self.attrs._pz, Node):
-            self.attrs._pz._update_diff(context, dpz)
+        for node, diff in ((self.attrs._x, dx), (self.attrs._w, dw), (self.attrs._b, db),
+                           (self.attrs._u, du), (self.attrs._pz, dpz)):
+            if isinstance(node, Node):
+                node._update_diff(context, diff)
 
     def prn(self, v, name='Node'):
         h = self._create_node(v)
@@ -195,6 +202,98 @@ class gru(Node):
             self.attrs._pz._update_diff(context, dpz)
 
 
+class gru_sequence(Node):
+    """Gru over a whole sequence x of the shape (T, N, D). The input
+    projection of all steps is one GEMM and backpropagation through time is
+    done in the backward of this single node."""
+
+    def __new__(cls, x, pz, w, u, b):
+        return cls.calc_value(x, pz, w, u, b)
+
+    @classmethod
+    def _oper_cpu(cls, x, pz, w, u, b):
+        T, N, D = x.shape
+        m = w.shape[1] // 3
+        # The activated gates sigmoid(A), sigmoid(B) and tanh(C) of each step
+        # are written over the input projection.
+        gates = np.dot(to_value(x).reshape(T * N, D), to_value(w)).reshape(T, N, m * 3)
+        if b is not None:
+            gates += to_value(b)
+        u_z, u_r, u_h = np.split(to_value(u), [m, m * 2], axis=1)
+        h = np.empty((T, N, m), dtype=gates.dtype)
+
+        hminus = to_value(pz) if pz is not None else np.zeros((N, m), dtype=gates.dtype)
+        for t in range(T):
+            A, B, C = gates[t, :, :m], gates[t, :, m:m * 2], gates[t, :, m * 2:]
+            A += hminus * u_z
+            B += hminus * u_r
+            _sigmoid(A)
+            _sigmoid(B)
+            C += B * u_h * hminus
+            np.tanh(C, out=C)
+            hminus = np.add(A, C, out=h[t])
+
+        ret = cls._create_node(h)
+        ret.attrs._x = x
+        ret.attrs._w = w
+        ret.attrs._u = u
+        ret.attrs._b = b
+        ret.attrs._pz = pz
+        ret.attrs._gates = gates
+        return ret
+
+    def _backward_cpu(self, context, dy, **kwargs):
+        x = to_value(self.attrs._x)
+        w = to_value(self.attrs._w)
+        gates = self.attrs._gates
+        pz = self.attrs._pz
+        h = to_value(self)
+        T, N, m = h.shape
+        u_z, u_r, u_h = np.split(to_value(self.attrs._u), [m, m * 2], axis=1)
+
+        dy = to_value(dy)
+        dgates = np.empty(gates.shape, dtype=gates.dtype)
+        du = np.zeros((3, N, m), dtype=gates.dtype)
+        dh = None
+        for t in range(T - 1, -1, -1):
+            if t:
+                hminus = h[t - 1]
+            elif pz is not None:
+                hminus = to_value(pz)
+            else:
+                hminus = None
+            e = dy[t] if dh is None else dy[t] + dh
+            sA, sB, tC = gates[t, :, :m], gates[t, :, m:m * 2], gates[t, :, m * 2:]
+            gA, gB, gC = dgates[t, :, :m], dgates[t, :, m:m * 2], dgates[t, :, m * 2:]
+            np.multiply(e, sA * (1. - sA), out=gA)
+            np.multiply(e, 1. - tC ** 2, out=gC)
+            if hminus is None:
+                gB[...] = 0
+                dh = None
+                continue
+            np.multiply(gC * u_h * hminus, sB * (1. - sB), out=gB)
+            du[0] += gA * hminus
+            du[1] += gB * hminus
+            du[2] += gC * sB * hminus
+            dh = gA * u_z + gB * u_r + gC * sB * u_h
+
+        dgates2 = dgates.reshape(T * N, m * 3)
+        if isinstance(self.attrs._x, Node):
+            self.attrs._x._update_diff(context, np.dot(dgates2, w.T).reshape(x.shape))
+
+        if isinstance(self.attrs._w, Node):
+            self.attrs._w._update_diff(context, np.dot(x.reshape(T * N, -1).T, dgates2))
+
+        if isinstance(self.attrs._b, Node):
+            self.attrs._b._update_diff(context, np.sum(dgates2, axis=0, keepdims=True))
+
+        if isinstance(self.attrs._u, Node):
+            self.attrs._u._update_diff(context, np.sum(du, axis=1).reshape(1, m * 3))
+
+        if isinstance(pz, Node):
+            pz._update_diff(context, dh)
+
+
 class Gru(Parametrized):
     '''
     Gated Recurrent Unit
@@ -225,10 +324,16 @@ class Gru(Parametrized):
         [-7.27466679, -0.45286781, -3.81758523]], dtype=float32)
         >>> layer.truncate()
 
+    As with :class:`Lstm`, an input of the shape (T, N, D) is taken as a whole
+    sequence and the outputs of all T steps are returned at once.
+
     https://arxiv.org/pdf/1409.1259.pdf
 
     '''
 
+    # Hidden states are kept between calls.
+    _traceable = False
+
     def __init__(self, output_size, input_size=None, ignore_bias=False, initializer=GlorotNormal(),
                  weight_decay=0):
         self._size_o = output_size
@@ -238,7 +343,7 @@ class Gru(Parametrized):
         super(Gru, self).__init__(input_size)
 
     def weight_initiallize(self, size_i):
-        size_i = size_i[0]
+        size_i = size_i[-1]
         size_o = self._size_o
         bias = np.ones((1, size_o * 3), dtype=precision)
         # At this point, all connected units in the same layer will use the SAME weights
@@ -250,13 +355,31 @@ class Gru(Parametrized):
             self.params["b"] = Variable(bias, auto_update=True)
 
     def forward(self, x):
-        ret = gru(x, getattr(self, "_z", None),
-                  self.params.w,
-                  self.params.u,
-                  self.params.get("b", None))
+        pz = getattr(self, "_z", None)
+        if pz is not None and len(pz.shape) == 3:
+            pz = pz[-1]
+        if len(x.shape) == 3:
+            if cu.is_cuda_active():
+                return concat([self.forward(x[t]).reshape(1, x.shape[1], self._size_o)
+                               for t in range(len(x))], axis=0)
+            func = gru_sequence
+        else:
+            func = gru
+        ret = func(x, pz,
+                   self.params.w,
+                   self.params.u,
+                   self.params.get("b", None))
         self._z = ret
         return ret
 
-    def truncate(self):
-        """Truncates temporal connection."""
-        self._z = None
+    def truncate(self, keep_state=False):
+        """Truncates temporal connection.
+
+        Args:
+            keep_state (bool): If True, the hidden state is kept as a constant
+                and the next call continues from it.
+        """
+        if keep_state:
+            self._z = _detach_state(getattr(self, "_z", None))
+        else:
+            self._z = None
@@ -4,9 +4,11 @@ import numpy as np
 import renom.cuda as cu
 if cu.has_cuda():
     from renom.cuda.gpuvalue import get_gpu
-from renom.core import Node, Variable
+from renom.core import Node, Variable, to_value
+from renom.core.pool import empty_buffer
 import renom.operation as op
 from .parameterized import Parametrized
+from .utils import moments, reduce_sum
 
 
 def get_std_distribution(x):
@@ -59,11 +61,12 @@ class layer_normalize(Node):
     def _oper_cpu(cls, x, gain, bias):
         assert len(x.shape) is 2 or len(x.shape) is 4, \
             "Currently only normalizes for dense and 2d convolutional networks."
-        mu = get_mu(x)
-        sigma = get_sigma(x, mu) + 1e-5
-        normalized = (x - mu) / sigma
-        # ret = cls._create_node(normalized)# * gain + bias)
-        ret = cls._create_node(normalized * gain + bias)
+        _ax = tuple(range(1, len(x.shape)))
+        normalized = empty_buffer(x.shape)
+        mu, var = moments(to_value(x), _ax, normalized)
+        sigma = np.sqrt(var) + 1e-5
+        normalized /= sigma
+        ret = cls._create_node(normalized * to_value(gain) + to_value(bias))
         ret.attrs._x = x
         ret.attrs._mu = mu
         ret.attrs._normalized = normalized
@@ -94,28 +97,27 @@ class layer_normalize(Node):
         return ret
 
     def _backward_cpu(self, context, dy, **kwargs):
-        x = self.attrs._x
-        mu = self.attrs._mu
+        normalized = self.attrs._normalized
         sigma = self.attrs._sigma
-        gain = self.attrs._gain
-        sigma_diff = get_sigma_diff(x)
-        mu_diff = get_mu_diff(x)
-        _ax = tuple([r for r in range(1, len(x.shape[1:]) + 1)])
-        dx = dy / sigma \
-            - sigma_diff * np.sum(x * dy, axis=_ax, keepdims=True) / np.power(sigma, 2) \
-            - np.sum(mu_diff * dy, axis=_ax, keepdims=True) / sigma \
-            + sigma_diff * np.sum(dy, axis=_ax, keepdims=True) * mu / np.power(sigma, 2)
-        dx *= gain
+        _ax = tuple(range(1, len(normalized.shape)))
+        H = float(np.prod(normalized.shape[1:]))
+        dy = to_value(dy)
+        dn = dy * to_value(self.attrs._gain)
+        # dx = (dn - mean(dn)) / sigma - normalized * mean(dn * normalized) / std
+        dx = np.multiply(normalized, reduce_sum(dn, _ax, normalized) * sigma / (H * (sigma - 1e-5)),
+                         out=empty_buffer(normalized.shape))
+        dx += reduce_sum(dn, _ax) / H
+        np.subtract(dn, dx, out=dx)
+        dx /= sigma
 
         if isinstance(self.attrs._x, Node):
             self.attrs._x._update_diff(context, dx, **kwargs)
 
         if isinstance(self.attrs._gain, Node):
-            self.attrs._gain._update_diff(context, np.sum(
-                self.attrs._normalized * dy, axis=0, keepdims=True), **kwargs)
+            self.attrs._gain._update_diff(context, reduce_sum(normalized, (0, ), dy), **kwargs)
 
         if isinstance(self.attrs._bias, Node):
-            self.attrs._bias._update_diff(context, np.sum(dy, axis=0, keepdims=True), **kwargs)
+            self.attrs._bias._update_diff(context, reduce_sum(dy, (0, )), **kwargs)
 
     def _backward_gpu(self, context, dy, **kwargs):
         dx = get_gpu(self.attrs._x).zeros_like_me()
@@ -4,11 +4,24 @@
 from __future__ import division
 import numpy as np
 from renom.core import Node, to_value
+from renom.layers.function.utils import pad_constant
 import renom.cuda as cu
 if cu.has_cuda():
     from renom.cuda.gpuvalue import get_gpu
 
 
+def _channel_window_sum(x, n):
+    # Sums x over the channels [c - n // 2, c + n // 2] through a strided view
+    # of the zero padded channel axis.
+    h = n // 2
+    x = pad_constant(x, ((0, 0), (h, h), (0, 0), (0, 0)))
+    N, C, H, W = x.shape
+    st_n, st_c, st_h, st_w = x.strides
+    view = np.lib.stride_tricks.as_strided(
+        x, (N, C - 2 * h, 2 * h + 1, H, W), (st_n, st_c, st_c, st_h, st_w), writeable=False)
+    return np.sum(view, axis=2)
+
+
 class lrn(Node):
 
     def __new__(cls, x, n=5, k=2, a=1e-4, b=0.75):
@@ -16,12 +29,7 @@ class lrn(Node):
 
     @classmethod
     def _oper_cpu(cls, x, n, k, a, b):
-        xs = np.square(x).view(np.ndarray)
-        sum = np.array(xs.copy())
-        sum = xs.copy()
-        for i in range(1, n // 2 + 1):
-            sum[:, i:, :, :] += xs[:, :-i, :, :]
-            sum[:, :-i, :, :] += xs[:, i:, :, :]
+        sum = _channel_window_sum(np.square(to_value(x)), n)
         unit_scale = k + a * sum
         scale = unit_scale ** -b
         value = x * scale
@@ -43,11 +51,7 @@ class lrn(Node):
             b = self.attrs._b
             n = self.attrs._n
             x = self.attrs._x
-            sum1 = (self * dy / unit_scale).view(np.ndarray)
-            sum2 = sum1.copy()
-            for i in range(1, n // 2 + 1):
-                sum2[:, i:, :, :] += sum1[:, :-i, :, :]
-                sum2[:, :-i, :, :] += sum1[:, i:, :, :]
+            sum2 = _channel_window_sum(to_value(self) * dy / unit_scale, n)
             self.attrs._x._update_diff(context, dy * scale - 2 * a * b * x * sum2, **kwargs)
 
     @classmethod
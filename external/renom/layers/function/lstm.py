@@ -5,11 +5,12 @@ from __future__ import division
 import numpy as np
 from renom.layers.activation.sigmoid import sigmoid
 from renom.layers.activation.tanh import tanh
-from renom.core import Node, Variable
+from renom.core import Node, Variable, to_value
+from renom.core.pool import zeros_buffer
 from renom import precision
-from renom.operation import dot, sum
+from renom.operation import dot, sum, concat
 from renom.utility.initializer import GlorotNormal
-from .parameterized import Parametrized
+from .parameterized import Parametrized, _detach_state
 import renom.cuda as cu
 if cu.has_cuda():
     from renom.cuda.gpuvalue import GPUValue, get_gpu
@@ -31,26 +32,71 @@ def activation_diff(x):
     return (1.0 - x**2)
 
 
+def _cell_forward(u, s, state=None, z=None):
+    # Activates the gate pre-activations u = [u, f, i, o] of one step in
+    # place and returns the new state and output.
+    m = u.shape[1] // 4
+    np.tanh(u[:, :m], out=u[:, :m])
+    gated = u[:, m:]
+    np.negative(gated, out=gated)
+    np.exp(gated, out=gated)
+    gated += 1.
+    np.reciprocal(gated, out=gated)
+    state = np.multiply(u[:, m * 2:m * 3], u[:, :m], out=state)
+    if s is not None:
+        state += u[:, m:m * 2] * s
+    z = np.tanh(state, out=z)
+    z *= u[:, m * 3:]
+    return state, z
+
+
+def _cell_backward(u, state, ps, e, ds, dr=None):
+    # Gradient of the gate pre-activations of one step. e is the gradient of
+    # the output and ds the state gradient carried from the following step.
+    m = u.shape[1] // 4
+    if dr is None:
+        dr = np.empty(u.shape, dtype=u.dtype)
+    s = np.tanh(state)
+    dou = e * u[:, m * 3:] * activation_diff(s)
+    if ds is not None:
+        dou += ds
+    dr[:, :m] = dou * activation_diff(u[:, :m]) * u[:, m * 2:m * 3]
+    if ps is not None:
+        dr[:, m:m * 2] = dou * gate_diff(u[:, m:m * 2]) * ps
+    else:
+        dr[:, m:m * 2] = 0
+    dr[:, m * 2:m * 3] = dou * gate_diff(u[:, m * 2:m * 3]) * u[:, :m]
+    dr[:, m * 3:] = e * s * gate_diff(u[:, m * 3:])
+    return dr, dou
+
+
+def _last_step(pz):
+    # The previous output is either a step or a whole sequence.
+    return pz if pz is None or pz.ndim == 2 else pz[-1]
+
+
+def _to_prev(pz, dz):
+    # Gradient of the previous output from the gradient of its last step.
+    if pz.ndim == 2:
+        return dz
+    ret = np.zeros(pz.shape, dtype=dz.dtype)
+    ret[-1] = dz
+    return ret
+
+
 class lstm(Node):
     def __new__(cls, x, pz, ps, w, wr, b):
         return cls.calc_value(x, pz, ps, w, wr, b)
 
     @classmethod
     def _oper_cpu(cls, x, pz, ps, w, wr, b):
-        s = np.zeros((x.shape[0], w.shape[1] // 4), dtype=precision) if ps is None else ps
-        z = np.zeros((x.shape[0], w.shape[1] // 4), dtype=precision) if pz is None else pz
-
-        u = dot(x, w) + dot(z, wr)
+        u = np.dot(to_value(x), to_value(w))
+        if pz is not None:
+            u += np.dot(to_value(_last_step(pz)), to_value(wr))
         if b is not None:
-            u += b
+            u += to_value(b)
         m = u.shape[1] // 4
-        u, gated = np.split(u.as_ndarray(), [m, ], axis=1)
-        u = tanh(u)
-
-        gated = sigmoid(gated)
-
-        state = gated[:, m:m * 2] * u + gated[:, :m] * s
-        z = tanh(state) * gated[:, m * 2:]
+        state, z = _cell_forward(u, to_value(ps) if ps is not None else None)
 
         ret = cls._create_node(z)
         ret.attrs._x = x
@@ -61,11 +107,10 @@ class lstm(Node):
         ret.attrs._u = u
         ret.attrs._pstate = ps
         ret.attrs._state = state
-        ret.attrs._gated = gated
         ret._state = state
 
         if isinstance(pz, Node):
-            pz.attrs._pfgate = gated[:, :m]
+            pz.attrs._pfgate = u[:, m:m * 2]
 
         return ret
 
@@ -107,53 +152,39 @@ class lstm(Node):
         return ret
 
     def _backward_cpu(self, context, dy, **kwargs):
-        n, m = dy.shape
-
         w = self.attrs._w
         wr = self.attrs._wr
         b = self.attrs._b
 
         u = self.attrs._u
-        s = tanh(self.attrs._state)
+        # Zero defaults are allocated only at the last time step.
+        drt = context.restore(wr)
+        if drt is None:
+            drt = zeros_buffer(u.shape, dtype=u.dtype)
+        dou = context.restore(w)
+        pfg = self.attrs.get("_pfgate")
+        ds = pfg * to_value(dou) if pfg is not None and dou is not None else None
 
-        gated = self.attrs._gated
-        gd = gate_diff(gated)
-        ps = self.attrs._pstate
-
-        drt = context.restore(wr, np.zeros((n, m * 4), dtype=dy.dtype))
-        dou = context.restore(w, np.zeros((n, m), dtype=dy.dtype))
-
-        pfg = self.attrs.get("_pfgate", np.zeros_like(self))
-
-        e = dy
-
-        do = e * s * gd[:, 2 * m:]
-        dou = e * gated[:, 2 * m:] * activation_diff(s) + pfg * dou
-
-        df = dou * gd[:, :m] * ps if ps is not None else np.zeros_like(dou)
-        di = dou * gd[:, m:2 * m] * u
-        dc = dou * activation_diff(u) * gated[:, m:2 * m]
-
-        dr = np.hstack((dc, df, di, do))
-        dx = np.dot(dr, w.T)
+        dr, dou = _cell_backward(u, self.attrs._state, self.attrs._pstate, to_value(dy), ds)
 
         context.store(wr, dr)
         context.store(w, dou)
 
         if isinstance(self.attrs._x, Node):
-            self.attrs._x._update_diff(context, dx)
+            self.attrs._x._update_diff(context, np.dot(dr, to_value(w).T))
 
         if isinstance(w, Node):
-            w._update_diff(context, np.dot(self.attrs._x.T, dr))
+            w._update_diff(context, np.dot(to_value(self.attrs._x).T, dr))
 
         if isinstance(wr, Node):
-            wr._update_diff(context, np.dot(self.T, drt))
+            wr._update_diff(context, np.dot(to_value(self).T, to_value(drt)))
 
         if isinstance(b, Node):
             b._update_diff(context, np.sum(dr, axis=0, keepdims=True))
 
         if isinstance(self.attrs._pz, Node):
-            self.attrs._pz._update_diff(context, np.dot(dr, wr.T))
+            self.attrs._pz._update_diff(context, _to_prev(
+                self.attrs._pz, np.dot(dr, to_value(wr).T)))
 
     def _backward_gpu(self, context, dy, **kwargs):
 
@@ -196,6 +227,98 @@ class lstm(Node):
             self.attrs._pz._update_diff(context, dot(dr, wr.T))
 
 
+class lstm_sequence(Node):
+    """Lstm over a whole sequence x of the shape (T, N, D). The input
+    projection of all steps is one GEMM and the recurrence runs on
+    preallocated gate buffers. Backpropagation through time is done in the
+    backward of this single node."""
+
+    def __new__(cls, x, pz, ps, w, wr, b):
+        return cls.calc_value(x, pz, ps, w, wr, b)
+
+    @classmethod
+    def _oper_cpu(cls, x, pz, ps, w, wr, b):
+        T, N, D = x.shape
+        m = wr.shape[0]
+        u = np.dot(to_value(x).reshape(T * N, D), to_value(w)).reshape(T, N, m * 4)
+        if b is not None:
+            u += to_value(b)
+        z = np.empty((T, N, m), dtype=u.dtype)
+        state = np.empty((T, N, m), dtype=u.dtype)
+
+        wr_ = to_value(wr)
+        h = to_value(_last_step(pz)) if pz is not None else None
+        s = to_value(ps) if ps is not None else None
+        for t in range(T):
+            if h is not None:
+                u[t] += np.dot(h, wr_)
+            h, s = _cell_forward(u[t], s, state[t], z[t])[::-1]
+
+        ret = cls._create_node(z)
+        ret.attrs._x = x
+        ret.attrs._w = w
+        ret.attrs._wr = wr
+        ret.attrs._b = b
+        ret.attrs._pz = pz
+        ret.attrs._u = u
+        ret.attrs._pstate = ps
+        ret.attrs._state = state
+        ret._state = state[-1]
+
+        if isinstance(pz, Node):
+            pz.attrs._pfgate = u[0, :, m:m * 2]
+
+        return ret
+
+    def _backward_cpu(self, context, dy, **kwargs):
+        w = self.attrs._w
+        wr = self.attrs._wr
+        b = self.attrs._b
+        x = to_value(self.attrs._x)
+        u = self.attrs._u
+        state = self.attrs._state
+        T, N, m = state.shape
+
+        drt = context.restore(wr)
+        dou = context.restore(w)
+        pfg = self.attrs.get("_pfgate")
+        ds = pfg * to_value(dou) if pfg is not None and dou is not None else None
+
+        dy = to_value(dy)
+        wr_t = to_value(wr).T
+        dr = np.empty(u.shape, dtype=u.dtype)
+        dh = None
+        for t in range(T - 1, -1, -1):
+            e = dy[t] if dh is None else dy[t] + dh
+            ps = state[t - 1] if t else self.attrs._pstate
+            dou = _cell_backward(u[t], state[t], ps, e, ds, dr[t])[1]
+            ds = dou * u[t, :, m:m * 2]
+            dh = np.dot(dr[t], wr_t)
+
+        context.store(wr, dr[0])
+        context.store(w, dou)
+
+        dr2 = dr.reshape(T * N, m * 4)
+        if isinstance(self.attrs._x, Node):
+            self.attrs._x._update_diff(context, np.dot(dr2, to_value(w).T).reshape(x.shape))
+
+        if isinstance(w, Node):
+            w._update_diff(context, np.dot(x.reshape(T * N, -1).T, dr2))
+
+        if isinstance(wr, Node):
+            z = to_value(self)
+            dwr = np.dot(z[:-1].reshape(-1, m).T, dr[1:].reshape(-1, m * 4))
+            if drt is not None:
+                dwr += np.dot(z[-1].T, to_value(drt))
+            wr._update_diff(context, dwr)
+
+        if isinstance(b, Node):
+            b._update_diff(context, np.sum(dr2, axis=0, keepdims=True))
+
+        if isinstance(self.attrs._pz, Node):
+            self.attrs._pz._update_diff(context, _to_prev(self.attrs._pz, dh))
+
+
 class Lstm(Parametrized):
     '''Long short time memory [lstm]_ .
     Lstm object has 8 weights and 4 biases parameters to learn.
@@ -245,9 +368,22 @@ class Lstm(Parametrized):
              [-0.0205425 , -0.05837972,  0.00467286]], dtype=float32)
         >>> layer.truncate()
 
+    An input of the shape (T, N, D) is taken as a whole sequence of T steps,
+    and the outputs of all steps are returned as an array of the shape
+    (T, N, output_size). This runs much faster on CPU than calling the layer
+    step by step. Hidden states are carried over between calls in both cases.
+
+        >>> xs = rm.Variable(np.random.rand(t, n, d))
+        >>> z = layer(xs)
+        >>> z.shape
+        (4, 2, 2)
+
     .. [lstm] Learning Precise Timing with LSTM Recurrent Networks
     '''
 
+    # Hidden states are kept between calls.
+    _traceable = False
+
     def __init__(self, output_size, input_size=None, ignore_bias=False, initializer=GlorotNormal(), weight_decay=0):
         self._size_o = output_size
         self._ignore_bias = ignore_bias
@@ -256,7 +392,7 @@ class Lstm(Parametrized):
         super(Lstm, self).__init__(input_size)
 
     def weight_initiallize(self, size_i):
-        size_i = size_i[0]
+        size_i = size_i[-1]
         size_o = self._size_o
         bias = np.zeros((1, size_o * 4), dtype=precision)
         bias[:, size_o:size_o * 2] = 1
@@ -267,7 +403,14 @@ class Lstm(Parametrized):
             self.params["b"] = Variable(bias, auto_update=True)
 
     def forward(self, x):
-        ret = lstm(x, self.__dict__.get("_z", None),
+        if len(x.shape) == 3:
+            if cu.is_cuda_active():
+                return concat([self.forward(x[t]).reshape(1, x.shape[1], self._size_o)
+                               for t in range(len(x))], axis=0)
+            func = lstm_sequence
+        else:
+            func = lstm
+        ret = func(x, self.__dict__.get("_z", None),
                    self.__dict__.get("_state", None),
                    self.params.w,
                    self.params.wr,
@@ -276,10 +419,18 @@ class Lstm(Parametrized):
         self._state = ret._state
         return ret
 
-    def truncate(self):
-        """Truncates temporal connection."""
-        self._z = None
-        self._state = None
+    def truncate(self, keep_state=False):
+        """Truncates temporal connection.
+
+        Args:
+            keep_state (bool): If True, the hidden state is kept as a constant
+                and the next call continues from it.
+        """
+        if keep_state:
+            self._z = _detach_state(self.__dict__.get("_z", None))
+        else:
+            self._z = None
+            self._state = None
 
 
 class ChainedLSTM(Lstm):
@@ -295,7 +446,4 @@ class ChainedLSTM(Lstm):
     def forward(self, x):
         lstm_model = super(ChainedLSTM, self)
         lstm_model.truncate()
-        length = x.shape[1]
-        for i in range(length):
-            ret = lstm_model.forward(x[:, i])
-        return ret
+        return lstm_model.forward(x.transpose(1, 0, 2))[-1]
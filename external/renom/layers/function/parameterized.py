@@ -6,9 +6,11 @@ from abc import ABCMeta, abstractmethod
 from contextlib import contextmanager
 import inspect
 import weakref
+import collections
 import copy
 import numpy as np
-from renom.core import Node, Variable
+from renom.core import Node, Variable, Grads, no_grad, is_grad_enabled
+from renom.core.rng import RandomStream
 import renom.cuda
 
 if renom.cuda.has_cuda():
@@ -48,11 +50,130 @@ class ModelParams(dict):
             raise AttributeError('%r has no attribute %r' % (self, name))
 
 
+def _as_leaf(x, cls=Node):
+    if not isinstance(x, Node):
+        return x
+    if is_cuda_active():
+        return cls(x.get_gpu())
+    return cls(x)
+
+
+def _collect_params(model):
+    params = collections.OrderedDict()
+    for m in model.iter_models():
+        if m.params:
+            params.update((id(p), p) for p in m.params.values())
+    return list(params.values())
+
+
+def _auto_update_states(model):
+    return [(m, m.auto_update) for m in model.iter_models()]
+
+
+def _stream_states(model):
+    return [(s, s.get_state()) for m in model.iter_models()
+            for s in vars(m).values() if isinstance(s, RandomStream)]
+
+
+def _set_stream_states(states):
+    for s, step in states:
+        s.set_state(step)
+
+
+def _set_auto_update_states(states):
+    for m, f in states:
+        m.auto_update = f
+
+
+class recompute(Node):
+    '''Output node of a checkpointed model call.
+
+    The model is called without building a computational graph and only the
+    input ``x`` is kept. In the backward pass the model is called again on the
+    same input with the numpy random state and the random streams of the first
+    call, and gradients of
+    the recomputed graph are propagated to ``x`` and to the model parameters.
+    '''
+
+    def __new__(cls, model, x, *args, **kwargs):
+        states = _auto_update_states(model)
+        model.set_auto_update(False)
+        try:
+            num_params = len(_collect_params(model))
+            rng = np.random.get_state()
+            streams = _stream_states(model)
+            ret = model._call_segment(_as_leaf(x), *args, **kwargs)
+            params = _collect_params(model)
+            if len(params) != num_params:
+                # Lazy weight initialization has consumed random numbers,
+                # so the first call can not be replayed.
+                rng = np.random.get_state()
+                _set_stream_states(streams)
+                ret = model._call_segment(_as_leaf(x), *args, **kwargs)
+        finally:
+            _set_auto_update_states(states)
+
+        ret = cls._create_node(ret.get_gpu() if is_cuda_active() else ret)
+        ret.attrs._model = model
+        ret.attrs._x = x
+        ret.attrs._args = args
+        ret.attrs._kwargs = kwargs
+        ret.attrs._params = params
+        ret.attrs._rng = rng
+        ret.attrs._streams = streams
+        ret.attrs._states = states
+        return ret
+
+    def __init__(self, model, x, *args, **kwargs):
+        super(recompute, self).__init__(x, self.attrs._params)
+
+    def _get_graph(self):
+        if self.attrs and self.attrs.get('_params') is not None:
+            return [self.attrs._x] + self.attrs._params
+        return []
+
+    def _backward_cpu(self, context, dy, **kwargs):
+        model = self.attrs._model
+        x = self.attrs._x
+        xr = _as_leaf(x, Variable)
+
+        rng = np.random.get_state()
+        streams = _stream_states(model)
+        states = _auto_update_states(model)
+        np.random.set_state(self.attrs._rng)
+        _set_stream_states(self.attrs._streams)
+        _set_auto_update_states(self.attrs._states)
+        try:
+            ret = model._call_segment(xr, *self.attrs._args, **self.attrs._kwargs)
+        finally:
+            np.random.set_state(rng)
+            _set_stream_states(streams)
+            _set_auto_update_states(states)
+
+        inner = Grads(ret, release_graph=True)
+        # Weight decay is applied once by the outer context.
+        inner.variables.clear()
+        ret._update_diff(inner, dy)
+
+        if isinstance(x, Node):
+            x._update_diff(context, inner.get(xr), **kwargs)
+
+        for p in self.attrs._params:
+            diff = inner.get(p, None)
+            if diff is not None:
+                p._update_diff(context, diff, **kwargs)
+
+    def _backward_gpu(self, context, dy, **kwargs):
+        return self._backward_cpu(context, dy, **kwargs)
+
+
 class Model(with_metaclass(ABCMeta, object)):
     """Abstract class of neural network model."""
 
     auto_update = False
     _prevent_update = False
+    _checkpoint = False
+    _traceable = True
     _parameters = None
     _device_id = 0
     SERIALIZED = ()
@@ -79,6 +200,26 @@ class Model(with_metaclass(ABCMeta, object)):
         return self._device_id
 
     def __call__(self, x, *args, **kwargs):
+        if self._checkpoint and self._requires_graph(x):
+            return recompute(self, x, *args, **kwargs)
+        return self._call(x, *args, **kwargs)
+
+    def _call_segment(self, x, *args, **kwargs):
+        checkpoint = self._checkpoint
+        self._checkpoint = False
+        try:
+            return self(x, *args, **kwargs)
+        finally:
+            self._checkpoint = checkpoint
+
+    def _requires_graph(self, x):
+        if not is_grad_enabled():
+            return False
+        if self.auto_update:
+            return True
+        return isinstance(x, Node) and bool(x.auto_update or x._has_autoupdate())
+
+    def _call(self, x, *args, **kwargs):
         with use_device(self._device_id):
             if self._model_hook:
                 x, args, kwargs = self._model_hook.call_enter(self, x, args, kwargs)
@@ -93,6 +234,35 @@ class Model(with_metaclass(ABCMeta, object)):
 
             return ret
 
+    def predict(self, x, *args, **kwargs):
+        """Calls the model in inference mode without building a computational graph.
+
+        Args:
+            x (ndarray, Node): Input data.
+
+        Returns:
+            (Node): Output of the model.
+
+        Example:
+            >>> import numpy as np
+            >>> import renom as rm
+            >>> model = rm.Sequential([rm.Dense(3), rm.Dropout(0.5), rm.Dense(1)])
+            >>> z = model.predict(np.random.rand(2, 4))
+            >>> z.shape
+            (2, 1)
+        """
+        states = [(m, m.__dict__.get('inference')) for m in self.iter_models()]
+        self.set_models(inference=True)
+        try:
+            with no_grad():
+                return self(x, *args, **kwargs)
+        finally:
+            for m, inference in states:
+                if inference is None:
+                    m.__dict__.pop('inference', None)
+                else:
+                    m.inference = inference
+
     def set_gpu(self, device_id):
         self.set_models(_device_id=device_id)
 
@@ -184,6 +354,49 @@ class Model(with_metaclass(ABCMeta, object)):
         finally:
             self.set_auto_update(False)
 
+    @contextmanager
+    def checkpoint(self):
+        """Context manager for gradient checkpointing.
+
+        Calls of this model inside the context do not keep intermediate
+        results for the backward pass. Only the input of the model is kept and
+        the forward calculation is recomputed during backpropagation, which
+        trades computation time for memory.
+        Gradients are propagated to the input and to the parameters of the
+        model. Stateful layers such as Lstm should not be checkpointed.
+
+        Example:
+            >>> import renom as rm
+            >>> import numpy as np
+            >>>
+            >>> model = rm.Sequential([
+            ...     rm.Sequential([rm.Conv2d(8, padding=1), rm.Relu()]),
+            ...     rm.Sequential([rm.Conv2d(8, padding=1), rm.Relu()]),
+            ... ])
+            >>> x = np.random.rand(2, 3, 8, 8)
+            >>> with model.train():
+            ...     with model[0].checkpoint(), model[1].checkpoint():
+            ...         loss = rm.sum(model(x))
+            >>> loss.grad().update()
+
+        See also :meth:`set_checkpoint` to mark a model permanently.
+        """
+        checkpoint = self._checkpoint
+        self.set_checkpoint(True)
+        try:
+            yield self
+        finally:
+            self.set_checkpoint(checkpoint)
+
+    def set_checkpoint(self, f):
+        """Enables or disables gradient checkpointing of this model.
+        See :meth:`checkpoint` for details.
+
+        Args:
+            f (bool): If True, calls of this model are checkpointed.
+        """
+        self._checkpoint = f
+
     @contextmanager
     def prevent_update(self):
         """This context manager can controls that whether model's weight parameter be updated.
@@ -490,10 +703,18 @@ class Model(with_metaclass(ABCMeta, object)):
             for k, v in kwargs.items():
                 setattr(c, k, v)
 
-    def truncate(self):
+    def truncate(self, keep_state=False):
+        """Truncates temporal connections of the recurrent layers.
+
+        Args:
+            keep_state (bool): If True, hidden states are kept without their
+                graphs. The next call continues the sequence, but gradients
+                do not flow back into the previous calls. This is truncated
+                backpropagation through time.
+        """
         for c in self.iter_models():
             if isinstance(c, Parametrized):
-                c.truncate()
+                c.truncate(keep_state)
 
 
 class Sequential(Model):
@@ -560,5 +781,13 @@ class Parametrized(Model):
                 self.weight_initiallize(x.shape[1:])
             return super(Parametrized, self).__call__(x, *args, **kwargs)
 
-    def truncate(self):
+    def truncate(self, keep_state=False):
         pass
+
+
+def _detach_state(z):
+    # Value of the last step of a hidden state, without its graph.
+    if z is None:
+        return None
+    z = z.as_ndarray() if isinstance(z, Node) else np.array(z)
+    return z[-1] if z.ndim == 3 else z
@@ -6,10 +6,11 @@ import numpy as np
 from renom.layers.activation.sigmoid import sigmoid
 from renom.layers.activation.tanh import tanh
 from renom.core import Node, Variable, to_value
+from renom.core.pool import zeros_buffer
 from renom import precision
 import renom.operation as op
 from renom.utility.initializer import GlorotNormal
-from .parameterized import Parametrized
+from .parameterized import Parametrized, _detach_state
 import renom.cuda as cu
 if cu.has_cuda():
     from renom.cuda.gpuvalue import GPUValue, get_gpu
@@ -45,7 +46,7 @@ class peephole_lstm(Node):
             u += b
 
         m = u.shape[1] // 4
-        u, gate_u = np.split(u.as_ndarray(), [m, ], axis=1)
+        u, gate_u = np.split(to_value(u), [m, ], axis=1)
         u = tanh(u)
 
         fg = sigmoid(s * wc[:, :m] + gate_u[:, :m])
@@ -121,10 +122,17 @@ class peephole_lstm(Node):
         gd = gate_diff(gated)
         ps = self.attrs._pstate
 
-        pfg = self.attrs.get("_pfgate", np.zeros_like(self))
+        # Zero defaults are allocated only at the last time step.
+        pfg = self.attrs.get("_pfgate")
+        if pfg is None:
+            pfg = zeros_buffer(self.shape, dtype=self.dtype)
 
-        dot = context.restore(w, np.zeros((n, m), dtype=dy.dtype))
-        drt = context.restore(wr, np.zeros((n, m * 4), dtype=dy.dtype))
+        dot = context.restore(w)
+        if dot is None:
+            dot = zeros_buffer((n, m), dtype=dy.dtype)
+        drt = context.restore(wr)
+        if drt is None:
+            drt = zeros_buffer((n, m * 4), dtype=dy.dtype)
 
         do = dy * s * gd[:, 2 * m:]
         dou = dy * gated[:, 2 * m:] * activation_diff(s) + do * wc[:, 2 * m:]
@@ -263,6 +271,9 @@ class PeepholeLstm(Parametrized):
         Learning Precise Timing with LSTM Recurrent Networks
     '''
 
+    # Hidden states are kept between calls.
+    _traceable = False
+
     def __init__(self, output_size, input_size=None, ignore_bias=False, initializer=GlorotNormal(), weight_decay=0):
         self._size_o = output_size
         self._ignore_bias = ignore_bias
@@ -293,7 +304,15 @@ class PeepholeLstm(Parametrized):
         self._state = ret._state
         return ret
 
-    def truncate(self):
-        """Truncates temporal connection."""
-        self._z = None
-        self._state = None
+    def truncate(self, keep_state=False):
+        """Truncates temporal connection.
+
+        Args:
+            keep_state (bool): If True, the hidden state is kept as a constant
+                and the next call continues from it.
+        """
+        if keep_state:
+            self._z = _detach_state(self.__dict__.get("_z", None))
+        else:
+            self._z = None
+            self._state = None
@@ -3,8 +3,12 @@
 
 from __future__ import division
 import numpy as np
-from renom.core import Node
-from renom.layers.function.utils import im2col, col2im, out_size, tuplize
+from renom.core import Node, to_value
+from renom.core.pool import zeros_buffer, empty_buffer
+from renom.core.basic_ops import Transpose
+from renom.core.layout import NCHW, NHWC, NHWC_TO_NCHW, NCHW_TO_NHWC, check_data_format
+from renom.layers.function.utils import im2col, im2col_view, window_sum, col2im, out_size, \
+    tuplize, pool_index_dtype
 import renom.cuda as cu
 if cu.has_cuda():
     from renom.cuda.gpuvalue import GPUValue, get_gpu
@@ -12,12 +16,21 @@ if cu.has_cuda():
 
 class pool_base(Node):
 
-    def __new__(cls, x, filter=3, stride=1, padding=0, ceil_mode=False):
+    def __new__(cls, x, filter=3, stride=1, padding=0, ceil_mode=False, data_format=None):
         filter, stride, padding = (tuplize(x) for x in (filter, stride, padding))
-        in_shape = x.shape[1:]
-        out_shape = [x.shape[1], ]
-        out_shape.extend(out_size(x.shape[2:], filter, stride, padding, ceil_mode=ceil_mode))
-        return cls.calc_value(x, in_shape, out_shape, filter, stride, padding)
+        data_format = check_data_format(data_format)
+        if data_format == NHWC:
+            if cu.is_cuda_active():
+                # cuDNN takes NCHW.
+                z = cls(Transpose(x, NHWC_TO_NCHW), filter, stride, padding, ceil_mode, NCHW)
+                return Transpose(z, NCHW_TO_NHWC)
+            # The CPU kernels work on NCHW views of the NHWC arrays.
+            in_shape = (x.shape[3], ) + x.shape[1:3]
+        else:
+            in_shape = x.shape[1:]
+        out_shape = [in_shape[0], ]
+        out_shape.extend(out_size(in_shape[1:], filter, stride, padding, ceil_mode=ceil_mode))
+        return cls.calc_value(x, in_shape, out_shape, filter, stride, padding, data_format)
 
     def _backward_gpu(self, context, dy, **kwargs):
         dx = get_gpu(self.attrs._x).empty_like_me()
@@ -31,15 +44,20 @@ class pool_base(Node):
 class max_pool2d(pool_base):
 
     @classmethod
-    def _oper_cpu(cls, x, in_shape, out_shape, karnel, stride, padding):
-        col = im2col(x, out_shape[1:], karnel,
-                     stride, padding)
-        n, ic, kh, kw, oh, ow = col.shape
-        col = col.reshape(n, ic, kh * kw, oh, ow)
-        index = np.argmax(col, axis=2)
-        value = np.max(col, axis=2)
+    def _oper_cpu(cls, x, in_shape, out_shape, karnel, stride, padding, data_format):
+        if data_format == NHWC:
+            value, index = cls._max_nhwc(to_value(x), out_shape, karnel, stride, padding)
+        else:
+            col = im2col(x, out_shape[1:], karnel,
+                         stride, padding)
+            n, ic, kh, kw, oh, ow = col.shape
+            col = col.reshape(n, ic, kh * kw, oh, ow)
+            index = np.argmax(col, axis=2)
+            value = np.max(col, axis=2)
         ret = cls._create_node(value)
-        ret.attrs._index = index
+        # Offsets of the maxima over the kernel axes of im2col.
+        ret.attrs._col_index = index
+        ret.attrs._data_format = data_format
         ret.attrs._x = x
         ret.attrs._in_shape = in_shape
         ret.attrs._out_shape = out_shape
@@ -49,7 +67,7 @@ class max_pool2d(pool_base):
         return ret
 
     @classmethod
-    def _oper_gpu(cls, x, in_shape, out_shape, karnel, stride, padding):
+    def _oper_gpu(cls, x, in_shape, out_shape, karnel, stride, padding, data_format):
         N = x.shape[0]
         pool_desc = cu.PoolingDescriptor(karnel, padding, stride, pool_mode=0)
         _x = get_gpu(x)
@@ -64,16 +82,43 @@ class max_pool2d(pool_base):
         ret.attrs._x = x
         return ret
 
+    @staticmethod
+    def _max_nhwc(x, out_shape, kernel, stride, padding):
+        # Maxima taken one kernel offset at a time over the channels last
+        # memory, ties going to the first offset as with np.argmax.
+        col = im2col_view(x, out_shape[1:], kernel, stride, padding, data_format=NHWC)
+        offsets = list(np.ndindex(*kernel))
+        value = col[:, :, 0, 0].copy(order="K")
+        for i, j in offsets[1:]:
+            np.maximum(value, col[:, :, i, j], out=value)
+        index = np.empty_like(value, dtype=pool_index_dtype(kernel))
+        mask = empty_buffer(value.shape, dtype=bool)
+        for o in range(len(offsets) - 1, -1, -1):
+            np.equal(col[:, :, offsets[o][0], offsets[o][1]], value, out=mask)
+            np.copyto(index, o, where=mask)
+        return value.transpose(NCHW_TO_NHWC), index
+
     def _backward_cpu(self, context, dy, **kwargs):
-        if isinstance(self.attrs._x, Node):
+        if isinstance(self.attrs._x, Node) and self.attrs._data_format == NHWC:
+            N, out_h, out_w, C = dy.shape
+            k_h, k_w = self.attrs._kernel
+            index = self.attrs._col_index
+            col = zeros_buffer((N, out_h, out_w, k_h, k_w, C)).transpose(0, 5, 3, 4, 1, 2)
+            dy = np.asarray(dy).transpose(NHWC_TO_NCHW)
+            for o, (i, j) in enumerate(np.ndindex(k_h, k_w)):
+                np.multiply(dy, index == o, out=col[:, :, i, j])
+            dx = col2im(col, self.attrs._in_shape[1:], self.attrs._stride, self.attrs._padding,
+                        data_format=NHWC)
+            self.attrs._x._update_diff(context, dx, **kwargs)
+        elif isinstance(self.attrs._x, Node):
             N = len(dy)
-            index = self.attrs._index
-            col = np.zeros((N, self.attrs._in_shape[0], self.attrs._kernel[0],
-                            self.attrs._kernel[1], self.attrs._out_shape[1], self.attrs._out_shape[2]))
-            col_k = np.rollaxis(col.reshape(
-                N, self.attrs._in_shape[0], -1, self.attrs._out_shape[1], self.attrs._out_shape[2]), 2)
-            for i in np.ndindex(N, self.attrs._in_shape[0], self.attrs._out_shape[1], self.attrs._out_shape[2]):
-                col_k[index[i]][i] = dy[i]
+            index = self.attrs._col_index
+            col = zeros_buffer((N, self.attrs._in_shape[0], self.attrs._kernel[0],
+                                self.attrs._kernel[1], self.attrs._out_shape[1],
+                                self.attrs._out_shape[2]))
+            col_k = col.reshape(
+                N, self.attrs._in_shape[0], -1, self.attrs._out_shape[1], self.attrs._out_shape[2])
+            np.put_along_axis(col_k, index[:, :, None], np.asarray(dy)[:, :, None], axis=2)
             dx = col2im(col, self.attrs._in_shape[1:], self.attrs._stride, self.attrs._padding)
             self.attrs._x._update_diff(context, dx, **kwargs)
 
@@ -81,13 +126,15 @@ class max_pool2d(pool_base):
 class average_pool2d(pool_base):
 
     @classmethod
-    def _oper_cpu(cls, x, in_shape, out_shape, karnel, stride, padding):
-        col = im2col(x, out_shape[1:], karnel,
-                     stride, padding)
-        n, ic, kh, kw, oh, ow = col.shape
-        col = col.reshape(n, ic, kh * kw, oh, ow)
-        value = np.mean(col, axis=2)
+    def _oper_cpu(cls, x, in_shape, out_shape, karnel, stride, padding, data_format):
+        col = im2col_view(to_value(x), out_shape[1:], karnel,
+                          stride, padding, data_format=data_format)
+        value = window_sum(col)
+        value /= float(karnel[0] * karnel[1])
+        if data_format == NHWC:
+            value = value.transpose(NCHW_TO_NHWC)
         ret = cls._create_node(value)
+        ret.attrs._data_format = data_format
         ret.attrs._x = x
         ret.attrs._in_shape = in_shape
         ret.attrs._out_shape = out_shape
@@ -97,7 +144,7 @@ class average_pool2d(pool_base):
         return ret
 
     @classmethod
-    def _oper_gpu(cls, x, in_shape, out_shape, karnel, stride, padding):
+    def _oper_gpu(cls, x, in_shape, out_shape, karnel, stride, padding, data_format):
         N = x.shape[0]
         pool_desc = cu.PoolingDescriptor(karnel, padding, stride, pool_mode=1)
         y = GPUValue(shape=tuple([N, ] + list(out_shape)))
@@ -113,25 +160,27 @@ class average_pool2d(pool_base):
 
     def _backward_cpu(self, context, dy, **kwargs):
         if isinstance(self.attrs._x, Node):
-            N = len(dy)
-            col = np.zeros((N, self.attrs._in_shape[0], self.attrs._kernel[0],
-                            self.attrs._kernel[1], self.attrs._out_shape[1], self.attrs._out_shape[2]))
-            col_k = np.rollaxis(col.reshape(
-                N, self.attrs._in_shape[0], -1, self.attrs._out_shape[1], self.attrs._out_shape[2]), 2)
-            col_k[:] = dy / float(len(col_k))
-            dx = col2im(col, self.attrs._in_shape[1:], self.attrs._stride, self.attrs._padding)
+            k_h, k_w = self.attrs._kernel
+            dy = np.asarray(dy) / float(k_h * k_w)
+            data_format = self.attrs._data_format
+            if data_format == NHWC:
+                dy = dy.transpose(NHWC_TO_NCHW)
+            col = np.broadcast_to(dy[:, :, None, None], dy.shape[:2] + (k_h, k_w) + dy.shape[2:])
+            dx = col2im(col, self.attrs._in_shape[1:], self.attrs._stride, self.attrs._padding,
+                        data_format=data_format)
             self.attrs._x._update_diff(context, dx, **kwargs)
 
 
 class PoolBase(object):
 
     def __init__(self, filter=3,
-                 padding=0, stride=1):
+                 padding=0, stride=1, data_format=None):
         self._padding, self._stride, self._kernel = (tuplize(x) for x in (padding, stride, filter))
+        self._data_format = check_data_format(data_format)
 
     def __call__(self, x):
         assert len(x.shape) == 4, "The dimension of input array must be 4. Actual dim is {}".format(x.ndim)
-        assert all([s > 0 for s in x.shape[2:]]), \
+        assert all([s > 0 for s in x.shape[1:]]), \
             "The shape of input array {} is too small. Please give an array which size is lager than 0.".format(
                 x.shape)
         return self.forward(x)
@@ -145,6 +194,9 @@ class MaxPool2d(PoolBase):
         filter (tuple,int): Filter size of the convolution kernel.
         padding (tuple,int): Size of the zero-padding around the image.
         stride (tuple,int): Stride-size of the convolution.
+        data_format (str): Memory layout of the input and the output, "NCHW"
+            or "NHWC". If None is given, the default set by ``rm.set_data_format``
+            when the layer is created is used.
 
     Example:
         >>> import numpy as np
@@ -162,7 +214,8 @@ class MaxPool2d(PoolBase):
     '''
 
     def forward(self, x):
-        return max_pool2d(x, self._kernel, self._stride, self._padding)
+        return max_pool2d(x, self._kernel, self._stride, self._padding,
+                          data_format=self._data_format)
 
 
 class AveragePool2d(PoolBase):
@@ -173,6 +226,9 @@ class AveragePool2d(PoolBase):
         filter (tuple,int): Filter size of the convolution kernel.
         padding (tuple,int): Size of the zero-padding around the image.
         stride (tuple,int): Stride-size of the convolution.
+        data_format (str): Memory layout of the input and the output, "NCHW"
+            or "NHWC". If None is given, the default set by ``rm.set_data_format``
+            when the layer is created is used.
 
     Example:
         >>> import numpy as np
@@ -190,4 +246,5 @@ class AveragePool2d(PoolBase):
     '''
 
     def forward(self, x):
-        return average_pool2d(x, self._kernel, self._stride, self._padding)
+        return average_pool2d(x, self._kernel, self._stride, self._padding,
+                          data_format=self._data_format)
@@ -1,6 +1,6 @@
 import numpy as np
 from renom.core import Node
-from renom.layers.function.utils import imnpool, poolnim
+from renom.layers.function.utils import imnpool, imnpool_index, poolnim
 import renom.cuda as cu
 if cu.has_cuda():
     from renom.cuda.gpuvalue import GPUValue, get_gpu
@@ -25,9 +25,10 @@ class max_poolnd(npool_base):
 
     @classmethod
     def _oper_cpu(cls, x, kernel, stride, padding):
-        result = imnpool(x, kernel, stride, padding, mode="max")
+        result, index = imnpool_index(x, kernel, stride, padding)
         ret = cls._create_node(result)
         ret.attrs._x = x
+        ret.attrs._index = index
         ret.attrs._kernel = kernel
         ret.attrs._stride = stride
         ret.attrs._padding = padding
@@ -51,8 +52,8 @@ class max_poolnd(npool_base):
         return ret
 
     def _backward_cpu(self, context, dy, **kwargs):
-        result = poolnim(self.attrs._x, dy, self.attrs._kernel,
-                         self.attrs._stride, self.attrs._padding, mode="max")
+        result = poolnim(self.attrs._x, dy, self.attrs._kernel, self.attrs._stride,
+                         self.attrs._padding, mode="max", index=self.attrs._index)
         self.attrs._x._update_diff(context, result, **kwargs)
 
 
@@ -92,7 +93,7 @@ class average_poolnd(npool_base):
 
 
 def check_input(var, length):
-    if isinstance(var, tuple):
+    if isinstance(var, (tuple, list)):
         assert len(var) is length
         var = list(var)
     elif not isinstance(var, np.ndarray):
@@ -115,19 +116,15 @@ class NPoolBase:
         self._dims = None
 
     def __call__(self, x):
-        dims = len(x.shape[2:])
         if self._dims is None:
-            if dims < 2:
-                dims = 2
-            self._dims = dims
+            self._dims = len(x.shape[2:])
+            if self._dims == 1:
+                self._kernel = np.append(self._kernel, 1).astype(np.int32)
+                self._padding = np.append(self._padding, 0).astype(np.int32)
+                self._stride = np.append(self._stride, 1).astype(np.int32)
         if is_cuda_active():
             assert self._dims < 4, "GPU Version can only 1, 2 and 3 dimensions"
 
-        if self._dims == 1:
-            self._kernel = np.append(self._kernel, 1).astype(np.int32)
-            self._padding = np.append(self._padding, 0).astype(np.int32)
-            self._stride = np.append(self._stride, 1).astype(np.int32)
-
         def func(var):
             return check_input(var, self._dims)
         self._padding, self._stride, self._kernel = map(
@@ -147,7 +144,7 @@ class Pool3Base(NPoolBase):
         dims = len(x.shape[2:])
         if is_cuda_active():
             assert dims == 3, "Pool 3D expects 3 dimensions"
-        super(Pool3Base, self).__call__(x)
+        return super(Pool3Base, self).__call__(x)
 
 
 class MaxPoolNd(NPoolBase):
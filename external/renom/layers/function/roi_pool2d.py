@@ -3,46 +3,86 @@
 
 import numpy as np
 from renom.core import Node, to_value
-from renom.layers.function.utils import roi_pooling_slice, region_cordinates, roi_pooling_slice_decode
 import renom.cuda as cu
 if cu.has_cuda():
     from renom.cuda.gpuvalue import GPUValue, get_gpu
 
 
+# Upper bound of the number of gathered elements in one chunk of rois.
+_CHUNK_SIZE = 1 << 22
+
+
+def _regions(rois, spatial_scale):
+    # Vectorized region_cordinates of all rois.
+    rois = to_value(rois)
+    idx = rois[:, 0].astype(np.int64)
+    xmin, ymin, xmax, ymax = (np.round(rois[:, i] * spatial_scale).astype(np.int64)
+                              for i in range(1, 5))
+    return idx, xmin, ymin, xmax, ymax
+
+
+def _roi_bins(start, length, out, limit):
+    # Vectorized roi_pooling_slice of the out bins of every roi along one axis.
+    stride = np.maximum(length, 1).astype(np.float64) / out
+    p = np.arange(out)
+    begin = np.floor(p * stride[:, None]).astype(np.int64) + start[:, None]
+    end = np.ceil((p + 1) * stride[:, None]).astype(np.int64) + start[:, None]
+    return np.clip(begin, 0, limit), np.clip(end, 0, limit)
+
+
+def _bin_indices(begin, end, limit):
+    # Indices of the bins padded to the longest one, and their mask.
+    size = max(int(np.max(end - begin, initial=0)), 1)
+    index = begin[..., None] + np.arange(size)
+    valid = index < end[..., None]
+    return np.minimum(index, limit - 1), valid
+
+
+def _chunks(n, size):
+    step = max(_CHUNK_SIZE // max(size, 1), 1)
+    return [slice(i, i + step) for i in range(0, n, step)]
+
+
 class roi_pool2d(Node):
 
     def __new__(cls, x, rois, outh=7, outw=7, spatial_scale=1 / 16.):
         ch, h, w = x.shape[1:]
         n_rois = rois.shape[0]
-        return cls.calc_value(x, rois, ch, h, w, n_rois, outh, outw, spatial_scale=1 / 16.)
+        return cls.calc_value(x, rois, ch, h, w, n_rois, outh, outw, spatial_scale=spatial_scale)
 
     @classmethod
     def _oper_cpu(cls, x, rois, ch, h, w, n_rois, outh, outw, spatial_scale):
-        z = np.zeros((n_rois, ch, outh, outw), np.float64)
-        index = np.zeros(z.shape, np.int32)
-
-        for i_roi in range(n_rois):
-            idx, xmin, ymin, xmax, ymax = region_cordinates(rois[i_roi], spatial_scale)
-            roi_height = max(ymax - ymin + 1, 1)
-            roi_width = max(xmax - xmin + 1, 1)
-            strideh = float(roi_height) / float(outh)
-            stridew = float(roi_width) / float(outw)
-
-            for idx_h in range(outh):
-                sliceh, lenh = roi_pooling_slice(idx_h, strideh, h, ymin)
-                if lenh <= 0:
-                    continue
-                for idx_w in range(outw):
-                    slicew, lenw = roi_pooling_slice(idx_w, stridew, w, xmin)
-                    if lenw <= 0:
-                        continue
-                    roi_data = x[int(idx), :, sliceh, slicew].reshape(ch, -1)
-                    z[i_roi, :, idx_h, idx_w] = np.max(roi_data, axis=1)
-                    max_idx_slice = np.unravel_index(np.argmax(roi_data, axis=1), (lenh, lenw))
-                    max_idx_slice_h = max_idx_slice[0] + sliceh.start
-                    max_idx_slice_w = max_idx_slice[1] + slicew.start
-                    max_idx_slice = max_idx_slice_h * w + max_idx_slice_w
-                    index[i_roi, :, idx_h, idx_w] = max_idx_slice
+        value = to_value(x)
+        idx, xmin, ymin, xmax, ymax = _regions(rois, spatial_scale)
+        rows, valid_h = _bin_indices(*_roi_bins(ymin, ymax - ymin + 1, outh, h), limit=h)
+        cols, valid_w = _bin_indices(*_roi_bins(xmin, xmax - xmin + 1, outw, w), limit=w)
+        lenh, lenw = rows.shape[-1], cols.shape[-1]
+
+        # Channels last with a row and a column of -inf, which the padding
+        # of the bins points to.
+        padded = np.full((value.shape[0], h + 1, w + 1, ch), -np.inf, dtype=value.dtype)
+        padded[:, :h, :w] = value.transpose(0, 2, 3, 1)
+        rows = np.where(valid_h, rows, h)
+        cols = np.where(valid_w, cols, w)
+
+        z = np.full((n_rois, outh, outw, ch), -np.inf, value.dtype)
+        index = np.full((n_rois, outh, outw, ch), -1, np.int64)
+        image = idx[:, None, None]
+        # One offset of every bin at a time, in row major order. A strict
+        # comparison keeps the first maximum, as np.argmax over a bin does.
+        for i in range(lenh):
+            row = rows[:, :, i, None]
+            for j in range(lenw):
+                col = cols[:, None, :, j]
+                data = padded[image, row, col]
+                update = data > z
+                np.copyto(z, data, where=update)
+                np.copyto(index, (row * w + col)[..., None], where=update)
+        # Bins outside of the input are empty.
+        z[index < 0] = 0
+        z = np.ascontiguousarray(z.transpose(0, 3, 1, 2))
+        index = index.transpose(0, 3, 1, 2)
+
         ret = cls._create_node(z)
         ret.attrs._index = index
         ret.attrs._x = x
@@ -70,33 +110,17 @@ class roi_pool2d(Node):
 
     def _backward_cpu(self, context, dy, **kwargs):
         if isinstance(self.attrs._x, Node):
-            ch, h, w = self.attrs._x.shape[1:]
-            n_rois = self.attrs._rois.shape[0]
-            dx = np.zeros_like(self.attrs._x)
-
-            for i_roi in range(n_rois):
-                idx, xmin, ymin, xmax, ymax = region_cordinates(self.attrs._rois[i_roi],
-                                                                self.attrs._spatial_scale)
-                roi_height = max(ymax - ymin + 1, 1)
-                roi_width = max(xmax - xmin + 1, 1)
-
-                stride_h = float(roi_height) / float(self.attrs._outh)
-                stride_w = float(roi_width) / float(self.attrs._outw)
-                for idx_h in range(ymin, ymax + 1):
-                    for idx_w in range(xmin, xmax + 1):
-                        start_w, end_w = roi_pooling_slice_decode(
-                            idx_w, stride_w, self.attrs._outw, xmin)
-                        start_h, end_h = roi_pooling_slice_decode(
-                            idx_h, stride_h, self.attrs._outh, ymin)
-
-                        for ph in range(start_h, end_h):
-                            for pw in range(start_w, end_w):
-                                max_idx_tmp = self.attrs._index[i_roi, :, ph, pw]
-                                for c in range(ch):
-                                    if max_idx_tmp[c] == (idx_h * w + idx_w):
-                                        dx[idx, c, idx_h, idx_w] += dy[i_roi, c, ph, pw]
-
-        self.attrs._x._update_diff(context, dx, **kwargs)
+            n, ch, h, w = self.attrs._x.shape
+            index = self.attrs._index
+            idx = _regions(self.attrs._rois, self.attrs._spatial_scale)[0]
+            # Scatter add of dy onto the argmax of every bin.
+            target = (idx[:, None, None, None] * ch +
+                      np.arange(ch)[:, None, None]) * (h * w) + index
+            valid = index >= 0
+            dx = np.bincount(target[valid], weights=to_value(dy)[valid],
+                             minlength=n * ch * h * w)
+            dx = dx.reshape(n, ch, h, w).astype(self.attrs._x.dtype, copy=False)
+            self.attrs._x._update_diff(context, dx, **kwargs)
 
     def _backward_gpu(self, context, dy, **kwargs):
         if isinstance(self.attrs._x, Node):
@@ -107,6 +131,88 @@ class roi_pool2d(Node):
             self.attrs._x._update_diff(context, dx, **kwargs)
 
 
+def _align_weights(start, length, out, grid, limit):
+    # Matrices of the shape (n_rois, out, limit) which average the bilinear
+    # interpolation of grid sampling points in each bin along one axis.
+    n_rois = len(start)
+    bin_size = length / out
+    pos = start[:, None, None] + (np.arange(out)[:, None] +
+                                  (np.arange(grid) + 0.5) / grid) * bin_size[:, None, None]
+    weight = ((pos >= -1.) & (pos <= limit)) / float(grid)
+    pos = np.maximum(pos, 0.)
+    low = np.floor(pos).astype(np.int64)
+    edge = low >= limit - 1
+    low[edge] = limit - 1
+    high = np.where(edge, low, low + 1)
+    frac = np.where(edge, 0., pos - low)
+    offset = (np.arange(n_rois)[:, None, None] * out + np.arange(out)[:, None]) * limit
+    size = n_rois * out * limit
+    ret = np.bincount((offset + low).ravel(), ((1. - frac) * weight).ravel(), size)
+    ret += np.bincount((offset + high).ravel(), (frac * weight).ravel(), size)
+    return ret.reshape(n_rois, out, limit)
+
+
+class roi_align2d(Node):
+
+    def __new__(cls, x, rois, outh=7, outw=7, spatial_scale=1 / 16., sampling_ratio=2):
+        return cls.calc_value(x, rois, outh, outw, spatial_scale, sampling_ratio)
+
+    @classmethod
+    def _oper_cpu(cls, x, rois, outh, outw, spatial_scale, sampling_ratio):
+        value = to_value(x)
+        ch, h, w = value.shape[1:]
+        boxes = to_value(rois)
+        idx = boxes[:, 0].astype(np.int64)
+        xmin, ymin, xmax, ymax = (boxes[:, i] * spatial_scale for i in range(1, 5))
+        # Each output is weight_h @ x[idx] @ weight_w.T for every roi.
+        weight_h = _align_weights(ymin, np.maximum(ymax - ymin, 1.), outh, sampling_ratio, h)
+        weight_w = _align_weights(xmin, np.maximum(xmax - xmin, 1.), outw, sampling_ratio, w)
+        weight_h = weight_h.astype(value.dtype, copy=False)
+        weight_w = weight_w.astype(value.dtype, copy=False)
+
+        z = np.empty((len(idx), ch, outh, outw), dtype=value.dtype)
+        for n in np.unique(idx):
+            sel = np.flatnonzero(idx == n)
+            for r in _chunks(len(sel), ch * outh * w):
+                r = sel[r]
+                z[r] = np.matmul(np.matmul(weight_h[r, None], value[n]),
+                                 weight_w[r, None].swapaxes(-1, -2))
+
+        ret = cls._create_node(z)
+        ret.attrs._x = x
+        ret.attrs._idx = idx
+        ret.attrs._weight_h = weight_h
+        ret.attrs._weight_w = weight_w
+        return ret
+
+    @classmethod
+    def _oper_gpu(cls, x, rois, outh, outw, spatial_scale, sampling_ratio):
+        return cls._oper_cpu(x, rois, outh, outw, spatial_scale, sampling_ratio)
+
+    def _backward_dx(self, dy):
+        x = self.attrs._x
+        idx = self.attrs._idx
+        weight_h = self.attrs._weight_h
+        weight_w = self.attrs._weight_w
+        dx = np.zeros(x.shape, dtype=dy.dtype)
+        for n in np.unique(idx):
+            sel = np.flatnonzero(idx == n)
+            for r in _chunks(len(sel), x.shape[1] * weight_h.shape[1] * x.shape[3]):
+                r = sel[r]
+                tmp = np.matmul(dy[r], weight_w[r, None])
+                dx[n] += np.tensordot(weight_h[r], tmp, axes=([0, 1], [0, 2])).swapaxes(0, 1)
+        return dx
+
+    def _backward_cpu(self, context, dy, **kwargs):
+        if isinstance(self.attrs._x, Node):
+            self.attrs._x._update_diff(context, self._backward_dx(to_value(dy)), **kwargs)
+
+    def _backward_gpu(self, context, dy, **kwargs):
+        if isinstance(self.attrs._x, Node):
+            dx = self._backward_dx(get_gpu(dy).new_array())
+            self.attrs._x._update_diff(context, get_gpu(dx), **kwargs)
+
+
 class RoiPoolBase(object):
     def __init__(self, outh=7, outw=7, spatial_scale=1 / 16.):
         self.outw = outw
@@ -120,3 +226,29 @@ class RoiPoolBase(object):
 class RoiPool2d(RoiPoolBase):
     def forward(self, x, rois):
         return roi_pool2d(x, rois, self.outh, self.outw, self.spatial_scale)
+
+
+class RoiAlign2d(RoiPoolBase):
+    """Roi align [roialign]_ . Every output bin is the average of
+    ``sampling_ratio`` x ``sampling_ratio`` points sampled by bilinear
+    interpolation, without rounding the roi coordinates.
+
+    Args:
+        outh (int): Output height.
+        outw (int): Output width.
+        spatial_scale (float): Scale of the roi coordinates to the input.
+        sampling_ratio (int): Number of sampling points per bin along each axis.
+
+    Rois are given as in :class:`RoiPool2d`, the rows are
+    ``(batch index, xmin, ymin, xmax, ymax)``.
+
+    .. [roialign] Kaiming He, Georgia Gkioxari, Piotr Dollar, Ross Girshick.
+        Mask R-CNN. ICCV 2017.
+    """
+
+    def __init__(self, outh=7, outw=7, spatial_scale=1 / 16., sampling_ratio=2):
+        super(RoiAlign2d, self).__init__(outh, outw, spatial_scale)
+        self.sampling_ratio = sampling_ratio
+
+    def forward(self, x, rois):
+        return roi_align2d(x, rois, self.outh, self.outw, self.spatial_scale, self.sampling_ratio)
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import division
+import warnings
+from renom.core import Node, Variable, no_grad
+from renom.core.basic_node import record_nodes
+
+
+class _Ref(object):
+    '''Placeholder for the value of a traced node in recorded arguments.'''
+    __slots__ = ('index', )
+
+    def __init__(self, index):
+        self.index = index
+
+
+def _iter_nodes(obj):
+    stack = [obj]
+    while stack:
+        o = stack.pop()
+        if isinstance(o, Node):
+            yield o
+        elif isinstance(o, (list, tuple)):
+            stack.extend(o)
+        elif isinstance(o, dict):
+            stack.extend(o.values())
+
+
+def _template(obj, index):
+    '''Replaces traced nodes found in ``obj`` with _Ref.'''
+    if isinstance(obj, Node):
+        i = index.get(id(obj))
+        return obj if i is None else _Ref(i)
+    elif isinstance(obj, (list, tuple)):
+        return type(obj)(_template(o, index) for o in obj)
+    elif isinstance(obj, dict):
+        return dict((k, _template(v, index)) for k, v in obj.items())
+    return obj
+
+
+def _fill(obj, values):
+    if isinstance(obj, _Ref):
+        return values[obj.index]
+    elif isinstance(obj, (list, tuple)):
+        return type(obj)(_fill(o, values) for o in obj)
+    elif isinstance(obj, dict):
+        return dict((k, _fill(v, values)) for k, v in obj.items())
+    return obj
+
+
+class TracedModel(object):
+    '''Model whose operations are recorded once and replayed.
+
+    See :func:`trace`.
+
+    Args:
+        model (Model): Model to be traced.
+        example_input (ndarray, Node): Input of the recorded call.
+    '''
+
+    def __init__(self, model, example_input):
+        self.model = model
+        self._ops = None
+        self._models = list(model.iter_models())
+
+        x = example_input if isinstance(example_input, Node) else Node(example_input)
+        self._shape = x.shape
+        if not all(m._traceable for m in self._models):
+            warnings.warn("{} keeps states between calls and is called eagerly.".format(
+                model.__class__.__name__))
+            return
+
+        with record_nodes() as nodes:
+            ret = model(x)
+        self._inference = self._inference_states()
+        self._params = [(m.params, k, v) for m in self._models for k, v in m.params.items()]
+        self._ops = self._compile(x, ret, nodes)
+        if self._ops is None:
+            warnings.warn("{} can not be traced and is called eagerly.".format(
+                model.__class__.__name__))
+
+    def _compile(self, x, ret, nodes):
+        if not isinstance(ret, Node):
+            return None
+
+        created = dict((id(n), (a, k)) for n, a, k in nodes if not isinstance(n, Variable))
+        # Nodes created inside of other operations are not replayed.
+        needed = set()
+        stack = [ret]
+        while stack:
+            n = stack.pop()
+            if id(n) in created and id(n) not in needed:
+                needed.add(id(n))
+                stack.extend(_iter_nodes(created[id(n)]))
+
+        index = {id(x): 0}
+        ops = []
+        variables = {}
+        for n, args, kwargs in nodes:
+            if id(n) not in needed:
+                continue
+            if type(n).__init__ is not Node.__init__:
+                return None
+            for a in _iter_nodes((args, kwargs)):
+                # Nodes other than parameters which come from the outside of
+                # the call are states of the model.
+                if id(a) not in index:
+                    if not isinstance(a, Variable):
+                        return None
+                    variables[id(a)] = a
+            args, kwargs = _template(args, index), _template(kwargs, index)
+            # Positions of arguments which are values of traced nodes.
+            refs = tuple(i for i, a in enumerate(args) if isinstance(a, _Ref))
+            nested = any(isinstance(a, (list, tuple, dict)) for a in args) or \
+                any(isinstance(v, (_Ref, list, tuple, dict)) for v in kwargs.values())
+            ops.append((type(n), args, kwargs, refs, nested))
+            index[id(n)] = len(ops)
+
+        self._variables = list(variables.values())
+        self._output = index.get(id(ret))
+        return ops if self._output is not None else None
+
+    def _inference_states(self):
+        return [getattr(m, 'inference', False) for m in self._models]
+
+    def _is_replayable(self, x):
+        if self._ops is None or x.shape != self._shape:
+            return False
+        if self._inference != self._inference_states():
+            return False
+        return all(params.get(k) is v for params, k, v in self._params)
+
+    def __call__(self, x):
+        if not self._is_replayable(x):
+            return self.model(x)
+
+        # The input is passed as it is, so that no gradient is calculated for
+        # an ndarray input. It is wrapped by a Node only while recording.
+        if any(v.auto_update for v in self._variables) or \
+                (isinstance(x, Node) and (x.auto_update or x._has_autoupdate())):
+            return self._replay(x)
+        # Nothing is updated, so that the graph would be reduced anyway.
+        with no_grad():
+            return self._replay(x)
+
+    def _replay(self, x):
+        values = [x]
+        for cls, args, kwargs, refs, nested in self._ops:
+            if nested:
+                values.append(cls(*_fill(args, values), **_fill(kwargs, values)))
+            else:
+                args = list(args)
+                for i in refs:
+                    args[i] = values[args[i].index]
+                values.append(cls(*args, **kwargs))
+        return values[self._output]
+
+
+def trace(model, example_input):
+    '''Records the operations of ``model(example_input)`` once and returns
+    a callable which replays them.
+
+    The replay skips the python code of the models, like forward methods,
+    parameter lookups and hooks, and calls the recorded operations directly
+    with the new input. Gradients are calculated as usual from the returned
+    node. The model is called eagerly if the shape of the input or the
+    inference flags of the models differ from the recorded call, or if
+    parameters have been replaced.
+
+    The forward computation must not depend on the values of the input.
+    Models which keep states between calls, like Lstm or BatchNormalize,
+    are always called eagerly.
+
+    Args:
+        model (Model): Model to be traced.
+        example_input (ndarray, Node): Input whose shape is used for replay.
+
+    Returns:
+        (TracedModel): Callable with the same outputs as ``model``.
+
+    Example:
+        >>> import numpy as np
+        >>> import renom as rm
+        >>> model = rm.Sequential([rm.Dense(10), rm.Relu(), rm.Dense(1)])
+        >>> x = np.random.rand(32, 4)
+        >>> traced = rm.trace(model, x)
+        >>> with model.train():
+        ...     loss = rm.mean_squared_error(traced(x), np.zeros((32, 1)))
+        >>> loss.grad().update(rm.Sgd())
+    '''
+    return TracedModel(model, example_input)
@@ -3,6 +3,7 @@
 
 import numpy as np
 from renom.core import Node
+from renom.core.layout import NCHW
 from renom.layers.function.utils import im2col, col2im, transpose_out_size, tuplize
 from renom.layers.function.pool2d import max_pool2d, average_pool2d
 from renom.layers.function.unpoolnd import max_unpoolnd, average_unpoolnd
@@ -24,6 +25,8 @@ class SimpleContainer(object):
 class max_unpool2d(Node):
 
     def __new__(cls, x, prev_pool):
+        assert prev_pool._item.attrs.get("_data_format", NCHW) == NCHW, \
+            "Unpooling supports the NCHW data format only."
         return cls.calc_value(x, prev_pool._item)
 
     _oper_cpu = max_unpoolnd._oper_cpu
@@ -38,6 +41,8 @@ class max_unpool2d(Node):
 class average_unpool2d(Node):
 
     def __new__(cls, x, prev_pool):
+        assert prev_pool._item.attrs.get("_data_format", NCHW) == NCHW, \
+            "Unpooling supports the NCHW data format only."
         return cls.calc_value(x, prev_pool._item)
 
     _oper_cpu = average_unpoolnd._oper_cpu
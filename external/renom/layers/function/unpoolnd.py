@@ -22,10 +22,12 @@ class max_unpoolnd(Node):
 
     @classmethod
     def _oper_cpu(cls, x, prev_pool):
-        result = poolnim(prev_pool.attrs._x, x, prev_pool.attrs._kernel,
-                         prev_pool.attrs._stride, prev_pool.attrs._padding, mode="max")
+        index = prev_pool.attrs.get("_index")
+        result = poolnim(prev_pool.attrs._x, x, prev_pool.attrs._kernel, prev_pool.attrs._stride,
+                         prev_pool.attrs._padding, mode="max", index=index)
         ret = cls._create_node(result)
         ret.attrs._x = x
+        ret.attrs._index = index
         ret.attrs._original_x = prev_pool.attrs._x
         ret.attrs._kernel = prev_pool.attrs._kernel
         ret.attrs._stride = prev_pool.attrs._stride
@@ -48,14 +50,16 @@ class max_unpoolnd(Node):
 
     def _backward_cpu(self, context, dy, **kwargs):
         dx = imnpool(self.attrs._original_x, self.attrs._kernel, self.attrs._stride,
-                     self.attrs._padding, mode="max", alternate_input=dy)
+                     self.attrs._padding, mode="max", alternate_input=dy,
+                     index=self.attrs.get("_index"))
         self.attrs._x._update_diff(context, dx)
 
     def _backward_gpu(self, context, dy, **kwargs):
         dy.to_cpu()
         cu.set_cuda_active(False)
         dx = imnpool(self.attrs._original_x, self.attrs._kernel, self.attrs._stride,
-                     self.attrs._padding, mode="max", alternate_input=dy)
+                     self.attrs._padding, mode="max", alternate_input=dy,
+                     index=self.attrs.get("_index"))
         cu.set_cuda_active(True)
         dx = Node(dx)
         self.attrs._x._update_diff(context, dx)
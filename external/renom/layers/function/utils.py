@@ -1,7 +1,9 @@
 # -*- coding: utf - 8 -*-
 import numpy as np
 from renom.core import to_value
+from renom.core.pool import empty_buffer, zeros_buffer
 from renom import precision
+from renom.core.layout import NCHW, NHWC, NHWC_TO_NCHW
 
 
 def out_size(size, k, s, p, d=(1, 1), ceil_mode=False):
@@ -23,27 +25,134 @@ def transpose_out_size(size, k, s, p, d=(1, 1)):
             (np.array(d) - 1) - 2 * np.array(p)).astype(np.int)
 
 
-def im2col(img, size, kernel, stride, padding, dilation=(1, 1), padWith=0.):
-    N, channel, in_h, in_w = img.shape
+def _window_pad(in_size, size, kernel, stride, padding, dilation):
+    # Trailing padding which makes every window of the output lie in the
+    # padded image. It exceeds the padding only for ceil_mode pooling.
+    return [max(p, (k - 1) * d + (o - 1) * s + 1 - i - p)
+            for i, o, k, s, p, d in zip(in_size, size, kernel, stride, padding, dilation)]
+
+
+def window_view(img, size, kernel, stride, dilation=(1, 1), writeable=False):
+    """Returns a view of ``img`` with the shape (N, C, k_h, k_w, out_h, out_w)
+    whose element [n, c, k_h - 1 - i, k_w - 1 - j, y, x] is
+    ``img[n, c, y * s_h + i * d_h, x * s_w + j * d_w]``. No data is copied.
+
+    Elements of a writeable view must not overlap, i.e. the windows must not
+    overlap each other.
+    """
+    N, channel = img.shape[:2]
     out_h, out_w = size
     k_h, k_w = kernel
     s_h, s_w = stride
-    p_h, p_w = padding
     d_h, d_w = dilation
-    img_n = np.pad(img, ((0, 0), (0, 0), (p_h, p_h + s_h - 1),
-                         (p_w, p_w + s_w - 1)), mode="constant", constant_values=padWith)
-    col = np.ndarray((N, channel, k_h, k_w, out_h, out_w), dtype=precision)
-    for i in range(k_h):
-        idh = i * d_h
-        iu = idh + s_h * out_h
-
-        for j in range(k_w):
-            jdw = j * d_w
-            ju = jdw + s_w * out_w
-            col[:, :, k_h - 1 - i, k_w - 1 - j, :, :] = img_n[:, :, idh:iu:s_h, jdw:ju:s_w]
+    st_n, st_c, st_h, st_w = img.strides
+    view = np.lib.stride_tricks.as_strided(
+        img, (N, channel, k_h, k_w, out_h, out_w),
+        (st_n, st_c, st_h * d_h, st_w * d_w, st_h * s_h, st_w * s_w),
+        writeable=writeable)
+    return view[:, :, ::-1, ::-1]
+
+
+def im2col_view(img, size, kernel, stride, padding, dilation=(1, 1), padWith=0.,
+                data_format=NCHW):
+    """Same as ``im2col``, but the column tensor is a strided view of the
+    padded image. The image is copied only if it has to be padded.
+
+    If ``data_format`` is "NHWC", ``img`` is of the shape (N, H, W, C) and
+    the view has the axes of ``im2col`` over the memory of ``img``."""
+    p_h, p_w = padding
+    spatial = 1 if data_format == NHWC else 2
+    a_h, a_w = _window_pad(img.shape[spatial:spatial + 2], size, kernel, stride, padding,
+                           dilation)
+    if p_h or p_w or a_h or a_w:
+        pad_width = [(0, 0), (p_h, a_h), (p_w, a_w)]
+        pad_width.insert(3 if data_format == NHWC else 1, (0, 0))
+        img = pad_constant(img, pad_width, padWith)
+    if data_format == NHWC:
+        img = img.transpose(NHWC_TO_NCHW)
+    return window_view(img, size, kernel, stride, dilation)
+
+
+def window_sum(col):
+    """Sums the columns (N, C, k_h, k_w, out_h, out_w) over the kernel axes.
+    It accumulates one kernel offset at a time, which is faster than a
+    reduction over the strided axes of a view."""
+    ret = col[:, :, 0, 0].copy(order="K")
+    for i, j in np.ndindex(*col.shape[2:4]):
+        if i or j:
+            ret += col[:, :, i, j]
+    return ret
+
+
+def _einsum_axes(ndim, axes):
+    letters = "abcdefghijklmnop"[:ndim]
+    return letters, "".join(l for i, l in enumerate(letters) if i not in axes)
+
+
+def reduce_sum(x, axes, y=None):
+    """Sums x, or the product x * y, over the axes keeping their dimensions.
+    The product is reduced by einsum without being stored."""
+    sub, kept = _einsum_axes(x.ndim, axes)
+    shape = tuple(1 if i in axes else s for i, s in enumerate(x.shape))
+    if y is None:
+        ret = np.einsum(sub + "->" + kept, x)
+    else:
+        ret = np.einsum("{0},{0}->{1}".format(sub, kept), x, y)
+    return ret.reshape(shape)
+
+
+def moments(x, axes, out):
+    """Mean and biased variance of x over the axes. The centered x is written
+    to ``out`` and its squares are reduced in place, so the statistics take
+    no temporary of the size of x."""
+    n = int(np.prod([x.shape[i] for i in axes]))
+    mean = reduce_sum(x, axes) / n
+    np.subtract(x, mean, out=out)
+    var = reduce_sum(out, axes, out) / n
+    return mean, var
+
+
+def im2col(img, size, kernel, stride, padding, dilation=(1, 1), padWith=0.):
+    view = im2col_view(img, size, kernel, stride, padding, dilation, padWith)
+    col = empty_buffer(view.shape, dtype=precision)
+    np.copyto(col, view)
     return col
 
 
+def im2row(img, size, kernel, stride, padding, dilation=(1, 1), padWith=0., data_format=NCHW):
+    """Returns the columns of ``im2col`` as a matrix of the shape
+    (N * out_h * out_w, C * k_h * k_w), which is the operand of GEMMs as it is.
+
+    If ``data_format`` is "NHWC", ``img`` is of the shape (N, H, W, C) and
+    the columns are ordered as (k_h, k_w, C), so that the channels of a pixel
+    are copied contiguously."""
+    view = im2col_view(img, size, kernel, stride, padding, dilation, padWith, data_format)
+    if data_format == NHWC:
+        view = view.transpose(0, 4, 5, 2, 3, 1)
+    else:
+        view = view.transpose(0, 4, 5, 1, 2, 3)
+    row = empty_buffer(view.shape, dtype=precision)
+    np.copyto(row, view)
+    return row.reshape(-1, int(np.prod(view.shape[3:])))
+
+
+def pad_constant(img, pad_width, value=0.):
+    """Same as ``np.pad(img, pad_width, mode="constant", constant_values=value)``,
+    but the padded array is drawn from the buffer pool."""
+    shape = tuple(s + before + after for s, (before, after) in zip(img.shape, pad_width))
+    ret = empty_buffer(shape, dtype=img.dtype)
+    for axis, (before, after) in enumerate(pad_width):
+        index = [slice(None)] * len(shape)
+        if before:
+            index[axis] = slice(None, before)
+            ret[tuple(index)] = value
+        if after:
+            index[axis] = slice(shape[axis] - after, None)
+            ret[tuple(index)] = value
+    ret[tuple(slice(before, before + s) for s, (before, _) in zip(img.shape, pad_width))] = img
+    return ret
+
+
 def pad_image(img, padding, stride, padWith=0.):
     dims = img.shape[2:]
     dimensionality = len(dims)
@@ -55,59 +164,75 @@ def pad_image(img, padding, stride, padWith=0.):
     return padded_image
 
 
-def imncol(img, weight, stride, padding, padWith=0.):
-    N, in_channels, in_dims = img.shape[0], img.shape[1], img.shape[2:]
-    out_channels = weight.shape[0]
-    assert in_channels is weight.shape[1], "Number of feature maps is not the same for input and output"
-    dimensionality = len(in_dims)
-
-    # Padding asks for (before, after) for each dimension or it generalizes the padding
-    pad_list = [(0, 0), (0, 0)]
-    pad_list.extend([(padding[i], padding[i]) for i in range(dimensionality)])
-    padded_image = np.pad(img, tuple(pad_list),
-                          mode="constant", constant_values=padWith)
-    ret = []
-    for batch in range(N):
-        tmp = []
-        for out_channel in range(out_channels):
-            tmp2 = 0
-            for in_channel in range(in_channels):
-                tmp2 += place_kernels(padded_image[batch, in_channel],
-                                      weight[out_channel, in_channel], stride=stride)
-            tmp.append(tmp2)
-        ret.append(tmp)
-    ret = np.array(ret)
-    return np.array(ret)
-
-
-def colnim(img, weight, stride):
-    ret = []
-    for batch in range(img.shape[0]):
-        tmp2 = 0
-        for out_channel in range(weight.shape[0]):
-            tmp = []
-            for in_channel in range(weight.shape[1]):
-                tmp.append(place_back_kernels(img[batch, out_channel],
-                                              weight[out_channel, in_channel], stride=stride))
-            tmp2 += np.array(tmp)
-        ret.append(tmp2)
-    ret = np.array(ret)
-    return ret
+def im2col_nd(img, kernel, stride, padding, padWith=0.):
+    """Returns a view of the padded ``img`` with the shape
+    (N, C, k_1, ..., k_n, o_1, ..., o_n) whose element [n, c, u, p] is
+    ``padded[n, c, p * s + u]``. The image is copied only if it has to be
+    padded. Unlike ``im2col``, the kernel axes are not reversed."""
+    kernel, stride, padding = (tuple(int(v) for v in a) for a in (kernel, stride, padding))
+    if any(padding):
+        img = pad_constant(img, ((0, 0), (0, 0)) + tuple((p, p) for p in padding), padWith)
+    size = tuple((i - k) // s + 1 for i, k, s in zip(img.shape[2:], kernel, stride))
+    st = img.strides
+    return np.lib.stride_tricks.as_strided(
+        img, img.shape[:2] + kernel + size,
+        st[:2] + st[2:] + tuple(t * s for t, s in zip(st[2:], stride)), writeable=False)
+
+
+def col2im_nd(col, size, stride, padding):
+    """Adjoint of ``im2col_nd``. Sums the columns (N, C, k_1, ..., k_n, o_1, ..., o_n)
+    into an image of the spatial shape ``size``."""
+    dims = (col.ndim - 2) // 2
+    kernel, out = col.shape[2:2 + dims], col.shape[2 + dims:]
+    padded = tuple(max(int(i) + 2 * int(p), (o - 1) * int(s) + k)
+                   for i, p, o, s, k in zip(size, padding, out, stride, kernel))
+    img = zeros_buffer(col.shape[:2] + padded, dtype=col.dtype)
+    for u in np.ndindex(*kernel):
+        window = tuple(slice(v, v + int(s) * (o - 1) + 1, int(s))
+                       for v, s, o in zip(u, stride, out))
+        img[(Ellipsis, ) + window] += col[(slice(None), slice(None)) + u]
+    return img[(Ellipsis, ) + tuple(slice(int(p), int(p) + int(i)) for i, p in zip(size, padding))]
 
 
-def colnw(img, weight, stride):
-    ret = []
-    for out_channel in range(weight.shape[1]):
-        tmp2 = 0
-        for batch in range(img.shape[0]):
-            tmp = []
-            for in_channel in range(img.shape[1]):
-                tmp.append(place_overlap_kernels(
-                    img[batch, in_channel], weight[batch, out_channel], stride=stride))
-            tmp2 += np.array(tmp)
-        ret.append(tmp2)
-    ret = np.array(ret)
-    return ret
+def imncol(img, weight, stride, padding, padWith=0.):
+    """N-d convolution of ``img`` (N, C, i_1, ...) with ``weight`` (O, C, k_1, ...)."""
+    assert img.shape[1] == weight.shape[1], \
+        "Number of feature maps is not the same for input and output"
+    dims = weight.ndim - 2
+    col = im2col_nd(img, weight.shape[2:], stride, padding, padWith)
+    axes = list(range(1, dims + 2))
+    return np.moveaxis(np.tensordot(col, weight, (axes, axes)), -1, 1)
+
+
+def colnim(img, weight, stride, padding=None, size=None):
+    """Transposed N-d convolution of ``img`` (N, C, i_1, ...) with ``weight``
+    (C, O, k_1, ...). The spatial shape of the result is ``size``, which
+    defaults to ``(i - 1) * s + k - 2 * p``."""
+    dims = weight.ndim - 2
+    kernel = weight.shape[2:]
+    padding = [0] * dims if padding is None else padding
+    if size is None:
+        size = [(i - 1) * int(s) + k - 2 * int(p)
+                for i, s, k, p in zip(img.shape[2:], stride, kernel, padding)]
+    # (N, i_1, ..., O, k_1, ...) -> (N, O, k_1, ..., i_1, ...)
+    col = np.tensordot(img, weight, ([1], [0]))
+    col = col.transpose([0, dims + 1] + list(range(dims + 2, 2 * dims + 2)) +
+                        list(range(1, dims + 1)))
+    return col2im_nd(col, size, stride, padding)
+
+
+def colnw(img, weight, stride, padding=None, kernel=None):
+    """Gradient of ``imncol`` with respect to its weight, where ``img`` is the
+    input (N, C, i_1, ...) and ``weight`` the output gradient (N, O, o_1, ...).
+    The kernel shape defaults to the one that fits the output exactly."""
+    dims = weight.ndim - 2
+    padding = [0] * dims if padding is None else padding
+    if kernel is None:
+        kernel = [i + 2 * int(p) - (o - 1) * int(s)
+                  for i, p, o, s in zip(img.shape[2:], padding, weight.shape[2:], stride)]
+    col = im2col_nd(img, kernel, stride, padding)
+    axes = [0] + list(range(dims + 2, 2 * dims + 2))
+    return np.tensordot(weight, col, ([0] + list(range(2, dims + 2)), axes))
 
 
 def imnw(img, weight, stride):
@@ -168,42 +293,114 @@ def place_overlap_back_kernels(img, kernel, stride=1, offset=0):
     itr_img = img
     min = np.array(ret.shape) - 1
     for pos in generate_positions(itr_img, stride, offset, min_space=min):
-        slices = [slice(pos[i], pos[i] + ret.shape[i]) for i in range(len(img.shape))]
-        strided_slices = [slice(pos[i] // stride[i], pos[i] // stride[i] + ret.shape[i])
-                          for i in range(len(img.shape))]
+        slices = tuple(slice(pos[i], pos[i] + ret.shape[i]) for i in range(len(img.shape)))
+        strided_slices = tuple(slice(pos[i] // stride[i], pos[i] // stride[i] + ret.shape[i])
+                               for i in range(len(img.shape)))
         kern = img[slices] * kernel[strided_slices]
         ret += kern
     return ret
 
 
-def imnpool(img, kernel, stride, padding, padWith=0, mode="max", alternate_input=None):
-    if mode is "max":
-        func = max_pool
-    elif mode is "average":
-        func = average_pool
-
-    N, in_channels, in_dims = img.shape[0], img.shape[1], img.shape[2:]
-    dimensionality = len(in_dims)
-    pad_list = [(0, 0), (0, 0)]
-    pad_list.extend([(padding[i], padding[i]) for i in range(dimensionality)])
-    padded_image = np.pad(img, tuple(pad_list),
-                          mode="constant", constant_values=padWith)
-    if alternate_input is not None:
-        alternate_input = np.pad(alternate_input, tuple(pad_list),
-                                 mode="constant", constant_values=padWith)
-
-    ret = []
-    for batch in range(N):
-        tmp = []
-        for in_channel in range(in_channels):
-            ret2 = place_pools(padded_image[batch, in_channel],
-                               kernel, stride, func,
-                               alternate_input=alternate_input[batch, in_channel]
-                               if alternate_input is not None else None)
-            tmp.append(ret2)
-        ret.append(tmp)
-    ret = np.array(ret)
-    return ret
+def _unit_axes(img, dims):
+    # 1d pooling comes with a trailing unit kernel appended, see NPoolBase.
+    return img.reshape(img.shape + (1, ) * (dims + 2 - img.ndim))
+
+
+def _pool_pad(img, kernel, stride, padding, padWith=0.):
+    # Padded img with unit axes and the spatial shape of the pooled output.
+    img = _unit_axes(to_value(img), len(kernel))
+    if any(int(p) for p in padding):
+        pad = tuple((int(p), int(p)) for p in padding)
+        img = pad_constant(img, ((0, 0), (0, 0)) + pad, padWith)
+    out = tuple((i - int(k)) // int(s) + 1 for i, k, s in zip(img.shape[2:], kernel, stride))
+    return img, out
+
+
+def _pool_slices(kernel, stride, out):
+    # For every kernel offset, in C order, the slice of the padded image
+    # holding the elements at that offset of all the windows.
+    return [(Ellipsis, ) + tuple(slice(v, v + int(s) * (o - 1) + 1, int(s))
+                                 for v, s, o in zip(u, stride, out))
+            for u in np.ndindex(*tuple(int(k) for k in kernel))]
+
+
+def pool_index_dtype(kernel):
+    """Narrowest integer type holding the offsets of a pooling window."""
+    size = int(np.prod(kernel))
+    for dtype in (np.int8, np.int16):
+        if size <= np.iinfo(dtype).max + 1:
+            return dtype
+    return np.int32
+
+
+def imnpool_index(img, kernel, stride, padding, padWith=0.):
+    """N-d max pooling of ``img`` which also returns the offset of the maximum
+    within every window, counted in C order over the kernel and stored as
+    ``pool_index_dtype(kernel)``. Ties go to the first offset, as with ``np.argmax``."""
+    ndim = to_value(img).ndim
+    img, out = _pool_pad(img, kernel, stride, padding, padWith)
+    slices = _pool_slices(kernel, stride, out)
+    ret = img[slices[0]].copy()
+    for s in slices[1:]:
+        np.maximum(ret, img[s], out=ret)
+    index = np.empty(ret.shape, dtype=pool_index_dtype(kernel))
+    mask = empty_buffer(ret.shape, dtype=bool)
+    for o in range(len(slices) - 1, -1, -1):
+        np.equal(img[slices[o]], ret, out=mask)
+        np.copyto(index, o, where=mask)
+    return ret.reshape(ret.shape[:ndim]), index.reshape(ret.shape[:ndim])
+
+
+def imnpool(img, kernel, stride, padding, padWith=0, mode="max", alternate_input=None, index=None):
+    """N-d pooling of ``img``. If ``alternate_input`` is given, its elements
+    at the pooled positions of ``img`` are pooled instead. The maxima are
+    looked up in ``index``, as returned by ``imnpool_index``, if it is given."""
+    ndim = to_value(img).ndim
+    if mode == "max":
+        if index is None:
+            ret, index = imnpool_index(img, kernel, stride, padding, padWith)
+            if alternate_input is None:
+                return ret
+        alt, out = _pool_pad(alternate_input, kernel, stride, padding, padWith)
+        index = _unit_axes(index, len(kernel))
+        ret = np.empty(index.shape, dtype=alt.dtype)
+        for o, s in enumerate(_pool_slices(kernel, stride, out)):
+            np.copyto(ret, alt[s], where=index == o)
+    elif mode == "average":
+        img = img if alternate_input is None else alternate_input
+        img, out = _pool_pad(img, kernel, stride, padding, padWith)
+        slices = _pool_slices(kernel, stride, out)
+        ret = np.array(img[slices[0]], dtype=np.result_type(img, 1.))
+        for s in slices[1:]:
+            ret += img[s]
+        ret /= float(np.prod(kernel))
+    return ret.reshape(ret.shape[:ndim])
+
+
+def poolnim(original, dy, kernel, stride, padding, mode="max", index=None):
+    """Gradient of ``imnpool`` with respect to ``original``. The maxima are
+    found again unless the ``index`` of ``imnpool_index`` is given."""
+    dims = len(kernel)
+    shape = original.shape
+    dy = _unit_axes(to_value(dy), dims)
+    size = tuple(shape[2:]) + (1, ) * (dims + 2 - len(shape))
+    if mode == "max":
+        if index is None:
+            index = imnpool_index(original, kernel, stride, padding)[1]
+        index = _unit_axes(index, dims)
+        padded = tuple(i + 2 * int(p) for i, p in zip(size, padding))
+        dx = zeros_buffer(dy.shape[:2] + padded, dtype=dy.dtype)
+        part = empty_buffer(dy.shape, dtype=dy.dtype)
+        for o, s in enumerate(_pool_slices(kernel, stride, dy.shape[2:])):
+            np.multiply(dy, index == o, out=part)
+            dx[s] += part
+        dx = dx[(Ellipsis, ) + tuple(slice(int(p), int(p) + i) for i, p in zip(size, padding))]
+    elif mode == "average":
+        dy = dy / float(np.prod(kernel))
+        col_shape = dy.shape[:2] + tuple(int(k) for k in kernel) + dy.shape[2:]
+        col = np.broadcast_to(dy.reshape(dy.shape[:2] + (1, ) * dims + dy.shape[2:]), col_shape)
+        dx = col2im_nd(col, size, stride, padding)
+    return dx.reshape(shape)
 
 
 def place_pools(img, kernel, stride, mode, offset=0, alternate_input=None):
@@ -211,7 +408,7 @@ def place_pools(img, kernel, stride, mode, offset=0, alternate_input=None):
     kernels = np.zeros(tuple(kernal))
 
     for pos in generate_positions(img, stride, offset, min_space=np.array(kernel) - 1):
-        slices = [slice(pos[i], pos[i] + kernel[i]) for i in range(len(img.shape))]
+        slices = tuple(slice(pos[i], pos[i] + kernel[i]) for i in range(len(img.shape)))
         if alternate_input is not None:
             alt = alternate_input[slices]
         else:
@@ -225,8 +422,8 @@ def place_back_pools(img, kernel, stride, mode, dy, offset=0):
     ret = np.zeros(img.shape)
 
     for pos in generate_positions(img, stride, offset, min_space=np.array(kernel) - 1):
-        slices = [slice(pos[i] if pos[i] > -1 else 0, pos[i] + kernel[i], 1)
-                  for i in range(len(img.shape))]
+        slices = tuple(slice(pos[i] if pos[i] > -1 else 0, pos[i] + kernel[i], 1)
+                       for i in range(len(img.shape)))
         kern = mode(img[slices], dy[tuple(np.array(pos) // stride)])
         ret[slices] += kern[...]
     return ret
@@ -246,31 +443,6 @@ def average_pool(img, alternate_input=None):
         return np.average(alternate_input)
 
 
-def poolnim(original, dy, kernel, stride, padding, mode="max"):
-    ret = np.zeros(original.shape)
-    if mode is "max":
-        func = back_max_pool
-    elif mode is "average":
-        func = back_average_pool
-
-    _, _, in_dims = original.shape[0], original.shape[1], original.shape[2:]  # noqa
-    dimensionality = len(in_dims)
-    pad_list = [(0, 0), (0, 0)]
-    pad_list.extend([(padding[i], padding[i]) for i in range(dimensionality)])
-    padded_image = np.pad(original, tuple(pad_list),
-                          mode="constant", constant_values=0)
-
-    ret = np.zeros(original.shape)
-
-    for batch in range(original.shape[0]):
-        for in_channel in range(original.shape[1]):
-            padding_slices = [slice(padding[i], padded_image.shape[2 + i] - padding[i])
-                              for i in range(len(original.shape[2:]))]
-            ret[batch, in_channel] = place_back_pools(
-                padded_image[batch, in_channel], kernel, stride, func, dy[batch, in_channel])[padding_slices]
-    return ret
-
-
 def back_max_pool(img, dy):
     ret = np.zeros_like(img)
     ret.ravel()[np.argmax(img)] += dy
@@ -285,8 +457,7 @@ def back_average_pool(img, dy):
 
 def pad_dx(dx, original):
     ret = np.zeros_like(original)
-    for p, v in np.ndenumerate(dx):
-        ret[p] = v
+    ret[tuple(slice(0, s) for s in dx.shape)] = dx
     return ret
 
 
@@ -316,26 +487,39 @@ def enum_positions(pos_list, index, length, dist, stride, offset, min_space=0):
         pos_list[index] += stride[0]
 
 
-def col2im(col, size, stride, padding, dilation=(1, 1)):
+def col2im(col, size, stride, padding, dilation=(1, 1), data_format=NCHW):
+    """Adjoint of ``im2col``. If ``data_format`` is "NHWC", the image is
+    returned in the shape (N, H, W, C), while ``col`` keeps the axes of
+    ``im2col``, e.g. a transposed view of an array of the shape
+    (N, out_h, out_w, k_h, k_w, C)."""
     in_h, in_w = size
     s_h, s_w = stride
     p_h, p_w = padding
     d_h, d_w = dilation
     N, channel, k_h, k_w, out_h, out_w = col.shape
-    img = np.zeros((N, channel, in_h + 2 * p_h + s_h - 1,
-                    in_w + 2 * p_w + s_w - 1), dtype=precision)
-    for i in range(k_h):
-        idh = i * d_h
-        iu = idh + s_h * out_h
-
-        for j in range(k_w):
-            jdw = j * d_w
-            ju = jdw + s_w * out_w
-            img[:, :, idh:iu:s_h, jdw:ju:s_w] += col[:, :, k_h - 1 - i, k_w - 1 - j, :, :]
-
-    im_shape = img.shape
-    return img[:, :, p_h:im_shape[2] - (p_h + s_h - 1),
-               p_w:im_shape[3] - (p_w + s_w - 1)]
+    a_h, a_w = _window_pad(size, (out_h, out_w), (k_h, k_w), stride, padding, dilation)
+    if data_format == NHWC:
+        ret = zeros_buffer((N, in_h + p_h + a_h, in_w + p_w + a_w, channel), dtype=precision)
+        img = ret.transpose(NHWC_TO_NCHW)
+    else:
+        ret = img = zeros_buffer((N, channel, in_h + p_h + a_h, in_w + p_w + a_w),
+                                 dtype=precision)
+    if (k_h - 1) * d_h < s_h and (k_w - 1) * d_w < s_w:
+        # Windows do not overlap, so that the columns are simply scattered.
+        view = window_view(img, (out_h, out_w), (k_h, k_w), stride, dilation, writeable=True)
+        np.copyto(view, col)
+    else:
+        for i in range(k_h):
+            idh = i * d_h
+            iu = idh + s_h * (out_h - 1) + 1
+
+            for j in range(k_w):
+                jdw = j * d_w
+                ju = jdw + s_w * (out_w - 1) + 1
+                img[:, :, idh:iu:s_h, jdw:ju:s_w] += col[:, :, k_h - 1 - i, k_w - 1 - j, :, :]
+    if data_format == NHWC:
+        return ret[:, p_h:p_h + in_h, p_w:p_w + in_w]
+    return img[:, :, p_h:p_h + in_h, p_w:p_w + in_w]
 
 
 def tuplize(x):
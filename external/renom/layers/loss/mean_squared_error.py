@@ -2,7 +2,7 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function, division
 import numpy as np
-from renom.core import BinOp, Node
+from renom.core import BinOp, Node, evaluate_fused
 import renom.cuda as cu
 if cu.has_cuda():
     from renom.cuda.gpuvalue import get_gpu
@@ -15,9 +15,9 @@ class mean_squared_error(BinOp):
         assert len(rhs.shape) > 1, "Input arrays must have no less than 2 dimension."
         N = len(lhs)
         if reduce_sum:
-            return np.sum((lhs - rhs) ** 2) / (N * 2)
+            return np.sum(evaluate_fused(lambda x, y: (x - y) ** 2, lhs, rhs)) / (N * 2)
         else:
-            return (lhs - rhs) ** 2 / (N * 2)
+            return evaluate_fused(lambda x, y: (x - y) ** 2 / (N * 2), lhs, rhs)
 
     @classmethod
     def _oper_gpu(cls, lhs, rhs, reduce_sum=True):
@@ -30,9 +30,10 @@ class mean_squared_error(BinOp):
 
     def _backward_cpu(self, context, dy, **kwargs):
         if isinstance(self.attrs._lhs, Node):
-            sub = self.attrs._lhs - self.attrs._rhs
             N = len(self.attrs._lhs)
-            self.attrs._lhs._update_diff(context, sub * dy / N, **kwargs)
+            dx = evaluate_fused(lambda x, y, dy: (x - y) * dy / N,
+                                self.attrs._lhs, self.attrs._rhs, dy)
+            self.attrs._lhs._update_diff(context, dx, **kwargs)
 
     def _backward_gpu(self, context, dy, **kwargs):
         if isinstance(self.attrs._lhs, Node):
@@ -2,7 +2,7 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function, division
 import numpy as np
-from renom.core import Node, to_value
+from renom.core import Node, to_value, evaluate_fused
 import renom.cuda as cu
 if cu.has_cuda():
     from renom.cuda.gpuvalue import get_gpu
@@ -17,13 +17,13 @@ class sigmoid_cross_entropy(Node):
     @classmethod
     def _oper_cpu(cls, lhs, rhs, reduce_sum):
         N = len(lhs)
-        z = 1. / (1. + np.exp(to_value(-lhs)))
+        z = evaluate_fused(lambda x: 1. / (1. + np.exp(-x)), lhs)
         if reduce_sum:
-            loss = -np.sum(to_value(rhs) * np.log(z + 1e-8) +
-                           to_value(1 - rhs) * np.log(1 - z + 1e-8)) / N
+            loss = -np.sum(evaluate_fused(lambda z, t: t * np.log(z + 1e-8) +
+                                          (1 - t) * np.log(1 - z + 1e-8), z, rhs)) / N
         else:
-            loss = -(to_value(rhs) * np.log(z + 1e-8) +
-                     to_value(1 - rhs) * np.log(1 - z + 1e-8)) / N
+            loss = evaluate_fused(lambda z, t: -(t * np.log(z + 1e-8) +
+                                                 (1 - t) * np.log(1 - z + 1e-8)) / N, z, rhs)
 
         ret = cls._create_node(loss)
         ret.attrs._z = z
@@ -52,9 +52,10 @@ class sigmoid_cross_entropy(Node):
 
     def _backward_cpu(self, context, dy, **kwargs):
         if isinstance(self.attrs._lhs, Node):
-            sub = self.attrs._z - self.attrs._rhs
             N = len(self.attrs._z)
-            self.attrs._lhs._update_diff(context, sub * dy / N, **kwargs)
+            dx = evaluate_fused(lambda z, t, dy: (z - t) * dy / N,
+                                self.attrs._z, self.attrs._rhs, dy)
+            self.attrs._lhs._update_diff(context, dx, **kwargs)
 
     def _backward_gpu(self, context, dy, **kwargs):
         if isinstance(self.attrs._lhs, Node):
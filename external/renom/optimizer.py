@@ -2,7 +2,7 @@
 # encoding: utf-8
 from __future__ import division, print_function
 import numpy as np
-from renom.core import Node, Variable
+from renom.core import Node, Variable, IndexedSlices, evaluate_fused
 from renom.operation import sqrt, square
 from renom.cuda import is_cuda_active
 from abc import ABCMeta, abstractmethod
@@ -12,12 +12,25 @@ if cu.has_cuda():
     from renom.cuda.gpuvalue import GPUValue, get_gpu
 
 
+def _sparse_state(state, dy):
+    '''Returns an optimizer state as a writable array of the table shape.
+    A new state is allocated by np.zeros, whose pages are not touched until
+    a row is written, so rows never seen take no memory.'''
+    if state is None or np.isscalar(state):
+        return np.zeros(dy.dense_shape, dtype=dy.dtype)
+    if type(state) is not np.ndarray or not state.flags.writeable:
+        return np.array(state, dtype=dy.dtype)
+    return state
+
+
 class Optimizer(with_metaclass(ABCMeta, object)):
 
     # Called by update_node in core.py
     def __call__(self, *args, **kwargs):
         if is_cuda_active():
             return self._get_gpu(*args, **kwargs)
+        elif isinstance(args[0], IndexedSlices):
+            return self._get_sparse(*args, **kwargs)
         else:
             return self._get_cpu(*args, **kwargs)
 
@@ -29,6 +42,12 @@ class Optimizer(with_metaclass(ABCMeta, object)):
     def _get_gpu(self, *args, **kwargs):
         pass
 
+    def _get_sparse(self, dy, node):
+        '''Returns the update of a sparse gradient. Optimizers with a lazy
+        update return an IndexedSlices of the rows in the gradient, the
+        others are given the dense gradient.'''
+        return self._get_cpu(dy.to_dense(), node)
+
 
 class Sgd(Optimizer):
     '''Stochastic Gradient Descent.
@@ -81,6 +100,19 @@ class Sgd(Optimizer):
             ret.detach_graph()
         return ret
 
+    def _get_sparse(self, dy, node):
+        # Lazy update, the momentum of rows not in the gradient is kept.
+        pdy = _sparse_state(self._params.get(id(node)), dy)
+        prev_dy = pdy[dy.indices]
+        if self._nesterov:
+            new_dy = self._momentum * prev_dy + self._lr * dy.values
+            ret = (1 + self._momentum) * new_dy - self._momentum * prev_dy
+        else:
+            ret = new_dy = self._lr * dy.values + self._momentum * prev_dy
+        pdy[dy.indices] = new_dy
+        self._params[id(node)] = pdy
+        return IndexedSlices(dy.indices, ret, dy.dense_shape)
+
     def _get_gpu(self, dy, node):
         node_id = id(node)
         pdy = self._params.get(node_id, get_gpu(dy).zeros_like_me())
@@ -144,6 +176,14 @@ class Adagrad(Optimizer):
             ret.detach_graph()
         return ret
 
+    def _get_sparse(self, dy, node):
+        r = _sparse_state(self._params.get(id(node)), dy)
+        r_rows = r[dy.indices] + dy.values * dy.values
+        r[dy.indices] = r_rows
+        self._params[id(node)] = r
+        ret = self._lr * dy.values / (np.sqrt(r_rows) + self._epsilon)
+        return IndexedSlices(dy.indices, ret, dy.dense_shape)
+
     def _get_gpu(self, dy, node):
         node_id = id(node)
         pdy = self._params.get(node_id, get_gpu(dy).zeros_like_me())
@@ -401,8 +441,8 @@ class Adam(Optimizer):
         if pdy is None:
             b = self._b
             g = self._g
-            u = (1 - self._b) * dy
-            r = (1 - self._g) * (dy**2)
+            u = evaluate_fused(lambda dy: (1 - self._b) * dy, dy)
+            r = evaluate_fused(lambda dy: (1 - self._g) * (dy**2), dy)
         else:
             u = pdy["u"]
             r = pdy["r"]
@@ -418,8 +458,9 @@ class Adam(Optimizer):
                     r.setflags(write=True)
                     u[min_flug] = 0
                     r[min_flug] = 0
-            u = self._b * u + (1 - self._b) * dy
-            r = self._g * r + (1 - self._g) * (dy * dy)
+            # Moments are owned by the optimizer and updated in place.
+            u = evaluate_fused(lambda u, dy: self._b * u + (1 - self._b) * dy, u, dy, out=u)
+            r = evaluate_fused(lambda r, dy: self._g * r + (1 - self._g) * (dy * dy), r, dy, out=r)
 
         self._params[node_id] = {"beta": b * self._b,
                                  "gamma": g * self._g,
@@ -427,10 +468,30 @@ class Adam(Optimizer):
                                  "r": r,
                                  "nth": nth + 1}
 
-        ret = self._lr * u / (sqrt(r / (1 - g)) + self._epsilon) / (1 - b)
-        if isinstance(ret, Node):
-            ret.detach_graph()
-        return ret
+        return evaluate_fused(lambda u, r: self._lr * u / (np.sqrt(r / (1 - g)) + self._epsilon) /
+                              (1 - b), u, r)
+
+    def _get_sparse(self, dy, node):
+        # Lazy update, the moments of rows not in the gradient are kept and
+        # the bias correction follows the number of updates of the table.
+        pdy = self._params.get(id(node), None)
+        if pdy is None:
+            pdy = {"beta": self._b, "gamma": self._g, "u": None, "r": None, "nth": 0}
+        b, g = pdy["beta"], pdy["gamma"]
+        u = _sparse_state(pdy["u"], dy)
+        r = _sparse_state(pdy["r"], dy)
+        u_rows = self._b * u[dy.indices] + (1 - self._b) * dy.values
+        r_rows = self._g * r[dy.indices] + (1 - self._g) * (dy.values * dy.values)
+        u[dy.indices] = u_rows
+        r[dy.indices] = r_rows
+
+        self._params[id(node)] = {"beta": b * self._b,
+                                  "gamma": g * self._g,
+                                  "u": u,
+                                  "r": r,
+                                  "nth": pdy["nth"] + 1}
+        ret = self._lr * u_rows / (np.sqrt(r_rows / (1 - g)) + self._epsilon) / (1 - b)
+        return IndexedSlices(dy.indices, ret, dy.dense_shape)
 
     def _get_gpu(self, dy, node):
         node_id = id(node)
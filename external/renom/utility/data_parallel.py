@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import division
+import copy
+import contextlib
+import traceback
+import multiprocessing
+import numpy as np
+from renom.config import precision
+from renom.core import Variable, to_value, no_grad
+from renom.core.grads import IndexedSlices
+from renom.core.pool import use_buffer_pool
+from renom.core.rng import sample_offset
+from renom.layers.function.parameterized import Parametrized
+
+
+class SharedAllReduce(object):
+    '''Sums vectors of ``num_workers`` processes through shared memory.
+
+    Every worker writes its vector to its own row of a shared array. Then
+    each worker sums one chunk of all the rows into the shared result, as the
+    reduce-scatter of a ring all-reduce, and reads the whole result, which the
+    shared memory gathers without copies. A worker reads and writes about
+    twice the size of the vector whatever the number of workers.
+
+    The object must be created before the workers are forked.
+
+    Args:
+        num_workers (int): Number of processes.
+        size (int): Length of the vectors.
+        dtype: Data type of the vectors.
+    '''
+
+    def __init__(self, num_workers, size, dtype=precision):
+        context = fork_context()
+        assert context is not None, "Shared memory is passed to forked processes."
+        self.num_workers = num_workers
+        self.size = size
+        self._dtype = np.dtype(dtype)
+        nbytes = size * self._dtype.itemsize
+        self._rows = context.RawArray("b", num_workers * nbytes)
+        self._result = context.RawArray("b", nbytes)
+        self._barrier = context.Barrier(num_workers)
+
+    def row(self, rank):
+        '''Returns the row of the worker, which it writes its vector to.'''
+        rows = np.frombuffer(self._rows, dtype=self._dtype)
+        return rows.reshape(self.num_workers, self.size)[rank]
+
+    def allreduce(self, rank):
+        '''Waits for the rows of all the workers and returns their sum.
+
+        The returned array is shared and valid until the next call.
+
+        Raises:
+            threading.BrokenBarrierError: If a worker has called ``abort``.
+        '''
+        rows = np.frombuffer(self._rows, dtype=self._dtype).reshape(self.num_workers, self.size)
+        result = np.frombuffer(self._result, dtype=self._dtype)
+        bounds = np.linspace(0, self.size, self.num_workers + 1).astype(int)
+        lo, hi = bounds[rank], bounds[rank + 1]
+        self._barrier.wait()
+        np.sum(rows[:, lo:hi], axis=0, out=result[lo:hi])
+        self._barrier.wait()
+        return result
+
+    def broadcast(self, rank, send):
+        '''Returns the vector which rank 0 writes by calling ``send`` with the
+        shared result. The result of ``allreduce`` is then overwritten.'''
+        result = np.frombuffer(self._result, dtype=self._dtype)
+        self._barrier.wait()
+        if rank == 0:
+            send(result)
+        self._barrier.wait()
+        return result
+
+    def abort(self):
+        '''Releases the workers waiting in ``allreduce`` with an error.'''
+        self._barrier.abort()
+
+
+def fork_context():
+    '''Returns the multiprocessing context which forks, or None if the
+    platform cannot fork, as on Windows.'''
+    if "fork" not in multiprocessing.get_all_start_methods():
+        return None
+    return multiprocessing.get_context("fork")
+
+
+def parameters(model):
+    '''Returns the Variables of the model in an order shared by its replicas.'''
+    return [v for _, values, _ in model.flatten_values() for v in values.values()]
+
+
+def statistics(model):
+    '''Returns the moving statistics of the model, the arrays listed in the
+    ``SERIALIZED`` attributes of its layers such as those of BatchNormalize,
+    as (layer, name) pairs in an order shared by its replicas.'''
+    return [(m, name) for m in model.iter_models() for name in getattr(m, "SERIALIZED", ())
+            if isinstance(getattr(m, name, None), np.ndarray)]
+
+
+def build(model, data):
+    '''Creates the weights of the layers which create them at their first
+    call, and the moving statistics which are created at the first training
+    step, so that the replicas forked from the model share their shapes.
+    The training state of the model is left as it is.'''
+    if any(isinstance(m, Parametrized) and not m.params for m in model.iter_models()):
+        model.set_models(inference=True)
+        with no_grad():
+            model(data)
+        model.set_models(inference=False)
+    # A copy takes a training step, whose random streams and statistics are
+    # discarded, to find the shapes of the statistics. The input is a
+    # Variable, so that the layers of the copy keep their statistics.
+    probe = copy.deepcopy(model)
+    with probe.train():
+        probe(Variable(data))
+    for m, p in zip(model.iter_models(), probe.iter_models()):
+        for name in getattr(m, "SERIALIZED", ()):
+            value = getattr(p, name, None)
+            if isinstance(value, np.ndarray) and not isinstance(getattr(m, name), np.ndarray):
+                setattr(m, name, np.full_like(value, getattr(m, name)))
+
+
+def data_parallel_step(trainer, model, rank, data, target, offset, total, allreduce,
+                       on_event=None):
+    '''Trains the model on the samples ``offset`` to ``offset + len(data)``
+    of a batch of ``total`` samples.
+
+    The gradients, the loss and the moving statistics are averaged over the
+    batch. A parameter is updated if any rank has its gradient. Sparse
+    gradients such as those of Embedding are reduced as dense arrays, so
+    the lazy update of the rows found in the batch does not apply and an
+    optimizer with momentum updates every row. Rank 0 calls ``on_event``
+    with the events of the Trainer, updates the parameters and sends them to
+    the other ranks, so that the replicas stay equal whatever the handlers of
+    the events do.
+
+    Returns:
+        (float): Loss of the batch.
+    '''
+    on_event = on_event or (lambda event: None)
+    on_event('forward')
+    # Random streams draw the numbers of exactly these samples of the batch.
+    with sample_offset(offset):
+        with model.train():
+            trainer.outputs = [model(data)]
+        on_event('loss')
+        loss = trainer.loss_func(trainer.outputs[0], target)
+        if trainer.regularization:
+            loss = trainer.regularization(model) + loss
+    trainer.losses = [loss]
+    on_event('backward')
+    grads = loss.grad()
+
+    # Losses are means over the shards, which are weighted by their sizes.
+    # The row holds the gradients, a flag per parameter telling whether the
+    # rank has its gradient, the statistics and the loss.
+    scale = len(data) / total
+    row = allreduce.row(rank)
+    params = parameters(model)
+    stats = statistics(model)
+    flags = int(sum(v.size for v in params))
+    pos = 0
+    for i, v in enumerate(params):
+        diff = grads.get(v, None)
+        if diff is None:
+            row[pos:pos + v.size] = 0
+        else:
+            if isinstance(diff, IndexedSlices):
+                diff = diff.to_dense()
+            np.multiply(to_value(diff).reshape(-1), scale, out=row[pos:pos + v.size])
+        row[flags + i] = diff is not None
+        pos += v.size
+    pos += len(params)
+    for m, name in stats:
+        value = getattr(m, name)
+        np.multiply(value.reshape(-1), scale, out=row[pos:pos + value.size])
+        pos += value.size
+    row[pos] = to_value(loss) * scale
+
+    result = allreduce.allreduce(rank)
+    pos = 0
+    for i, v in enumerate(params):
+        if result[flags + i] > 0:
+            # Parameters without gradient on this rank are updated as well.
+            if grads.get(v, None) is None and v._auto_update:
+                grads._auto_updates.append(v)
+            grads.set(v, result[pos:pos + v.size].reshape(v.shape).copy())
+        pos += v.size
+    pos += len(params)
+    for m, name in stats:
+        value = getattr(m, name)
+        setattr(m, name, result[pos:pos + value.size].reshape(value.shape).copy())
+        pos += value.size
+    batch_loss = float(result[pos])
+    trainer.grads = [grads]
+
+    def send(buf):
+        on_event('grad')
+        grads.update(trainer.optimizer)
+        pos = 0
+        for v in params:
+            buf[pos:pos + v.size] = to_value(v).reshape(-1)
+            pos += v.size
+
+    result = allreduce.broadcast(rank, send)
+    if rank:
+        pos = 0
+        for v in params:
+            v.copy_from(result[pos:pos + v.size].reshape(v.shape))
+            pos += v.size
+    return batch_loss
+
+
+def worker_loop(trainer, model, rank, conn, allreduce):
+    '''Main loop of a worker process. It takes the shards sent through
+    ``conn`` until None is received, and reports an error by sending its
+    traceback.'''
+    try:
+        while True:
+            message = conn.recv()
+            if message is None:
+                break
+            data, target, offset, total = message
+            with contextlib.ExitStack() as stack:
+                if trainer.buffer_pool is not None:
+                    stack.enter_context(use_buffer_pool(pool=trainer.buffer_pool))
+                data_parallel_step(trainer, model, rank, data, target, offset, total, allreduce)
+    except Exception:
+        allreduce.abort()
+        conn.send(traceback.format_exc())
+    finally:
+        conn.close()
+
+
+class WorkerPool(object):
+    '''Forked processes holding the replicas of a model for data parallel
+    training. The process which creates the pool is the worker of rank 0.
+
+    Args:
+        trainer (Trainer): Trainer whose loss function, regularization and
+            optimizer the workers use.
+        model (Model): Model prepared by ``build``.
+        num_workers (int): Number of workers including the calling process.
+    '''
+
+    def __init__(self, trainer, model, num_workers):
+        context = fork_context()
+        assert context is not None, "Data parallel workers are forked processes."
+        params = parameters(model)
+        size = int(sum(v.size for v in params)) + len(params)
+        size += int(sum(getattr(m, name).size for m, name in statistics(model))) + 1
+        self.allreduce = SharedAllReduce(num_workers, size)
+        self._conns = []
+        self._processes = []
+        for rank in range(1, num_workers):
+            conn, child = context.Pipe()
+            process = context.Process(target=worker_loop,
+                                      args=(trainer, model, rank, child, self.allreduce))
+            process.daemon = True
+            process.start()
+            child.close()
+            self._conns.append(conn)
+            self._processes.append(process)
+
+    @property
+    def num_workers(self):
+        return self.allreduce.num_workers
+
+    def split(self, total):
+        '''Returns the bounds of the shards of a batch of ``total`` samples.'''
+        bounds = np.linspace(0, total, self.num_workers + 1).astype(int)
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    def scatter(self, data, target):
+        '''Sends the shards of the workers of rank 1 and above.'''
+        for conn, (lo, hi) in zip(self._conns, self.split(len(data))[1:]):
+            conn.send((data[lo:hi], target[lo:hi], lo, len(data)))
+
+    def raise_error(self):
+        '''Raises the error of a failed worker.'''
+        for conn in self._conns:
+            if conn.poll(1):
+                raise RuntimeError("A data parallel worker failed.\n" + conn.recv())
+        raise RuntimeError("A data parallel worker failed.")
+
+    def close(self):
+        # Releases the workers waiting for a step which rank 0 left.
+        self.allreduce.abort()
+        for conn in self._conns:
+            try:
+                conn.send(None)
+            except (IOError, OSError):
+                pass
+        for process in self._processes:
+            process.join()
+        for conn in self._conns:
+            conn.close()
@@ -1,2 +1,6 @@
-from renom.utility.distributor.distributor import NdarrayDistributor, TimeSeriesDistributor, GPUDistributor
+from renom.utility.distributor.distributor import NdarrayDistributor, TimeSeriesDistributor, \
+    GPUDistributor, StreamDistributor, PrefetchDistributor
+from renom.utility.distributor.memmapdistributor import MemmapDistributor, save_shards, \
+    convert_mat, convert_csv
 from renom.utility.distributor.threadingdistributor import ImageClassificationDistributor, ImageDetectionDistributor
+from renom.utility.distributor.imagecache import ImageCache
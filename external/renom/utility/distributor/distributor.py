@@ -1,7 +1,9 @@
 #!/usr / bin / env python
 # -*- coding: utf - 8 -*-
 from __future__ import division
+import queue
 import warnings
+import threading
 import numpy as np
 from renom.core import Node
 from renom.cuda import has_cuda, is_cuda_active
@@ -56,14 +58,26 @@ class Distributor(object):
     def __len__(self):
         return self._data_size
 
-    def batch(self, batch_size, shuffle=True, steps=None):
+    def batch(self, batch_size, shuffle=True, steps=None, prefetch=0):
         '''
         This function returns `minibatch`.
 
         Args:
             batch_size (int): Size of batch.
             shuffle (bool): If True is passed, data will be selected randomly.
+            steps (int): Number of batches to yield. Defaults to one epoch.
+            prefetch (int): Number of batches gathered ahead on a background
+                thread. The batches are then written into a ring of
+                preallocated arrays, so the arrays of a batch are only valid
+                until the next batch is requested.
         '''
+        if prefetch:
+            return _prefetch(self._gather(batch_size, shuffle, steps, prefetch + 2), prefetch)
+        return self._batch(batch_size, shuffle, steps)
+
+    def _batch_indices(self, batch_size, shuffle, steps):
+        # Returns the indices of the samples of every batch, slices if the
+        # batches are contiguous. The permutation is drawn by the caller.
         epoch_step_size = int(np.ceil(self._data_size / batch_size))
         if steps is None:
             batchcount = epoch_step_size
@@ -72,15 +86,35 @@ class Distributor(object):
 
         if shuffle:
             perm = np.random.permutation(self._data_size)
-            for s in range(batchcount):
-                i = s % epoch_step_size
-                p = perm[i * batch_size:(i + 1) * batch_size]
-                yield self._data_x[p], self._data_y[p]
-        else:
-            for s in range(batchcount):
-                i = s % epoch_step_size
-                yield self._data_x[i * batch_size:(i + 1) * batch_size], \
-                    self._data_y[i * batch_size:(i + 1) * batch_size]
+            return (perm[i * batch_size:(i + 1) * batch_size]
+                    for i in (s % epoch_step_size for s in range(batchcount)))
+        return (slice(i * batch_size, (i + 1) * batch_size)
+                for i in (s % epoch_step_size for s in range(batchcount)))
+
+    def _batch(self, batch_size, shuffle, steps):
+        for p in self._batch_indices(batch_size, shuffle, steps):
+            yield self._data_x[p], self._data_y[p]
+
+    def _gather(self, batch_size, shuffle, steps, num_buffers):
+        # Gathers the batches into a ring of ``num_buffers`` arrays.
+        indices = self._batch_indices(batch_size, shuffle, steps)
+        data = (self._data_x, self._data_y)
+        ring = [[np.empty((batch_size, ) + d.shape[1:], dtype=d.dtype) for d in data]
+                for _ in range(num_buffers)]
+
+        def gather():
+            for n, p in enumerate(indices):
+                buffers = ring[n % num_buffers]
+                if isinstance(p, slice):
+                    size = len(range(*p.indices(self._data_size)))
+                    for d, buf in zip(data, buffers):
+                        np.copyto(buf[:size], d[p])
+                else:
+                    size = len(p)
+                    for d, buf in zip(data, buffers):
+                        np.take(d, p, axis=0, out=buf[:size], mode="clip")
+                yield tuple(buf[:size] for buf in buffers)
+        return gather()
 
     def kfold(self, num, overlap=False, shuffle=False):
         for i in range(num):
@@ -118,6 +152,100 @@ class Distributor(object):
         return self._data_x
 
 
+def _prefetch(generator, depth):
+    '''Runs ``generator`` on a background thread, at most ``depth`` items
+    ahead of the caller. Errors of the generator are raised in the caller.'''
+    items = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def run():
+        try:
+            for item in generator:
+                if not put((item, None)):
+                    return
+        except Exception as e:
+            put((done, e))
+            return
+        put((done, None))
+
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is done:
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+class PrefetchDistributor(Distributor):
+    '''
+    Wraps a distributor and draws its batches on a background thread, so that
+    gathering, reading or decoding the next batches overlaps the training
+    step. Any distributor with a ``batch`` generator can be wrapped, e.g. an
+    image distributor.
+
+    Args:
+        distributor (Distributor): Distributor to wrap.
+        prefetch (int): Number of batches drawn ahead.
+
+    >>> import numpy as np
+    >>> from renom.utility.distributor import NdarrayDistributor, PrefetchDistributor
+    >>> distributor = PrefetchDistributor(NdarrayDistributor(x, y), prefetch=2)
+    >>> for batch_x, batch_y in distributor.batch(64):
+    ...     pass
+    '''
+
+    def __init__(self, distributor, prefetch=2):
+        data_table = getattr(distributor, "_data_table", None)
+        super(PrefetchDistributor, self).__init__(data_table=data_table)
+        assert prefetch > 0, "The number of prefetched batches must be positive."
+        self._distributor = distributor
+        self._prefetch = prefetch
+        self._data_size = len(distributor)
+
+    def __getitem__(self, index):
+        return self._distributor[index]
+
+    def batch(self, *args, **kwargs):
+        '''
+        Returns the batches of the wrapped distributor. The arguments are
+        those of its ``batch`` method.
+        '''
+        return _prefetch(self._distributor.batch(*args, **kwargs), self._prefetch)
+
+    def split(self, *args, **kwargs):
+        for distributor in self._distributor.split(*args, **kwargs):
+            yield self.__class__(distributor, self._prefetch)
+
+    def data(self):
+        return self._distributor.data()
+
+    @property
+    def y(self):
+        return self._distributor.y
+
+    @property
+    def x(self):
+        return self._distributor.x
+
+
 class NdarrayDistributor(Distributor):
 
     '''
@@ -240,3 +368,80 @@ class TimeSeriesDistributor(NdarrayDistributor):
         assert x.ndim == 3
         assert len(x) == len(y)
         self._data_size = len(x)
+
+
+class StreamDistributor(Distributor):
+
+    '''
+    Derived class of Distributor which streams one long series in chunks
+    for truncated backpropagation through time.
+
+    The series is cut into ``batch_size`` contiguous streams, and each batch
+    holds the next ``steps`` time steps of every stream in time major order
+    ``(steps, batch_size, ...)``, the layout taken by :class:`Lstm` and
+    :class:`Gru`. Batches are views of the series, so memory use does not
+    depend on its length. Batches are never shuffled.
+
+    Args:
+        x (ndarray): Input series of the shape (T, ...).
+        y (ndarray): Target series of the shape (T, ...).
+        steps (int): Number of time steps in one batch.
+
+    >>> import numpy as np
+    >>> from renom.utility.distributor import StreamDistributor
+    >>> x = np.random.rand(1000, 3)
+    >>> y = np.random.rand(1000, 1)
+    >>> distributor = StreamDistributor(x, y, steps=20)
+    >>> batch_x, batch_y = next(distributor.batch(10))
+    >>> batch_x.shape
+    (20, 10, 3)
+    '''
+
+    def __init__(self, x, y, steps, **kwargs):
+        super(StreamDistributor, self).__init__(x=x, y=y,
+                                                data_table=kwargs.get("data_table"))
+        assert len(x) == len(y), "{} {}".format(len(x), len(y))
+        self._steps = steps
+        # Length of the series in chunks.
+        self._data_size = len(x) // steps
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.__class__(x=self._data_x[index], y=self._data_y[index],
+                                  steps=self._steps, data_table=self._data_table)
+        return super(StreamDistributor, self).__getitem__(index)
+
+    def _streams(self, data, batch_size):
+        length = len(data) // batch_size
+        data = data[:length * batch_size]
+        return data.reshape((batch_size, length) + data.shape[1:]).swapaxes(0, 1)
+
+    def batch(self, batch_size, shuffle=False, steps=None):
+        '''
+        This function returns consecutive chunks of the streams.
+
+        Args:
+            batch_size (int): Number of streams.
+            shuffle (bool): Ignored, the order of chunks is kept.
+            steps (int): Number of batches to yield. Defaults to one pass
+                over the series.
+        '''
+        x = self._streams(self._data_x, batch_size)
+        y = self._streams(self._data_y, batch_size)
+        epoch_step_size = int(np.ceil(len(x) / self._steps))
+        batchcount = epoch_step_size if steps is None else steps
+        for s in range(batchcount):
+            i = (s % epoch_step_size) * self._steps
+            yield x[i:i + self._steps], y[i:i + self._steps]
+
+    def split(self, ratio=0.8, shuffle=False):
+        '''
+        This method splits the series into a leading and a trailing part.
+
+        Args:
+            ratio (float): Ratio for dividing data.
+            shuffle (bool): Ignored, the series is kept in order.
+        '''
+        div = int(len(self._data_x) * ratio)
+        yield self[:div]
+        yield self[div:]
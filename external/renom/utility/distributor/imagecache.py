@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+import os
+import hashlib
+import tempfile
+import collections
+import numpy as np
+
+CachedImage = collections.namedtuple("CachedImage", ["pixels", "shape"])
+CachedImage.__doc__ = '''Resized pixels of an image as uint8, and the (height, width) of the
+image as decoded, which the transformation of its bounding boxes needs.'''
+
+
+class ImageCache(object):
+    '''Cache of decoded and resized images for the image distributors, so
+    that only the first epoch reads and decodes the image files.
+
+    The first tier is a least recently used cache of uint8 arrays in memory
+    limited to ``max_bytes``. The optional second tier is a directory of
+    memory mapped ``.npy`` files, which outlives the process and is shared
+    by the workers of a distributor. Entries are keyed by the path and the
+    modification time of the file, the size and the color of the images, so
+    edited files are read again.
+
+    Pixels are rounded to uint8, as they are stored in the image files.
+
+    With ``num_workers > 0`` the images are read in forked processes, each of
+    which fills a memory tier of its own of up to ``max_bytes`` and counts its
+    own lookups. Only the disk tier is shared then, and the counters and
+    ``hit_rate`` of the cache in the calling process stay 0.
+
+    Args:
+        max_bytes (int): Budget of the memory tier in bytes.
+        path (str): Directory of the disk tier. If None, images are only
+            cached in memory.
+
+    Example:
+        >>> from renom.utility.distributor import ImageClassificationDistributor, ImageCache
+        >>> dist = ImageClassificationDistributor(x_list, y_list, imsize=(224, 224),
+        ...                                       cache=ImageCache(4 << 30, path="cache"))
+    '''
+
+    def __init__(self, max_bytes=1 << 30, path=None):
+        self.max_bytes = max_bytes
+        self._path = path
+        if path is not None and not os.path.isdir(path):
+            os.makedirs(path)
+        self._images = collections.OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @property
+    def hit_rate(self):
+        '''Ratio of the lookups found in either tier.'''
+        lookups = self.hits + self.disk_hits + self.misses
+        return (self.hits + self.disk_hits) / float(lookups) if lookups else 0.
+
+    def _key(self, filename, imsize, color):
+        return (os.path.abspath(filename), os.path.getmtime(filename), tuple(imsize), color)
+
+    def _file(self, key):
+        name = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+        return os.path.join(self._path, name + ".npy")
+
+    def get(self, filename, imsize, color):
+        '''Returns the CachedImage of the file, or None if it is not cached.'''
+        key = self._key(filename, imsize, color)
+        image = self._images.get(key)
+        if image is not None:
+            self._images.move_to_end(key)
+            self.hits += 1
+            return image
+        if self._path is not None and os.path.exists(self._file(key)):
+            # The last 8 bytes of a file are the size of the decoded image.
+            data = np.load(self._file(key), mmap_mode="r")
+            shape = tuple(int(s) for s in np.array(data[-8:]).view("<u4"))
+            channels = (len(data) - 8) // (imsize[0] * imsize[1])
+            image = CachedImage(np.array(data[:-8]).reshape(tuple(imsize) + (channels, )), shape)
+            self._insert(key, image)
+            self.disk_hits += 1
+            return image
+        self.misses += 1
+        return None
+
+    def put(self, filename, imsize, color, pixels, shape):
+        '''Caches resized pixels of the file.
+
+        Args:
+            filename (str): Path of the image file.
+            imsize (tuple): Size the image is resized to.
+            color (str): Color of the image, "RGB" or "GRAY".
+            pixels (ndarray): Resized image of the shape (height, width, channel).
+            shape (tuple): (height, width) of the decoded image.
+
+        Returns:
+            (CachedImage): Cached image.
+        '''
+        key = self._key(filename, imsize, color)
+        image = CachedImage(np.rint(np.clip(pixels, 0, 255)).astype(np.uint8), tuple(shape))
+        self._insert(key, image)
+        if self._path is not None:
+            data = np.concatenate([image.pixels.reshape(-1),
+                                   np.array(shape, dtype="<u4").view(np.uint8)])
+            # Written to a temporary file first, as workers may write at once.
+            fd, tmp = tempfile.mkstemp(suffix=".npy", dir=self._path)
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, data)
+            os.replace(tmp, self._file(key))
+        return image
+
+    def _insert(self, key, image):
+        if image.pixels.nbytes > self.max_bytes:
+            return
+        if key in self._images:
+            self.nbytes -= self._images.pop(key).pixels.nbytes
+        self._images[key] = image
+        self.nbytes += image.pixels.nbytes
+        while self.nbytes > self.max_bytes:
+            self.nbytes -= self._images.popitem(last=False)[1].pixels.nbytes
+
+    def clear(self):
+        '''Drops the images cached in memory and resets the counters.'''
+        self._images.clear()
+        self.nbytes = self.hits = self.disk_hits = self.misses = 0
@@ -4,6 +4,16 @@ standard_library.install_aliases()
 import threading
 from PIL import Image
 
+COLOR_KEY = {'GRAY': 'L', 'RGB': 'RGB'}
+
+
+def read_image(filename, color="RGB"):
+    """Decodes an image file into a PIL image of the color space."""
+    img = Image.open(filename)
+    # Call load() method explicitly to let PIL to close file
+    img.load()
+    return img.convert(COLOR_KEY[color])
+
 
 class _ImageThread(threading.Thread):
 
@@ -12,16 +22,11 @@ class _ImageThread(threading.Thread):
 
         self._filenames = filenames
         self._results = results
-        color_key = {'GRAY': 'L', 'RGB': 'RGB'}
-        self._color = color_key[color]
+        self._color = color
 
     def run(self):
         for filename in self._filenames:
-            img = Image.open(filename)
-            # Call load() method explicitly to let PIL to close file
-            img.load()
-            img = img.convert(self._color)
-            self._results.append(img)
+            self._results.append(read_image(filename, self._color))
 
 
 class ImageLoader(object):
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+import queue
+import traceback
+import multiprocessing
+import numpy as np
+
+
+def _worker(distributor, slots, tasks, results):
+    # Main loop of a worker process. It processes the batches of the tasks
+    # until None is received and reports an error by sending its traceback.
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        n, slot, p, seed = task
+        try:
+            # The seed of the batch makes the augmentation independent of the
+            # worker which processes it.
+            np.random.seed(seed)
+            x, y = distributor._process_batch(p)
+            buf = np.frombuffer(slots[slot], dtype=np.float32)
+            if x.size <= buf.size:
+                np.copyto(buf[:x.size].reshape(x.shape), x)
+                results.put((n, slot, x.shape, y, None, None))
+            else:
+                # Augmentations which enlarge the images do not fit the slot.
+                results.put((n, slot, x.shape, y, x, None))
+        except Exception:
+            results.put((n, slot, None, None, None, traceback.format_exc()))
+
+
+class ImagePool(object):
+    '''Persistent processes which read, resize and augment the batches of an
+    image distributor into shared memory slots. The processes are forked,
+    so they hold a copy of the distributor as it is when the pool is created.
+
+    Args:
+        distributor (ImageDistributor): Distributor whose ``_process_batch``
+            the workers call.
+        num_workers (int): Number of processes.
+        num_slots (int): Number of batches processed ahead.
+        slot_size (int): Number of float32 values of a slot.
+    '''
+
+    def __init__(self, distributor, num_workers, num_slots, slot_size):
+        context = multiprocessing.get_context("fork")
+        self._slots = [context.RawArray("f", slot_size) for _ in range(num_slots)]
+        self._tasks = context.Queue()
+        self._results = context.Queue()
+        self._processes = []
+        for _ in range(num_workers):
+            process = context.Process(target=_worker,
+                                      args=(distributor, self._slots, self._tasks, self._results))
+            process.daemon = True
+            process.start()
+            self._processes.append(process)
+
+    @property
+    def num_slots(self):
+        return len(self._slots)
+
+    def _get(self):
+        while True:
+            try:
+                return self._results.get(timeout=1)
+            except queue.Empty:
+                if not all(process.is_alive() for process in self._processes):
+                    raise RuntimeError("An image worker exited.")
+
+    def map(self, batches, seeds):
+        '''Yields the (x, y) pairs of the batches in order. At most
+        ``num_slots`` batches are processed at a time.
+
+        Args:
+            batches (list): Indices of the samples of every batch.
+            seeds (list): Seeds of np.random of every batch.
+        '''
+        free = list(range(self.num_slots))
+        done = {}
+        submitted = 0
+        try:
+            for n in range(len(batches)):
+                while free and submitted < len(batches):
+                    self._tasks.put((submitted, free.pop(), batches[submitted], seeds[submitted]))
+                    submitted += 1
+                while n not in done:
+                    m, slot, shape, y, x, error = self._get()
+                    done[m] = (slot, shape, y, x, error)
+                # Errors are raised in the order of the batches, so a caller
+                # which stops early does not see those of later batches.
+                slot, shape, y, x, error = done.pop(n)
+                if error is not None:
+                    free.append(slot)
+                    raise RuntimeError("An image worker failed.\n" + error)
+                if x is None:
+                    x = np.frombuffer(self._slots[slot], dtype=np.float32,
+                                      count=int(np.prod(shape))).reshape(shape).copy()
+                free.append(slot)
+                yield x, y
+        finally:
+            # Waits for the batches in flight, so the next pass starts clean.
+            while len(free) + len(done) < self.num_slots:
+                free.append(self._get()[1])
+
+    def close(self):
+        for _ in self._processes:
+            self._tasks.put(None)
+        for process in self._processes:
+            process.join()
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+from __future__ import division
+import os
+import glob
+import itertools
+import numpy as np
+
+from renom.config import precision
+from renom.utility.distributor.distributor import Distributor
+
+
+def _shard_path(path, name, index):
+    return os.path.join(path, "{}_{:05d}.npy".format(name, index))
+
+
+def _rechunk(chunks, size):
+    # Cuts a sequence of (x, y) chunks into chunks of ``size`` samples.
+    pending = []
+    count = 0
+    for x, y in chunks:
+        assert len(x) == len(y), "{} {}".format(len(x), len(y))
+        start = 0
+        while start < len(x):
+            stop = min(len(x), start + size - count)
+            pending.append((x[start:stop], y[start:stop]))
+            count += stop - start
+            start = stop
+            if count == size:
+                yield pending
+                pending = []
+                count = 0
+    if pending:
+        yield pending
+
+
+def save_shards(path, chunks, shard_size=65536, dtype=precision):
+    '''Writes samples as ``.npy`` shards of ``shard_size`` samples into the
+    directory ``path``, which :class:`MemmapDistributor` reads. Only one shard
+    is held in memory at a time.
+
+    Args:
+        path (str): Directory of the shards. It is created if needed.
+        chunks (iterable): Pairs of input and target arrays, e.g. the blocks
+            of rows of files too large for memory.
+        shard_size (int): Number of samples of a shard.
+        dtype: Data type the samples are saved in.
+
+    Returns:
+        (MemmapDistributor): Distributor of the shards.
+
+    >>> import numpy as np
+    >>> from renom.utility.distributor import save_shards
+    >>> x = np.random.rand(1000, 32)
+    >>> y = np.random.rand(1000, 32)
+    >>> distributor = save_shards("train", [(x, y)], shard_size=256)
+    '''
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    for name in ("x", "y"):
+        for filename in glob.glob(os.path.join(path, name + "_*.npy")):
+            os.remove(filename)
+    for i, pieces in enumerate(_rechunk(chunks, shard_size)):
+        for name, k in (("x", 0), ("y", 1)):
+            shard = np.concatenate([np.asarray(p[k], dtype=dtype) for p in pieces])
+            np.save(_shard_path(path, name, i), shard)
+    return MemmapDistributor(path)
+
+
+def _mat_rows(filename, key, size):
+    # Yields blocks of rows of a matrix of a .mat file. MATLAB 7.3 files are
+    # HDF5 files whose matrices are read block by block, older ones are
+    # loaded whole by scipy.
+    try:
+        import scipy.io
+        data = scipy.io.loadmat(filename, variable_names=[key])[key]
+    except NotImplementedError:
+        import h5py
+        with h5py.File(filename, "r") as f:
+            # HDF5 stores the columns of MATLAB matrices as rows.
+            data = f[key]
+            for start in range(0, data.shape[-1], size):
+                yield data[..., start:start + size].T
+        return
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+def convert_mat(path, x_file, x_key, y_file, y_key, shard_size=65536, dtype=precision):
+    '''Converts the input and target matrices of .mat files to shards of
+    :class:`MemmapDistributor`. Samples are the rows of the matrices.
+
+    Args:
+        path (str): Directory of the shards.
+        x_file (str): .mat file of the input data.
+        x_key (str): Name of the input matrix.
+        y_file (str): .mat file of the target data.
+        y_key (str): Name of the target matrix.
+        shard_size (int): Number of samples of a shard.
+        dtype: Data type the samples are saved in.
+
+    Returns:
+        (MemmapDistributor): Distributor of the shards.
+
+    >>> from renom.utility.distributor import convert_mat
+    >>> distributor = convert_mat("train", "Train_inputSet_g711.mat", "inputSetNorm",
+    ...                           "Train_targetSet_g711.mat", "targetSet")
+    '''
+    chunks = zip(_mat_rows(x_file, x_key, shard_size), _mat_rows(y_file, y_key, shard_size))
+    return save_shards(path, chunks, shard_size, dtype)
+
+
+def convert_csv(path, filename, y_columns, shard_size=65536, dtype=precision, **kwargs):
+    '''Converts a CSV file to shards of :class:`MemmapDistributor`, reading
+    ``shard_size`` rows at a time.
+
+    Args:
+        path (str): Directory of the shards.
+        filename (str): CSV file of numeric columns.
+        y_columns (list): Indices of the target columns. The other columns
+            are the input data.
+        shard_size (int): Number of samples of a shard.
+        dtype: Data type the samples are saved in.
+        **kwargs: Arguments of ``pandas.read_csv``, e.g. ``header=None``.
+
+    Returns:
+        (MemmapDistributor): Distributor of the shards.
+    '''
+    import pandas as pd
+
+    def chunks():
+        for frame in pd.read_csv(filename, chunksize=shard_size, **kwargs):
+            values = frame.values
+            x_columns = [i for i in range(values.shape[1]) if i not in y_columns]
+            yield values[:, x_columns], values[:, list(y_columns)]
+    return save_shards(path, chunks(), shard_size, dtype)
+
+
+class MemmapDistributor(Distributor):
+
+    '''
+    Derived class of Distributor which reads data larger than memory from
+    ``.npy`` shards, as written by :func:`save_shards`.
+
+    Shuffling is local to the shards. The order of the shards is shuffled,
+    then every shard is read sequentially into memory and its samples are
+    shuffled there, so memory use is about that of two shards whatever the
+    size of the data. ``x`` and ``y`` are lists of memory maps of the shards.
+
+    Args:
+        path (str): Directory of the shards.
+        shards (list): Indices of the shards to read. Defaults to all of them.
+
+    >>> from renom.utility.distributor import MemmapDistributor
+    >>> distributor = MemmapDistributor("train")
+    >>> for batch_x, batch_y in distributor.batch(64, prefetch=2):
+    ...     pass
+    '''
+
+    def __init__(self, path, shards=None, **kwargs):
+        if shards is None:
+            shards = range(len(glob.glob(os.path.join(path, "x_*.npy"))))
+        self._shards = list(shards)
+        x = [np.load(_shard_path(path, "x", i), mmap_mode="r") for i in self._shards]
+        y = [np.load(_shard_path(path, "y", i), mmap_mode="r") for i in self._shards]
+        super(MemmapDistributor, self).__init__(x=x, y=y, path=path,
+                                                data_table=kwargs.get("data_table"))
+        for x_, y_ in zip(x, y):
+            assert len(x_) == len(y_), "{} {}".format(len(x_), len(y_))
+        self._offsets = np.cumsum([0] + [len(x_) for x_ in x])
+        self._data_size = int(self._offsets[-1])
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            index = np.arange(self._data_size)[index]
+            shards = np.searchsorted(self._offsets, index, side="right") - 1
+            x, y = [], []
+            for i in np.unique(shards):
+                rows = index[shards == i] - self._offsets[i]
+                x.append(self._data_x[i][rows])
+                y.append(self._data_y[i][rows])
+            return np.concatenate(x), np.concatenate(y)
+        index = range(self._data_size)[index]
+        i = int(np.searchsorted(self._offsets, index, side="right")) - 1
+        return self._data_x[i][index - self._offsets[i]], self._data_y[i][index - self._offsets[i]]
+
+    def _batch(self, batch_size, shuffle, steps):
+        return self._stream(batch_size, shuffle, steps)
+
+    def _gather(self, batch_size, shuffle, steps, num_buffers):
+        # Batches are new arrays, so no ring of buffers is needed.
+        return self._stream(batch_size, shuffle, steps)
+
+    def _stream(self, batch_size, shuffle, steps):
+        epoch_step_size = int(np.ceil(self._data_size / batch_size))
+        batchcount = epoch_step_size if steps is None else steps
+        # The permutations are drawn from a generator seeded by the caller, so
+        # they do not depend on the thread reading the shards.
+        rng = np.random.RandomState(np.random.randint(2**31 - 1)) if shuffle else None
+        passes = (self._pass(batch_size, rng) for _ in itertools.count())
+        return itertools.islice(itertools.chain.from_iterable(passes), batchcount)
+
+    def _pass(self, batch_size, rng):
+        order = range(len(self._shards)) if rng is None else rng.permutation(len(self._shards))
+        rest_x, rest_y = [], []
+        count = 0
+        for i in order:
+            # np.load reads the shard sequentially into memory, unlike the
+            # memory map whose pages would stay resident.
+            x = np.load(_shard_path(self._folder_path, "x", self._shards[i]))
+            y = np.load(_shard_path(self._folder_path, "y", self._shards[i]))
+            perm = None if rng is None else rng.permutation(len(x))
+            start = 0
+            while start < len(x):
+                stop = min(len(x), start + batch_size - count)
+                rows = slice(start, stop) if perm is None else perm[start:stop]
+                # Copies, so that a batch does not keep its shard in memory.
+                rest_x.append(np.array(x[rows]))
+                rest_y.append(np.array(y[rows]))
+                count += stop - start
+                start = stop
+                if count == batch_size:
+                    yield self._join(rest_x), self._join(rest_y)
+                    rest_x, rest_y = [], []
+                    count = 0
+        if count:
+            yield self._join(rest_x), self._join(rest_y)
+
+    @staticmethod
+    def _join(arrays):
+        return arrays[0] if len(arrays) == 1 else np.concatenate(arrays)
+
+    def split(self, ratio=0.8, shuffle=True):
+        '''
+        This method splits the shards and generates 2 distributors using them.
+
+        Args:
+            ratio (float): Ratio of the shards of the first distributor.
+            shuffle (bool): If True, the shards are shuffled before dividing.
+        '''
+        perm = np.random.permutation(len(self._shards)) if shuffle else np.arange(len(self._shards))
+        div = int(round(len(self._shards) * ratio))
+        for p in (perm[:div], perm[div:]):
+            yield self.__class__(self._folder_path, shards=[self._shards[i] for i in sorted(p)],
+                                 data_table=self._data_table)
@@ -2,8 +2,11 @@
 from __future__ import division
 import numpy as np
 
-from renom.utility.distributor.imageloader import ImageLoader
-from renom.utility.image.data_augmentation.resize import resize
+from renom.core.layout import NCHW, check_data_format
+from renom.utility.distributor.imagecache import CachedImage
+from renom.utility.distributor.imageloader import ImageLoader, read_image
+from renom.utility.distributor.imagepool import ImagePool
+from renom.utility.image.data_augmentation.resize import Resize, resize
 from .utilities import make_ndarray
 
 
@@ -21,9 +24,24 @@ class ImageDistributor(object):
         imsize (tuple): Resize input image for converting batch ndarray.
         color (str): Color of Input Image. ["RGB", "GRAY"]
         augmentation (function): Augmentater for input Image.
+        data_format (str): Layout of the batches, "NCHW" or "NHWC". Decoded images
+            are HWC, so NHWC batches are not transposed. If None is given, the
+            default set by ``rm.set_data_format`` is used.
+        num_workers (int): Number of processes which read, resize and augment
+            the batches into shared memory. The processes are forked at the
+            first batch and kept until ``close`` is called. Each batch seeds
+            np.random with its own seed, so the augmentation does not depend
+            on the number of workers. With 0, images are read by threads and
+            processed in the calling process.
+        prefetch (int): Number of batches processed ahead by the workers.
+            Defaults to twice the number of workers.
+        cache (ImageCache): Cache of the resized images. The augmentation then
+            runs on cached pixels. Each worker process has its own memory
+            tier, while the disk tier is shared.
     """
 
-    def __init__(self, image_path_list, y_list=None, class_list=None, imsize=(32, 32), color="RGB", augmentation=None):
+    def __init__(self, image_path_list, y_list=None, class_list=None, imsize=(32, 32), color="RGB",
+                 augmentation=None, data_format=None, num_workers=0, prefetch=None, cache=None):
         self._data_table = image_path_list
         self._data_size = len(image_path_list)
         self._data_y = y_list
@@ -31,10 +49,93 @@ class ImageDistributor(object):
         self._imsize = imsize
         self._color = color
         self._augmentation = augmentation
+        self._data_format = check_data_format(data_format)
+        self._num_workers = num_workers
+        self._prefetch = prefetch or 2 * num_workers
+        self._pool = None
+        self._cache = cache
 
     def __len__(self):
         return self._data_size
 
+    def _batches(self, batch_size, shuffle):
+        # Yields the (x, y) pairs of the batches of an epoch.
+        if shuffle:
+            perm = np.random.permutation(self._data_size)
+        else:
+            perm = np.arange(self._data_size)
+        batches = [perm[i * batch_size:(i + 1) * batch_size]
+                   for i in range(int(np.ceil(self._data_size / batch_size)))]
+
+        if self._num_workers:
+            if self._pool is None:
+                channels = 1 if self._color == "GRAY" else 3
+                slot_size = batch_size * self._imsize[0] * self._imsize[1] * channels
+                self._pool = ImagePool(self, self._num_workers, self._prefetch, slot_size)
+            seeds = np.random.randint(2**31 - 1, size=len(batches))
+            for x, y in self._pool.map(batches, seeds):
+                yield x, y
+            return
+
+        if self._cache is not None:
+            # Cached images are neither read nor decoded.
+            for p in batches:
+                yield self._process_batch(p)
+            return
+
+        imgfiles = [[self._data_table[p] for p in b] for b in batches]
+        loader = ImageLoader(imgfiles, self._color)
+        for p, imgs in zip(batches, loader.wait_images()):
+            yield self._load_batch(p, imgs)
+
+    def _process_batch(self, p):
+        # Reads the images of a batch, which the workers call.
+        return self._load_batch(p, [self._read(self._data_table[i]) for i in p])
+
+    def _read(self, filename):
+        if self._cache is None:
+            return read_image(filename, self._color)
+        img = self._cache.get(filename, self._imsize, self._color)
+        if img is None:
+            decoded = read_image(filename, self._color)
+            img = self._cache.put(filename, self._imsize, self._color, self._resize(decoded)[0],
+                                  (decoded.height, decoded.width))
+        return img
+
+    def _load_batch(self, p, imgs):
+        """Resizes and augments the decoded images of the samples ``p`` and
+        returns the batch and its labels, or None if there is no label."""
+        raise NotImplementedError
+
+    def _resize(self, img, labels=None):
+        if isinstance(img, CachedImage):
+            x = img.pixels[np.newaxis].astype(np.float32)
+            if labels is None:
+                return x
+            labels = Resize(self._imsize)._labels_transform(
+                labels, len(self._class_list), img.shape)
+            return x, labels
+        if self._color == "GRAY":
+            img = np.array(img, dtype=np.float32)[:, :, np.newaxis]
+        else:
+            img = np.array(img, dtype=np.float32)
+        if labels is None:
+            return resize(img, size=self._imsize)
+        return resize(img, size=self._imsize, labels=labels, num_class=len(self._class_list))
+
+    def close(self):
+        """Stops the worker processes."""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool = None
+
+    def _to_batch(self, imgs):
+        # Stacks the HWC images into a batch of the data format.
+        imgs = np.array(imgs, dtype=np.float32)
+        if self._data_format == NCHW:
+            imgs = imgs.transpose(0, 3, 1, 2)
+        return imgs
+
 
 class ImageDetectionDistributor(ImageDistributor):
     """Distributor class for tasks of image detection.
@@ -49,6 +150,10 @@ class ImageDetectionDistributor(ImageDistributor):
         imsize (tuple): resize input image for converting batch ndarray
         color (str): color of Input Image. ["RGB", "GRAY"]
         augmentation (function): augmentater for Input Image
+        data_format (str): layout of the batches, "NCHW" or "NHWC"
+        num_workers (int): number of processes which read and augment the images
+        prefetch (int): number of batches processed ahead by the workers
+        cache (ImageCache): cache of the resized images
 
     :Example:
         >>> from renom.utility.load.imageloader.threadingdistributor import ImageDetectionDistributor
@@ -71,10 +176,14 @@ class ImageDetectionDistributor(ImageDistributor):
     """
 
     def __init__(self, image_path_list, y_list=None, class_list=None, imsize=(360, 360),
-                 color='RGB', augmentation=None):
+                 color='RGB', augmentation=None, data_format=None, num_workers=0, prefetch=None,
+                 cache=None):
         super(ImageDetectionDistributor, self).__init__(image_path_list, y_list=y_list,
                                                         class_list=class_list, imsize=imsize,
-                                                        color=color, augmentation=augmentation)
+                                                        color=color, augmentation=augmentation,
+                                                        data_format=data_format,
+                                                        num_workers=num_workers, prefetch=prefetch,
+                                                        cache=cache)
 
         if self._data_y is not None:
             self._data_y, _ = make_ndarray(self._data_y, len(self._class_list))
@@ -88,46 +197,32 @@ class ImageDetectionDistributor(ImageDistributor):
             (ndarray): Images(4 dimension) of input data for Network.
               If including labels, return with transformed labels
         """
-        if shuffle:
-            perm = np.random.permutation(self._data_size)
-        else:
-            perm = np.arange(self._data_size)
-        batches = [perm[i * batch_size:(i + 1) * batch_size]
-                   for i in range(int(np.ceil(self._data_size / batch_size)))]
-
-        imgfiles = [[self._data_table[p] for p in b] for b in batches]
-        imgs = ImageLoader(imgfiles, self._color)
-        for p, imgs in zip(batches, imgs.wait_images()):
+        for imgs, data_y in self._batches(batch_size, shuffle):
             # Case: we are given both images and labels
-            if self._data_y is not None:
-                data_y = self._data_y[p].copy()
-                for index, img in enumerate(imgs):
-                    label = np.array([data_y[index]], dtype=np.float32)
-                    if self._color == "GRAY":
-                        img = np.array(img, dtype=np.float32)[:, :, np.newaxis]
-                    else:
-                        img = np.array(img, dtype=np.float32)
-                    image, data_y[index] = resize(
-                        img, size=self._imsize, labels=label, num_class=len(self._class_list))
-                    imgs[index] = image[0]
-                if self._augmentation is not None:
-                    imgs, data_y = self._augmentation.create(
-                        np.array(imgs, dtype=np.float32), labels=data_y, num_class=len(self._class_list))
-                imgs = np.array(imgs, dtype=np.float32).transpose((0, 3, 1, 2))
+            if data_y is not None:
                 yield imgs, data_y
             # Case: we are only given images
             else:
-                for index, img in enumerate(imgs):
-                    if self._color == "GRAY":
-                        img = np.array(img, dtype=np.float32)[:, :, np.newaxis]
-                    else:
-                        img = np.array(img, dtype=np.float32)
-                    imgs[index] = resize(img, size=self._imsize)[0]
-                if self._augmentation is not None:
-                    imgs = self._augmentation.create(np.array(imgs, dtype=np.float32))
-                imgs = np.array(imgs, dtype=np.float32).transpose((0, 3, 1, 2))
                 yield imgs
 
+    def _load_batch(self, p, imgs):
+        if self._data_y is not None:
+            data_y = self._data_y[p].copy()
+            for index, img in enumerate(imgs):
+                label = np.array([data_y[index]], dtype=np.float32)
+                image, data_y[index] = self._resize(img, label)
+                imgs[index] = image[0]
+            if self._augmentation is not None:
+                imgs, data_y = self._augmentation.create(np.array(imgs, dtype=np.float32),
+                                                         labels=data_y,
+                                                         num_class=len(self._class_list))
+            return self._to_batch(imgs), data_y
+        for index, img in enumerate(imgs):
+            imgs[index] = self._resize(img)[0]
+        if self._augmentation is not None:
+            imgs = self._augmentation.create(np.array(imgs, dtype=np.float32))
+        return self._to_batch(imgs), None
+
 
 class ImageClassificationDistributor(ImageDistributor):
     """Distributor class for tasks of image classification.
@@ -140,6 +235,10 @@ class ImageClassificationDistributor(ImageDistributor):
         imsize (tuple): resize input image for converting batch ndarray
         color (str): color of Input Image. ["RGB", "GRAY"]
         augmentation: (function) augmentater for Input Image
+        data_format (str): layout of the batches, "NCHW" or "NHWC"
+        num_workers (int): number of processes which read and augment the images
+        prefetch (int): number of batches processed ahead by the workers
+        cache (ImageCache): cache of the resized images
 
     Example:
         >>> from renom.utility.load.imageloader.threadingdistributor import ImageClassificationDistributor
@@ -162,10 +261,14 @@ class ImageClassificationDistributor(ImageDistributor):
     """
 
     def __init__(self, image_path_list, y_list=None, class_list=None,
-                 imsize=(360, 360), color='RGB', augmentation=None):
+                 imsize=(360, 360), color='RGB', augmentation=None, data_format=None,
+                 num_workers=0, prefetch=None, cache=None):
         super(ImageClassificationDistributor, self).__init__(image_path_list, y_list=y_list,
                                                              class_list=class_list, imsize=imsize,
-                                                             color=color, augmentation=augmentation)
+                                                             color=color, augmentation=augmentation,
+                                                             data_format=data_format,
+                                                             num_workers=num_workers,
+                                                             prefetch=prefetch, cache=cache)
 
     def batch(self, batch_size, shuffle):
         """
@@ -174,29 +277,13 @@ class ImageClassificationDistributor(ImageDistributor):
         Returns:
             (ndarray): Images(4 dimension) of input data for Network. If including labels, return with original labels
         """
-        if shuffle:
-            perm = np.random.permutation(self._data_size)
-        else:
-            perm = np.arange(self._data_size)
-        batches = [perm[i * batch_size:(i + 1) * batch_size]
-                   for i in range(int(np.ceil(self._data_size / batch_size)))]
-
-        imgfiles = [[self._data_table[p] for p in b] for b in batches]
-        labels = [[self._data_y[p] for p in b] for b in batches]
-
-        imgs = ImageLoader(imgfiles, self._color)
-
-        for lbls, imgs in zip(labels, imgs.wait_images()):
-            for index, img in enumerate(imgs):
-                if self._color == "GRAY":
-                    img = np.array(img, dtype=np.float32)[:, :, np.newaxis]
-                else:
-                    img = np.array(img, dtype=np.float32)
-                imgs[index] = resize(img, size=self._imsize)[0]
-            if self._augmentation is not None:
-                imgs = self._augmentation.create(np.array(imgs, dtype=np.float32))
-            lbls = np.array(lbls)
-            imgs = np.array(imgs, dtype=np.float32).transpose(0, 3, 1, 2)
-            if self._data_y is None:
-                yield imgs
+        for imgs, lbls in self._batches(batch_size, shuffle):
             yield imgs, lbls
+
+    def _load_batch(self, p, imgs):
+        for index, img in enumerate(imgs):
+            imgs[index] = self._resize(img)[0]
+        if self._augmentation is not None:
+            imgs = self._augmentation.create(np.array(imgs, dtype=np.float32))
+        lbls = np.array([self._data_y[i] for i in p])
+        return self._to_batch(imgs), lbls
@@ -620,21 +620,23 @@ def build_yolo_labels(y, total_w, total_h, cells, classes):
         (cell 0,1 has no object)
     """
 
-    truth = np.zeros((y.shape[0], cells, cells, 5 + classes))
-    for im in range(y.shape[0]):
-        for obj in range(0, y.shape[1], 4 + classes):
-            truth_classes = y[im, obj + 4:obj + 4 + classes]
-            if np.all(truth_classes == 0):
-                continue
-            truth_x = y[im, obj]
-            truth_y = y[im, obj + 1]
-            truth_w = y[im, obj + 2]
-            truth_h = y[im, obj + 3]
-            norm_x = truth_x * .99 * cells / total_w
-            norm_y = truth_y * .99 * cells / total_h
-            norm_w = truth_w / total_w
-            norm_h = truth_h / total_h
-            truth[im, int(norm_y), int(norm_x)] = np.concatenate(
-                ([1, norm_x % 1, norm_y % 1, norm_w, norm_h], truth_classes))
-    truth = truth.reshape(y.shape[0], -1)
+    n = y.shape[0]
+    objects = y.reshape(n, -1, 4 + classes)
+    truth_classes = objects[:, :, 4:]
+    norm_x = objects[:, :, 0] * .99 * cells / total_w
+    norm_y = objects[:, :, 1] * .99 * cells / total_h
+    norm_w = objects[:, :, 2] / total_w
+    norm_h = objects[:, :, 3] / total_h
+    labels = np.concatenate([np.stack([np.ones_like(norm_x), norm_x % 1, norm_y % 1,
+                                       norm_w, norm_h], axis=2), truth_classes], axis=2)
+
+    # Rows without a class are padding. A later object of the same cell
+    # replaces the former ones.
+    im, obj = np.nonzero(np.any(truth_classes != 0, axis=2))
+    cell = (im * cells + norm_y[im, obj].astype(int)) * cells + norm_x[im, obj].astype(int)
+    last = len(cell) - 1 - np.unique(cell[::-1], return_index=True)[1]
+
+    truth = np.zeros((n * cells * cells, 5 + classes))
+    truth[cell[last]] = labels[im[last], obj[last]]
+    truth = truth.reshape(n, -1)
     return truth
@@ -1,8 +1,13 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import warnings
+import threading
+import contextlib
 import numpy as np
 from renom.cuda import use_device, is_cuda_active
-from renom.core import Node
+from renom.core import Node, no_grad
+from renom.core.pool import BufferPool, use_buffer_pool
+from renom.utility.data_parallel import WorkerPool, build, data_parallel_step, fork_context
 
 
 class _EventHandlers(object):
@@ -70,9 +75,17 @@ def default_event_end_epoch(trainer):
 
     if test_distributor:
         trainer.model.set_models(inference=True)
-        for i, (data, target) in enumerate(test_distributor.batch(trainer.batch_size, trainer.shuffle)):
-            test_loss = trainer.loss_func(trainer.model(data), target).as_ndarray()
-            avg_test_loss += (test_loss - avg_test_loss) / (i + 1)
+        if trainer.stateful:
+            trainer.model.truncate()
+        with no_grad():
+            batches = test_distributor.batch(trainer.batch_size, trainer.shuffle)
+            for i, (data, target) in enumerate(batches):
+                test_loss = trainer.loss_func(trainer.model(data), target).as_ndarray()
+                avg_test_loss += (test_loss - avg_test_loss) / (i + 1)
+                if trainer.stateful:
+                    trainer.model.truncate(keep_state=True)
+        if trainer.stateful:
+            trainer.model.truncate()
         msg = "epoch%3d: avg loss %6.4f: avg test loss %6.4f" % \
             (epoch, avg_train_loss, avg_test_loss)
         trainer.model.set_models(inference=False)
@@ -113,6 +126,27 @@ class Trainer(object):
         optimizer (Optimizer): Gradient descent algorithm.
         shuffle (bool): If it's true, mini batch is created randomly.
         events (dict): Dictionary of function.
+        stateful (bool): If True, hidden states of recurrent layers are
+            carried over from one batch to the next, and their temporal
+            connections are truncated after every update. This trains a long
+            series streamed by :class:`StreamDistributor` with truncated
+            backpropagation through time. States are reset at the start of
+            every epoch.
+        num_workers (int): Number of processes of data parallel training on
+            CPU. Replicas of the model are forked before the first batch, every
+            process takes a shard of each batch, and the gradients are averaged
+            through shared memory. Random streams draw the numbers of the samples of their shard, so
+            the training follows that of one process. Moving statistics such as
+            those of BatchNormalize are averaged over the shards. Sparse
+            gradients are averaged as dense arrays, so the optimizers update
+            every row of an Embedding, not only the rows found in the batch. The
+            events are handled in the first process, which updates the
+            parameters and sends them to the others. Batches with fewer samples
+            than workers are skipped. Platforms which cannot fork, such as
+            Windows, train in one process.
+        buffer_pool (bool): If True, the CPU temporaries of the iterations are
+            drawn from a buffer pool owned by the trainer, which is released
+            when ``train`` returns. The default buffer pool is not touched.
 
     Example:
         >>> import numpy as np
@@ -138,7 +172,15 @@ class Trainer(object):
     """
 
     def __init__(self, model, num_epoch, loss_func, batch_size,
-                 optimizer=None, shuffle=True, events=None, num_gpu=1, regularization=None):
+                 optimizer=None, shuffle=True, events=None, num_gpu=1, regularization=None,
+                 stateful=False, num_workers=1, buffer_pool=False):
+        assert not (stateful and num_gpu > 1), "A stateful trainer runs on a single gpu."
+        assert num_workers == 1 or (num_gpu == 1 and not stateful), \
+            "Worker processes train a stateless model on CPU."
+        if num_workers > 1 and fork_context() is None:
+            warnings.warn("Data parallel workers are forked processes, which this platform "
+                          "does not support. The model is trained in one process.")
+            num_workers = 1
 
         self.model = model
         self.num_epoch = num_epoch
@@ -148,13 +190,16 @@ class Trainer(object):
         self.regularization = regularization
         self.shuffle = shuffle
         self.num_gpu = num_gpu
+        self.stateful = stateful
+        self.num_workers = num_workers
+        self.buffer_pool = BufferPool() if buffer_pool else None
         self.train_loss_list = []
         self.test_loss_list = []
 
         if events:
             self._events = events.copy()
         else:
-            self._events = DEFAULT_EVENTS
+            self._events = DEFAULT_EVENTS.copy()
 
         self.events = _EventHandlers(self._events)
 
@@ -187,77 +232,109 @@ class Trainer(object):
             for n in range(self.num_gpu):
                 models[n].set_gpu(n)
 
+        self._workers = None
+        try:
+            if self.num_workers > 1:
+                self._start_workers()
+            self._train_epochs(models)
+        finally:
+            if self._workers is not None:
+                self._workers.close()
+                self._workers = None
+            if self.buffer_pool is not None:
+                self.buffer_pool.release()
+
+    def _train_epochs(self, models):
         while self.epoch < self.num_epoch:
             self.on_event('start_epoch')
             self.nth = 0
             self.avg_train_loss = 0
-
-            for iteration, (data, target) in enumerate(self.train_distributor.batch(self.batch_size, self.shuffle)):
-                datalen = len(data) // len(models)
-                if not datalen:
-                    continue
-                self.data = [data[i:i + datalen] for i in range(0, datalen * len(models), datalen)]
-                if is_cuda_active():
-                    self.data = [Node(d) if not isinstance(d, Node) else d for d in self.data]
-                    for n, d in enumerate(self.data):
-                        if not d._gpu:
-                            with use_device(n):
-                                d.to_gpu()
-
-                targetlen = len(target) // len(models)
-                self.targets = [target[i:i + targetlen]
-                                for i in range(0, targetlen * len(models), targetlen)]
-                if is_cuda_active():
-                    self.targets = [Node(d) if not isinstance(d, Node) else d for d in self.targets]
-                    for n, d in enumerate(self.targets):
-                        if not d._gpu:
-                            with use_device(n):
-                                d.to_gpu()
-
-                for gpu in range(1, self.num_gpu):
-                    models[gpu].copy_params(models[0])
-
-                for gpu in range(0, self.num_gpu):
-                    models[gpu].set_models(inference=False)
-
-                self.on_event('forward')
-                self.outputs = []
-
-                for gpu in range(self.num_gpu):
-                    model = models[gpu]
-                    with model.train():
-                        self.outputs.append(model(self.data[gpu]))
-
-                self.on_event('loss')
-                self.losses = []
-
-                for gpu in range(self.num_gpu):
-                    model = models[gpu]
-                    with use_device(gpu):
-                        loss = self.loss_func(self.outputs[gpu], self.targets[gpu])
-                        if self.regularization:
-                            loss = self.regularization(model) + loss
-                        self.losses.append(loss)
-                self.avg_train_loss += (self.losses[0] -
-                                        self.avg_train_loss) / (iteration + 1)
-
-                self.on_event('backward')
-                self.grads = []
-
-                for gpu in range(self.num_gpu):
-                    model = models[gpu]
-                    with use_device(gpu):
-                        self.grads.append(self.losses[gpu].grad())
-
-                self.on_event('grad')
-
-                if self.num_gpu > 1:
-                    models[0].join_grads(self.grads[0], zip(models[1:], self.grads[1:]))
-
-                self.grads[0].update(self.optimizer)
-
-                self.on_event('updated')
-                self.nth += 1
+            if self.stateful:
+                self.model.truncate()
+
+            # Temporaries of every iteration are drawn from the buffer pool,
+            # so that steady state steps hardly allocate large arrays.
+            with contextlib.ExitStack() as stack:
+                if self.buffer_pool is not None:
+                    stack.enter_context(use_buffer_pool(pool=self.buffer_pool))
+                batches = self.train_distributor.batch(self.batch_size, self.shuffle)
+                for iteration, (data, target) in enumerate(batches):
+                    if self.num_workers > 1:
+                        if len(data) >= self.num_workers:
+                            self._data_parallel_step(iteration, data, target)
+                        continue
+
+                    datalen = len(data) // len(models)
+                    if not datalen:
+                        continue
+                    self.data = [data[i:i + datalen]
+                                 for i in range(0, datalen * len(models), datalen)]
+                    if is_cuda_active():
+                        self.data = [Node(d) if not isinstance(d, Node) else d for d in self.data]
+                        for n, d in enumerate(self.data):
+                            if not d._gpu:
+                                with use_device(n):
+                                    d.to_gpu()
+
+                    targetlen = len(target) // len(models)
+                    self.targets = [target[i:i + targetlen]
+                                    for i in range(0, targetlen * len(models), targetlen)]
+                    if is_cuda_active():
+                        self.targets = [Node(d) if not isinstance(d, Node) else d
+                                        for d in self.targets]
+                        for n, d in enumerate(self.targets):
+                            if not d._gpu:
+                                with use_device(n):
+                                    d.to_gpu()
+
+                    for gpu in range(1, self.num_gpu):
+                        models[gpu].copy_params(models[0])
+
+                    for gpu in range(0, self.num_gpu):
+                        models[gpu].set_models(inference=False)
+
+                    self.on_event('forward')
+                    self.outputs = []
+
+                    for gpu in range(self.num_gpu):
+                        model = models[gpu]
+                        with model.train():
+                            self.outputs.append(model(self.data[gpu]))
+
+                    self.on_event('loss')
+                    self.losses = []
+
+                    for gpu in range(self.num_gpu):
+                        model = models[gpu]
+                        with use_device(gpu):
+                            loss = self.loss_func(self.outputs[gpu], self.targets[gpu])
+                            if self.regularization:
+                                loss = self.regularization(model) + loss
+                            self.losses.append(loss)
+                    # The average is kept as a value, so that it does not
+                    # chain the graphs of all iterations together.
+                    self.avg_train_loss += (self.losses[0].as_ndarray() -
+                                            self.avg_train_loss) / (iteration + 1)
+
+                    self.on_event('backward')
+                    self.grads = []
+
+                    for gpu in range(self.num_gpu):
+                        model = models[gpu]
+                        with use_device(gpu):
+                            self.grads.append(self.losses[gpu].grad())
+
+                    self.on_event('grad')
+
+                    if self.num_gpu > 1:
+                        models[0].join_grads(self.grads[0], zip(models[1:], self.grads[1:]))
+
+                    self.grads[0].update(self.optimizer)
+                    if self.stateful:
+                        self.model.truncate(keep_state=True)
+
+                    self.on_event('updated')
+                    self.nth += 1
 
             self.on_event('end_epoch')
             self.epoch += 1
@@ -267,6 +344,35 @@ class Trainer(object):
             self.outputs = self.losses = self.grads = None
             self.avg_train_loss = None
 
+    def _start_workers(self):
+        # The workers are forked before the batches are drawn, while no thread
+        # of a prefetching distributor runs. The first batch builds the model
+        # and the random state is restored, so that the epochs draw it again.
+        state = np.random.get_state()
+        batches = self.train_distributor.batch(self.batch_size, self.shuffle)
+        try:
+            data, _ = next(iter(batches))
+        finally:
+            if hasattr(batches, "close"):
+                batches.close()
+        np.random.set_state(state)
+        build(self.model, data[:max(len(data) // self.num_workers, 1)])
+        self._workers = WorkerPool(self, self.model, self.num_workers)
+
+    def _data_parallel_step(self, iteration, data, target):
+        workers = self._workers
+        workers.scatter(data, target)
+        lo, hi = workers.split(len(data))[0]
+        self.data, self.targets = [data[lo:hi]], [target[lo:hi]]
+        try:
+            batch_loss = data_parallel_step(self, self.model, 0, self.data[0], self.targets[0],
+                                            lo, len(data), workers.allreduce, self.on_event)
+        except threading.BrokenBarrierError:
+            workers.raise_error()
+        self.avg_train_loss += (batch_loss - self.avg_train_loss) / (iteration + 1)
+        self.on_event('updated')
+        self.nth += 1
+
     def test(self, data):
         """Test method.
         This method executes forward propagation for given data.
@@ -280,7 +386,8 @@ class Trainer(object):
         bs = self.batch_size // self.num_gpu
         N = len(data) - 1 + bs
         self.model.set_models(inference=True)
-        ret = np.vstack([self.model(data[bs * i:bs * (i + 1)]).as_ndarray()
-                         for i in range(N // bs)])
+        with no_grad():
+            ret = np.vstack([self.model(data[bs * i:bs * (i + 1)]).as_ndarray()
+                             for i in range(N // bs)])
         self.model.set_models(inference=False)
         return ret
@@ -129,7 +129,7 @@ class build_ext(orig_build_ext):
 
 
 requires = [
-    "numpy", "scikit-image", "scikit-learn", "Cython>=0.24.0", "Pillow", "future"
+    "numpy>=1.17", "scikit-image", "scikit-learn", "Cython>=0.24.0", "Pillow", "future"
 ]
 
 
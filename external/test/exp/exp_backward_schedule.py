@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Compares the recursive and the iterative backward schedules of Grads
+on unrolled Lstm graphs.
+
+    $ python test/exp/exp_backward_schedule.py
+"""
+
+from __future__ import print_function
+import sys
+import time
+import threading
+import numpy as np
+import renom as rm
+from renom.core import Grads
+
+
+class RecursiveGrads(Grads):
+    '''Former schedule: a ready node runs its backward immediately.'''
+
+    def schedule(self, node, **kwargs):
+        node.backward(self, self.get(node), **kwargs)
+
+
+def unroll(layer, x, length):
+    layer.truncate()
+    loss = 0
+    for _ in range(length):
+        loss = loss + rm.sum(layer(x))
+    return loss
+
+
+def run(grads_class, length, batch=8, size=32):
+    layer = rm.Lstm(size, input_size=(size, ))
+    x = rm.Variable(np.random.rand(batch, size))
+    loss = unroll(layer, x, length)
+
+    start = time.time()
+    context = grads_class(loss)
+    loss._update_diff(context, np.ones_like(loss))
+    elapsed = time.time() - start
+    loss.detach_graph()
+    return elapsed
+
+
+def main():
+    sys.setrecursionlimit(1000000)
+    print("{:>8} {:>14} {:>14}".format("steps", "recursive[s]", "iterative[s]"))
+    for length in (1000, 2000, 5000, 10000):
+        try:
+            recursive = "{:14.3f}".format(run(RecursiveGrads, length))
+        except RuntimeError:
+            recursive = "{:>14}".format("overflow")
+        iterative = run(Grads, length)
+        print("{:>8} {} {:14.3f}".format(length, recursive, iterative))
+
+
+if __name__ == '__main__':
+    # The recursive schedule needs a deep C stack as well.
+    threading.stack_size(1 << 29)
+    t = threading.Thread(target=main)
+    t.start()
+    t.join()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Step time of the CIFAR-10 CNN of cifar10_cnn.py ported to renom, with a
+BatchNormalize after every convolution and the hidden dense layer. A
+training step (forward, backward and update) and an inference step are
+timed with the former batch_normalize kernels, the fused ones, and for
+inference also with the BatchNormalize layers folded into the preceding
+weights by fold_batch_normalize. The last rows time the forward and
+backward of a single BatchNormalize on the largest activation of the
+network.
+
+    $ python test/exp/exp_bn_cifar.py
+"""
+
+from __future__ import print_function
+import timeit
+import numpy as np
+import renom as rm
+from renom.core import to_value
+from renom.layers.function.batch_normalize import batch_normalize, BATCH_NORMALIZE_FEATUREMAP
+
+
+class former_batch_normalize(batch_normalize):
+    '''Former batch_normalize CPU kernels.'''
+
+    @classmethod
+    def _oper_cpu(cls, x, w, b, momentum, mov_m, mov_s, inference, mode, epsilon):
+        if mode == BATCH_NORMALIZE_FEATUREMAP:
+            axs = (0, 2, 3)
+        else:
+            axs = (0, )
+        if inference:
+            mean = mov_m
+            var = mov_s
+        else:
+            mean = np.mean(to_value(x), axis=axs, keepdims=True)
+            var = np.var(to_value(x), axis=axs, keepdims=True)
+        sq_var = 1.0 / np.sqrt(var + epsilon)
+        xh = (to_value(x) - mean) * sq_var
+        z = to_value(w) * xh
+        if b is not None:
+            z += to_value(b)
+        ret = cls._create_node(z)
+        ret.attrs._axs = axs
+        ret.attrs._x = x
+        ret.attrs._w = w
+        ret.attrs._b = b
+        ret.attrs._m = mean
+        ret.attrs._v = sq_var
+        if not inference:
+            N = np.prod([x.shape[s] for s in axs])
+            ret.attrs._mov_m = (1 - momentum) * mov_m + momentum * mean
+            ret.attrs._mov_v = (1 - momentum) * mov_s + momentum * var * N / max(N - 1., 1.)
+        return ret
+
+    def _backward_cpu(self, context, dy, **kwargs):
+        a = self.attrs._axs
+        sq_var = self.attrs._v
+        meaned = self.attrs._x - self.attrs._m
+        N = np.prod([self.attrs._x.shape[s] for s in a])
+        if isinstance(self.attrs._x, rm.Node):
+            dxh = dy * to_value(self.attrs._w)
+            ds = np.sum(dxh * meaned * -np.power(sq_var, 3) / 2, axis=a, keepdims=True)
+            du = np.sum(-dxh * sq_var, axis=a, keepdims=True)
+            dx = dxh * sq_var + (ds * 2 * meaned + du) / N
+            self.attrs._x._update_diff(context, dx, **kwargs)
+        if isinstance(self.attrs._w, rm.Node):
+            xh = meaned * sq_var
+            self.attrs._w._update_diff(context, np.sum(xh * dy, axis=a, keepdims=True), **kwargs)
+        if isinstance(self.attrs._b, rm.Node):
+            self.attrs._b._update_diff(context, np.sum(dy, axis=a, keepdims=True), **kwargs)
+
+
+class FormerBatchNormalize(rm.BatchNormalize):
+
+    def forward(self, x):
+        ret = former_batch_normalize(x, self.params["w"], self.params.get("b", None),
+                                     self._momentum, self._mov_mean, self._mov_std,
+                                     self.inference, self._mode, self._epsilon)
+        self._mov_mean = ret.attrs.get("_mov_m", self._mov_mean)
+        self._mov_std = ret.attrs.get("_mov_v", self._mov_std)
+        return ret
+
+
+def cifar10_cnn(bn, classes=10):
+    def conv(channel, padding):
+        return [rm.Conv2d(channel, filter=3, padding=padding), bn(mode="feature"), rm.Relu()]
+    return rm.Sequential(
+        conv(32, 1) + conv(32, 0) + [rm.MaxPool2d(filter=2, stride=2), rm.Dropout(0.25)] +
+        conv(64, 1) + conv(64, 0) + [rm.MaxPool2d(filter=2, stride=2), rm.Dropout(0.25)] +
+        [rm.Flatten(), rm.Dense(512), bn(), rm.Relu(), rm.Dropout(0.5), rm.Dense(classes)])
+
+
+def layer_step(layer, x):
+    def step():
+        rm.sum(layer(x)).grad().get(x)
+    return step
+
+
+def measure(func, number=5):
+    func()
+    return min(timeit.repeat(func, number=number, repeat=7)) / number * 1e3
+
+
+def main(batch_size=32):
+    x = np.random.rand(batch_size, 3, 32, 32).astype(rm.precision)
+    y = np.eye(10)[np.random.randint(10, size=batch_size)].astype(rm.precision)
+    opt = rm.Sgd(0.01, momentum=0.9)
+    print(("{:>8}" + " {:>10}" * 3).format("", "former", "fused", "folded"))
+    models = []
+    for bn in (FormerBatchNormalize, rm.BatchNormalize):
+        np.random.seed(0)
+        model = cifar10_cnn(bn)
+        model(x)
+        models.append(model)
+
+    def train(model):
+        def step():
+            with model.train():
+                loss = rm.softmax_cross_entropy(model(x), y)
+            loss.grad().update(opt)
+        return step
+
+    def infer(model):
+        return lambda: model(x)
+
+    print(("{:>8}" + " {:10.1f}" * 2).format("train", *[measure(train(m)) for m in models]))
+    for m in models:
+        m.set_models(inference=True)
+    folded = rm.fold_batch_normalize(models[1])
+    times = [measure(infer(m)) for m in models + [folded]]
+    print(("{:>8}" + " {:10.1f}" * 3).format("infer", *times))
+
+    for shape, mode in (((batch_size, 32, 32, 32), "feature"), ((batch_size, 512), "activation")):
+        v = rm.Variable(np.random.rand(*shape).astype(rm.precision))
+        times = [measure(layer_step(bn(mode=mode), v), 20)
+                 for bn in (FormerBatchNormalize, rm.BatchNormalize)]
+        print(("{:>8}" + " {:10.2f}" * 2).format(mode[:7], *times))
+
+
+if __name__ == '__main__':
+    main()
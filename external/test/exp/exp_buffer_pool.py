@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Step time and minor page faults of CPU training with and without the
+buffer pool, and the pool hits and misses of the steady state steps. The
+best of 5 runs is shown. The wide model has column tensors above the 32MB
+from which glibc maps every allocation afresh.
+
+    $ python test/exp/exp_buffer_pool.py
+"""
+
+from __future__ import print_function
+import time
+import resource
+import numpy as np
+import renom as rm
+
+
+class CnnNet(rm.Model):
+    def __init__(self):
+        super(CnnNet, self).__init__()
+        self.conv1 = rm.Conv2d(channel=32, filter=3, padding=1)
+        self.conv2 = rm.Conv2d(channel=32, filter=3, padding=1)
+        self.conv3 = rm.Conv2d(channel=64, filter=3, padding=1)
+        self.conv4 = rm.Conv2d(channel=64, filter=3, padding=1)
+        self.pool = rm.MaxPool2d(filter=2, stride=2)
+        self.dense = rm.Dense(10)
+
+    def forward(self, x):
+        h = self.pool(rm.relu(self.conv2(rm.relu(self.conv1(x)))))
+        h = self.pool(rm.relu(self.conv4(rm.relu(self.conv3(h)))))
+        return self.dense(rm.flatten(h))
+
+
+class WideNet(rm.Model):
+    def __init__(self):
+        super(WideNet, self).__init__()
+        self.conv1 = rm.Conv2d(channel=32, filter=3, padding=1)
+        self.conv2 = rm.Conv2d(channel=32, filter=3, padding=1)
+        self.pool = rm.AveragePool2d(filter=8, stride=8)
+        self.dense = rm.Dense(10)
+
+    def forward(self, x):
+        h = self.pool(rm.relu(self.conv2(rm.relu(self.conv1(x)))))
+        return self.dense(rm.flatten(h))
+
+
+class LstmNet(rm.Model):
+    def __init__(self):
+        super(LstmNet, self).__init__()
+        self.layer1 = rm.Lstm(output_size=512)
+        self.layer2 = rm.Dense(output_size=10)
+
+    def forward(self, x):
+        self.layer1.truncate()
+        for i in range(x.shape[1]):
+            ret = self.layer2(self.layer1(x[:, i]))
+        return ret
+
+
+def train(model, x, y, steps, pool):
+    opt = rm.Sgd()
+    rm.release_buffer_pool()
+    with rm.use_buffer_pool(pool):
+        for i in range(steps + 1):
+            if i == 1:
+                # The first step warms up the pool.
+                rm.get_buffer_pool().reset_counters()
+                faults = resource.getrusage(resource.RUSAGE_SELF).ru_minflt
+                start = time.time()
+            with model.train():
+                loss = rm.softmax_cross_entropy(model(x), y)
+            loss.grad().update(opt)
+    seconds = (time.time() - start) / steps
+    faults = resource.getrusage(resource.RUSAGE_SELF).ru_minflt - faults
+    return seconds, faults / steps
+
+
+def main(steps=10, repeat=5):
+    pool = rm.get_buffer_pool()
+    print("{:>6} {:>10} {:>10} {:>14} {:>14} {:>10} {:>12}".format(
+        "model", "eager[s]", "pool[s]", "eager faults", "pool faults", "hits/step",
+        "misses/step"))
+    for name, model, x in (
+            ("cnn", CnnNet(), np.random.rand(64, 3, 32, 32)),
+            ("wide", WideNet(), np.random.rand(32, 3, 64, 64)),
+            ("lstm", LstmNet(), np.random.rand(128, 28, 28))):
+        x = x.astype(rm.precision)
+        y = np.eye(10)[np.random.randint(0, 10, len(x))].astype(rm.precision)
+        # The runs alternate, so that both modes see the same load.
+        runs = [(train(model, x, y, steps, False), train(model, x, y, steps, True))
+                for _ in range(repeat)]
+        eager, pooled = min(r[0] for r in runs), min(r[1] for r in runs)
+        print("{:>6} {:10.3f} {:10.3f} {:14.0f} {:14.0f} {:10.1f} {:12.1f}".format(
+            name, eager[0], pooled[0], eager[1], pooled[1], pool.hits / steps,
+            pool.misses / steps))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Peak RSS and step time of VGG16 when its convolution blocks are
+checkpointed with Model.set_checkpoint.
+
+Each configuration runs in its own process because ru_maxrss never decreases.
+
+    $ python test/exp/exp_checkpoint.py
+"""
+
+from __future__ import print_function
+import sys
+import time
+import resource
+import subprocess
+import numpy as np
+import renom as rm
+from renom.algorithm.image.model.vgg import VGG16
+
+
+def step(num_checkpoints, batch=16, size=64, repeat=3):
+    model = VGG16()
+    x = np.random.rand(batch, 3, size, size).astype(rm.precision)
+    y = np.eye(10)[np.random.randint(0, 10, batch)].astype(rm.precision)
+    model(x[:1])
+    for block in model._layers[:num_checkpoints]:
+        block.set_checkpoint(True)
+
+    opt = rm.Sgd()
+    start = time.time()
+    for _ in range(repeat):
+        with model.train():
+            loss = rm.softmax_cross_entropy(model(x), y)
+        loss.grad().update(opt)
+    elapsed = (time.time() - start) / repeat
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, elapsed
+
+
+def main():
+    print("{:>12} {:>10} {:>10}".format("checkpoints", "peak[MB]", "step[s]"))
+    for n in range(6):
+        out = subprocess.check_output([sys.executable, __file__, str(n)])
+        peak, elapsed = out.split()[-2:]
+        print("{:>12} {:10.1f} {:10.3f}".format(n, int(peak) / 1024., float(elapsed)))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        print(*step(int(sys.argv[1])))
+    else:
+        main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Wall time of the CPU algorithms of conv2d, forward and backward, on
+the 3x3 layers of VGG at batch 16 and on 1d convolutions with long kernels
+over 4000 samples as in audio models. im2col and GEMM is the algorithm
+conv2d always used before. The last column is the algorithm the auto tuner
+picks for a training step.
+
+    $ python test/exp/exp_conv2d_algorithm.py
+"""
+
+from __future__ import print_function
+import timeit
+import numpy as np
+import renom as rm
+from renom.layers.function.conv2d_algorithm import CONV2D_ALGORITHMS, find_conv2d_algorithm
+from renom.layers.function.utils import out_size
+
+
+def measure(func, number=1):
+    func()
+    return min(timeit.repeat(func, number=number, repeat=3)) / number * 1000
+
+
+def main():
+    configs = [
+        ("vgg 64x32x32", (16, 64, 32, 32), 64, (3, 3), (1, 1)),
+        ("vgg 128x16x16", (16, 128, 16, 16), 128, (3, 3), (1, 1)),
+        ("vgg 256x8x8", (16, 256, 8, 8), 256, (3, 3), (1, 1)),
+        ("1d k=9", (16, 16, 1, 4000), 16, (1, 9), (0, 4)),
+        ("1d k=64", (16, 16, 1, 4000), 16, (1, 64), (0, 32)),
+        ("1d k=256", (16, 16, 1, 4000), 16, (1, 256), (0, 128)),
+    ]
+    names = list(CONV2D_ALGORITHMS)
+    print(("{:>14}" + " {:>17}" * len(names) + " {:>9}").format("", *(names + ["auto"])))
+    for label, shape, channel, kernel, padding in configs:
+        x = np.random.rand(*shape).astype(rm.precision)
+        w = np.random.rand(channel, shape[1], *kernel).astype(rm.precision)
+        args = (kernel, (1, 1), padding, (1, 1))
+        size = tuple(out_size(shape[2:], kernel, (1, 1), padding))
+        times = []
+        for name in names:
+            algorithm = CONV2D_ALGORITHMS[name]
+            if not algorithm.supports(kernel, (1, 1), (1, 1)):
+                times.append("-")
+                continue
+            y, state = algorithm.forward(x, w, size, *args)
+            times.append("{:8.1f}/{:8.1f}".format(
+                measure(lambda: algorithm.forward(x, w, size, *args)),
+                measure(lambda: algorithm.backward(state, x, w, y, *args))))
+        best = find_conv2d_algorithm(x, w, size, *args)
+        print(("{:>14}" + " {:>17}" * len(names) + " {:>9}").format(label, *(times + [best])))
+
+
+if __name__ == '__main__':
+    main()
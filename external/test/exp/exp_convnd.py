@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Wall time of the CPU N-d convolution and pooling kernels on 3d volumes,
+built on im2col_nd and one tensordot, compared to the former kernels which
+place the kernel at one position at a time. The last columns are the
+forward and backward times of Conv3d and MaxPoolNd on a larger batch.
+
+    $ python test/exp/exp_convnd.py
+"""
+
+from __future__ import print_function
+import timeit
+import numpy as np
+import renom as rm
+from renom.layers.function import utils
+
+
+def loop_imncol(x, w, stride, padding):
+    '''Former imncol.'''
+    x = np.pad(x, [(0, 0), (0, 0)] + [(p, p) for p in padding], mode="constant")
+    return np.array([[np.sum([utils.place_kernels(x[n, c], w[o, c], stride)
+                              for c in range(x.shape[1])], axis=0)
+                      for o in range(w.shape[0])] for n in range(x.shape[0])])
+
+
+def loop_colnim(dy, w, stride):
+    '''Former colnim.'''
+    return np.array([np.sum([[utils.place_back_kernels(dy[n, o], w[o, c], stride)
+                              for c in range(w.shape[1])] for o in range(dy.shape[1])], axis=0)
+                     for n in range(dy.shape[0])])
+
+
+def loop_colnw(x, dy, stride):
+    '''Former colnw.'''
+    return np.array([np.sum([[utils.place_overlap_kernels(x[n, c], dy[n, o], stride)
+                              for c in range(x.shape[1])] for n in range(x.shape[0])], axis=0)
+                     for o in range(dy.shape[1])])
+
+
+def loop_imnpool(x, kernel, stride):
+    '''Former imnpool without padding.'''
+    return np.array([[utils.place_pools(x[n, c], kernel, stride, utils.max_pool)
+                      for c in range(x.shape[1])] for n in range(x.shape[0])])
+
+
+def measure(func, number=1):
+    func()
+    return min(timeit.repeat(func, number=number, repeat=3)) / number * 1000
+
+
+def layer_step(layer, x):
+    def step():
+        rm.sum(layer(x)).grad().get(x)
+    return step
+
+
+def main(shape=(2, 4, 12, 12, 12), large_shape=(8, 4, 24, 24, 24), channel=8):
+    x = np.random.rand(*shape)
+    large = rm.Variable(np.random.rand(*large_shape).astype(rm.precision))
+    print(("{:>3} {:>3}" + " {:>10}" * 10).format(
+        "k", "s", "fwd_loop", "fwd_gemm", "dx_loop", "dx_gemm", "dw_loop", "dw_gemm",
+        "pool_loop", "pool_view", "conv3d", "maxpoolnd"))
+    for k in (2, 3):
+        for s in (1, 2):
+            kernel, stride, padding = (k, ) * 3, (s, ) * 3, (0, ) * 3
+            w = np.random.rand(channel, shape[1], *kernel)
+            y = utils.imncol(x, w, stride, padding)
+            times = [
+                measure(lambda: loop_imncol(x, w, stride, padding)),
+                measure(lambda: utils.imncol(x, w, stride, padding), number=10),
+                measure(lambda: loop_colnim(y, w, stride)),
+                measure(lambda: utils.colnim(y, w, stride, padding, shape[2:]), number=10),
+                measure(lambda: loop_colnw(x, y, stride)),
+                measure(lambda: utils.colnw(x, y, stride, padding, kernel), number=10),
+                measure(lambda: loop_imnpool(x, kernel, stride)),
+                measure(lambda: utils.imnpool(x, kernel, stride, padding), number=10),
+                measure(layer_step(rm.Conv3d(channel, filter=k, stride=s), large)),
+                measure(layer_step(rm.MaxPoolNd(kernel=k, stride=s), large)),
+            ]
+            print(("{:3d} {:3d}" + " {:10.2f}" * len(times)).format(k, s, *times))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Samples per second of an epoch of the Trainer on CPU with 1, 2, 4 and 8
+worker processes, which average their gradients through shared memory, on
+an MLP of 4 layers of 1024 units and batches of 256 samples. The last column
+is the wall time of the all-reduce of the gradients alone, in ms.
+
+    $ python test/exp/exp_data_parallel.py
+"""
+
+from __future__ import print_function
+import time
+import timeit
+import multiprocessing
+import numpy as np
+import renom as rm
+from renom.utility.distributor import NdarrayDistributor
+from renom.utility.trainer import Trainer
+from renom.utility.data_parallel import SharedAllReduce
+
+
+def mlp():
+    return rm.Sequential([
+        rm.Dense(1024), rm.Relu(), rm.Dense(1024), rm.Relu(),
+        rm.Dense(1024), rm.Relu(), rm.Dense(10),
+    ])
+
+
+def measure(num_workers, x, y, batch):
+    np.random.seed(0)
+    model = mlp()
+    trainer = Trainer(model, num_epoch=2, loss_func=rm.softmax_cross_entropy,
+                      batch_size=batch, optimizer=rm.Sgd(0.01), shuffle=False,
+                      events={}, num_workers=num_workers)
+    times = []
+    trainer.events.start_epoch = lambda trainer: times.append(time.time())
+    trainer.events.end_epoch = lambda trainer: times.append(time.time())
+    trainer.train(NdarrayDistributor(x, y))
+    # The first epoch forks the workers.
+    return len(x) / (times[-1] - times[-2])
+
+
+def allreduce_time(num_workers, size):
+    allreduce = SharedAllReduce(num_workers, size)
+
+    def loop(rank, number):
+        for _ in range(number):
+            allreduce.allreduce(rank)
+
+    context = multiprocessing.get_context("fork")
+    number = 20
+    processes = [context.Process(target=loop, args=(rank, number * 4))
+                 for rank in range(1, num_workers)]
+    for p in processes:
+        p.start()
+    t = min(timeit.repeat(lambda: loop(0, number), number=1, repeat=4)) / number
+    for p in processes:
+        p.join()
+    return t * 1000
+
+
+def main(batch=256):
+    x = np.random.rand(batch * 16, 784).astype(rm.precision)
+    y = np.eye(10)[np.random.randint(10, size=len(x))].astype(rm.precision)
+    size = sum(v.size for v in (np.empty((784, 1024)), np.empty((1024, 1024)),
+                                np.empty((1024, 1024)), np.empty((1024, 10))))
+    print("cpus: {}".format(multiprocessing.cpu_count()))
+    print("{:>8} {:>12} {:>12}".format("workers", "samples/s", "allreduce"))
+    for num_workers in (1, 2, 4, 8):
+        print("{:8d} {:12.1f} {:12.2f}".format(
+            num_workers, measure(num_workers, x, y, batch), allreduce_time(num_workers, size)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Wall time and temporary memory of the Adam update and of the losses
+with elementwise chains evaluated by evaluate_fused, compared to chains of
+Node operations.
+
+Temporary memory is the peak reported by tracemalloc, in units of the size of
+one input array.
+
+    $ python test/exp/exp_fused_elementwise.py
+"""
+
+from __future__ import print_function
+import timeit
+import tracemalloc
+import numpy as np
+import renom as rm
+from renom.core import Node, to_value
+from renom.layers.loss.mean_squared_error import mean_squared_error
+from renom.layers.loss.sigmoid_cross_entropy import sigmoid_cross_entropy
+
+
+class NodeAdam(rm.Adam):
+    '''Former Adam._get_cpu without the zero check.'''
+
+    def _get_cpu(self, dy, node):
+        pdy = self._params.get(id(node), None)
+        if pdy is None:
+            b, g = self._b, self._g
+            u = (1 - self._b) * dy
+            r = (1 - self._g) * (dy**2)
+        else:
+            u, r, b, g = pdy["u"], pdy["r"], pdy["beta"], pdy["gamma"]
+            u = self._b * u + (1 - self._b) * dy
+            r = self._g * r + (1 - self._g) * (dy * dy)
+        self._params[id(node)] = {"beta": b * self._b, "gamma": g * self._g,
+                                  "u": u, "r": r, "nth": 1}
+        ret = self._lr * u / (rm.sqrt(r / (1 - g)) + self._epsilon) / (1 - b)
+        if isinstance(ret, Node):
+            ret.detach_graph()
+        return ret
+
+
+class node_mean_squared_error(mean_squared_error):
+    '''Former mean_squared_error.'''
+
+    @classmethod
+    def _oper_cpu(cls, lhs, rhs, reduce_sum=True):
+        return np.sum((lhs - rhs) ** 2) / (len(lhs) * 2)
+
+    def _backward_cpu(self, context, dy, **kwargs):
+        sub = self.attrs._lhs - self.attrs._rhs
+        N = len(self.attrs._lhs)
+        self.attrs._lhs._update_diff(context, sub * dy / N, **kwargs)
+
+
+class node_sigmoid_cross_entropy(sigmoid_cross_entropy):
+    '''Former sigmoid_cross_entropy.'''
+
+    @classmethod
+    def _oper_cpu(cls, lhs, rhs, reduce_sum):
+        N = len(lhs)
+        z = 1. / (1. + np.exp(to_value(-lhs)))
+        loss = -np.sum(to_value(rhs) * np.log(z + 1e-8) +
+                       to_value(1 - rhs) * np.log(1 - z + 1e-8)) / N
+        ret = cls._create_node(loss)
+        ret.attrs._z = z
+        ret.attrs._lhs = lhs
+        ret.attrs._rhs = rhs
+        return ret
+
+    def _backward_cpu(self, context, dy, **kwargs):
+        sub = self.attrs._z - self.attrs._rhs
+        N = len(self.attrs._z)
+        self.attrs._lhs._update_diff(context, sub * dy / N, **kwargs)
+
+
+def step(loss, x, y):
+    return loss(x, y).grad().get(x)
+
+
+def measure(func, nbytes, number=20):
+    func()
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    elapsed = min(timeit.repeat(func, number=number, repeat=3)) / number
+    return elapsed * 1000, peak / float(nbytes)
+
+
+def main(size=1 << 20):
+    dy = np.random.rand(size).astype(rm.precision)
+    x = rm.Variable(np.random.rand(size // 256, 256))
+    y = (np.random.rand(size // 256, 256) > 0.5).astype(rm.precision)
+
+    node_opt, fused_opt = NodeAdam(), rm.Adam()
+    cases = (
+        ("adam", lambda: node_opt(dy, x), lambda: fused_opt(dy, x)),
+        ("mse", lambda: step(node_mean_squared_error, x, y),
+         lambda: step(mean_squared_error, x, y)),
+        ("sigmoid_ce", lambda: step(node_sigmoid_cross_entropy, x, y),
+         lambda: step(sigmoid_cross_entropy, x, y)),
+    )
+    print("{:>12} {:>10} {:>10} {:>12} {:>12}".format(
+        "path", "node[ms]", "fused[ms]", "node[temps]", "fused[temps]"))
+    for name, node, fused in cases:
+        t0, m0 = measure(node, dy.nbytes)
+        t1, m1 = measure(fused, dy.nbytes)
+        print("{:>12} {:10.2f} {:10.2f} {:12.1f} {:12.1f}".format(name, t0, t1, m0, m1))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Wall time of im2col, im2row and col2im built on strided window views,
+compared to the former loops over kernel offsets, across kernel sizes,
+strides and dilations. The last columns are the forward and backward times
+of Conv2d, MaxPool2d and AveragePool2d on the same input.
+
+    $ python test/exp/exp_im2col.py
+"""
+
+from __future__ import print_function
+import timeit
+import numpy as np
+import renom as rm
+from renom.layers.function.utils import im2col, im2row, col2im, out_size
+
+
+def loop_im2col(img, size, kernel, stride, padding, dilation=(1, 1), padWith=0.):
+    '''Former im2col.'''
+    N, channel, in_h, in_w = img.shape
+    out_h, out_w = size
+    k_h, k_w = kernel
+    s_h, s_w = stride
+    p_h, p_w = padding
+    d_h, d_w = dilation
+    img_n = np.pad(img, ((0, 0), (0, 0), (p_h, p_h + s_h - 1), (p_w, p_w + s_w - 1)),
+                   mode="constant", constant_values=padWith)
+    col = np.ndarray((N, channel, k_h, k_w, out_h, out_w), dtype=rm.precision)
+    for i in range(k_h):
+        idh = i * d_h
+        iu = idh + s_h * out_h
+        for j in range(k_w):
+            jdw = j * d_w
+            ju = jdw + s_w * out_w
+            col[:, :, k_h - 1 - i, k_w - 1 - j, :, :] = img_n[:, :, idh:iu:s_h, jdw:ju:s_w]
+    return col
+
+
+def loop_col2im(col, size, stride, padding, dilation=(1, 1)):
+    '''Former col2im.'''
+    in_h, in_w = size
+    s_h, s_w = stride
+    p_h, p_w = padding
+    d_h, d_w = dilation
+    N, channel, k_h, k_w, out_h, out_w = col.shape
+    img = np.zeros((N, channel, in_h + 2 * p_h + s_h - 1,
+                    in_w + 2 * p_w + s_w - 1), dtype=rm.precision)
+    for i in range(k_h):
+        idh = i * d_h
+        iu = idh + s_h * out_h
+        for j in range(k_w):
+            jdw = j * d_w
+            ju = jdw + s_w * out_w
+            img[:, :, idh:iu:s_h, jdw:ju:s_w] += col[:, :, k_h - 1 - i, k_w - 1 - j, :, :]
+    im_shape = img.shape
+    return img[:, :, p_h:im_shape[2] - (p_h + s_h - 1),
+               p_w:im_shape[3] - (p_w + s_w - 1)]
+
+
+def measure(func, number=10):
+    func()
+    return min(timeit.repeat(func, number=number, repeat=3)) / number * 1000
+
+
+def layer_step(layer, x):
+    def step():
+        rm.sum(layer(x)).grad().get(x)
+    return step
+
+
+def main(shape=(32, 16, 32, 32)):
+    x = rm.Variable(np.random.rand(*shape).astype(rm.precision))
+    img = x.as_ndarray()
+    print(("{:>3} " * 3 + "{:>9} " * 8).format(
+        "k", "s", "d", "i2c_loop", "i2c_view", "im2row", "c2i_loop", "c2i_view",
+        "conv", "maxpool", "avgpool"))
+    for k in (1, 2, 3, 5):
+        for s in (1, 2):
+            for d in (1, 2):
+                kernel, stride, dilation = (k, k), (s, s), (d, d)
+                padding = ((k - 1) * d // 2, ) * 2
+                size = out_size(shape[2:], kernel, stride, padding, dilation)
+                col = im2col(img, size, kernel, stride, padding, dilation)
+                times = [
+                    measure(lambda: loop_im2col(img, size, kernel, stride, padding, dilation)),
+                    measure(lambda: im2col(img, size, kernel, stride, padding, dilation)),
+                    measure(lambda: im2row(img, size, kernel, stride, padding, dilation)),
+                    measure(lambda: loop_col2im(col, shape[2:], stride, padding, dilation)),
+                    measure(lambda: col2im(col, shape[2:], stride, padding, dilation)),
+                    measure(layer_step(rm.Conv2d(16, filter=k, stride=s, padding=padding[0],
+                                                 dilation=d), x), number=3),
+                ]
+                # Pooling has no dilation.
+                if d == 1:
+                    times.extend(measure(layer_step(layer(filter=k, stride=s), x), number=3)
+                                 for layer in (rm.MaxPool2d, rm.AveragePool2d))
+                    row = "{:9.2f} " * 8
+                else:
+                    row = "{:9.2f} " * 6 + "{:>9} " * 2
+                    times.extend(("-", "-"))
+                print(("{:3d} {:3d} {:3d} " + row).format(k, s, d, *times))
+
+
+if __name__ == '__main__':
+    main()
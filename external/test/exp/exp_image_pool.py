@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Images per second of an epoch of ImageClassificationDistributor over a
+folder of 512 JPEGs of 320x240 pixels, resized to 64x64 and augmented by
+flips and shifts, against the number of worker processes. 0 workers is the
+thread loader, which decodes on threads and resizes and augments in the
+consuming process.
+
+    $ python test/exp/exp_image_pool.py
+"""
+
+from __future__ import print_function
+import os
+import time
+import shutil
+import tempfile
+import multiprocessing
+import numpy as np
+from PIL import Image
+from renom.utility.distributor import ImageClassificationDistributor
+from renom.utility.image.data_augmentation.augmentation import DataAugmentation
+from renom.utility.image.data_augmentation.flip import Flip
+from renom.utility.image.data_augmentation.shift import Shift
+
+
+def measure(distributor, batch):
+    # The first epoch forks the workers.
+    for _ in distributor.batch(batch, shuffle=True):
+        pass
+    start = time.time()
+    for _ in distributor.batch(batch, shuffle=True):
+        pass
+    return len(distributor) / (time.time() - start)
+
+
+def main(num_images=512, batch=32):
+    directory = tempfile.mkdtemp()
+    rng = np.random.RandomState(0)
+    paths = []
+    for i in range(num_images):
+        # Smooth images compress like photographs.
+        img = rng.randint(0, 256, (30, 40, 3)).astype(np.uint8)
+        path = os.path.join(directory, "{}.jpg".format(i))
+        Image.fromarray(img).resize((320, 240), Image.BILINEAR).save(path, quality=90)
+        paths.append(path)
+    labels = list(rng.randint(10, size=num_images))
+    augmentation = DataAugmentation([Flip(1), Shift((8, 8))], random=True)
+
+    print("cpus: {}".format(multiprocessing.cpu_count()))
+    print("{:>8} {:>10}".format("workers", "images/s"))
+    for num_workers in (0, 1, 2, 4, 8):
+        distributor = ImageClassificationDistributor(paths, labels, imsize=(64, 64),
+                                                     augmentation=augmentation,
+                                                     num_workers=num_workers)
+        print("{:8d} {:10.1f}".format(num_workers, measure(distributor, batch)))
+        distributor.close()
+    shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
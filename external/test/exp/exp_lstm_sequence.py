@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Training throughput in tokens (time steps times batch size) per second
+of Lstm and Gru on MNIST shaped rows of 28 pixels, calling the layer once
+per step compared to passing the whole sequence of the shape (T, N, D) in
+one call, for sequence lengths from 28 to 1000.
+
+    $ python test/exp/exp_lstm_sequence.py
+"""
+
+from __future__ import print_function
+import timeit
+import numpy as np
+import renom as rm
+
+
+def step_loop(layer, x):
+    def step():
+        loss = 0
+        for t in range(len(x)):
+            loss += rm.sum(layer(x[t]))
+        loss.grad()
+        layer.truncate()
+    return step
+
+
+def step_sequence(layer, x):
+    def step():
+        rm.sum(layer(x)).grad()
+        layer.truncate()
+    return step
+
+
+def measure(func, number=1):
+    func()
+    return min(timeit.repeat(func, number=number, repeat=3))
+
+
+def main(batch=100, input_size=28, hidden=128):
+    print(("{:>5} {:>5}" + " {:>12}" * 3).format(
+        "layer", "T", "steps", "sequence", "speedup"))
+    for layer_type in (rm.Lstm, rm.Gru):
+        for T in (28, 100, 300, 1000):
+            x = rm.Variable(np.random.rand(T, batch, input_size).astype(rm.precision))
+            tokens = T * batch
+            layer = layer_type(hidden)
+            loop = tokens / measure(step_loop(layer, x))
+            sequence = tokens / measure(step_sequence(layer, x))
+            print(("{:>5} {:5d}" + " {:12.0f}" * 2 + " {:12.2f}").format(
+                layer_type.__name__, T, loop, sequence, sequence / loop))
+
+
+if __name__ == '__main__':
+    main()
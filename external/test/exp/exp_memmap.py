@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Peak resident memory and throughput of a shuffled epoch over frames of
+32 cepstral coefficients and their targets, as in the speech scripts.
+
+The first rows load .mat files of 1M frames in memory as CepsDomCNN_Train.py
+does (loadmat, column_stack and shuffle), or convert them to shards read by
+MemmapDistributor. The last rows read shards of a dataset 4 times larger
+than the physical memory with MemmapDistributor, from a cold page cache.
+Every case runs in a new process, whose import of renom alone is the
+baseline.
+
+    $ python test/exp/exp_memmap.py [directory]
+"""
+
+from __future__ import print_function
+import os
+import sys
+import time
+import shutil
+import multiprocessing
+import numpy as np
+
+FRAME = 32
+
+
+def peak_rss():
+    # VmHWM, unlike ru_maxrss, does not carry the peak of the parent over exec.
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+
+
+def drop_caches():
+    try:
+        with open("/proc/sys/vm/drop_caches", "w") as f:
+            f.write("3\n")
+        return True
+    except (IOError, OSError):
+        return False
+
+
+def baseline():
+    import renom  # NOQA
+    return 0, 0
+
+
+def loadmat_pipeline(x_file, y_file, batch):
+    import scipy.io
+    from renom.utility.distributor import NdarrayDistributor
+    start = time.time()
+    x = scipy.io.loadmat(x_file)["inputSetNorm"]
+    y = scipy.io.loadmat(y_file)["targetSet"]
+    train = np.column_stack((x, y))
+    np.random.shuffle(train)
+    x, y = train[:, :FRAME], train[:, FRAME:]
+    for _ in NdarrayDistributor(x, y).batch(batch):
+        pass
+    return len(x), time.time() - start
+
+
+def memmap_epoch(path, batch, prefetch):
+    from renom.utility.distributor import MemmapDistributor
+    distributor = MemmapDistributor(path)
+    start = time.time()
+    for _ in distributor.batch(batch, shuffle=True, prefetch=prefetch):
+        pass
+    return len(distributor), time.time() - start
+
+
+def run(func, *args):
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=_child, args=(queue, func, args))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def _child(queue, func, args):
+    queue.put(func(*args) + (peak_rss(), ))
+
+
+def chunks(total, size=1 << 20):
+    rng = np.random.RandomState(0)
+    for start in range(0, total, size):
+        n = min(size, total - start)
+        x = rng.rand(n, FRAME).astype(np.float32)
+        yield x, x + rng.rand(n, FRAME).astype(np.float32) * 0.1
+
+
+def report(label, result):
+    samples, seconds, rss = result
+    if seconds:
+        print("{:>34} {:10.0f} {:12.0f}".format(label, rss, samples / seconds))
+    else:
+        print("{:>34} {:10.0f}".format(label, rss))
+
+
+def main(directory="/tmp/exp_memmap", batch=256, shard_size=1 << 20):
+    import scipy.io
+    from renom.utility.distributor import convert_mat, save_shards
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    print("{:>34} {:>10} {:>12}".format("", "RSS MB", "samples/s"))
+    report("import renom", run(baseline))
+
+    frames = 1 << 20
+    x_file = os.path.join(directory, "Train_inputSet.mat")
+    y_file = os.path.join(directory, "Train_targetSet.mat")
+    x, y = next(chunks(frames, frames))
+    scipy.io.savemat(x_file, {"inputSetNorm": x.astype(np.float64)})
+    scipy.io.savemat(y_file, {"targetSet": y.astype(np.float64)})
+    del x, y
+    report("1M frames, loadmat in memory", run(loadmat_pipeline, x_file, y_file, batch))
+    path = os.path.join(directory, "small")
+    convert_mat(path, x_file, "inputSetNorm", y_file, "targetSet", shard_size // 4)
+    report("1M frames, MemmapDistributor", run(memmap_epoch, path, batch, 0))
+
+    memory = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    total = 4 * memory // (2 * FRAME * 4)
+    path = os.path.join(directory, "large")
+    start = time.time()
+    save_shards(path, chunks(total), shard_size, np.float32)
+    print("wrote {:.1f} GB of shards for {:.1f} GB of memory in {:.0f} s".format(
+        2 * total * FRAME * 4 / 2**30, memory / 2**30, time.time() - start))
+    cold = drop_caches()
+    report("4x memory, MemmapDistributor", run(memmap_epoch, path, batch, 0))
+    drop_caches()
+    report("4x memory, prefetch=2", run(memmap_epoch, path, batch, 2))
+    if not cold:
+        print("the page cache could not be dropped")
+    shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Inference throughput of Trainer.test with and without rm.no_grad().
+
+    $ python test/exp/exp_no_grad.py
+"""
+
+from __future__ import print_function
+import time
+import numpy as np
+import renom as rm
+from renom.utility.trainer import Trainer
+
+
+class MNist(rm.Model):
+    def __init__(self):
+        super(MNist, self).__init__()
+        self.layer1 = rm.Dense(output_size=100)
+        self.layer2 = rm.Dense(output_size=10)
+
+    def forward(self, x):
+        return self.layer2(rm.relu(self.layer1(x)))
+
+
+def test_with_graph(trainer, data):
+    # Trainer.test before rm.no_grad() was introduced.
+    bs = trainer.batch_size
+    N = len(data) - 1 + bs
+    trainer.model.set_models(inference=True)
+    ret = np.vstack([trainer.model(data[bs * i:bs * (i + 1)]).as_ndarray()
+                     for i in range(N // bs)])
+    trainer.model.set_models(inference=False)
+    return ret
+
+
+def main(num=20000):
+    data = np.random.rand(num, 784).astype(rm.precision)
+    print("{:>6} {:>16} {:>16}".format("batch", "graph[samples/s]", "no_grad[samples/s]"))
+    for batch in (1, 8, 64):
+        trainer = Trainer(MNist(), 1, rm.softmax_cross_entropy, batch)
+        trainer.test(data[:batch])
+        n = min(num, batch * 2000)
+
+        start = time.time()
+        test_with_graph(trainer, data[:n])
+        graph = n / (time.time() - start)
+
+        start = time.time()
+        trainer.test(data[:n])
+        nograd = n / (time.time() - start)
+        print("{:>6} {:16.0f} {:16.0f}".format(batch, graph, nograd))
+
+
+if __name__ == '__main__':
+    main()
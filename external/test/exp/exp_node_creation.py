@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Operations per second of basic_ops on small arrays, where the cost of
+creating Node objects dominates.
+
+    $ python test/exp/exp_node_creation.py
+"""
+
+from __future__ import print_function
+import timeit
+import numpy as np
+import renom as rm
+
+
+def main(number=20000):
+    print("{:>10} {:>8} {:>14} {:>14}".format("op", "shape", "graph[ops/s]", "no graph[ops/s]"))
+    for shape in ((1, ), (4, 4), (16, 16)):
+        a = rm.Variable(np.random.rand(*shape))
+        b = rm.Variable(np.random.rand(*shape))
+        c = rm.Node(np.random.rand(*shape))
+        d = rm.Node(np.random.rand(*shape))
+        ops = (
+            ("Add", lambda x, y: x + y),
+            ("Mul", lambda x, y: x * y),
+            ("dot", lambda x, y: rm.dot(x, y.T) if len(shape) > 1 else rm.dot(x, y)),
+        )
+        for name, op in ops:
+            graph = number / min(timeit.repeat(lambda: op(a, b), number=number, repeat=5))
+            nograph = number / min(timeit.repeat(lambda: op(c, d), number=number, repeat=5))
+            print("{:>10} {:>8} {:14.0f} {:14.0f}".format(
+                name, "x".join(map(str, shape)), graph, nograph))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Volumes per second of the CPU N-d max pooling kernels on 64x64x64
+volumes. The former kernels take the argmax over a strided view of all the
+windows and find the maxima again in backward and in unpooling. The
+current ones take one pass per kernel offset and keep the offsets of the
+maxima as int8, so backward and unpooling scatter and gather without
+searching. The last columns are the forward and backward of MaxPoolNd and
+of MaxPoolNd followed by MaxUnPoolNd.
+
+    $ python test/exp/exp_poolnd.py
+"""
+
+from __future__ import print_function
+import timeit
+import numpy as np
+import renom as rm
+from renom.layers.function import utils
+from renom.layers.function.unpoolnd import MaxUnPoolNd
+
+
+def strided_imnpool(x, kernel, stride, padding):
+    '''Former imnpool.'''
+    col = utils.im2col_nd(x, kernel, stride, padding)
+    col = col.reshape(col.shape[:2] + (-1, ) + col.shape[2 + len(kernel):])
+    index = np.argmax(col, axis=2)[:, :, None]
+    return np.take_along_axis(col, index, axis=2)[:, :, 0]
+
+
+def strided_poolnim(x, dy, kernel, stride, padding):
+    '''Former poolnim.'''
+    dims = len(kernel)
+    col = utils.im2col_nd(x, kernel, stride, padding)
+    index = np.argmax(col.reshape(col.shape[:2] + (-1, ) + col.shape[2 + dims:]), axis=2)
+    col = np.zeros(dy.shape[:2] + tuple(kernel) + dy.shape[2:], dtype=dy.dtype)
+    col_k = col.reshape(dy.shape[:2] + (-1, ) + dy.shape[2:])
+    np.put_along_axis(col_k, index[:, :, None], dy[:, :, None], axis=2)
+    return utils.col2im_nd(col, x.shape[2:], stride, padding)
+
+
+def measure(func, n, number=1):
+    func()
+    return n / (min(timeit.repeat(func, number=number, repeat=3)) / number)
+
+
+def pool_step(x, kernel, stride, unpool=False):
+    pool = rm.MaxPoolNd(kernel=kernel[0], stride=stride[0])
+    unpool_layer = MaxUnPoolNd()
+
+    def step():
+        z = pool(x)
+        if unpool:
+            z = unpool_layer(z * 2, z)
+        rm.sum(z).grad().get(x)
+    return step
+
+
+def main(shape=(4, 4, 64, 64, 64)):
+    x = np.random.rand(*shape).astype(rm.precision)
+    var = rm.Variable(x)
+    n = shape[0]
+    print(("{:>16}" + " {:>10}" * 6).format(
+        "kernel/stride", "fwd_strd", "bwd_strd", "fwd_off", "bwd_off", "pool", "unpool"))
+    for kernel, stride in (((2, 2, 2), (2, 2, 2)), ((3, 3, 3), (2, 2, 2)), ((3, 3, 3), (1, 1, 1))):
+        padding = (0, 0, 0)
+        y, index = utils.imnpool_index(x, kernel, stride, padding)
+        times = [
+            measure(lambda: strided_imnpool(x, kernel, stride, padding), n),
+            measure(lambda: strided_poolnim(x, y, kernel, stride, padding), n),
+            measure(lambda: utils.imnpool_index(x, kernel, stride, padding), n),
+            measure(lambda: utils.poolnim(x, y, kernel, stride, padding, index=index), n),
+            measure(pool_step(var, kernel, stride), n),
+            measure(pool_step(var, kernel, stride, unpool=True), n),
+        ]
+        print(("{:>16}" + " {:10.1f}" * len(times)).format(
+            "{}/{}".format(kernel[0], stride[0]), *times))
+
+
+if __name__ == '__main__':
+    main()
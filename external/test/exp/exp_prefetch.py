@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Wall time of a shuffled epoch of an MLP training step over an in-memory
+dataset of 200000 samples of 1024 float32 features (800 MB), with the
+batches gathered synchronously or prefetched on a background thread. The
+overlap is the share of the gather time hidden behind the steps.
+
+    $ python test/exp/exp_prefetch.py
+"""
+
+from __future__ import print_function
+import time
+import numpy as np
+import renom as rm
+from renom.utility.distributor import NdarrayDistributor
+
+
+def measure(func):
+    func()
+    times = []
+    for _ in range(3):
+        start = time.time()
+        func()
+        times.append(time.time() - start)
+    return min(times)
+
+
+def epoch(distributor, batch, step=None, **kwargs):
+    def run():
+        for x, y in distributor.batch(batch, **kwargs):
+            if step is not None:
+                step(x, y)
+    return run
+
+
+def main(size=200000, features=1024, batch=256):
+    x = np.random.rand(size, features).astype(np.float32)
+    y = np.eye(10, dtype=np.float32)[np.random.randint(10, size=size)]
+    distributor = NdarrayDistributor(x, y)
+    model = rm.Sequential([rm.Dense(256), rm.Relu(), rm.Dense(10)])
+    opt = rm.Sgd(0.01)
+
+    def step(x, y):
+        with model.train():
+            loss = rm.softmax_cross_entropy(model(x), y)
+        loss.grad().update(opt)
+
+    gather = measure(epoch(distributor, batch))
+    compute = measure(epoch(distributor, batch, step, shuffle=False))
+    print("{:>20} {:>10}".format("", "s/epoch"))
+    print("{:>20} {:10.3f}".format("gather only", gather))
+    print("{:>20} {:10.3f}".format("step only", compute))
+    for prefetch in (0, 1, 2, 4):
+        t = measure(epoch(distributor, batch, step, prefetch=prefetch))
+        print("{:>20} {:10.3f}   overlap {:5.1f}%".format(
+            "prefetch={}".format(prefetch), t, 100 * (gather + compute - t) / gather))
+
+
+if __name__ == '__main__':
+    main()
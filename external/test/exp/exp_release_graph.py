@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Peak RSS of one training step with and without releasing graph
+attributes during backward.
+
+The models follow example/simple_mnist_lstm.py and a small MNIST sized CNN.
+Each measurement runs in its own process because ru_maxrss never decreases.
+
+    $ python test/exp/exp_release_graph.py
+"""
+
+from __future__ import print_function
+import sys
+import resource
+import subprocess
+import numpy as np
+import renom as rm
+
+
+class LstmNet(rm.Model):
+    def __init__(self):
+        super(LstmNet, self).__init__()
+        self.layer1 = rm.PeepholeLstm(output_size=256)
+        self.layer2 = rm.Dense(output_size=10)
+
+    def forward(self, x):
+        self.layer1.truncate()
+        for i in range(x.shape[1]):
+            ret = self.layer2(self.layer1(x[:, i]))
+        return ret
+
+
+class CnnNet(rm.Model):
+    def __init__(self):
+        super(CnnNet, self).__init__()
+        self.conv1 = rm.Conv2d(channel=32, filter=3, padding=1)
+        self.conv2 = rm.Conv2d(channel=32, filter=3, padding=1)
+        self.conv3 = rm.Conv2d(channel=64, filter=3, padding=1)
+        self.conv4 = rm.Conv2d(channel=64, filter=3, padding=1)
+        self.pool = rm.MaxPool2d(filter=2, stride=2)
+        self.dense = rm.Dense(10)
+
+    def forward(self, x):
+        h = self.pool(rm.relu(self.conv2(rm.relu(self.conv1(x)))))
+        h = self.pool(rm.relu(self.conv4(rm.relu(self.conv3(h)))))
+        return self.dense(rm.flatten(h))
+
+
+def step(name, release):
+    if name == "lstm":
+        model = LstmNet()
+        x = rm.Node(np.random.rand(128, 28, 28))
+    else:
+        model = CnnNet()
+        x = rm.Node(np.random.rand(128, 1, 28, 28))
+    y = np.eye(10)[np.random.randint(0, 10, len(x))].astype(rm.precision)
+
+    with model.train():
+        loss = rm.softmax_cross_entropy(model(x), y)
+    base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if release:
+        grad = loss.grad()
+    else:
+        grad = loss.grad(detach_graph=False)
+        loss.detach_graph()
+    grad.update(rm.Sgd())
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return base, peak
+
+
+def measure(name, release):
+    out = subprocess.check_output([sys.executable, __file__, name, str(int(release))])
+    return [int(v) for v in out.split()[-2:]]
+
+
+def main():
+    print("{:>6} {:>10} {:>16} {:>16}".format("model", "release", "forward[MB]", "peak[MB]"))
+    for name in ("cnn", "lstm"):
+        for release in (False, True):
+            base, peak = measure(name, release)
+            print("{:>6} {:>10} {:16.1f} {:16.1f}".format(
+                name, str(release), base / 1024., peak / 1024.))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        print(*step(sys.argv[1], bool(int(sys.argv[2]))))
+    else:
+        main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Proposals per second of roi_pool2d forward and backward on a detection
+sized feature map, vectorized over all rois compared to the former loops
+over every roi and output bin, and of roi_align2d. The former backward
+loops over every pixel and channel of a roi, so it is timed on a few
+rois only.
+
+    $ python test/exp/exp_roi_pool.py
+"""
+
+from __future__ import print_function
+import timeit
+import numpy as np
+import renom as rm
+from renom.layers.function.utils import roi_pooling_slice, region_cordinates, \
+    roi_pooling_slice_decode
+
+
+def loop_forward(x, rois, outh, outw, spatial_scale):
+    '''Former roi_pool2d._oper_cpu.'''
+    n_rois, (ch, h, w) = len(rois), x.shape[1:]
+    z = np.zeros((n_rois, ch, outh, outw), np.float64)
+    index = np.zeros(z.shape, np.int32)
+    for i_roi in range(n_rois):
+        idx, xmin, ymin, xmax, ymax = region_cordinates(rois[i_roi], spatial_scale)
+        strideh = float(max(ymax - ymin + 1, 1)) / float(outh)
+        stridew = float(max(xmax - xmin + 1, 1)) / float(outw)
+        for idx_h in range(outh):
+            sliceh, lenh = roi_pooling_slice(idx_h, strideh, h, ymin)
+            if lenh <= 0:
+                continue
+            for idx_w in range(outw):
+                slicew, lenw = roi_pooling_slice(idx_w, stridew, w, xmin)
+                if lenw <= 0:
+                    continue
+                roi_data = x[int(idx), :, sliceh, slicew].reshape(ch, -1)
+                z[i_roi, :, idx_h, idx_w] = np.max(roi_data, axis=1)
+                max_idx_slice = np.unravel_index(np.argmax(roi_data, axis=1), (lenh, lenw))
+                index[i_roi, :, idx_h, idx_w] = (max_idx_slice[0] + sliceh.start) * w + \
+                    max_idx_slice[1] + slicew.start
+    return z, index
+
+
+def loop_backward(x, rois, index, dy, outh, outw, spatial_scale):
+    '''Former roi_pool2d._backward_cpu.'''
+    ch, h, w = x.shape[1:]
+    dx = np.zeros_like(x)
+    for i_roi in range(len(rois)):
+        idx, xmin, ymin, xmax, ymax = region_cordinates(rois[i_roi], spatial_scale)
+        stride_h = float(max(ymax - ymin + 1, 1)) / float(outh)
+        stride_w = float(max(xmax - xmin + 1, 1)) / float(outw)
+        for idx_h in range(ymin, ymax + 1):
+            for idx_w in range(xmin, xmax + 1):
+                start_w, end_w = roi_pooling_slice_decode(idx_w, stride_w, outw, xmin)
+                start_h, end_h = roi_pooling_slice_decode(idx_h, stride_h, outh, ymin)
+                for ph in range(start_h, end_h):
+                    for pw in range(start_w, end_w):
+                        max_idx_tmp = index[i_roi, :, ph, pw]
+                        for c in range(ch):
+                            if max_idx_tmp[c] == (idx_h * w + idx_w):
+                                dx[idx, c, idx_h, idx_w] += dy[i_roi, c, ph, pw]
+    return dx
+
+
+def random_rois(n, shape, spatial_scale):
+    size = np.array([shape[3], shape[2]]) / spatial_scale
+    rois = np.random.rand(n, 5)
+    rois[:, 0] = np.floor(rois[:, 0] * shape[0])
+    rois[:, 1:3] *= size * 0.8
+    rois[:, 3:] = rois[:, 1:3] + np.random.rand(n, 2) * size * 0.4
+    return rois
+
+
+def measure(func, n_rois, number=1):
+    func()
+    return n_rois / (min(timeit.repeat(func, number=number, repeat=3)) / number)
+
+
+def layer_step(layer, x, rois):
+    def step():
+        rm.sum(layer(x, rois)).grad().get(x)
+    return step
+
+
+def main(shape=(2, 256, 38, 50), outh=7, outw=7, spatial_scale=1 / 16., loop_rois=8):
+    x = rm.Variable(np.random.rand(*shape).astype(rm.precision))
+    value = x.as_ndarray()
+    print(("{:>6}" + " {:>10}" * 5).format(
+        "rois", "fwd_loop", "bwd_loop", "fwd_vec", "pool_vec", "align_vec"))
+    for n_rois in (128, 512, 2000):
+        rois = random_rois(n_rois, shape, spatial_scale)
+        few = rois[:loop_rois]
+        z, index = loop_forward(value, few, outh, outw, spatial_scale)
+        times = [
+            measure(lambda: loop_forward(value, few, outh, outw, spatial_scale), loop_rois),
+            measure(lambda: loop_backward(value, few, index, z, outh, outw, spatial_scale),
+                    loop_rois),
+            measure(lambda: rm.roi_pool2d(value, rois, outh, outw, spatial_scale), n_rois),
+            measure(layer_step(rm.RoiPool2d(outh, outw, spatial_scale), x, rois), n_rois),
+            measure(layer_step(rm.RoiAlign2d(outh, outw, spatial_scale), x, rois), n_rois),
+        ]
+        print(("{:6d}" + " {:10.0f}" * len(times)).format(n_rois, *times))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Step time and peak memory of an Embedding of a 1M x 128 table trained
+by Sgd, Adagrad and Adam on batches of 4096 lookups. The dense columns use
+the dense gradient of the whole table, the sparse ones an IndexedSlices
+of the looked up rows with the lazy optimizer updates. The former
+backward, which adds the rows of the gradient in a python loop, is timed
+on its own.
+
+    $ python test/exp/exp_sparse_embedding.py
+"""
+
+from __future__ import print_function
+import gc
+import time
+import tracemalloc
+import numpy as np
+import renom as rm
+
+
+def loop_backward(index, dy, shape):
+    '''Former embedding._backward_cpu.'''
+    dx = np.zeros(shape, dtype=dy.dtype)
+    for i in range(len(index)):
+        dx[index[i]] += dy[i]
+    return dx
+
+
+def measure(optimizer, sparse, batches, rows, dim):
+    np.random.seed(0)
+    layer = rm.Embedding(dim, rows, sparse=sparse)
+    opt = optimizer()
+    times = []
+    tracemalloc.start()
+    for x in batches:
+        start = time.time()
+        with layer.train():
+            loss = rm.sum(layer(x) ** 2)
+        loss.grad().update(opt)
+        times.append(time.time() - start)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del layer, opt
+    gc.collect()
+    # The first step allocates the optimizer states.
+    return min(times[1:]) * 1e3, peak / 2.**20
+
+
+def main(rows=10**6, dim=128, batch_size=4096, steps=4):
+    batches = [np.random.randint(rows, size=(batch_size, 1)) for _ in range(steps)]
+    dy = np.random.rand(batch_size, dim).astype(rm.precision)
+    start = time.time()
+    loop_backward(batches[0][:, 0], dy, (rows, dim))
+    print("former backward {:.1f} ms".format((time.time() - start) * 1e3))
+    print(("{:>8}" + " {:>10}" * 4).format("", "dense_ms", "dense_MiB", "sparse_ms", "sparse_MiB"))
+    for optimizer in (rm.Sgd, rm.Adagrad, rm.Adam):
+        result = measure(optimizer, False, batches, rows, dim)
+        result += measure(optimizer, True, batches, rows, dim)
+        print(("{:>8}" + " {:10.1f}" * 4).format(optimizer.__name__, *result))
+
+
+if __name__ == '__main__':
+    main()
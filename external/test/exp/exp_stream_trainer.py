@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Wall time and peak memory of one training epoch of an Lstm on a long
+synthetic series, streamed in chunks of k steps by StreamDistributor to a
+stateful Trainer (truncated backpropagation through time), compared to
+training on whole windows that unroll the full series of every stream.
+Whole window training is skipped where its memory grows too large.
+
+    $ python test/exp/exp_stream_trainer.py
+"""
+
+from __future__ import print_function
+import time
+import tracemalloc
+import numpy as np
+import renom as rm
+from renom.utility.trainer import Trainer
+from renom.utility.distributor import NdarrayDistributor, StreamDistributor
+
+
+class Model(rm.Model):
+
+    def __init__(self, hidden, time_major):
+        super(Model, self).__init__()
+        self._time_major = time_major
+        self.rnn = rm.Lstm(hidden)
+        self.dense = rm.Dense(1)
+
+    def forward(self, x):
+        if not self._time_major:
+            x = x.transpose(1, 0, 2)
+        z = self.rnn(x)
+        return self.dense(z.reshape(-1, z.shape[-1]))
+
+
+def loss_func(time_major):
+    def loss(z, t):
+        if not time_major:
+            t = t.transpose(1, 0, 2)
+        return rm.mse(z, t.reshape(-1, 1))
+    return loss
+
+
+def measure(distributor, batch_size, time_major, stateful, hidden):
+    model = Model(hidden, time_major)
+    trainer = Trainer(model, 1, loss_func(time_major), batch_size, rm.Sgd(0.01),
+                      shuffle=False, events={"start": None}, stateful=stateful)
+    tracemalloc.start()
+    start = time.time()
+    trainer.train(distributor)
+    elapsed = time.time() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak / 2.**20
+
+
+def main(steps=50, batch_size=100, hidden=16, whole_limit=10**6):
+    print(("{:>9}" + " {:>12}" * 4).format(
+        "length", "stream_s", "stream_MiB", "whole_s", "whole_MiB"))
+    for length in (10**4, 10**5, 10**6, 10**7):
+        series = np.sin(np.arange(length + 1) * 0.01).astype(rm.precision)
+        series += np.random.rand(length + 1).astype(rm.precision) * 0.1
+        x, y = series[:-1, None], series[1:, None]
+        times = measure(StreamDistributor(x, y, steps), batch_size, True, True, hidden)
+        if length <= whole_limit:
+            # One window per stream holding all of its steps.
+            window = length // batch_size
+            windows = NdarrayDistributor(x[:window * batch_size].reshape(batch_size, window, 1),
+                                         y[:window * batch_size].reshape(batch_size, window, 1))
+            times += measure(windows, batch_size, False, False, hidden)
+            row = " {:12.2f}" * 4
+        else:
+            times += ("-", "-")
+            row = " {:12.2f}" * 2 + " {:>12}" * 2
+        print(("{:9d}" + row).format(length, *times))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Training steps and inference calls per second of models called eagerly
+and replayed by rm.trace. The MLP follows example/simple_mnist_model.py.
+
+    $ python test/exp/exp_trace.py
+"""
+
+from __future__ import print_function
+import time
+import numpy as np
+import renom as rm
+
+
+class MNist(rm.Model):
+    def __init__(self):
+        super(MNist, self).__init__()
+        self.layer1 = rm.Dense(output_size=100)
+        self.layer2 = rm.Dense(output_size=10)
+
+    def forward(self, x):
+        return self.layer2(rm.relu(self.layer1(x)))
+
+
+class CnnNet(rm.Model):
+    def __init__(self):
+        super(CnnNet, self).__init__()
+        self.conv1 = rm.Conv2d(channel=8, filter=3, padding=1)
+        self.conv2 = rm.Conv2d(channel=16, filter=3, padding=1)
+        self.pool = rm.MaxPool2d(filter=2, stride=2)
+        self.dropout = rm.Dropout(0.25)
+        self.dense = rm.Dense(10)
+
+    def forward(self, x):
+        h = self.pool(rm.relu(self.conv1(x)))
+        h = self.pool(rm.relu(self.conv2(h)))
+        return self.dense(self.dropout(rm.flatten(h)))
+
+
+def run(model, call, x, y, seconds=2.):
+    opt = rm.Sgd()
+    steps = 0
+    start = time.time()
+    while time.time() - start < seconds:
+        with model.train():
+            loss = rm.softmax_cross_entropy(call(x), y)
+        loss.grad().update(opt)
+        steps += 1
+    return steps / (time.time() - start)
+
+
+def infer(call, x, seconds=1.):
+    calls = 0
+    start = time.time()
+    while time.time() - start < seconds:
+        call(x)
+        calls += 1
+    return calls / (time.time() - start)
+
+
+def main():
+    print("{:>6} {:>6} {:>14} {:>14} {:>14} {:>14}".format(
+        "model", "batch", "eager[steps/s]", "trace[steps/s]", "eager[calls/s]", "trace[calls/s]"))
+    for name, cls, shape in (("mlp", MNist, (784, )), ("cnn", CnnNet, (1, 28, 28))):
+        for batch in (1, 16, 128):
+            model = cls()
+            x = np.random.rand(batch, *shape).astype(rm.precision)
+            y = np.eye(10)[np.random.randint(0, 10, batch)].astype(rm.precision)
+            traced = rm.trace(model, x)
+            eager = run(model, model, x, y)
+            replay = run(model, traced, x, y)
+            print("{:>6} {:>6} {:14.0f} {:14.0f} {:14.0f} {:14.0f}".format(
+                name, batch, eager, replay, infer(model, x), infer(traced, x)))
+
+
+if __name__ == '__main__':
+    main()
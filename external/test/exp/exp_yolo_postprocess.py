@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Images per second of the YOLO post processing, apply_nms and
+build_truth, on 7x7x2 and 13x13x5 grids of 20 classes. The former
+apply_nms compares boxes pairwise in python for every class and the former
+build_truth loops over images and objects. The batched column runs
+apply_nms on the whole batch at once.
+
+    $ python test/exp/exp_yolo_postprocess.py
+"""
+
+from __future__ import print_function
+import timeit
+import numpy as np
+from renom.algorithm.image.detection.yolo import apply_nms, build_truth, box_iou
+
+
+def loop_apply_nms(x, cells, bbox, classes, thresh=0.2, iou_thresh=0.3):
+    '''Former apply_nms.'''
+    probs = np.zeros((cells, cells, bbox, classes))
+    boxes = np.zeros((cells, cells, bbox, 4))
+    for b in range(bbox):
+        prob = x[:, :, b * 5] * x[:, :, bbox * 5:].transpose(2, 0, 1)
+        probs[:, :, b, :] = prob.transpose(1, 2, 0)
+        boxes[:, :, b, :] = x[:, :, b * 5 + 1:b * 5 + 5]
+    offset = np.array([np.arange(cells)] * (cells * bbox)
+                      ).reshape(bbox, cells, cells).transpose(1, 2, 0)
+    boxes[:, :, :, 0] += offset
+    boxes[:, :, :, 1] += offset.transpose(1, 0, 2)
+    boxes[:, :, :, 0:2] = boxes[:, :, :, 0:2] / float(cells)
+    probs = probs.reshape(-1, classes)
+    boxes = boxes.reshape(-1, 4)
+    probs[probs < thresh] = 0
+    argsort = np.argsort(probs, axis=0)[::-1]
+
+    def get_xy12(box):
+        return [box[0] - box[2] / 2, box[1] - box[3] / 2,
+                box[0] + box[2] / 2, box[1] + box[3] / 2]
+    for cl in range(classes):
+        for b in range(boxes.shape[0]):
+            if probs[argsort[b, cl], cl] == 0:
+                continue
+            b1 = get_xy12(boxes[argsort[b, cl], :])
+            for compar in range(b + 1, boxes.shape[0]):
+                b2 = get_xy12(boxes[argsort[compar, cl], :])
+                if box_iou(b1, b2) > iou_thresh:
+                    probs[argsort[compar, cl], cl] = 0
+    indexes = np.nonzero(probs > 0)
+    return [{"class": indexes[1][b], "box": boxes[indexes[0][b]],
+             "score": probs[indexes[0][b], indexes[1][b]]} for b in range(len(indexes[0]))]
+
+
+def loop_build_truth(y, total_w, total_h, cells, classes):
+    '''Former build_truth.'''
+    truth = np.zeros((y.shape[0], cells, cells, 5 + classes))
+    for im in range(y.shape[0]):
+        for obj in range(0, y.shape[1], 4 + classes):
+            truth_classes = y[im, obj + 4:obj + 4 + classes]
+            if np.all(truth_classes == 0):
+                continue
+            norm_x = y[im, obj] * .99 * cells / total_w
+            norm_y = y[im, obj + 1] * .99 * cells / total_h
+            truth[im, int(norm_y), int(norm_x)] = np.concatenate(
+                ([1, norm_x % 1, norm_y % 1, y[im, obj + 2] / total_w,
+                  y[im, obj + 3] / total_h], truth_classes))
+    return truth.reshape(y.shape[0], -1)
+
+
+def predictions(n, cells, bbox, classes):
+    x = np.random.rand(n, cells, cells, bbox * 5 + classes).astype(np.float32)
+    # Few confident boxes and a softmax like class distribution.
+    x[..., :bbox * 5:5] **= 3
+    x[..., bbox * 5:] **= 8
+    x[..., bbox * 5:] /= x[..., bbox * 5:].sum(axis=-1, keepdims=True)
+    x[..., 3:bbox * 5:5] *= 0.5
+    x[..., 4:bbox * 5:5] *= 0.5
+    return x
+
+
+def labels(n, classes, objects=10, size=448):
+    y = np.zeros((n, objects, 4 + classes))
+    y[:, :, :2] = np.random.rand(n, objects, 2) * size
+    y[:, :, 2:4] = np.random.rand(n, objects, 2) * size / 2
+    y[:, :, 4 + np.random.randint(classes)] = 1
+    return y.reshape(n, -1)
+
+
+def measure(func, n, number=1):
+    func()
+    return n / (min(timeit.repeat(func, number=number, repeat=3)) / number)
+
+
+def main(n=32, classes=20):
+    print(("{:>9}" + " {:>10}" * 5).format(
+        "grid", "nms_loop", "nms_vec", "nms_batch", "truth_loop", "truth_vec"))
+    for cells, bbox in ((7, 2), (13, 5)):
+        x = predictions(n, cells, bbox, classes)
+        y = labels(n, classes)
+        times = [
+            measure(lambda: [loop_apply_nms(i, cells, bbox, classes) for i in x[:4]], 4),
+            measure(lambda: [apply_nms(i, cells, bbox, classes, (448, 448)) for i in x], n),
+            measure(lambda: apply_nms(x, cells, bbox, classes, (448, 448)), n),
+            measure(lambda: loop_build_truth(y, 448, 448, cells, classes), n, 10),
+            measure(lambda: build_truth(y, 448, 448, cells, classes), n, 10),
+        ]
+        print(("{:>9}" + " {:10.0f}" * len(times)).format(
+            "{0}x{0}x{1}".format(cells, bbox), *times))
+
+
+if __name__ == '__main__':
+    main()
@@ -35,6 +35,7 @@ from renom.layers.function.unpoolnd import MaxUnPoolNd, AverageUnPoolNd
 from renom.layers.function.poolnd import MaxPoolNd, AveragePoolNd
 from renom.layers.function.roi_pool2d import RoiPool2d
 from renom.layers.function.dropout import Dropout, SpatialDropout
+from renom.core.rng import set_rng_seed
 from renom.layers.function.lstm import Lstm
 from renom.layers.function.l2_norm import L2Norm
 from renom.layers.function.weight_normalize import WeightNormalize
@@ -43,6 +44,7 @@ from renom.layers.function.batch_normalize import BatchNormalize,\
     BATCH_NORMALIZE_FEATUREMAP
 from renom.layers.function.layer_normalize import LayerNormalize
 from renom.layers.function.lrn import Lrn
+from renom.layers.function import utils
 from test_utility import auto_diff, numeric_diff
 
 from renom.cuda import is_cuda_active, set_cuda_active, curand_generator, has_cuda
@@ -264,6 +266,27 @@ def test_div(node, x, raise_error, use_gpu):
         assert raise_error
 
 
+@pytest.mark.parametrize("node, x", [
+    [Variable(rand((2, 2))), rand((2, 2))],
+    [Variable(rand((2, 1))), rand((2, 2))],
+    [Variable(rand((2, 2))), Variable(rand((2,)))],
+])
+def test_fused(node, x, use_gpu):
+    node = Variable(node)
+    assert_cuda_active(use_gpu)
+
+    def expr(a, b):
+        return (a - b) ** 2 * a / (np.sqrt(b) + 1) - np.log(a + 1) * np.tanh(b) + np.exp(-a * b)
+
+    def func(node, x):
+        return sum(rm.Fused(expr, node, x))
+    compare(func, node, node, x)
+
+    def func_shared(node, x):
+        return sum(rm.Fused(lambda a, b: a * a + b, node, node))
+    compare(func_shared, node, node, x)
+
+
 @pytest.mark.parametrize("node", [
     Variable(rand((2, 1))),
     Variable(rand((2, 2))),
@@ -594,6 +617,63 @@ def test_conv2d(node, use_gpu, ignore_bias):
         assert ignore_bias
 
 
+@pytest.mark.parametrize("algorithm, filter, padding", [
+    ["winograd", 3, 0],
+    ["winograd", 3, 1],
+    ["winograd", 3, 3],
+    ["fft", 3, 1],
+    ["fft", (1, 5), (0, 2)],
+    ["auto", 3, 1],
+])
+def test_conv2d_algorithm(algorithm, filter, padding, ignore_bias):
+    # A generator of its own keeps the samples of the other tests as they are.
+    rng = np.random.RandomState(0)
+    node = Variable(rng.rand(2, 3, 5, 6))
+    params = {"w": Variable(rng.rand(4, 3, *utils.tuplize(filter)))}
+    if not ignore_bias:
+        params["b"] = Variable(rng.rand(1, 4, 1, 1))
+    layer = Conv2d(channel=4, filter=filter, padding=padding, ignore_bias=ignore_bias,
+                   algorithm=algorithm)
+    gemm = Conv2d(channel=4, filter=filter, padding=padding, ignore_bias=ignore_bias)
+    layer.params = gemm.params = params
+    assert np.allclose(layer(node), gemm(node))
+
+    def func(node):
+        return sum(layer(node))
+    compare(func, node, node)
+    compare(func, layer.params["w"], node)
+    if not ignore_bias:
+        compare(func, layer.params["b"], node)
+
+
+@pytest.mark.parametrize("layer", [
+    lambda data_format: Conv2d(channel=4, padding=1, data_format=data_format),
+    lambda data_format: Conv2d(channel=4, filter=(3, 2), stride=(2, 1), dilation=(1, 2),
+                               data_format=data_format),
+    lambda data_format: Conv2d(channel=4, padding=1, algorithm="winograd",
+                               data_format=data_format),
+    lambda data_format: Deconv2d(channel=4, stride=2, padding=1, data_format=data_format),
+    lambda data_format: MaxPool2d(filter=3, stride=2, padding=1, data_format=data_format),
+    lambda data_format: AveragePool2d(filter=2, stride=2, data_format=data_format),
+    lambda data_format: BatchNormalize(mode="feature", data_format=data_format),
+])
+def test_nhwc(layer):
+    rng = np.random.RandomState(0)
+    x = rng.rand(3, 3, 5, 6)
+    nchw, nhwc = layer("NCHW"), layer("NHWC")
+    node = Variable(x.transpose(0, 2, 3, 1))
+    expected = nchw(x)
+    if hasattr(nchw, "params"):
+        nhwc.params = nchw.params
+    assert np.allclose(nhwc(node), expected.transpose(0, 2, 3, 1))
+
+    def func(node):
+        return sum(nhwc(node) * nhwc(node))
+    compare(func, node, node)
+    for param in getattr(nhwc, "params", {}).values():
+        compare(func, param, node)
+
+
 @pytest.mark.parametrize("node", [
     Variable(rand((2, 8, 3, 3))),
     Variable(rand((2, 16, 4, 5))),
@@ -637,6 +717,24 @@ def test_conv2d_with_dilation(node, size, raise_error, use_gpu):
         assert raise_error
 
 
+@pytest.mark.parametrize("node, filter, stride, padding, dilation", [
+    [Variable(rand((2, 2, 5, 6))), 1, 2, 0, 1],
+    [Variable(rand((2, 2, 7, 7))), 2, 2, 1, 1],
+    [Variable(rand((2, 2, 7, 8))), 3, 2, 1, 2],
+    [Variable(rand((2, 2, 8, 7))), 2, 3, 2, 2],
+])
+def test_conv2d_with_stride(node, filter, stride, padding, dilation, use_gpu):
+    node = Variable(node)
+    assert_cuda_active(use_gpu)
+
+    layer = Conv2d(channel=3, filter=filter, stride=stride, padding=padding, dilation=dilation)
+
+    def func(node):
+        return sum(layer(node))
+    compare(func, node, node)
+    compare(func, layer.params["w"], node)
+
+
 @pytest.mark.parametrize("node, error", [
     [Variable(rand((1, 1, 3, 3, 3, 3))), True],
     [Variable(rand((2, 2, 4, 4))), False],
@@ -667,6 +765,118 @@ def test_convnd(node, error, use_gpu, ignore_bias):
             assert ignore_bias
 
 
+@pytest.mark.parametrize("shape, filter, stride, padding", [
+    [(2, 2, 5, 4, 6), 3, 2, 1],
+    [(2, 2, 6, 5), 2, 3, 2],
+    [(2, 2, 7), 3, 2, 0],
+])
+def test_convnd_with_stride(shape, filter, stride, padding):
+    node = Variable(rand(shape))
+    assert_cuda_active(False)
+    layer = ConvNd(channel=2, filter=filter, stride=stride, padding=padding)
+
+    def func(node):
+        return sum(layer(node))
+    compare(func, node, node)
+    compare(func, layer.params["w"], node)
+    compare(func, layer.params["b"], node)
+
+
+def reference_convnd(x, w, stride, padding):
+    '''Former imncol, placing the kernel at one position at a time.'''
+    x = np.pad(x, [(0, 0), (0, 0)] + [(p, p) for p in padding], mode="constant")
+    return np.array([[np.sum([utils.place_kernels(x[n, c], w[o, c], stride)
+                              for c in range(x.shape[1])], axis=0)
+                      for o in range(w.shape[0])] for n in range(x.shape[0])])
+
+
+def reference_deconvnd(x, w, stride):
+    '''Former colnim.'''
+    return np.array([np.sum([[utils.place_back_kernels(x[n, c], w[c, o], stride)
+                              for o in range(w.shape[1])] for c in range(x.shape[1])], axis=0)
+                     for n in range(x.shape[0])])
+
+
+def reference_colnw(x, dy, stride):
+    '''Former colnw.'''
+    return np.array([np.sum([[utils.place_overlap_kernels(x[n, c], dy[n, o], stride)
+                              for c in range(x.shape[1])] for n in range(x.shape[0])], axis=0)
+                     for o in range(dy.shape[1])])
+
+
+def reference_poolnd(x, kernel, stride, padding, mode):
+    '''Former imnpool and poolnim.'''
+    func, back_func = {"max": (utils.max_pool, utils.back_max_pool),
+                       "average": (utils.average_pool, utils.back_average_pool)}[mode]
+    x = np.pad(x, [(0, 0), (0, 0)] + [(p, p) for p in padding], mode="constant")
+    y = np.array([[utils.place_pools(x[n, c], kernel, stride, func)
+                   for c in range(x.shape[1])] for n in range(x.shape[0])])
+    crop = (Ellipsis, ) + tuple(slice(p, s - p) for s, p in zip(x.shape[2:], padding))
+    dx = np.array([[utils.place_back_pools(x[n, c], kernel, stride, back_func, y[n, c])[crop]
+                    for c in range(x.shape[1])] for n in range(x.shape[0])])
+    return y, dx
+
+
+@pytest.mark.parametrize("shape, kernel, stride, padding", [
+    [(2, 3, 5, 5, 5), (3, 3, 3), (1, 1, 1), (0, 0, 0)],
+    [(2, 3, 7, 5, 6), (3, 1, 2), (2, 2, 1), (1, 0, 2)],
+    [(1, 2, 4, 6), (2, 2), (2, 2), (0, 0)],
+    [(2, 1, 9), (3, ), (3, ), (1, )],
+])
+def test_convnd_parity(shape, kernel, stride, padding):
+    x = rand(shape)
+    w = rand((4, shape[1]) + kernel)
+    y = reference_convnd(x, w, stride, padding)
+    assert np.allclose(utils.imncol(x, w, stride, padding), y)
+
+    # The former backward kernels hold where the windows tile the unpadded input.
+    if not any(padding) and all((s - k) % t == 0 for s, k, t in zip(shape[2:], kernel, stride)):
+        dy = rand(y.shape)
+        assert np.allclose(utils.colnim(dy, w, stride), reference_deconvnd(dy, w, stride))
+        assert np.allclose(utils.colnw(x, dy, stride), reference_colnw(x, dy, stride))
+
+
+@pytest.mark.parametrize("shape, kernel, stride, padding", [
+    [(2, 3, 4, 5, 3), (2, 2, 2), (1, 1, 1), (1, 1, 1)],
+    [(2, 2, 7, 6, 5), (3, 2, 2), (2, 2, 1), (0, 1, 0)],
+    [(1, 2, 6, 6), (2, 2), (2, 2), (0, 0)],
+])
+@pytest.mark.parametrize("mode", ["max", "average"])
+def test_poolnd_parity(shape, kernel, stride, padding, mode):
+    # Distinct values, so that the maximum of every window is unique.
+    x = np.random.permutation(np.prod(shape)).reshape(shape).astype(np.float64)
+    y, dx = reference_poolnd(x, kernel, stride, padding, mode)
+    assert np.allclose(utils.imnpool(x, kernel, stride, padding, mode=mode), y)
+    assert np.allclose(utils.poolnim(x, y, kernel, stride, padding, mode=mode), dx)
+    if mode == "max":
+        z, index = utils.imnpool_index(x, kernel, stride, padding)
+        assert np.allclose(z, y)
+        assert index.dtype == np.int8 and index.shape == y.shape
+        assert np.allclose(utils.poolnim(x, y, kernel, stride, padding, index=index), dx)
+        # The backward of unpooling gathers from the positions of the maxima.
+        alt = rand(shape)
+        pad = [(0, 0), (0, 0)] + [(p, p) for p in padding]
+        xp, altp = np.pad(x, pad, mode="constant"), np.pad(alt, pad, mode="constant")
+        expected = np.array([[utils.place_pools(xp[n, c], kernel, stride, utils.max_pool,
+                                                alternate_input=altp[n, c])
+                              for c in range(shape[1])] for n in range(shape[0])])
+        assert np.allclose(utils.imnpool(x, kernel, stride, padding, alternate_input=alt,
+                                         index=index), expected)
+        assert np.allclose(utils.imnpool(x, kernel, stride, padding, alternate_input=alt),
+                           expected)
+
+
+@pytest.mark.parametrize("kernel, dtype", [
+    [(2, 2, 2), np.int8],
+    [(8, 4, 4), np.int8],
+    [(9, 4, 4), np.int16],
+    [(64, 64, 8), np.int16],
+    [(64, 64, 9), np.int32],
+])
+def test_pool_index_dtype(kernel, dtype):
+    assert utils.pool_index_dtype(kernel) == dtype
+
+
 @pytest.mark.parametrize("node", [
     Variable(rand((2, 3, 3, 3))),
     Variable(rand((2, 3, 4, 5))),
@@ -721,6 +931,22 @@ def test_deconvnd(node, use_gpu):
     compare(func, layer.params["b"], node)
 
 
+@pytest.mark.parametrize("shape, filter, stride, padding", [
+    [(2, 2, 3, 2, 3), 3, 2, 1],
+    [(2, 2, 3, 4), 2, 1, 0],
+])
+def test_deconvnd_with_stride(shape, filter, stride, padding):
+    node = Variable(rand(shape))
+    assert_cuda_active(False)
+    layer = DeconvNd(channel=2, filter=filter, stride=stride, padding=padding)
+
+    def func(node):
+        return sum(layer(node) * layer(node))
+    compare(func, node, node)
+    compare(func, layer.params["w"], node)
+    compare(func, layer.params["b"], node)
+
+
 @pytest.mark.parametrize("node", [
     Variable(np.arange(2 * 3 * 3 * 3).reshape(2, 3, 3, 3)),
     Variable(np.arange(2 * 3 * 4 * 5).reshape(2, 3, 4, 5)),
@@ -775,6 +1001,26 @@ def test_max_unpool2d(node, use_gpu):
     raise AssertionError("Failed all three attempts.")
 
 
+@pytest.mark.parametrize("x", [
+    np.random.RandomState(0).rand(2, 3, 5, 6),
+    np.ones((1, 2, 4, 4)),
+])
+def test_max_unpool2d_overlap(x):
+    # Overlapping windows, and windows whose maxima tie, which go to the
+    # first position of the window.
+    pool = MaxPool2d(filter=3, stride=1)(Variable(x))
+    y = np.random.RandomState(1).rand(*pool.shape)
+    expected = np.zeros_like(x)
+    for i in range(pool.shape[2]):
+        for j in range(pool.shape[3]):
+            window = x[:, :, i:i + 3, j:j + 3].reshape(x.shape[0], x.shape[1], -1)
+            k, l = np.unravel_index(window.argmax(axis=2), (3, 3))
+            for n in range(x.shape[0]):
+                for c in range(x.shape[1]):
+                    expected[n, c, i + k[n, c], j + l[n, c]] += y[n, c, i, j]
+    assert np.allclose(MaxUnPool2d()(Variable(y), pool), expected)
+
+
 @pytest.mark.parametrize("node", [
     Variable(np.arange(2 * 2 * 3 * 3).reshape(2, 2, 3, 3) + 1),
     Variable(np.arange(2 * 3 * 4 * 5).reshape(2, 3, 4, 5) + 1),
@@ -894,6 +1140,101 @@ def test_roi_pool2d(node, rois, use_gpu):
     compare(func, node, node, rois)
 
 
+def reference_roi_pool2d(x, rois, outh, outw, spatial_scale):
+    '''Former roi_pool2d forward and backward of dy = 1.'''
+    n_rois, (ch, h, w) = len(rois), x.shape[1:]
+    z = np.zeros((n_rois, ch, outh, outw))
+    dx = np.zeros(x.shape)
+    for i_roi in range(n_rois):
+        idx, xmin, ymin, xmax, ymax = utils.region_cordinates(rois[i_roi], spatial_scale)
+        strideh = float(max(ymax - ymin + 1, 1)) / outh
+        stridew = float(max(xmax - xmin + 1, 1)) / outw
+        for idx_h in range(outh):
+            sliceh, lenh = utils.roi_pooling_slice(idx_h, strideh, h, ymin)
+            for idx_w in range(outw):
+                slicew, lenw = utils.roi_pooling_slice(idx_w, stridew, w, xmin)
+                if lenh <= 0 or lenw <= 0:
+                    continue
+                roi_data = x[idx, :, sliceh, slicew].reshape(ch, -1)
+                z[i_roi, :, idx_h, idx_w] = np.max(roi_data, axis=1)
+                arg_h, arg_w = np.unravel_index(np.argmax(roi_data, axis=1), (lenh, lenw))
+                dx[idx, np.arange(ch), arg_h + sliceh.start, arg_w + slicew.start] += 1
+    return z, dx
+
+
+@pytest.mark.parametrize("shape, outh, outw, spatial_scale", [
+    [(3, 3, 8, 13), 7, 5, 0.6],
+    [(2, 4, 20, 16), 3, 3, 1 / 2.],
+    [(1, 2, 6, 6), 4, 4, 1.],
+])
+def test_roi_pool2d_parity(shape, outh, outw, spatial_scale):
+    x = rand(shape)
+    # Rois of any size, also beyond the input and of a single pixel.
+    size = np.array([shape[0], shape[3] / spatial_scale, shape[2] / spatial_scale])
+    rois = np.random.rand(20, 5) * size[[0, 1, 2, 1, 2]] * [1, 1, 1, 1.2, 1.2]
+    rois[:, 0] = np.floor(rois[:, 0])
+    rois[:, 3:] = np.maximum(rois[:, 3:], rois[:, 1:3])
+    rois[0, 3:] = rois[0, 1:3]
+
+    node = Variable(x)
+    z = rm.roi_pool2d(node, rois, outh, outw, spatial_scale)
+    dx = rm.sum(z).grad().get(node)
+    ref_z, ref_dx = reference_roi_pool2d(x, rois, outh, outw, spatial_scale)
+    assert np.allclose(z, ref_z)
+    assert np.allclose(dx, ref_dx)
+
+
+def reference_roi_align2d(x, rois, outh, outw, spatial_scale, sampling_ratio):
+    '''Roi align by bilinear interpolation of one sampling point at a time.'''
+    h, w = x.shape[2:]
+
+    def interpolate(img, y, x):
+        if y < -1. or y > h or x < -1. or x > w:
+            return 0.
+        y, x = max(y, 0.), max(x, 0.)
+        y_low, x_low = min(int(y), h - 1), min(int(x), w - 1)
+        y_high, x_high = min(y_low + 1, h - 1), min(x_low + 1, w - 1)
+        ly = y - y_low if y_low < h - 1 else 0.
+        lx = x - x_low if x_low < w - 1 else 0.
+        return ((1 - ly) * (1 - lx) * img[:, y_low, x_low] + (1 - ly) * lx * img[:, y_low, x_high] +
+                ly * (1 - lx) * img[:, y_high, x_low] + ly * lx * img[:, y_high, x_high])
+
+    z = np.zeros((len(rois), x.shape[1], outh, outw))
+    for i, (idx, xmin, ymin, xmax, ymax) in enumerate(rois * np.array([1] + [spatial_scale] * 4)):
+        bin_h = max(ymax - ymin, 1.) / outh
+        bin_w = max(xmax - xmin, 1.) / outw
+        for ph in range(outh):
+            for pw in range(outw):
+                for iy in range(sampling_ratio):
+                    for ix in range(sampling_ratio):
+                        z[i, :, ph, pw] += interpolate(
+                            x[int(idx)], ymin + (ph + (iy + .5) / sampling_ratio) * bin_h,
+                            xmin + (pw + (ix + .5) / sampling_ratio) * bin_w)
+    return z / sampling_ratio ** 2
+
+
+@pytest.mark.parametrize("node, rois", [
+    [Variable(rand((3, 3, 8, 13)) * 10), Variable(np.array([
+        [0, 1, 1, 6, 6],
+        [2, 6, 2, 7, 11],
+        [1, 3.3, 1.5, 5.2, 10],
+        [0, 3, 3, 3, 3],
+        [1, -2, 10, 25, 16],
+    ], dtype=np.float64))]
+])
+def test_roi_align2d(node, rois, use_gpu):
+    assert_cuda_active(use_gpu)
+    node = Variable(node)
+    layer = rm.RoiAlign2d(outh=4, outw=3, spatial_scale=0.6, sampling_ratio=2)
+
+    z = layer(node, rois)
+    assert np.allclose(z, reference_roi_align2d(node, rois.as_ndarray(), 4, 3, 0.6, 2))
+
+    def func(node, rois):
+        return sum(layer(node, rois))
+    compare(func, node, node, rois)
+
+
 @pytest.mark.parametrize("node", [
     Variable(rand((1, 3, 3, 3))),
 ])
@@ -953,7 +1294,7 @@ def test_dropout(node, seed, use_gpu):
         if is_cuda_active():
             curand_generator().set_seed(seed)
         else:
-            np.random.seed(seed)
+            set_rng_seed(seed)
         return sum(layer(node))
 
     compare(func, node, node)
@@ -974,7 +1315,7 @@ def test_spatial_dropout(node, seed, use_gpu):
         if is_cuda_active():
             curand_generator().set_seed(seed)
         else:
-            np.random.seed(seed)
+            set_rng_seed(seed)
         return sum(layer(node))
     compare(func, node, node)
 
@@ -1053,6 +1394,54 @@ def test_lstm_temporal_connection(node, use_gpu):
         compare(func, layer1.params[k], node)
 
 
+@pytest.mark.parametrize("shape", [
+    (3, 2, 2),
+    (4, 1, 3),
+    (1, 2, 1),
+])
+@pytest.mark.parametrize("layer_type", [Lstm, Gru])
+def test_rnn_sequence(shape, layer_type, use_gpu):
+    node = Variable(rand(shape))
+    assert_cuda_active(use_gpu)
+
+    layer1 = layer_type(output_size=4)
+
+    def func(node):
+        # Per step calls before and after a whole sequence share the state.
+        layer1(node[0])
+        z = layer1(node)
+        loss = sum(z * z) + sum(layer1(node[-1]))
+        layer1.truncate()
+        return loss
+
+    compare(func, node, node)
+    for k in layer1.params.keys():
+        compare(func, layer1.params[k], node)
+
+
+@pytest.mark.parametrize("layer_type", [Lstm, Gru])
+def test_rnn_sequence_vs_steps(layer_type):
+    node = Variable(rand((5, 3, 4)))
+    layer1 = layer_type(output_size=6)
+
+    loss = 0
+    steps = []
+    for t in range(len(node)):
+        z = layer1(node[t])
+        steps.append(z.as_ndarray())
+        loss += sum(z * z)
+    grad = loss.grad()
+    layer1.truncate()
+
+    z = layer1(node)
+    seq_grad = sum(z * z).grad()
+    layer1.truncate()
+
+    assert np.allclose(z.as_ndarray(), np.stack(steps), atol=1e-5)
+    for p in list(layer1.params.values()) + [node]:
+        assert np.allclose(seq_grad.get(p), grad.get(p), atol=1e-5)
+
+
 @pytest.mark.parametrize("node", [
     Variable(rand((2, 2))),
     Variable(rand((2, 1))),
@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+from renom.algorithm.image.detection.yolo import box_iou, nms, apply_nms, build_truth
+from renom.utility.distributor.utilities import build_yolo_labels
+
+
+def reference_nms(boxes, probs, iou_thresh):
+    '''Former pairwise loop of apply_nms.'''
+    probs = probs.copy()
+    argsort = np.argsort(probs, axis=0)[::-1]
+    for cl in range(probs.shape[1]):
+        for b in range(len(boxes)):
+            if probs[argsort[b, cl], cl] == 0:
+                continue
+            for compar in range(b + 1, len(boxes)):
+                if box_iou(boxes[argsort[b, cl]], boxes[argsort[compar, cl]]) > iou_thresh:
+                    probs[argsort[compar, cl], cl] = 0
+    return probs
+
+
+def random_boxes(shape):
+    xy = np.random.rand(*shape + (2, ))
+    wh = np.random.rand(*shape + (2, )) * 0.5
+    return np.concatenate([xy, xy + wh], axis=-1)
+
+
+@pytest.mark.parametrize("n_boxes, classes", [
+    [1, 1],
+    [98, 20],
+    [300, 3],
+])
+def test_nms(n_boxes, classes):
+    boxes = random_boxes((n_boxes, ))
+    probs = np.random.rand(n_boxes, classes)
+    probs[probs < 0.4] = 0
+    assert np.allclose(nms(boxes, probs, 0.3), reference_nms(boxes, probs, 0.3))
+
+
+def test_nms_batch():
+    boxes = random_boxes((3, 50))
+    probs = np.random.rand(3, 50, 4)
+    ret = nms(boxes, probs, 0.5, thresh=0.3, method="gaussian")
+    for i in range(3):
+        assert np.allclose(ret[i], nms(boxes[i], probs[i], 0.5, thresh=0.3, method="gaussian"))
+
+
+@pytest.mark.parametrize("method", ["linear", "gaussian"])
+def test_soft_nms(method):
+    boxes = np.array([[0, 0, 2, 2], [1, 0, 3, 2], [5, 5, 6, 6.]])
+    probs = np.array([[0.9], [0.8], [0.7]])
+    iou = box_iou(boxes[0], boxes[1])
+    decay = 1 - iou if method == "linear" else np.exp(-iou ** 2 / 0.5)
+    ret = nms(boxes, probs, 0.3, method=method)
+    assert np.allclose(ret[:, 0], [0.9, 0.8 * decay, 0.7])
+    assert np.allclose(nms(boxes, probs, 0.3), [[0.9], [0], [0.7]])
+
+
+def test_apply_nms_batch():
+    cells, bbox, classes = 7, 2, 5
+    x = np.random.rand(2, cells, cells, bbox * 5 + classes)
+    results = apply_nms(x, cells, bbox, classes, (448, 448))
+    for i in range(2):
+        single = apply_nms(x[i], cells, bbox, classes, (448, 448))
+        assert [r["class"] for r in results[i]] == [r["class"] for r in single]
+        assert np.allclose([r["score"] for r in results[i]], [r["score"] for r in single])
+
+
+def test_build_yolo_labels():
+    cells, classes = 7, 4
+    objects = np.zeros((3, 5, 4 + classes))
+    objects[:, :, :2] = np.random.rand(3, 5, 2) * 100
+    objects[:, :, 2:4] = np.random.rand(3, 5, 2) * 50
+    objects[:, :4, 4] = 1
+    # Two objects in the same cell, the later one is kept.
+    objects[0, 1, :2] = objects[0, 0, :2] + 0.1
+
+    expected = np.zeros((3, cells, cells, 5 + classes))
+    for im in range(3):
+        for obj in objects[im]:
+            if np.any(obj[4:]):
+                norm_x = obj[0] * .99 * cells / 100
+                norm_y = obj[1] * .99 * cells / 100
+                expected[im, int(norm_y), int(norm_x)] = np.concatenate(
+                    ([1, norm_x % 1, norm_y % 1, obj[2] / 100, obj[3] / 100], obj[4:]))
+    truth = build_yolo_labels(objects.reshape(3, -1), 100, 100, cells, classes)
+    assert np.allclose(truth, expected.reshape(3, -1))
+    assert np.allclose(build_truth(objects.reshape(3, -1), 100, 100, cells, classes), truth)
@@ -36,3 +36,227 @@ def test_gpu_distributor(data_shape):
             result = result.as_ndarray()
             assert np.allclose(result, test_result), "\n{}".format(np.isclose(result, test_result))
             i += 1
+
+
+def test_stream_distributor():
+    from renom.utility.distributor import StreamDistributor
+    X = np.arange(103 * 2).reshape(103, 2)
+    Y = np.arange(103)
+    distributor = StreamDistributor(X, Y, steps=4)
+    batches = list(distributor.batch(5))
+    # 5 streams of 20 steps, cut into 5 chunks of 4 steps.
+    assert len(batches) == 5
+    streams = X[:100].reshape(5, 20, 2)
+    for i, (batch_x, batch_y) in enumerate(batches):
+        assert batch_x.shape == (4, 5, 2)
+        assert np.all(batch_x == streams[:, i * 4:(i + 1) * 4].swapaxes(0, 1))
+        assert np.all(batch_y == Y[:100].reshape(5, 20)[:, i * 4:(i + 1) * 4].T)
+    assert len(list(distributor.batch(5, steps=7))) == 7
+
+    train, test = distributor.split(0.8)
+    assert len(train.x) == 82 and len(test.x) == 21
+
+
+def test_image_distributor_data_format(tmpdir):
+    from PIL import Image
+    from renom.utility.distributor.threadingdistributor import ImageClassificationDistributor
+    rng = np.random.RandomState(0)
+    paths = []
+    for i in range(5):
+        path = str(tmpdir.join("{}.png".format(i)))
+        Image.fromarray(rng.randint(0, 256, (8, 8, 3)).astype(np.uint8)).save(path)
+        paths.append(path)
+    labels = list(range(5))
+
+    nchw = ImageClassificationDistributor(paths, labels, imsize=(8, 8))
+    nhwc = ImageClassificationDistributor(paths, labels, imsize=(8, 8), data_format="NHWC")
+    for (x, y), (x_nhwc, y_nhwc) in zip(nchw.batch(2, shuffle=False), nhwc.batch(2, shuffle=False)):
+        assert x_nhwc.shape[1:] == (8, 8, 3)
+        assert x_nhwc.flags.c_contiguous
+        assert np.all(x_nhwc == x.transpose(0, 2, 3, 1))
+        assert np.all(y == y_nhwc)
+
+
+@pytest.mark.parametrize("shuffle", [True, False])
+def test_distributor_prefetch(shuffle):
+    import threading
+    from renom.utility.distributor import NdarrayDistributor, PrefetchDistributor
+    rng = np.random.RandomState(0)
+    X = rng.rand(103, 3, 4).astype(np.float32)
+    Y = rng.randint(10, size=103)
+    distributor = NdarrayDistributor(X, Y)
+
+    np.random.seed(5)
+    expected = list(distributor.batch(10, shuffle))
+    np.random.seed(5)
+    # The buffers of a batch are reused, so they are copied before the next one.
+    batches = [(x.copy(), y.copy()) for x, y in distributor.batch(10, shuffle, prefetch=2)]
+    np.random.seed(5)
+    wrapped = list(PrefetchDistributor(distributor, prefetch=2).batch(10, shuffle))
+    assert len(batches) == len(wrapped) == len(expected) == 11
+    for (x, y), (x1, y1), (x2, y2) in zip(expected, batches, wrapped):
+        assert x1.dtype == x.dtype and y1.dtype == y.dtype
+        assert np.all(x == x1) and np.all(y == y1)
+        assert np.all(x == x2) and np.all(y == y2)
+    assert len(list(distributor.batch(10, shuffle, steps=25, prefetch=3))) == 25
+
+    # Leaving the loop early stops the background thread.
+    threads = threading.active_count()
+    for _ in distributor.batch(10, shuffle, prefetch=2):
+        break
+    assert threading.active_count() == threads
+
+    class Broken(object):
+        def __len__(self):
+            return 1
+
+        def batch(self, batch_size):
+            yield 1
+            raise ValueError("broken")
+
+    with pytest.raises(ValueError):
+        list(PrefetchDistributor(Broken()).batch(1))
+
+
+def test_memmap_distributor(tmpdir):
+    import scipy.io
+    from renom.utility.distributor import MemmapDistributor, NdarrayDistributor, save_shards, \
+        convert_mat, convert_csv
+    rng = np.random.RandomState(0)
+    X = rng.rand(103, 4).astype(precision)
+    Y = np.arange(103).astype(precision)
+    path = str(tmpdir.join("shards"))
+    distributor = save_shards(path, [(X[:50], Y[:50]), (X[50:], Y[50:])], shard_size=30)
+    assert len(distributor) == 103 and len(distributor.x) == 4
+
+    for (x, y), (x1, y1) in zip(NdarrayDistributor(X, Y).batch(16, shuffle=False),
+                                distributor.batch(16, shuffle=False)):
+        assert np.all(x == x1) and np.all(y == y1)
+
+    # Every sample appears once per epoch, and the shards are read one after
+    # another.
+    np.random.seed(5)
+    batches = list(distributor.batch(16, shuffle=True, prefetch=2))
+    assert [len(y) for _, y in batches] == [16] * 6 + [7]
+    order = np.concatenate([y for _, y in batches]).astype(int)
+    assert sorted(order) == list(range(103))
+    assert np.all(np.concatenate([x for x, _ in batches]) == X[order])
+    for shard in range(4):
+        position = np.flatnonzero(order // 30 == shard)
+        assert position[-1] - position[0] == len(position) - 1
+    np.random.seed(5)
+    assert all(np.all(y == y1) for (_, y), (_, y1) in
+               zip(batches, distributor.batch(16, shuffle=True)))
+    assert len(list(distributor.batch(16, steps=20))) == 20
+
+    assert np.all(distributor[65][0] == X[65])
+    assert np.all(distributor[25:70:3][1] == Y[25:70:3])
+    train, test = distributor.split(0.5, shuffle=False)
+    assert len(train) == 60 and len(test) == 43
+
+    scipy.io.savemat(str(tmpdir.join("x.mat")), {"inputSetNorm": X})
+    scipy.io.savemat(str(tmpdir.join("y.mat")), {"targetSet": Y[:, None]})
+    distributor = convert_mat(path, str(tmpdir.join("x.mat")), "inputSetNorm",
+                              str(tmpdir.join("y.mat")), "targetSet", shard_size=40)
+    assert len(distributor.x) == 3
+    assert np.allclose(distributor[0:103][0], X) and np.allclose(distributor[0:103][1][:, 0], Y)
+
+    np.savetxt(str(tmpdir.join("data.csv")), np.column_stack([Y, X]), delimiter=",")
+    distributor = convert_csv(path, str(tmpdir.join("data.csv")), [0], shard_size=40, header=None)
+    assert np.allclose(distributor[0:103][0], X) and np.allclose(distributor[0:103][1][:, 0], Y)
+
+
+def test_image_distributor_num_workers(tmpdir):
+    from PIL import Image
+    from renom.utility.distributor import ImageClassificationDistributor
+    from renom.utility.image.data_augmentation.augmentation import DataAugmentation
+    from renom.utility.image.data_augmentation.flip import Flip
+    rng = np.random.RandomState(0)
+    paths = []
+    for i in range(11):
+        path = str(tmpdir.join("{}.png".format(i)))
+        Image.fromarray(rng.randint(0, 256, (6 + i, 9, 3)).astype(np.uint8)).save(path)
+        paths.append(path)
+    labels = list(range(11))
+
+    def epochs(distributor, shuffle):
+        np.random.seed(3)
+        batches = [list(distributor.batch(4, shuffle=shuffle)) for _ in range(2)]
+        distributor.close()
+        return sum(batches, [])
+
+    expected = epochs(ImageClassificationDistributor(paths, labels, imsize=(8, 8)), False)
+    batches = epochs(ImageClassificationDistributor(paths, labels, imsize=(8, 8), num_workers=2),
+                     False)
+    assert len(batches) == len(expected) == 6
+    for (x, y), (x1, y1) in zip(expected, batches):
+        assert np.allclose(x, x1) and np.all(y == y1)
+
+    # Augmentations draw the numbers of their batch whatever the worker.
+    flip = DataAugmentation([Flip(1)], random=True)
+    batches = [epochs(ImageClassificationDistributor(paths, labels, imsize=(8, 8),
+                                                     augmentation=flip, num_workers=n,
+                                                     prefetch=3), True)
+               for n in (1, 3)]
+    for (x, y), (x1, y1) in zip(*batches):
+        assert np.all(x == x1) and np.all(y == y1)
+
+    distributor = ImageClassificationDistributor(paths + ["missing.png"], labels + [0],
+                                                 imsize=(8, 8), num_workers=2)
+    with pytest.raises(RuntimeError):
+        list(distributor.batch(4, shuffle=False))
+    # The pool recovers from the error and from an early break.
+    for x, y in distributor.batch(4, shuffle=False):
+        break
+    assert np.all(next(distributor.batch(4, shuffle=False))[1] == [0, 1, 2, 3])
+    distributor.close()
+
+
+def test_image_cache(tmpdir):
+    import os
+    from PIL import Image
+    from renom.utility.distributor import ImageCache, ImageClassificationDistributor, \
+        ImageDetectionDistributor
+    rng = np.random.RandomState(0)
+    paths = []
+    for i in range(6):
+        path = str(tmpdir.join("{}.png".format(i)))
+        Image.fromarray(rng.randint(0, 256, (10 + i, 12, 3)).astype(np.uint8)).save(path)
+        paths.append(path)
+    labels = list(range(6))
+    expected = list(ImageClassificationDistributor(paths, labels, imsize=(8, 8)).batch(4, False))
+
+    cache = ImageCache(path=str(tmpdir.join("cache")))
+    distributor = ImageClassificationDistributor(paths, labels, imsize=(8, 8), cache=cache)
+    for _ in range(3):
+        for (x, y), (x1, y1) in zip(expected, distributor.batch(4, shuffle=False)):
+            # Cached pixels are rounded to uint8.
+            assert np.allclose(x, x1, atol=0.5) and np.all(y == y1)
+    assert cache.misses == 6 and cache.hits == 12
+    assert cache.hit_rate == 2. / 3 and cache.nbytes == 6 * 8 * 8 * 3
+
+    # The disk tier outlives the memory tier, and edited files are read again.
+    cache = ImageCache(path=str(tmpdir.join("cache")))
+    os.utime(paths[0], (0, 0))
+    distributor = ImageClassificationDistributor(paths, labels, imsize=(8, 8), cache=cache)
+    batches = list(distributor.batch(4, shuffle=False))
+    assert cache.disk_hits == 5 and cache.misses == 1
+    assert all(np.allclose(x, x1, atol=0.5) for (x, _), (x1, _) in zip(expected, batches))
+
+    # The memory tier keeps the most recently used images within its budget.
+    cache = ImageCache(max_bytes=8 * 8 * 3 * 2)
+    distributor = ImageClassificationDistributor(paths, labels, imsize=(8, 8), cache=cache)
+    list(distributor.batch(6, shuffle=False))
+    assert cache.nbytes == 8 * 8 * 3 * 2
+    assert cache.get(paths[5], (8, 8), "RGB") is not None
+    assert cache.get(paths[0], (8, 8), "RGB") is None
+
+    # Boxes are transformed with the size of the decoded images.
+    boxes = [[{"bndbox": [6., 5., 4., 4.], "name": [1, 0]}] for _ in range(6)]
+    expected = list(ImageDetectionDistributor(paths, boxes, class_list=["a", "b"],
+                                              imsize=(8, 8)).batch(3, False))
+    distributor = ImageDetectionDistributor(paths, boxes, class_list=["a", "b"], imsize=(8, 8),
+                                            cache=ImageCache())
+    for _ in range(2):
+        for (x, y), (x1, y1) in zip(expected, distributor.batch(3, shuffle=False)):
+            assert np.allclose(x, x1, atol=0.5) and np.allclose(y, y1)
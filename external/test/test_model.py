@@ -207,6 +207,188 @@ def test_update():
     assert np.allclose(cur.as_ndarray() - grad.get(nn.params.w), nn.params.w.as_ndarray())
 
 
+def test_predict():
+    nn = rm.Sequential([rm.Dense(3), rm.Dropout(0.5), rm.Dense(2)])
+    x = np.random.rand(4, 2)
+    nn(x)
+    nn.set_models(inference=True)
+    expected = nn(x)
+    nn.set_models(inference=False)
+
+    with nn.train():
+        ret = nn.predict(x)
+    assert np.allclose(ret, expected)
+    assert not list(ret.attrs.get_attrs())
+    assert not nn[1].inference
+
+
+def test_checkpoint():
+    def build():
+        return rm.Sequential([
+            rm.Sequential([rm.Conv2d(3, padding=1), rm.Relu(), rm.Dropout(0.5, key="d")]),
+            rm.Sequential([rm.Conv2d(3, padding=1, weight_decay=0.1), rm.Relu()]),
+            rm.Flatten(),
+            rm.Dense(2),
+        ])
+
+    x = Variable(np.random.rand(2, 2, 4, 4))
+    nn = build()
+    nn(x)
+    nn2 = build()
+    nn2(x)
+    nn2.copy_params(nn)
+
+    rm.set_renom_seed(10)
+    with nn.train():
+        loss = rm.sum(nn(x))
+    grad = loss.grad(weight_decay=0.1)
+
+    rm.set_renom_seed(10)
+    with nn2.train():
+        with nn2[0].checkpoint():
+            nn2[1].set_checkpoint(True)
+            loss2 = rm.sum(nn2(x))
+    grad2 = loss2.grad(weight_decay=0.1)
+
+    assert np.allclose(loss, loss2)
+    assert np.allclose(grad.get(x), grad2.get(x))
+    for m, m2 in zip(nn.iter_models(), nn2.iter_models()):
+        for k, v in m.params.items():
+            assert np.allclose(grad.get(v), grad2.get(m2.params[k]))
+
+    grad.update(rm.Sgd(1.0))
+    grad2.update(rm.Sgd(1.0))
+    for m, m2 in zip(nn.iter_models(), nn2.iter_models()):
+        for k, v in m.params.items():
+            assert np.allclose(v, m2.params[k])
+
+
+def test_trace():
+    nn = rm.Sequential([rm.Conv2d(3, padding=1), rm.Relu(), rm.Dropout(0.5),
+                        rm.Flatten(), rm.Dense(2)])
+    x = np.random.rand(2, 2, 4, 4)
+    traced = rm.trace(nn, x)
+    assert traced._ops
+
+    for _ in range(2):
+        rm.set_renom_seed(10)
+        with nn.train():
+            loss = rm.sum(nn(x))
+        grad = loss.grad()
+
+        rm.set_renom_seed(10)
+        with nn.train():
+            loss2 = rm.sum(traced(x))
+        grad2 = loss2.grad()
+
+        assert np.allclose(loss, loss2)
+        for m in nn.iter_models():
+            for v in m.params.values():
+                assert np.allclose(grad.get(v), grad2.get(v))
+        grad2.update(rm.Sgd())
+
+    # Replays without graph if nothing is trained.
+    ret = traced(x)
+    assert not list(ret.attrs.get_attrs())
+
+    # Falls back to eager calls.
+    x3 = np.random.rand(3, 2, 4, 4)
+    nn.set_models(inference=True)
+    assert np.allclose(traced(x3), nn(x3))
+    assert np.allclose(traced(x), nn(x))
+    nn.set_models(inference=False)
+
+    lstm = rm.Sequential([rm.Lstm(2)])
+    with pytest.warns(UserWarning):
+        traced = rm.trace(lstm, x[:, :, 0, 0])
+    assert traced._ops is None
+
+
+def test_fold_batch_normalize():
+    nn = rm.Sequential([
+        rm.Conv2d(4, padding=1), rm.BatchNormalize(mode="feature"), rm.Relu(),
+        rm.Conv2d(3, ignore_bias=True), rm.BatchNormalize(mode="feature", ignore_bias=True),
+        rm.Flatten(),
+        rm.Sequential([rm.Dense(5), rm.BatchNormalize(), rm.Relu()]),
+        rm.BatchNormalize(),
+    ])
+    x = np.random.rand(6, 2, 5, 5)
+    for _ in range(3):
+        nn(x)
+    nn.set_models(inference=True)
+    expected = nn(x)
+
+    folded = rm.fold_batch_normalize(nn)
+    assert len(folded._layers) == 6
+    assert len(folded[4]._layers) == 2
+    assert isinstance(folded[5], rm.BatchNormalize)
+    assert np.allclose(folded(x), expected, atol=1e-5)
+    # The original model is left as it is.
+    assert np.allclose(nn(x), expected)
+
+
+def test_conv2d_algorithm_auto():
+    from renom.layers.function import conv2d_algorithm
+
+    class Counted(conv2d_algorithm.Im2colGemm):
+        calls = 0
+
+        def forward(self, *args):
+            Counted.calls += 1
+            return super(Counted, self).forward(*args)
+
+    rm.register_conv2d_algorithm("counted", Counted())
+    try:
+        layer = rm.Conv2d(2, padding=1, algorithm="auto")
+        x = rm.Variable(np.random.rand(2, 3, 6, 6))
+        expected = rm.Conv2d(2, padding=1)
+        expected(x)
+        layer.params = expected.params
+        for _ in range(3):
+            assert np.allclose(layer(x), expected(x), atol=1e-5)
+        # The candidates are timed at the first call only.
+        assert Counted.calls in (1, 4)
+
+        with pytest.raises(AssertionError):
+            rm.Conv2d(2, stride=2, algorithm="winograd")(x)
+    finally:
+        del conv2d_algorithm.CONV2D_ALGORITHMS["counted"]
+        rm.clear_conv2d_algorithm_cache()
+
+
+def test_data_format():
+    def cnn():
+        return rm.Sequential([
+            rm.Conv2d(4, padding=1), rm.BatchNormalize(mode="feature"), rm.Relu(),
+            rm.MaxPool2d(filter=2, stride=2), rm.Deconv2d(3, stride=2),
+            rm.AveragePool2d(filter=2, stride=2),
+        ])
+    rng = np.random.RandomState(0)
+    x = rng.rand(4, 3, 6, 6)
+    nchw = cnn()
+    with rm.use_data_format("NHWC"):
+        nhwc = cnn()
+        assert rm.get_data_format() == "NHWC"
+    assert rm.get_data_format() == "NCHW"
+    assert all(layer._data_format == "NHWC"
+               for layer in nhwc._layers if hasattr(layer, "_data_format"))
+
+    expected = nchw(x)
+    for a, b in zip(nchw._layers, nhwc._layers):
+        if hasattr(a, "params"):
+            b.params = a.params
+    assert np.allclose(nhwc(x.transpose(0, 2, 3, 1)), expected.transpose(0, 2, 3, 1), atol=1e-5)
+
+    # Parameters and moving statistics are shaped alike in both layouts,
+    # so BatchNormalize folds into a NHWC Conv2d as well.
+    assert np.allclose(nhwc[1]._mov_mean, nchw[1]._mov_mean, atol=1e-5)
+    nchw.set_models(inference=True)
+    nhwc.set_models(inference=True)
+    folded = rm.fold_batch_normalize(nhwc)
+    assert len(folded._layers) == 5
+    assert np.allclose(folded(x.transpose(0, 2, 3, 1)), nchw(x).transpose(0, 2, 3, 1), atol=1e-5)
+
+
 @test_utility.skipgpu
 def test_multi_gpu():
     from renom.cuda import cuGetDeviceCount
@@ -2,10 +2,11 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import division, print_function
+import sys
 import numpy as np
 import pytest
 from renom.cuda import use_cuda
-from renom.core import Variable
+from renom.core import Node, Variable, evaluate_fused
 import renom as rm
 import test_utility
 
@@ -72,3 +73,137 @@ def test_grad2():
     g = f.grad(np.array([1., 2.]))
     print(g._refcounts)
     print(g._backwards)
+
+
+def test_grad_deep_graph():
+    depth = sys.getrecursionlimit() * 2
+    a = Variable(np.array([1., 2.]))
+    b = a
+    for _ in range(depth):
+        b = 1 * b + a
+
+    g = b.grad(np.array([1., 1.]))
+    assert np.allclose(g.get(a), [depth + 1, depth + 1])
+
+
+def test_grad_long_lstm():
+    layer = rm.Lstm(3)
+    x = Variable(np.random.rand(2, 4))
+    z = 0
+    for _ in range(sys.getrecursionlimit()):
+        z = z + rm.sum(layer(x))
+    g = z.grad()
+    assert g.get(layer.params.w).shape == layer.params.w.shape
+    assert g.get(x).shape == x.shape
+
+
+def test_grad_release_graph():
+    a = Variable(np.array([1., 2.]))
+    b = a * 2
+    c = rm.sum(b * a)
+
+    g = c.grad()
+    assert np.allclose(g.get(a), [4., 8.])
+    # The gradient of an intermediate node is dropped with the graph.
+    with pytest.raises(Exception):
+        g.get(b)
+    assert g.get(b, None) is None
+    assert not list(b.attrs.get_attrs())
+
+    b = a * 2
+    c = rm.sum(b * a)
+    g = c.grad(detach_graph=False)
+    assert np.allclose(g.get(b), [1., 2.])
+    assert list(b.attrs.get_attrs())
+
+
+def test_create_node_without_copy():
+    value = np.random.rand(2, 3).astype(rm.precision)
+    node = Node._create_node(value)
+    assert np.shares_memory(node, value)
+
+    v = Variable(value)
+    assert not np.shares_memory(v, value)
+
+    view = value[:, :2]
+    assert not np.shares_memory(Node._create_node(view), value)
+    assert Node._create_node(value.astype(np.float16)).dtype == rm.precision
+
+    attrs = node.attrs
+    attrs._x = 1
+    assert list(attrs.get_names()) == ['_x']
+    assert not hasattr(attrs, '__dict__')
+
+
+def test_no_grad():
+    a = Variable(np.array([1., 2.]))
+    with rm.no_grad():
+        assert not rm.is_grad_enabled()
+        b = rm.sum(a * a + a)
+    assert rm.is_grad_enabled()
+
+    assert np.allclose(b, 8.)
+    assert not list(b.attrs.get_attrs())
+    assert not b._args
+    assert b.grad().get(a, None) is None
+
+    c = rm.sum(a * a)
+    assert np.allclose(c.grad().get(a), [2., 4.])
+
+
+def test_evaluate_fused():
+    u = np.random.rand(3, 4)
+    r = np.random.rand(4)
+    expected = 0.1 * u / (np.sqrt(r / 0.5) + 1e-8) / 0.9
+    assert np.allclose(evaluate_fused(lambda u, r: 0.1 * u / (np.sqrt(r / 0.5) + 1e-8) / 0.9, u, r),
+                       expected)
+
+    out = u.copy()
+    ret = evaluate_fused(lambda u, r: 0.9 * u + 0.1 * r, out, r, out=out)
+    assert ret is out
+    assert np.allclose(out, 0.9 * u + 0.1 * r)
+
+    a = Variable(u)
+    with rm.no_grad():
+        b = rm.Fused(lambda a: a + 1, a)
+    assert isinstance(b, rm.Fused)
+    assert np.allclose(b, u + 1)
+    assert not b._args
+
+
+def test_buffer_pool():
+    pool = rm.get_buffer_pool()
+    pool.reset_counters()
+    model = rm.Sequential([rm.Conv2d(channel=4, filter=3, padding=1),
+                           rm.MaxPool2d(filter=2, stride=2),
+                           rm.Conv2d(channel=4, filter=3, padding=1)])
+    x = rm.Variable(np.random.rand(8, 3, 16, 16))
+
+    def step():
+        loss = rm.sum(model(x))
+        return loss, loss.grad().get(x).copy()
+
+    expected = step()
+    with rm.use_buffer_pool():
+        assert rm.is_buffer_pool_active()
+        results = [step() for _ in range(3)]
+    assert not rm.is_buffer_pool_active()
+
+    for loss, dx in results:
+        assert np.allclose(loss, expected[0])
+        assert np.allclose(dx, expected[1])
+    assert pool.hits > 0
+    assert pool.misses > 0
+
+    # Buffers referred from the outside are not handed out again.
+    with rm.use_buffer_pool():
+        shape = (1024, 64)
+        a = pool.empty(shape)
+        b = pool.empty(shape)
+        assert not np.shares_memory(a, b)
+        view = a[1:]
+        del a
+        assert not np.shares_memory(pool.empty(shape), view)
+
+    rm.release_buffer_pool()
+    assert pool.nbytes == 0
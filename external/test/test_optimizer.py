@@ -1,5 +1,7 @@
 import numpy as np
-from renom.core import Variable, Node, to_value
+import pytest
+import renom as rm
+from renom.core import Variable, Node, IndexedSlices, to_value
 from renom.operation import dot
 from renom.config import precision
 from renom.optimizer import *
@@ -7,6 +9,7 @@ from renom.utility.initializer import GlorotNormal
 from renom.cuda import set_cuda_active
 from renom.layers.loss.mean_squared_error import mean_squared_error
 from renom.layers.function.parameterized import Parametrized
+from renom.layers.function.embedding import Embedding
 import test_utility
 
 
@@ -128,3 +131,49 @@ def test_Adam_correct():
 @test_utility.skipgpu
 def test_Adam_gpu():
     gpu_check(Adam())
+
+
+def embedding_steps(optimizer, sparse, batches):
+    np.random.seed(3)
+    layer = Embedding(output_size=4, input_size=12, sparse=sparse)
+    target = np.random.rand(4)
+    for x in batches:
+        with layer.train():
+            z = layer(x)
+            # The same rows are looked up twice, the gradients are summed.
+            l = mean_squared_error(z, target * np.ones_like(z)) + rm.sum(layer(x[:2]))
+        grad = l.grad()
+        assert isinstance(grad.get(layer.params["w"]), IndexedSlices) == sparse
+        grad.update(optimizer)
+    return layer.params["w"].as_ndarray()
+
+
+@pytest.mark.parametrize("optimizer", [
+    lambda: Sgd(),
+    lambda: Sgd(nesterov=False),
+    lambda: Adagrad(),
+    lambda: Adam(),
+    lambda: Rmsprop(),
+])
+def test_sparse_update(optimizer):
+    # Rows which are not in a batch of a lazy update are never updated
+    # before, so the updates are the same as the dense ones.
+    batches = [np.array([[1], [3], [3], [5]]), np.array([[3], [1], [5]])]
+    dense = embedding_steps(optimizer(), False, batches)
+    sparse = embedding_steps(optimizer(), True, batches)
+    assert np.allclose(dense, sparse)
+
+
+def test_indexed_slices():
+    grad = IndexedSlices([4, 1, 4], np.arange(6.).reshape(3, 2), (6, 2))
+    dense = np.zeros((6, 2))
+    dense[4] = [4, 6]
+    dense[1] = [2, 3]
+    assert np.allclose(grad.to_dense(), dense)
+    merged = grad.coalesce()
+    assert list(merged.indices) == [1, 4]
+    assert np.allclose((grad + grad).to_dense(), dense * 2)
+    assert np.allclose(grad + np.ones((6, 2)), dense + 1)
+    assert np.allclose(np.ones((6, 2)) + grad, dense + 1)
+    assert np.allclose((grad * 2 / 4).to_dense(), dense / 2)
+    assert np.isclose((grad ** 2).sum(), (dense ** 2).sum())
@@ -0,0 +1,49 @@
+import copy
+import numpy as np
+import pytest
+import renom as rm
+from renom.core.rng import RandomStream, generator, set_rng_seed
+
+
+@pytest.mark.parametrize("dtype", [np.float32, np.float64])
+@pytest.mark.parametrize("offset", [0, 1, 3, 8])
+def test_stream_offset(dtype, offset):
+    set_rng_seed(7)
+    full = RandomStream("a").random((10, 3), dtype)
+    set_rng_seed(7)
+    part = RandomStream("a").random((10 - offset, 3), dtype, offset=offset)
+    assert part.dtype == dtype
+    assert np.array_equal(part, full[offset:])
+
+
+def test_stream_keys():
+    set_rng_seed(3)
+    stream = RandomStream("layer")
+    first, second = stream.random((4, 5)), stream.random((4, 5))
+    assert not np.array_equal(first, second)
+    assert not np.array_equal(first, RandomStream("other").random((4, 5)))
+    assert not np.array_equal(first, stream.spawn(1).random((4, 5)))
+    set_rng_seed(3)
+    assert np.array_equal(stream.random((4, 5)), first)
+    assert np.array_equal(generator("aug", 2).random(5), generator("aug", 2).random(5))
+
+
+@pytest.mark.parametrize("layer, shape", [
+    [rm.Dropout(0.3), (8, 6)],
+    [rm.SpatialDropout(0.5), (8, 4, 3, 3)],
+])
+def test_dropout_workers(layer, shape):
+    x = np.random.rand(*shape).astype(rm.precision)
+    rm.set_renom_seed(11)
+    steps = [layer(x) for _ in range(2)]
+    assert not np.array_equal(steps[0], steps[1])
+
+    # Replicas of the layer working on a share of each batch.
+    rm.set_renom_seed(11)
+    replicas = [layer, copy.deepcopy(layer)]
+    for step in steps:
+        shares = []
+        for i, (replica, part) in enumerate(zip(replicas, np.split(x, [3]))):
+            with rm.sample_offset(3 * i):
+                shares.append(replica(part))
+        assert np.array_equal(np.concatenate(shares), step)
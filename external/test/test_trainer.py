@@ -52,3 +52,189 @@ def test_trainer():
 
     trainer.train(distributor)
     assert l == set(['start', 'start_epoch', 'forward', 'backward', 'updated', 'end_epoch'])
+
+
+@pytest.mark.parametrize("layer_type", [rm.Lstm, rm.Gru, rm.PeepholeLstm])
+def test_stateful_trainer(layer_type):
+    from renom.utility.distributor import StreamDistributor
+
+    class NN(rm.Model):
+        def __init__(self):
+            super(NN, self).__init__()
+            self.rnn = layer_type(3)
+            self.dense = rm.Dense(1)
+
+        def forward(self, x):
+            # Time major chunks are fed one step at a time.
+            return rm.concat([self.dense(self.rnn(x[t])) for t in range(len(x))], axis=0)
+
+    x = np.random.rand(200, 2)
+    y = np.random.rand(200, 1)
+    distributor = StreamDistributor(x, y, steps=5)
+
+    model = NN()
+    trainer = Trainer(model, num_epoch=2, batch_size=4, optimizer=rm.Sgd(),
+                      loss_func=lambda z, t: rm.mse(z, t.reshape(-1, 1)),
+                      stateful=True)
+    chunks = []
+
+    @trainer.events.forward
+    def forward(trainer):
+        # The state carried in is a constant from the previous chunk.
+        z = model.rnn._z
+        chunks.append(None if z is None else isinstance(z, rm.Node))
+
+    trainer.train(distributor)
+    assert chunks[0] is None and chunks[1] is False and chunks[10] is None
+    assert len(trainer.train_loss_list) == 2
+
+
+def test_truncate_keep_state():
+    x = np.random.rand(6, 2, 3)
+    layer = rm.Lstm(4)
+    full = layer(x).as_ndarray()
+    layer.truncate()
+
+    z1 = layer(x[:3])
+    layer.truncate(keep_state=True)
+    z2 = layer(x[3:])
+    assert np.allclose(np.concatenate([z1.as_ndarray(), z2.as_ndarray()]), full, atol=1e-5)
+
+    # Gradients do not flow into the previous chunk.
+    grad = rm.sum(z2).grad()
+    with pytest.raises(Exception):
+        grad.get(z1)
+
+
+@pytest.mark.parametrize("buffer_pool", [True, False])
+def test_trainer_buffer_pool(buffer_pool):
+    rng = np.random.RandomState(0)
+    x = rng.rand(32, 3, 16, 16)
+    y = np.eye(2)[rng.randint(2, size=32)]
+    model = rm.Sequential([rm.Conv2d(4, padding=1), rm.Relu(), rm.Flatten(), rm.Dense(2)])
+    trainer = Trainer(model, num_epoch=2, loss_func=rm.softmax_cross_entropy,
+                      batch_size=16, optimizer=rm.Sgd(0.1), events={}, buffer_pool=buffer_pool)
+    pool = rm.get_buffer_pool()
+    try:
+        with rm.use_buffer_pool():
+            kept = pool.empty((64, 1024)).nbytes
+            trainer.train(NdarrayDistributor(x, y))
+            # The buffers of the caller's pool survive the training.
+            assert pool.nbytes >= kept
+            assert rm.is_buffer_pool_active()
+    finally:
+        rm.release_buffer_pool()
+    if buffer_pool:
+        # The trainer draws from its own pool, which is released at the end.
+        assert trainer.buffer_pool.hits > 0
+        assert trainer.buffer_pool.nbytes == 0
+    else:
+        assert trainer.buffer_pool is None
+    assert not rm.is_buffer_pool_active()
+
+
+@pytest.mark.parametrize("num_workers", [2, 3])
+def test_trainer_num_workers(num_workers):
+    rng = np.random.RandomState(0)
+    x = rng.rand(52, 6)
+    y = np.eye(3)[rng.randint(3, size=52)]
+
+    def train(num_workers):
+        np.random.seed(0)
+        model = rm.Sequential([rm.Dense(8), rm.Relu(), rm.Dropout(0.5, key="dropout"), rm.Dense(3)])
+        rm.set_rng_seed(1)
+        trainer = Trainer(model, num_epoch=2, loss_func=rm.softmax_cross_entropy,
+                          batch_size=16, optimizer=rm.Sgd(0.1, momentum=0.9), shuffle=False,
+                          events={}, num_workers=num_workers)
+        trainer.train(NdarrayDistributor(x, y))
+        assert trainer._workers is None
+        return model
+
+    # The shards of the workers draw the dropout masks of one process.
+    expected = train(1)
+    model = train(num_workers)
+    for a, b in zip(expected.flatten_values(), model.flatten_values()):
+        for k in a[1]:
+            assert np.allclose(a[1][k], b[1][k], atol=1e-5)
+
+
+@pytest.mark.parametrize("num_workers", [2, 3])
+def test_trainer_num_workers_events(num_workers):
+    rng = np.random.RandomState(0)
+    x = rng.rand(54, 6)
+    y = np.eye(3)[rng.randint(3, size=54)]
+
+    def clip(trainer):
+        grads = trainer.grads[0]
+        for _, values, _ in trainer.model.flatten_values():
+            for v in values.values():
+                if grads.get(v, None) is not None:
+                    grads.set(v, np.clip(grads.get(v), -0.01, 0.01))
+
+    def train(model, num_workers):
+        trainer = Trainer(model, num_epoch=2, loss_func=rm.softmax_cross_entropy,
+                          batch_size=16, optimizer=rm.Sgd(0.1, momentum=0.9), shuffle=False,
+                          events={}, num_workers=num_workers)
+        shapes = []
+        trainer.events.loss = lambda trainer: shapes.append(trainer.outputs[0].shape)
+        trainer.events.grad = clip
+        trainer.train(NdarrayDistributor(x, y))
+        assert len(shapes) == 8 and all(s[1] == 3 for s in shapes)
+        return model
+
+    def mlp():
+        np.random.seed(0)
+        return rm.Sequential([rm.Dense(8), rm.Relu(), rm.Dense(3)])
+
+    # The clipped update of the first process is that of every replica.
+    expected = train(mlp(), 1)
+    model = train(mlp(), num_workers)
+    for a, b in zip(expected.flatten_values(), model.flatten_values()):
+        for k in a[1]:
+            assert np.allclose(a[1][k], b[1][k], atol=1e-5)
+
+    # The moving mean of the inputs is averaged over the shards.
+    expected = train(rm.Sequential([rm.BatchNormalize(), rm.Dense(3)]), 1)
+    model = train(rm.Sequential([rm.BatchNormalize(), rm.Dense(3)]), num_workers)
+    assert np.allclose(expected[0]._mov_mean, model[0]._mov_mean)
+
+
+@pytest.mark.parametrize("num_workers", [2, 3])
+def test_trainer_num_workers_partial_grads(num_workers):
+    rng = np.random.RandomState(0)
+    x = rng.rand(48, 6)
+    y = np.eye(3)[rng.randint(3, size=48)]
+    # Only the last samples of each batch take the second branch, so the
+    # shard of the first process has no gradient of its parameters.
+    x[:, 0] = np.arange(48) % 16 >= 12
+
+    class Branch(rm.Model):
+        def __init__(self):
+            self.a = rm.Dense(3)
+            self.b = rm.Dense(3)
+
+        def forward(self, x):
+            z = self.a(x)
+            if x[:, 0].any():
+                z = z + self.b(x) * x[:, :1]
+            return z
+
+    def train(num_workers):
+        np.random.seed(0)
+        model = Branch()
+        with rm.no_grad():
+            model(x)
+        initial = model.b.params.w.copy()
+        trainer = Trainer(model, num_epoch=2, loss_func=rm.softmax_cross_entropy,
+                          batch_size=16, optimizer=rm.Sgd(0.1, momentum=0.9), shuffle=False,
+                          events={}, num_workers=num_workers)
+        trainer.train(NdarrayDistributor(x, y))
+        # Every process updates the second branch.
+        assert not np.allclose(model.b.params.w, initial)
+        return model
+
+    expected = train(1)
+    model = train(num_workers)
+    for a, b in zip(expected.flatten_values(), model.flatten_values()):
+        for k in a[1]:
+            assert np.allclose(a[1][k], b[1][k], atol=1e-5)